@@ -0,0 +1,566 @@
+"""
+Offline end-to-end benchmark of the FastAPI app.
+
+    python bench/bench_e2e.py --portfolios 1000000 --clients 100000 --concurrency 16 --requests 500
+
+Runs main.app in-process against stand-ins for every external service:
+
+- a deterministic fake LLM behind the real gateway (canned output per
+  question, --llm-latency/--llm-jitter milliseconds to the first token,
+  --llm-token-ms per token and --llm-tail tokens of commentary after the
+  query, streamed or not; --llm-only bypasses the local router and templates
+  so every question reaches it),
+- SQLite in place of MySQL and mongomock in place of Mongo, seeded by scaling
+  the populate_mysql/populate_mongo datasets up to the requested row counts,
+  or with --dataset synthetic from db/generate_data.py.
+
+Question.txt is replayed at the given concurrency. The report has p50/p95/p99
+latency and throughput overall, the same percentiles per pipeline stage (from
+the observability spans) and the peak process RSS seen at the end of each
+stage. It is written as JSON (default bench/results/e2e-<commit>.json);
+--compare prints the change against an earlier report.
+
+The extra packages are listed in bench/requirements.txt. Mongo timings come
+from mongomock, which is pure Python, so compare them across commits rather
+than against a real server.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from itertools import islice, zip_longest
+from types import SimpleNamespace
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Allow running as `python bench/bench_e2e.py` from backend/
+sys.path.insert(0, BACKEND_DIR)
+
+DEFAULT_STOCK = "Reliance"
+INSERT_BATCH = 50_000
+
+# Canned LLM output per question; anything missing gets a keyword route and the generic fallback
+CANNED = {
+    "What are the top five portfolios of our wealth members?": {
+        "store": "sql",
+        "sql": "SELECT client_name, portfolio_value FROM portfolios ORDER BY portfolio_value DESC LIMIT 5;",
+    },
+    "Give me the breakup of portfolio values per relationship manager.": {
+        "store": "sql",
+        "sql": "SELECT relationship_manager, SUM(portfolio_value) AS total_portfolio_value FROM portfolios GROUP BY relationship_manager;",
+    },
+    "Tell me the top relationship managers in my firm": {
+        "store": "sql",
+        "sql": "SELECT relationship_manager, SUM(portfolio_value) AS total_portfolio_value FROM portfolios "
+               "GROUP BY relationship_manager ORDER BY total_portfolio_value DESC;",
+    },
+    f"Which clients are the highest holders of {DEFAULT_STOCK}?": {
+        "store": "sql",
+        "sql": f"SELECT client_name, portfolio_value FROM portfolios WHERE stock = '{DEFAULT_STOCK}' "
+               "ORDER BY portfolio_value DESC LIMIT 10;",
+    },
+    "Show all portfolios with stock = 'Reliance'.": {
+        "store": "sql",
+        "sql": "SELECT * FROM portfolios WHERE stock = 'Reliance';",
+    },
+    "Show all portfolios managed by Rajiv Mehra.": {
+        "store": "sql",
+        "sql": "SELECT * FROM portfolios WHERE relationship_manager = 'Rajiv Mehra';",
+    },
+    "What is the total portfolio value?": {
+        "store": "sql",
+        "sql": "SELECT SUM(portfolio_value) AS total_portfolio_value FROM portfolios;",
+    },
+    "Show portfolios with value greater than 7,000,000": {
+        "store": "sql",
+        "sql": "SELECT * FROM portfolios WHERE portfolio_value > 7000000;",
+    },
+}
+MONGO_WORDS = ("risk", "age", "city", "prefer", "profile", "demographic")
+
+# --- stand-ins -------------------------------------------------------------------
+
+# Commentary a reasoning model adds after the query; --llm-tail tokens of it follow each answer
+TAIL_TEXT = " This query reads the relevant rows and aggregates them as requested; adjust the filters if needed."
+
+class FakeStream:
+    """OpenAI-shaped chunk stream; records whether the reader closed it before the end."""
+
+    def __init__(self, llm, pieces, usage):
+        self.llm = llm
+        self.pieces = pieces
+        self.usage = usage
+        self.sent = 0
+
+    def chunks(self):
+        for piece in self.pieces:
+            self.sent += 1
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))], usage=None)
+        yield SimpleNamespace(choices=[], usage=self.usage)
+
+    def finish(self):
+        self.llm.tokens_sent += self.sent
+        if self.sent < len(self.pieces):
+            self.llm.cancelled += 1
+
+    async def __aiter__(self):
+        await asyncio.sleep(self.llm.delay())
+        for chunk in self.chunks():
+            yield chunk
+            await asyncio.sleep(self.llm.token_delay)
+
+    async def close(self):
+        self.finish()
+
+class FakeSyncStream(FakeStream):
+    def __iter__(self):
+        time.sleep(self.llm.delay())
+        for chunk in self.chunks():
+            yield chunk
+            time.sleep(self.llm.token_delay)
+
+    def close(self):
+        self.finish()
+
+class FakeLLM:
+    """
+    OpenAI-shaped client returning canned completions after a simulated delay:
+    time to first token plus token_ms per ~4-character token, streamed or not.
+    """
+    stream_class = FakeStream
+
+    def __init__(self, canned, latency_ms, jitter_ms, seed, token_ms=0.0, tail_tokens=0):
+        self.canned = canned
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.token_delay = token_ms / 1000
+        self.tail = (TAIL_TEXT * (tail_tokens * 4 // len(TAIL_TEXT) + 1))[:tail_tokens * 4] if tail_tokens else ""
+        self.rng = random.Random(seed)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+        self.tokens_sent = 0
+        self.cancelled = 0
+
+    def answer(self, prompt):
+        match = re.search(r"Question:\s*(.*)", prompt)
+        question = match.group(1).strip() if match else ""
+        entry = self.canned.get(question, {})
+        if "Respond with only 'mongo' or 'sql'" in prompt:
+            if "store" in entry:
+                return entry["store"]
+            return "mongo" if any(w in question.lower() for w in MONGO_WORDS) else "sql"
+        if "SQL Query:" in prompt:
+            return entry.get("sql", "") + self.tail
+        return entry.get("mongo", "{}") + self.tail
+
+    def pieces(self, content):
+        return [content[i:i + 4] for i in range(0, len(content), 4)]
+
+    def delay(self):
+        return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+    def usage(self, prompt, content):
+        return SimpleNamespace(prompt_tokens=len(prompt) // 4, completion_tokens=len(content) // 4)
+
+    def response(self, prompt):
+        content = self.answer(prompt)
+        self.tokens_sent += len(self.pieces(content))
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=self.usage(prompt, content),
+        )
+
+    def stream(self, prompt):
+        content = self.answer(prompt)
+        return self.stream_class(self, self.pieces(content), self.usage(prompt, content))
+
+    async def create(self, messages, stream=False, **kwargs):
+        prompt = messages[-1]["content"]
+        if stream:
+            return self.stream(prompt)
+        await asyncio.sleep(self.delay() + self.token_delay * len(self.pieces(self.answer(prompt))))
+        return self.response(prompt)
+
+class FakeSyncLLM(FakeLLM):
+    stream_class = FakeSyncStream
+
+    def create(self, messages, stream=False, **kwargs):
+        prompt = messages[-1]["content"]
+        if stream:
+            return self.stream(prompt)
+        time.sleep(self.delay() + self.token_delay * len(self.pieces(self.answer(prompt))))
+        return self.response(prompt)
+
+def scaled_portfolios(count, base):
+    # Copies of the populate_mysql rows; client names line up with scaled_clients
+    for i in range(count):
+        name, value, manager, stock = base[i % len(base)]
+        copy = i // len(base)
+        yield (f"{name} {copy}" if copy else name, round(value * (1 + (i % 97) / 1000), 2), manager, stock)
+
+def scaled_clients(count, base):
+    for i in range(count):
+        doc = base[i % len(base)]
+        copy = i // len(base)
+        yield {**doc, "name": f"{doc['name']} {copy}" if copy else doc["name"],
+               "age": doc["age"] + copy % 7, "preferences": list(doc["preferences"])}
+
+def batched(items, size=INSERT_BATCH):
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+def populate_batches(portfolios, clients):
+    """(client docs, portfolio rows) batches scaled up from the populate_* datasets."""
+    from db.populate_mongo import CLIENTS
+    from db.populate_mysql import PORTFOLIOS
+
+    return zip_longest(
+        batched(scaled_clients(clients, CLIENTS)), batched(scaled_portfolios(portfolios, PORTFOLIOS)), fillvalue=[]
+    )
+
+def synthetic_batches(clients, seed):
+    """Skewed, store-consistent batches from db/generate_data.py; portfolio count follows from the clients."""
+    from db.generate_data import generate_chunk, manager_names
+
+    options = {"seed": seed, "skew": 1.1, "managers": manager_names(50, seed), "portfolios_per_client": 3.0}
+    for chunk, start in enumerate(range(0, clients, INSERT_BATCH)):
+        yield generate_chunk(chunk, start, min(start + INSERT_BATCH, clients), options)
+
+def seed(sqlite_path, collection, batches):
+    conn = sqlite3.connect(sqlite_path)
+    counts = [0, 0]
+    try:
+        conn.execute(
+            "CREATE TABLE portfolios (id INTEGER PRIMARY KEY, client_name TEXT, "
+            "portfolio_value NUMERIC, relationship_manager TEXT, stock TEXT)"
+        )
+        for docs, rows in batches:
+            if rows:
+                conn.executemany(
+                    "INSERT INTO portfolios (client_name, portfolio_value, relationship_manager, stock) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+            if docs:
+                collection.insert_many(docs)
+            counts[0] += len(docs)
+            counts[1] += len(rows)
+        conn.commit()
+    finally:
+        conn.close()
+    return counts
+
+# --- measurement -------------------------------------------------------------------
+
+def current_rss() -> int:
+    """Resident set size in bytes; falls back to the process peak where /proc is missing."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+def peak_rss() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+class Recorder:
+    def __init__(self):
+        self.requests = []
+        self.stages = {}
+        self.stage_rss = {}
+
+    def instrument(self, observability):
+        """Wrap span/request_scope; must run before main (and the tools) import them."""
+        span, request_scope = observability.span, observability.request_scope
+        recorder = self
+
+        @contextmanager
+        def recorded_span(stage):
+            try:
+                with span(stage):
+                    yield
+            finally:
+                rss = current_rss()
+                if rss > recorder.stage_rss.get(stage, 0):
+                    recorder.stage_rss[stage] = rss
+
+        @contextmanager
+        def recorded_scope(endpoint):
+            start = time.perf_counter()
+            timings = {}
+            try:
+                with request_scope(endpoint) as timings:
+                    yield timings
+            finally:
+                recorder.requests.append(time.perf_counter() - start)
+                for stage, seconds in timings.items():
+                    recorder.stages.setdefault(stage, []).append(seconds)
+
+        observability.span = recorded_span
+        observability.request_scope = recorded_scope
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 2)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "max_ms": round(ordered[-1] * 1000, 2),
+    }
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BACKEND_DIR,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+def bypass_shortcuts():
+    """Send every question through the (fake) LLM: no router, templates or federated plans."""
+    from langchain_agent import federated, mongo_tool, sql_tool
+    from langchain_agent.router import query_router
+
+    def nothing(*args, **kwargs):
+        return None
+
+    query_router.route = nothing
+    sql_tool.match_sql_template = nothing
+    mongo_tool.match_mongo_template = nothing
+    mongo_tool.match_mongo_pipeline = nothing
+    federated.match_federated = nothing
+
+def load_questions(path, stock):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip().replace("[specific stock]", stock) for line in f if line.strip()]
+
+# --- run -------------------------------------------------------------------------
+
+async def replay(app, questions, total, concurrency, page_size, cold, caches):
+    import httpx
+
+    statuses = {}
+    errors = 0
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(questions[i % len(questions)])
+
+    async def worker(client):
+        nonlocal errors
+        while True:
+            try:
+                question = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if cold:
+                for cache in caches:
+                    cache.clear()
+            body = {"query": question}
+            if page_size:
+                body["page_size"] = page_size
+            response = await client.post("/query", json=body)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code != 200 or response.json().get("error"):
+                errors += 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return elapsed, statuses, errors
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="insightlens-bench-")
+    # Keep caches and logs of the app under test out of the way
+    os.environ.setdefault("CACHE_DIR", workdir)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    import observability
+    recorder = Recorder()
+    recorder.instrument(observability)
+
+    import mongomock
+    from mongomock_motor import AsyncMongoMockClient
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    import db.mongo
+    import db.mysql
+
+    started = time.perf_counter()
+    sqlite_path = os.path.join(workdir, "portfolios.db")
+    mongo = mongomock.MongoClient()
+    batches = (synthetic_batches(args.clients, args.seed) if args.dataset == "synthetic"
+               else populate_batches(args.portfolios, args.clients))
+    clients, portfolios = seed(sqlite_path, mongo["bench"]["clients"], batches)
+    load_seconds = time.perf_counter() - started
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{sqlite_path}")
+    db.mysql.AsyncSessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    db.mongo.db = mongo["bench"]
+    db.mongo.async_db = AsyncMongoMockClient(mock_mongo_client=mongo)["bench"]
+
+    canned = dict(CANNED)
+    if args.canned:
+        with open(args.canned, encoding="utf-8") as f:
+            canned.update(json.load(f))
+
+    import main
+    from cache.results import result_cache
+    from cache.translation import translation_cache
+    from langchain_agent.llm_gateway import llm_gateway
+
+    fake = FakeLLM(canned, args.llm_latency, args.llm_jitter, args.seed, args.llm_token_ms, args.llm_tail)
+    llm_gateway._async_client = fake
+    llm_gateway._sync_client = FakeSyncLLM(canned, args.llm_latency, args.llm_jitter, args.seed,
+                                           args.llm_token_ms, args.llm_tail)
+    if args.llm_only:
+        bypass_shortcuts()
+
+    questions = load_questions(args.questions, args.stock)
+    total = args.requests or len(questions)
+    rss_before = current_rss()
+    elapsed, statuses, errors = asyncio.run(replay(
+        main.app, questions, total, args.concurrency, args.page_size, args.cold, (result_cache, translation_cache)
+    ))
+
+    commit, dirty = git_revision()
+    llm = llm_gateway.stats()
+    return {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "config": {
+            "dataset": args.dataset,
+            "portfolios": portfolios,
+            "clients": clients,
+            "requests": total,
+            "concurrency": args.concurrency,
+            "page_size": args.page_size,
+            "cold": args.cold,
+            "llm_only": args.llm_only,
+            "llm_latency_ms": args.llm_latency,
+            "llm_jitter_ms": args.llm_jitter,
+            "llm_token_ms": args.llm_token_ms,
+            "llm_tail": args.llm_tail,
+            "questions": len(questions),
+        },
+        "load_seconds": round(load_seconds, 2),
+        "overall": {
+            **percentiles(recorder.requests),
+            "throughput_rps": round(total / elapsed, 2) if elapsed else None,
+            "wall_seconds": round(elapsed, 3),
+            "errors": errors,
+            "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        },
+        "stages": {
+            stage: {**percentiles(samples), "rss_peak_mb": round(recorder.stage_rss.get(stage, 0) / 2**20, 1)}
+            for stage, samples in sorted(recorder.stages.items())
+        },
+        "rss": {
+            "before_replay_mb": round(rss_before / 2**20, 1),
+            "peak_mb": round(peak_rss() / 2**20, 1),
+        },
+        "llm": {"calls": llm["requests"], "prompt_tokens": llm["prompt_tokens"],
+                "completion_tokens": llm["completion_tokens"], "streams": llm["streams"],
+                "early_stops": llm["early_stops"], "tokens_generated": fake.tokens_sent},
+        "cache": {"results": result_cache.stats(), "translation": translation_cache.stats()},
+    }
+
+# --- report ------------------------------------------------------------------------
+
+def change(new, old):
+    if not old:
+        return ""
+    return f"{(new - old) / old * 100:+.1f}%"
+
+def print_report(report, baseline=None):
+    config = report["config"]
+    overall = report["overall"]
+    print(f"{config['requests']} requests, concurrency {config['concurrency']}, "
+          f"{config['portfolios']} portfolios / {config['clients']} clients "
+          f"(loaded in {report['load_seconds']}s)")
+    print(f"throughput {overall['throughput_rps']} req/s, errors {overall['errors']}, "
+          f"peak RSS {report['rss']['peak_mb']} MB")
+    rows = [("overall", overall, (baseline or {}).get("overall"))]
+    rows += [(stage, stats, ((baseline or {}).get("stages") or {}).get(stage))
+             for stage, stats in report["stages"].items()]
+    header = f"{'stage':<14}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rss MB':>9}"
+    print(header + (f"{'p50 Δ':>9}{'p95 Δ':>9}{'p99 Δ':>9}" if baseline else ""))
+    for name, stats, old in rows:
+        if not stats.get("count"):
+            continue
+        line = (f"{name:<14}{stats['count']:>7}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+                f"{stats['p99_ms']:>10}{stats.get('rss_peak_mb', ''):>9}")
+        if baseline:
+            old = old or {}
+            line += "".join(f"{change(stats[k], old.get(k)):>9}" for k in ("p50_ms", "p95_ms", "p99_ms"))
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dataset", choices=("populate", "synthetic"), default="populate",
+                        help="scaled populate_* rows, or skewed data from db/generate_data.py")
+    parser.add_argument("--portfolios", type=int, default=100_000,
+                        help="rows in the SQLite portfolios table (populate dataset only)")
+    parser.add_argument("--clients", type=int, default=10_000, help="documents in the in-memory clients collection")
+    parser.add_argument("--requests", type=int, default=200, help="total requests (0 = each question once)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--page-size", type=int, default=None)
+    parser.add_argument("--cold", action="store_true", help="clear the result and translation caches before each request")
+    parser.add_argument("--llm-only", action="store_true", help="skip the local router and templates so every question calls the LLM")
+    parser.add_argument("--llm-latency", type=float, default=200.0, help="mean fake LLM time to first token in ms")
+    parser.add_argument("--llm-jitter", type=float, default=50.0, help="uniform +/- jitter in ms")
+    parser.add_argument("--llm-token-ms", type=float, default=0.0, help="fake LLM time per generated token in ms")
+    parser.add_argument("--llm-tail", type=int, default=0,
+                        help="tokens of commentary the fake LLM adds after each query (what streaming cuts off)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--questions", default=os.path.join(BACKEND_DIR, "Question.txt"))
+    parser.add_argument("--stock", default=DEFAULT_STOCK, help="stock substituted for [specific stock]")
+    parser.add_argument("--canned", help="JSON file of {question: {store, sql, mongo}} overriding the built-in answers")
+    parser.add_argument("--output", help="report path (default bench/results/e2e-<commit>.json)")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    args = parser.parse_args()
+
+    report = run(args)
+    output = args.output or os.path.join(
+        BACKEND_DIR, "bench", "results", f"e2e-{report['meta']['commit']}{'-dirty' if report['meta']['dirty'] else ''}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    print(f"report written to {output}")
+
+if __name__ == "__main__":
+    main()
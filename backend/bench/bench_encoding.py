@@ -0,0 +1,85 @@
+"""
+Compare /query response encodings on a synthetic portfolios table.
+
+    python bench/bench_encoding.py --rows 100000
+
+Times the current path (QueryResponse validation + jsonable_encoder + json)
+against columnar orjson and Arrow IPC, and reports body sizes raw, gzip and zstd.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+# Allow running as `python bench/bench_encoding.py` from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fastapi.encoders import jsonable_encoder
+from schemas import QueryResponse
+from encoding import encode_columnar, encode_arrow, compress, pa
+
+CLIENTS = ["Alice", "Bob", "Charlie", "Deepika", "Amitabh", "Priya"]
+RMS = ["Rajiv Mehra", "Priya Shah", "Suresh Iyer"]
+STOCKS = ["HDFC Bank", "Reliance", "Infosys", "TCS"]
+
+def make_result(rows: int):
+    rng = random.Random(42)
+    table_rows = [
+        [f"{rng.choice(CLIENTS)} {i}", Decimal(rng.randrange(100_000_00, 10_000_000_00)) / 100,
+         rng.choice(RMS), rng.choice(STOCKS)]
+        for i in range(rows)
+    ]
+    return {
+        "text": "Results for: benchmark",
+        "table": {"columns": ["client_name", "portfolio_value", "relationship_manager", "stock"], "rows": table_rows},
+        "chart": None,
+        "next_cursor": None,
+        "truncated": False,
+        "error": None,
+    }
+
+def current_json(result) -> bytes:
+    validated = QueryResponse.model_validate(result)
+    return json.dumps(jsonable_encoder(validated), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def timed(fn, result, repeat):
+    best = float("inf")
+    body = b""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn(result)
+        best = min(best, time.perf_counter() - start)
+    return best, body
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    result = make_result(args.rows)
+    encoders = {"current": current_json, "columnar": encode_columnar}
+    if pa is not None:
+        encoders["arrow"] = encode_arrow
+    report = {"rows": args.rows, "formats": {}}
+    for name, fn in encoders.items():
+        seconds, body = timed(fn, result, args.repeat)
+        report["formats"][name] = {
+            "encode_ms": round(seconds * 1000, 1),
+            "bytes": len(body),
+            "gzip_bytes": len(compress(body, "gzip")[0]),
+            "zstd_bytes": len(compress(body, "zstd")[0]),
+        }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{args.rows} rows")
+    print(f"{'format':<10}{'encode ms':>12}{'bytes':>12}{'gzip':>12}{'zstd':>12}")
+    for name, stats in report["formats"].items():
+        print(f"{name:<10}{stats['encode_ms']:>12}{stats['bytes']:>12}{stats['gzip_bytes']:>12}{stats['zstd_bytes']:>12}")
+
+if __name__ == "__main__":
+    main()
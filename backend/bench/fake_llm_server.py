@@ -0,0 +1,105 @@
+"""
+Local OpenAI-compatible endpoint serving the benchmark's canned answers.
+
+    python bench/fake_llm_server.py --port 8099 --token-ms 20 --tail 200
+    LLM_API_BASE=http://127.0.0.1:8099/v1 OPENROUTER_API_KEY=fake uvicorn main:app
+
+POST /v1/chat/completions answers like bench_e2e.FakeLLM, as one JSON body or
+as server-sent events when "stream": true. Unlike the in-process fake, the
+real openai client and HTTP connection are exercised, so closing a stream early
+shows up here: GET /stats counts the tokens actually sent and the streams the
+client abandoned before the end.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_e2e import CANNED, FakeLLM
+
+def create_app(llm: FakeLLM, model: str = "fake"):
+    app = FastAPI()
+    stats = {"requests": 0, "streams": 0, "cancelled": 0, "tokens_sent": 0}
+
+    def chunk(completion_id, delta=None, usage=None):
+        body = {
+            "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+            "choices": [] if delta is None else [{"index": 0, "delta": {"content": delta}, "finish_reason": None}],
+        }
+        if usage is not None:
+            body["usage"] = usage
+        return f"data: {json.dumps(body)}\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        content = llm.answer(prompt)
+        pieces = llm.pieces(content)
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(pieces),
+                 "total_tokens": len(prompt) // 4 + len(pieces)}
+        completion_id = f"fake-{stats['requests']}"
+        stats["requests"] += 1
+        if not body.get("stream"):
+            await asyncio.sleep(llm.delay() + llm.token_delay * len(pieces))
+            stats["tokens_sent"] += len(pieces)
+            return {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        async def events():
+            stats["streams"] += 1
+            sent = 0
+            try:
+                await asyncio.sleep(llm.delay())
+                for piece in pieces:
+                    yield chunk(completion_id, piece)
+                    sent += 1
+                    await asyncio.sleep(llm.token_delay)
+                yield chunk(completion_id, usage=usage)
+                yield "data: [DONE]\n\n"
+            finally:
+                # Runs when the client disconnects mid-stream too
+                stats["tokens_sent"] += sent
+                if sent < len(pieces):
+                    stats["cancelled"] += 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    def get_stats():
+        return stats
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=200.0, help="mean time to first token in ms")
+    parser.add_argument("--jitter", type=float, default=50.0, help="uniform +/- jitter in ms")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="time per generated token in ms")
+    parser.add_argument("--tail", type=int, default=200, help="tokens of commentary after each query")
+    parser.add_argument("--canned", help="JSON file of {question: {store, sql, mongo}} overriding the built-in answers")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    canned = dict(CANNED)
+    if args.canned:
+        with open(args.canned, encoding="utf-8") as f:
+            canned.update(json.load(f))
+
+    import uvicorn
+    llm = FakeLLM(canned, args.latency, args.jitter, args.seed, args.token_ms, args.tail)
+    uvicorn.run(create_app(llm), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Startup budget check.
+
+    python bench/startup_budget.py --runs 5
+
+Each run is a fresh interpreter that measures, in order:
+
+- import: `import main`, which must stay cheap (no LangChain, drivers or
+  connections at import time),
+- startup: the FastAPI lifespan, i.e. the parallel warm-up of the tools, the
+  LLM client and both stores,
+- first_request: the first /query after startup.
+
+Stores and the LLM are the same stand-ins bench_e2e.py uses, so this runs
+offline. The median of every measurement is compared with its budget and the
+script exits with status 1 when any is over, so it can gate CI.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "1500"))
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "5000"))
+FIRST_REQUEST_BUDGET_MS = float(os.getenv("FIRST_REQUEST_BUDGET_MS", "1000"))
+
+FIRST_QUESTION = "Give me the breakup of portfolio values per relationship manager."
+
+def measure(question):
+    """One cold run in this process; returns milliseconds per phase."""
+    workdir = tempfile.mkdtemp(prefix="insightlens-startup-")
+    os.environ.setdefault("CACHE_DIR", workdir)
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.path.insert(0, BACKEND_DIR)
+
+    started = time.perf_counter()
+    import main
+    import_ms = (time.perf_counter() - started) * 1000
+
+    # Stand-ins go in after the import: the db modules only build clients on first use
+    import httpx
+    import mongomock
+    from mongomock_motor import AsyncMongoMockClient
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    import bench_e2e
+    import db.mongo
+    import db.mysql
+
+    sqlite_path = os.path.join(workdir, "portfolios.db")
+    mongo = mongomock.MongoClient()
+    bench_e2e.seed(sqlite_path, mongo["bench"]["clients"], bench_e2e.populate_batches(1000, 100))
+    engine = create_async_engine(f"sqlite+aiosqlite:///{sqlite_path}")
+    db.mysql.AsyncSessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+    db.mongo.db = mongo["bench"]
+    db.mongo.async_db = AsyncMongoMockClient(mock_mongo_client=mongo)["bench"]
+
+    async def run():
+        started = time.perf_counter()
+        async with main.app.router.lifespan_context(main.app):
+            startup_ms = (time.perf_counter() - started) * 1000
+            # The lifespan built the real client (and imported openai); answer from the fake one
+            main.llm_gateway._async_client = bench_e2e.FakeLLM(bench_e2e.CANNED, 0, 0, 42)
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+                started = time.perf_counter()
+                response = await client.post("/query", json={"query": question})
+                first_request_ms = (time.perf_counter() - started) * 1000
+                ready = (await client.get("/ready")).json()
+        if response.status_code != 200 or response.json().get("error"):
+            raise RuntimeError(f"first request failed: {response.status_code} {response.text[:200]}")
+        return startup_ms, first_request_ms, ready
+
+    startup_ms, first_request_ms, ready = asyncio.run(run())
+    return {
+        "import_ms": round(import_ms, 1),
+        "startup_ms": round(startup_ms, 1),
+        "first_request_ms": round(first_request_ms, 1),
+        "warmup_ms": {name: dep.get("warmup_ms") for name, dep in ready["dependencies"].items()},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters to measure; medians are checked")
+    parser.add_argument("--import-budget", type=float, default=IMPORT_BUDGET_MS, help="ms")
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET_MS, help="ms")
+    parser.add_argument("--first-request-budget", type=float, default=FIRST_REQUEST_BUDGET_MS, help="ms")
+    parser.add_argument("--question", default=FIRST_QUESTION)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.question)))
+        return
+
+    runs = []
+    for _ in range(args.runs):
+        # A new interpreter per run, so nothing is already imported or connected
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", "--question", args.question],
+            cwd=BACKEND_DIR, capture_output=True, text=True,
+        )
+        if child.returncode != 0:
+            sys.stderr.write(child.stderr)
+            sys.exit(child.returncode)
+        runs.append(json.loads(child.stdout.strip().splitlines()[-1]))
+
+    budgets = {"import_ms": args.import_budget, "startup_ms": args.startup_budget,
+               "first_request_ms": args.first_request_budget}
+    over = False
+    for name, budget in budgets.items():
+        median = statistics.median(run[name] for run in runs)
+        verdict = "ok" if median <= budget else "OVER"
+        over = over or median > budget
+        print(f"{name:<18}{median:>10.1f} ms   budget {budget:>8.0f} ms   {verdict}")
+    warmups = {name: statistics.median(run["warmup_ms"][name] for run in runs)
+               for name in runs[0]["warmup_ms"] if runs[0]["warmup_ms"][name] is not None}
+    print("warm-up (median): " + ", ".join(f"{name} {ms:.1f} ms" for name, ms in warmups.items()))
+    sys.exit(1 if over else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""
+Server-side query history: an append-only log with an in-memory search index.
+
+Every answered question is appended by a background writer as one JSON line
+to HISTORY_PATH (in CACHE_DIR, shared by all workers on the host) with its
+route, generated query, latency and result size. Each worker indexes the log by tailing it
+from the last offset it read, so questions asked on other workers show up
+too. The index keeps one entry per normalized question:
+
+- a sorted key list for prefix search (bisect)
+- character trigrams for fuzzy search, scored by trigram overlap
+- per-day counts, so popularity covers a recent window
+
+When the log outgrows HISTORY_MAX_BYTES it is compacted to one summary line
+per question (keeping its counts), under an exclusive lock so no append is
+lost.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+
+from cache.normalize import normalize_question
+from cache.translation import CACHE_DIR
+from observability import get_logger
+
+log = get_logger("History")
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "1") == "1"
+HISTORY_PATH = os.getenv("HISTORY_PATH", os.path.join(CACHE_DIR, "history.jsonl"))
+HISTORY_MAX_BYTES = int(os.getenv("HISTORY_MAX_BYTES", str(20 * 1024 * 1024)))
+# Questions kept when compacting, most recently asked first
+HISTORY_MAX_QUESTIONS = int(os.getenv("HISTORY_MAX_QUESTIONS", "20000"))
+# Popularity counts questions asked within this many days
+HISTORY_POPULAR_DAYS = int(os.getenv("HISTORY_POPULAR_DAYS", "7"))
+# Fuzzy matches need at least this share of the search text's trigrams
+HISTORY_FUZZY_THRESHOLD = float(os.getenv("HISTORY_FUZZY_THRESHOLD", "0.4"))
+# Queries longer than this are stored truncated
+MAX_QUERY_CHARS = 2000
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+def _day(ts):
+    return int(ts // 86400)
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class QueryHistory:
+    def __init__(self, path=HISTORY_PATH, enabled=HISTORY_ENABLED, max_bytes=HISTORY_MAX_BYTES,
+                 max_questions=HISTORY_MAX_QUESTIONS):
+        self.path = path
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.max_questions = max_questions
+        self._lock = threading.Lock()
+        # Appends take a file lock and a write, so they never run on the caller's thread
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-history")
+        self._reset()
+        self._stats = {"recorded": 0, "compactions": 0, "bad_lines": 0}
+
+    def _reset(self):
+        self._entries = {}
+        self._keys = []
+        self._grams = {}
+        self._offset = 0
+        self._inode = None
+
+    # --- writing ---------------------------------------------------------------
+
+    def _flock(self, mode):
+        """The lock file, locked in `mode`; None without fcntl or when a non-blocking request finds it taken."""
+        if fcntl is None:
+            return None
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # A descriptor per caller, so threads of one worker lock against each other too
+        lock_file = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file, mode)
+        except OSError:
+            lock_file.close()
+            return None
+        return lock_file
+
+    def record(self, question: str, endpoint: str, latency_ms: float, route=None, query=None, rows=0, error=None):
+        """Queue one answered question for the background writer to append to the log."""
+        if not self.enabled or not question or not question.strip():
+            return
+        if isinstance(query, str) and len(query) > MAX_QUERY_CHARS:
+            query = query[:MAX_QUERY_CHARS]
+        line = json.dumps({
+            "ts": round(time.time(), 3), "question": question.strip(), "endpoint": endpoint, "route": route,
+            "query": query, "latency_ms": round(latency_ms, 1), "rows": rows, "error": error,
+        }, default=_json_default) + "\n"
+        self._writer.submit(self._append, line)
+
+    def _append(self, line):
+        try:
+            # Shared with other appenders, exclusive against compaction swapping the file
+            lock_file = self._flock(fcntl.LOCK_SH) if fcntl is not None else None
+            try:
+                # One write on an O_APPEND descriptor, so concurrent workers never interleave a line
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, line.encode("utf-8"))
+                finally:
+                    os.close(fd)
+            finally:
+                if lock_file is not None:
+                    lock_file.close()
+        except OSError as e:
+            log.warning(f"Could not append to the query history: {e}")
+            return
+        with self._lock:
+            self._stats["recorded"] += 1
+
+    def flush(self):
+        """Wait for the appends queued so far."""
+        self._writer.submit(lambda: None).result()
+
+    # --- indexing --------------------------------------------------------------
+
+    def _apply(self, record):
+        question = record.get("question")
+        if not question:
+            return
+        key = normalize_question(question)
+        if not key:
+            return
+        ts = record.get("ts") or 0.0
+        count = int(record.get("count", 1))
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = {
+                "question": question, "count": 0, "days": Counter(), "endpoints": Counter(),
+                "first_ts": ts, "last_ts": 0.0, "latency_total": 0.0,
+            }
+            bisect.insort(self._keys, key)
+            for gram in trigrams(key):
+                self._grams.setdefault(gram, set()).add(key)
+        entry["count"] += count
+        entry["latency_total"] += record.get("latency_total", (record.get("latency_ms") or 0.0) * count)
+        # Summary lines from a compaction carry their counts; plain lines are one question each
+        days = record["days"] if "days" in record else {str(_day(ts)): count}
+        for day, n in days.items():
+            entry["days"][int(day)] += n
+        endpoints = record["endpoints"] if "endpoints" in record else {record.get("endpoint") or "query": count}
+        for endpoint, n in endpoints.items():
+            entry["endpoints"][endpoint] += n
+        entry["first_ts"] = min(entry["first_ts"], record.get("first_ts", ts))
+        if ts >= entry["last_ts"]:
+            # The latest run describes the question: its wording, route, query and outcome
+            entry.update({
+                "question": question, "last_ts": ts, "route": record.get("route"), "query": record.get("query"),
+                "latency_ms": record.get("latency_ms"), "rows": record.get("rows"), "error": record.get("error"),
+            })
+
+    def _catch_up(self):
+        """Index whatever was appended since the last read; caller holds self._lock."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            if self._offset:
+                self._reset()
+            return
+        with f:
+            # Checked on the open file, so a compaction swapping the path cannot slip in between
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != self._inode or stat.st_size < self._offset:
+                # Compacted (by this or another worker) since the last read: start over
+                self._reset()
+                self._inode = stat.st_ino
+            if stat.st_size == self._offset:
+                return
+            f.seek(self._offset)
+            data = f.read()
+        # A line still being written stays for the next read
+        end = data.rfind(b"\n") + 1
+        for raw in data[:end].splitlines():
+            try:
+                self._apply(json.loads(raw))
+            except (ValueError, TypeError, AttributeError):
+                self._stats["bad_lines"] += 1
+        self._offset += end
+
+    # --- reading ---------------------------------------------------------------
+
+    def _recent_count(self, entry, days, today):
+        return sum(n for day, n in entry["days"].items() if today - day < days)
+
+    def _view(self, entry, today, **extra):
+        return {
+            "question": entry["question"],
+            "count": entry["count"],
+            "recent_count": self._recent_count(entry, HISTORY_POPULAR_DAYS, today),
+            "last_asked": entry["last_ts"],
+            "route": entry.get("route"),
+            "query": entry.get("query"),
+            "latency_ms": entry.get("latency_ms"),
+            "avg_latency_ms": round(entry["latency_total"] / entry["count"], 1) if entry["count"] else None,
+            "rows": entry.get("rows"),
+            "error": entry.get("error"),
+            **extra,
+        }
+
+    def search(self, text: str = "", limit: int = 20):
+        """Past questions matching `text`: prefix matches first, then fuzzy ones; the most recent when empty."""
+        limit = max(1, min(limit, 100))
+        today = _day(time.time())
+        with self._lock:
+            self._catch_up()
+            needle = normalize_question(text or "")
+            if not needle:
+                recent = sorted(self._entries.items(), key=lambda item: item[1]["last_ts"], reverse=True)
+                return [self._view(entry, today) for _, entry in recent[:limit]]
+            results = []
+            seen = set()
+            start = bisect.bisect_left(self._keys, needle)
+            prefixed = []
+            for key in self._keys[start:]:
+                if not key.startswith(needle):
+                    break
+                prefixed.append(key)
+            for key in sorted(prefixed, key=lambda k: self._entries[k]["count"], reverse=True)[:limit]:
+                results.append(self._view(self._entries[key], today, match="prefix", score=1.0))
+                seen.add(key)
+            if len(results) < limit:
+                grams = trigrams(needle)
+                hits = Counter()
+                for gram in grams:
+                    for key in self._grams.get(gram, ()):
+                        if key not in seen:
+                            hits[key] += 1
+                scored = [(n / len(grams), key) for key, n in hits.items() if n / len(grams) >= HISTORY_FUZZY_THRESHOLD]
+                scored.sort(key=lambda item: (item[0], self._entries[item[1]]["count"]), reverse=True)
+                for score, key in scored[:limit - len(results)]:
+                    results.append(self._view(self._entries[key], today, match="fuzzy", score=round(score, 3)))
+            return results
+
+    def popular(self, n: int = 20, days: int = HISTORY_POPULAR_DAYS, min_count: int = 1):
+        """The questions asked most within the last `days` days whose latest run succeeded."""
+        today = _day(time.time())
+        with self._lock:
+            self._catch_up()
+            ranked = []
+            for key, entry in self._entries.items():
+                recent = self._recent_count(entry, days, today)
+                if recent >= min_count and not entry.get("error"):
+                    ranked.append((recent, entry["last_ts"], key))
+            ranked.sort(reverse=True)
+            return [
+                {**self._view(self._entries[key], today),
+                 "endpoint": self._entries[key]["endpoints"].most_common(1)[0][0]}
+                for _, _, key in ranked[:n]
+            ]
+
+    # --- compaction ------------------------------------------------------------
+
+    def compact_if_needed(self):
+        """Rewrite an oversized log as one summary line per question. Returns True when it did."""
+        try:
+            if os.path.getsize(self.path) <= self.max_bytes:
+                return False
+        except FileNotFoundError:
+            return False
+        # Compaction swaps the file, which is only safe while no other worker can append
+        lock_file = self._flock(fcntl.LOCK_EX | fcntl.LOCK_NB) if fcntl is not None else None
+        if lock_file is None:
+            return False
+        try:
+            with self._lock:
+                self._catch_up()
+                keep = sorted(self._entries.values(), key=lambda e: e["last_ts"], reverse=True)[:self.max_questions]
+                oldest_day = _day(time.time()) - HISTORY_POPULAR_DAYS
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    for entry in reversed(keep):
+                        summary = {
+                            "ts": entry["last_ts"], "first_ts": entry["first_ts"], "question": entry["question"],
+                            "route": entry.get("route"), "query": entry.get("query"),
+                            "latency_ms": entry.get("latency_ms"), "rows": entry.get("rows"), "error": entry.get("error"),
+                            "count": entry["count"], "latency_total": entry["latency_total"],
+                            "endpoints": dict(entry["endpoints"]),
+                            # Older days no longer matter for popularity; keep their count in the total only
+                            "days": {str(day): n for day, n in entry["days"].items() if day >= oldest_day},
+                        }
+                        f.write(json.dumps(summary, default=_json_default) + "\n")
+                before = os.path.getsize(self.path)
+                os.replace(tmp, self.path)
+                self._reset()
+                self._stats["compactions"] += 1
+            log.info("Compacted query history", extra={"fields": {
+                "bytes_before": before, "bytes_after": os.path.getsize(self.path), "questions": len(keep),
+            }})
+            return True
+        except OSError as e:
+            log.warning(f"Query history compaction failed: {e}")
+            return False
+        finally:
+            lock_file.close()
+
+    def stats(self):
+        with self._lock:
+            self._catch_up()
+            stats = dict(self._stats)
+            stats["questions"] = len(self._entries)
+            stats["asked"] = sum(e["count"] for e in self._entries.values())
+        try:
+            stats["log_bytes"] = os.path.getsize(self.path)
+        except FileNotFoundError:
+            stats["log_bytes"] = 0
+        return stats
+
+history = QueryHistory()
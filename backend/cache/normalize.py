@@ -0,0 +1,41 @@
+import re
+import unicodedata
+
+WORD_NUMBERS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+    "eleven": 11, "twelve": 12, "fifteen": 15, "twenty": 20,
+    "fifty": 50, "hundred": 100,
+}
+MULTIPLIERS = {
+    "k": 1_000, "thousand": 1_000, "lakh": 100_000, "lakhs": 100_000,
+    "m": 1_000_000, "mn": 1_000_000, "million": 1_000_000,
+    "cr": 10_000_000, "crore": 10_000_000, "crores": 10_000_000,
+}
+
+_NUMBER_RE = re.compile(
+    r"(\d[\d,]*(?:\.\d+)?)(?:\s*(" + "|".join(sorted(MULTIPLIERS, key=len, reverse=True)) + r"))?\b"
+)
+_WORD_NUMBER_RE = re.compile(r"\b(" + "|".join(WORD_NUMBERS) + r")\b")
+# Keep comparison operators and quotes, they change the meaning of a question
+_PUNCT_RE = re.compile(r"[^\w\s=<>'.]")
+
+def _canonical_number(match) -> str:
+    value = float(match.group(1).replace(",", ""))
+    if match.group(2):
+        value *= MULTIPLIERS[match.group(2)]
+    return str(int(value)) if value == int(value) else repr(value)
+
+def normalize_question(question: str) -> str:
+    """
+    Canonical form of a question used as a cache key: case, whitespace,
+    punctuation and number spelling ("7,000,000", "70 lakh", "7 million") are folded.
+    """
+    q = unicodedata.normalize("NFKC", question).lower()
+    q = q.replace("’", "'").replace('"', "'")
+    q = _WORD_NUMBER_RE.sub(lambda m: str(WORD_NUMBERS[m.group(1)]), q)
+    q = _NUMBER_RE.sub(_canonical_number, q)
+    q = _PUNCT_RE.sub(" ", q)
+    # Sentence-final dots are punctuation, decimal points are not
+    q = re.sub(r"\.(?!\d)", " ", q)
+    return " ".join(q.split())
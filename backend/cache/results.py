@@ -0,0 +1,185 @@
+"""
+Query result cache with data-version invalidation.
+
+Entries are keyed by the final executed query (SQL text + bound params, or a
+Mongo filter) together with the current data version of every table or
+collection the query reads. Writers call bump_data_version(), which bumps a
+counter in a SQLite file shared by all workers, so stale entries are never
+served again once the data changes. Each worker re-reads the counters at most
+every DATA_VERSION_CHECK_INTERVAL seconds, on one connection and in a
+background thread, so lookups on the event loop never wait for SQLite.
+
+Entries never hold a next_cursor: cursors encode the asker's question, so the
+tools store the cursor state and encode it per asker (pagination.with_cursor).
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cache.translation import CACHE_DIR
+from observability import get_logger
+
+log = get_logger("ResultCache")
+
+DATA_VERSION_PATH = os.getenv("DATA_VERSION_PATH", os.path.join(CACHE_DIR, "data_versions.sqlite3"))
+# How long a worker trusts its last read of the version table
+DATA_VERSION_CHECK_INTERVAL = float(os.getenv("DATA_VERSION_CHECK_INTERVAL", "1.0"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "3600"))
+# Very large results are not worth pinning in worker memory
+RESULT_CACHE_MAX_ROWS = int(os.getenv("RESULT_CACHE_MAX_ROWS", "10000"))
+
+_TABLE_RE = re.compile(r"\b(?:from|join)\s+`?([a-zA-Z_][a-zA-Z0-9_]*)`?", re.IGNORECASE)
+
+def _connect(path=DATA_VERSION_PATH, check_same_thread=True):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS data_versions (name TEXT PRIMARY KEY, version INTEGER, updated_at REAL)")
+    return conn
+
+def bump_data_version(name: str, path=DATA_VERSION_PATH) -> int:
+    """
+    Mark a table or collection as changed. Call this from every write path.
+    """
+    conn = _connect(path)
+    try:
+        conn.execute(
+            "INSERT INTO data_versions (name, version, updated_at) VALUES (?, 1, ?) "
+            "ON CONFLICT(name) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at",
+            (name, time.time()),
+        )
+        version = conn.execute("SELECT version FROM data_versions WHERE name = ?", (name,)).fetchone()[0]
+    finally:
+        conn.close()
+    log.debug(f"Data version of {name} is now {version}")
+    return version
+
+def sql_tables(sql: str):
+    return sorted({t.lower() for t in _TABLE_RE.findall(sql)})
+
+class DataVersions:
+    def __init__(self, path=DATA_VERSION_PATH, check_interval=DATA_VERSION_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._versions = {}
+        self._updated_at = {}
+        self._checked_at = None
+        self._refreshing = False
+        self._conn = None
+        self._lock = threading.Lock()
+        self._conn_lock = threading.Lock()
+        self._poller = ThreadPoolExecutor(max_workers=1, thread_name_prefix="data-versions")
+
+    def refresh(self):
+        """Re-read the version table on the one connection this instance keeps."""
+        try:
+            with self._conn_lock:
+                if self._conn is None:
+                    self._conn = _connect(self.path, check_same_thread=False)
+                rows = self._conn.execute("SELECT name, version, updated_at FROM data_versions").fetchall()
+        except sqlite3.Error as e:
+            log.warning(f"SQLite error reading data versions: {e}")
+            rows = None
+        with self._lock:
+            if rows is not None:
+                self._versions = {name: version for name, version, _ in rows}
+                self._updated_at = {name: updated_at or 0.0 for name, _, updated_at in rows}
+            self._checked_at = time.monotonic()
+            self._refreshing = False
+            return self._versions
+
+    def snapshot(self):
+        with self._lock:
+            if self._checked_at is not None:
+                if not self._refreshing and time.monotonic() - self._checked_at >= self.check_interval:
+                    # Served from the last read while the poller thread re-reads the table
+                    self._refreshing = True
+                    self._poller.submit(self.refresh)
+                return self._versions
+        # Only the very first read waits; the app lifespan makes it in a thread before serving
+        return self.refresh()
+
+    def get(self, names):
+        versions = self.snapshot()
+        return tuple((name, versions.get(name, 0)) for name in names)
+
+    def last_write(self, names=None) -> float:
+        """Wall-clock time of the latest bump of any of `names` (all tables when None), 0 if never."""
+        self.snapshot()
+        with self._lock:
+            updated = self._updated_at
+            times = updated.values() if names is None else [updated.get(name, 0.0) for name in names]
+            return max(times, default=0.0)
+
+class ResultCache:
+    def __init__(self, size=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL, max_rows=RESULT_CACHE_MAX_ROWS,
+                 versions=None):
+        self.size = size
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.versions = versions or DataVersions()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "stale": 0}
+
+    def key(self, store: str, query, params=None, sources=()):
+        """
+        Build the cache key for an executed query. `sources` are the tables or
+        collections it reads; their current data versions become part of the key.
+        """
+        payload = json.dumps([store, query, params or {}], sort_keys=True, default=str)
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        return digest, self.versions.get(sources)
+
+    def get(self, key):
+        digest, versions = key
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            value, entry_versions, stored_at = entry
+            if entry_versions != versions or now - stored_at >= self.ttl:
+                del self._entries[digest]
+                self._stats["stale"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(digest)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key, value):
+        if len(value.get("rows") or []) > self.max_rows:
+            return
+        if "next_cursor" in value:
+            # Encoded for one asker's question; see pagination.with_cursor
+            value = {k: v for k, v in value.items() if k != "next_cursor"}
+        digest, versions = key
+        with self._lock:
+            self._entries[digest] = (value, versions, time.monotonic())
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+            self._stats["stores"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] / lookups) if lookups else 0.0
+        return stats
+
+result_cache = ResultCache()
@@ -0,0 +1,230 @@
+"""
+Single-flight coalescing of identical concurrent questions.
+
+Requests for the same normalized question (and page size) that arrive while
+one is already running wait for that execution and share its result instead
+of each routing, calling the LLM and querying the database.
+
+Within a worker, duplicates await one shared task. With SINGLEFLIGHT_SHARED=1
+workers on the same host also coordinate through a lock file per question:
+the worker holding the lock computes the answer and writes it next to the
+lock, and the others wait for the lock and read that answer; Decimals and
+dates survive the trip, and the leader returns the answer as written so every
+worker responds identically. Lock and result files untouched for
+SINGLEFLIGHT_FILE_TTL seconds are pruned together.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from cache.normalize import normalize_question
+from cache.translation import CACHE_DIR
+from observability import get_logger
+
+log = get_logger("SingleFlight")
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "1") == "1"
+SINGLEFLIGHT_SHARED = os.getenv("SINGLEFLIGHT_SHARED", "0") == "1"
+SINGLEFLIGHT_DIR = os.getenv("SINGLEFLIGHT_DIR", os.path.join(CACHE_DIR, "singleflight"))
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", "0.05"))
+# Lock and result files older than this are pruned
+SINGLEFLIGHT_FILE_TTL = float(os.getenv("SINGLEFLIGHT_FILE_TTL", "300"))
+PRUNE_INTERVAL = 100
+
+def _encode(value):
+    # Tagged so a follower decodes exactly the values the leader computed
+    if isinstance(value, Decimal):
+        return {"$decimal": str(value)}
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, date):
+        return {"$date": value.isoformat()}
+    return str(value)
+
+_DECODERS = {"$decimal": Decimal, "$datetime": datetime.fromisoformat, "$date": date.fromisoformat}
+
+def _decode(obj):
+    if len(obj) == 1:
+        (tag, value), = obj.items()
+        if tag in _DECODERS and isinstance(value, str):
+            return _DECODERS[tag](value)
+    return obj
+
+class SingleFlight:
+    def __init__(self, enabled=SINGLEFLIGHT_ENABLED, shared=SINGLEFLIGHT_SHARED, directory=SINGLEFLIGHT_DIR):
+        self.enabled = enabled
+        self.shared = shared and fcntl is not None
+        self.directory = directory
+        self._inflight = {}
+        self._writes = 0
+        # Shared results are read and written on worker threads
+        self._lock = threading.Lock()
+        self._stats = {"executions": 0, "coalesced": 0, "shared_hits": 0, "pruned": 0}
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def key(self, question: str, *parts) -> str:
+        payload = json.dumps([normalize_question(question), *parts], default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def do(self, key: str, fn):
+        """Run `fn()` once for all concurrent callers with the same key and return its result."""
+        if not self.enabled:
+            return await fn()
+        task = self._inflight.get(key)
+        if task is not None:
+            self._count("coalesced")
+            log.debug(f"Coalesced request onto in-flight {key[:12]}")
+        else:
+            # A separate task keeps running for the followers even if the first caller goes away
+            task = asyncio.ensure_future(self._shared_do(key, fn) if self.shared else self._execute(fn))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _execute(self, fn):
+        self._count("executions")
+        return await fn()
+
+    # --- cross-worker mode -----------------------------------------------------
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".lock", base + ".json"
+
+    def _try_lock(self, fd) -> bool:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _read(self, path, since):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f, object_hook=_decode)
+        except (OSError, ValueError):
+            return None
+        # Only an answer finished after we started waiting counts as shared
+        return entry["result"] if entry.get("at", 0) >= since else None
+
+    def _write(self, path, result):
+        """Write the leader's result; returns it as followers will read it back."""
+        payload = json.dumps({"at": time.time(), "result": result}, default=_encode)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp, path)
+        with self._lock:
+            self._writes += 1
+            due = self._writes % PRUNE_INTERVAL == 0
+        if due:
+            self._prune()
+        return json.loads(payload, object_hook=_decode)["result"]
+
+    def _recent(self, lock_path, result_path, cutoff):
+        for path in (lock_path, result_path):
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    return True
+            except OSError:
+                pass
+        return False
+
+    def _prune(self):
+        """Remove the lock and result files of questions nobody asked for SINGLEFLIGHT_FILE_TTL seconds."""
+        cutoff = time.time() - SINGLEFLIGHT_FILE_TTL
+        keys = {name.rsplit(".", 1)[0] for name in os.listdir(self.directory) if name.endswith((".lock", ".json"))}
+        pruned = 0
+        for key in keys:
+            lock_path, result_path = self._paths(key)
+            if self._recent(lock_path, result_path, cutoff):
+                continue
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_RDWR)
+            except OSError:
+                continue
+            try:
+                # Only a lock nobody holds; a worker still waiting on it re-opens the new file (_acquire)
+                # Checked again under the lock: an answer may have been written meanwhile
+                if not self._try_lock(fd) or self._recent(lock_path, result_path, cutoff):
+                    continue
+                for path in (result_path, lock_path):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                pruned += 1
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+        if pruned:
+            self._count("pruned", pruned)
+
+    def _current(self, fd, lock_path):
+        try:
+            return os.fstat(fd).st_ino == os.stat(lock_path).st_ino
+        except FileNotFoundError:
+            return False
+
+    async def _acquire(self, lock_path):
+        """(fd, waited): a descriptor holding the lock at lock_path, and whether another worker held it first."""
+        waited = False
+        while True:
+            fd = os.open(lock_path, os.O_CREAT | os.O_RDWR)
+            try:
+                while not self._try_lock(fd):
+                    waited = True
+                    await asyncio.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+                current = self._current(fd, lock_path)
+            except BaseException:
+                # Cancelled while waiting (e.g. the request deadline)
+                os.close(fd)
+                raise
+            if current:
+                return fd, waited
+            # Pruned while we waited: the lock that counts is the file now at that path
+            os.close(fd)
+
+    async def _shared_do(self, key, fn):
+        os.makedirs(self.directory, exist_ok=True)
+        lock_path, result_path = self._paths(key)
+        started = time.time()
+        fd, waited = await self._acquire(lock_path)
+        try:
+            if waited:
+                result = await asyncio.to_thread(self._read, result_path, started)
+                if result is not None:
+                    self._count("shared_hits")
+                    log.debug(f"Shared result from another worker for {key[:12]}")
+                    return result
+            result = await self._execute(fn)
+            # Leader and followers answer with the same values (rows as lists, not tuples)
+            return await asyncio.to_thread(self._write, result_path, result)
+        finally:
+            # Closing the descriptor releases the lock
+            os.close(fd)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            **stats,
+            "inflight": len(self._inflight),
+            "shared_mode": self.shared,
+        }
+
+single_flight = SingleFlight()
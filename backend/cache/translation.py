@@ -0,0 +1,193 @@
+"""
+Persistent NL -> query translation cache.
+
+Two tiers: a per-process in-memory LRU in front of a SQLite file in WAL mode,
+which every uvicorn worker on the host opens so translations are shared and
+survive restarts. Keys are (store, schema version, normalized question).
+
+SQLite never runs on the event loop: aget() answers from memory and reads the
+file in a worker thread, and writes (stores, access times, eviction) go to one
+background writer thread, so a busy file cannot stall requests.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from cache.normalize import normalize_question
+from observability import get_logger
+
+log = get_logger("TranslationCache")
+
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+TRANSLATION_CACHE_PATH = os.getenv("TRANSLATION_CACHE_PATH", os.path.join(CACHE_DIR, "translations.sqlite3"))
+TRANSLATION_CACHE_TTL = int(os.getenv("TRANSLATION_CACHE_TTL", str(7 * 24 * 3600)))
+TRANSLATION_CACHE_MEMORY_SIZE = int(os.getenv("TRANSLATION_CACHE_MEMORY_SIZE", "1024"))
+TRANSLATION_CACHE_MAX_ENTRIES = int(os.getenv("TRANSLATION_CACHE_MAX_ENTRIES", "100000"))
+# Disk eviction runs once every this many writes rather than on every write
+EVICTION_INTERVAL = 100
+
+class TranslationCache:
+    def __init__(self, path=TRANSLATION_CACHE_PATH, ttl=TRANSLATION_CACHE_TTL,
+                 memory_size=TRANSLATION_CACHE_MEMORY_SIZE, max_entries=TRANSLATION_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Its thread starts on the first write
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="translation-cache")
+        self._writes = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                "key TEXT PRIMARY KEY, store TEXT, question TEXT, value TEXT, "
+                "created_at REAL, accessed_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_translations_accessed ON translations (accessed_at)")
+            self._local.conn = conn
+        return conn
+
+    def _key(self, store: str, question: str, schema_version: str) -> str:
+        raw = f"{store}|{schema_version}|{normalize_question(question)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _remember(self, key, value, created_at):
+        with self._lock:
+            self._memory[key] = (value, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _memory_get(self, key, now):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] < self.ttl:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return entry[0]
+            if entry is not None:
+                del self._memory[key]
+        return None
+
+    def _disk_get(self, key, now):
+        try:
+            row = self._conn().execute(
+                "SELECT value, created_at FROM translations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] < self.ttl:
+                value = json.loads(row[0])
+                self._remember(key, value, row[1])
+                # The access time only orders eviction, so it is written in the background
+                self._writer.submit(self._touch, key, now)
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                return value
+        except sqlite3.Error as e:
+            log.warning(f"SQLite error on read: {e}")
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def get(self, store: str, question: str, schema_version: str):
+        key = self._key(store, question, schema_version)
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is not None:
+            return value
+        return self._disk_get(key, now)
+
+    async def aget(self, store: str, question: str, schema_version: str):
+        """get() for the event loop: memory hits return at once, the file is read in a worker thread."""
+        key = self._key(store, question, schema_version)
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is not None:
+            return value
+        return await asyncio.to_thread(self._disk_get, key, now)
+
+    def set(self, store: str, question: str, schema_version: str, value):
+        """
+        Store a validated translation, e.g. {"query": sql, "params": {...}}. It is served
+        from memory at once; the background writer persists it.
+        """
+        key = self._key(store, question, schema_version)
+        now = time.time()
+        self._remember(key, value, now)
+        self._writer.submit(self._write, key, store, normalize_question(question), json.dumps(value, default=str), now)
+
+    def _touch(self, key, now):
+        try:
+            self._conn().execute("UPDATE translations SET accessed_at = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            log.warning(f"SQLite error on write: {e}")
+
+    def _write(self, key, store, question, value, now):
+        try:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO translations (key, store, question, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, store, question, value, now, now),
+            )
+        except sqlite3.Error as e:
+            log.warning(f"SQLite error on write: {e}")
+            return
+        with self._lock:
+            self._stats["stores"] += 1
+            self._writes += 1
+            evict = self._writes % EVICTION_INTERVAL == 0
+        if evict:
+            self.evict()
+
+    def flush(self):
+        """Wait for the writes queued so far."""
+        self._writer.submit(lambda: None).result()
+
+    def evict(self):
+        """Drop expired rows, then the least recently used ones above max_entries."""
+        try:
+            conn = self._conn()
+            expired = conn.execute(
+                "DELETE FROM translations WHERE created_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+            overflow = conn.execute(
+                "DELETE FROM translations WHERE key IN ("
+                "SELECT key FROM translations ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+        except sqlite3.Error as e:
+            log.warning(f"SQLite error on eviction: {e}")
+            return
+        with self._lock:
+            self._stats["evictions"] += expired + overflow
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        # On the writer, so no write queued before the clear lands after it
+        self._writer.submit(lambda: self._conn().execute("DELETE FROM translations")).result()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = ((stats["memory_hits"] + stats["disk_hits"]) / lookups) if lookups else 0.0
+        return stats
+
+translation_cache = TranslationCache()
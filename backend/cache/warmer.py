@@ -0,0 +1,140 @@
+"""
+Prewarming the translation and result caches with the most asked questions.
+
+A warm-up re-runs the HISTORY_WARM_TOP questions asked most over the last
+HISTORY_POPULAR_DAYS days (at least HISTORY_WARM_MIN_COUNT times, last run
+successful), the same way their askers ran them (/query or /query/stream):
+
+- at the local times in HISTORY_WARM_AT, e.g. "07:30" before the morning rush
+- after a data reload, once no table has changed for HISTORY_WARM_SETTLE seconds
+  (the reload bumped the data versions, so every cached result is stale)
+- when the worker starts, and on demand via POST /history/warm
+
+Result caches are per worker, so every worker warms its own. Translations are
+shared on disk, so only the first worker to warm a question calls the LLM.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, time as clock
+
+from cache.history import history, HISTORY_POPULAR_DAYS
+from cache.results import result_cache
+from observability import get_logger
+
+log = get_logger("CacheWarmer")
+
+HISTORY_WARM_ENABLED = os.getenv("HISTORY_WARM_ENABLED", "1") == "1"
+HISTORY_WARM_TOP = int(os.getenv("HISTORY_WARM_TOP", "20"))
+HISTORY_WARM_MIN_COUNT = int(os.getenv("HISTORY_WARM_MIN_COUNT", "2"))
+# Comma-separated local HH:MM times
+HISTORY_WARM_AT = os.getenv("HISTORY_WARM_AT", "07:30")
+HISTORY_WARM_SETTLE = float(os.getenv("HISTORY_WARM_SETTLE", "60"))
+HISTORY_WARM_ON_START = os.getenv("HISTORY_WARM_ON_START", "1") == "1"
+HISTORY_WARM_CHECK_INTERVAL = float(os.getenv("HISTORY_WARM_CHECK_INTERVAL", "30"))
+# Questions re-run at once, so warming never crowds out real traffic
+HISTORY_WARM_CONCURRENCY = int(os.getenv("HISTORY_WARM_CONCURRENCY", "2"))
+
+def parse_times(spec: str):
+    times = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            hour, minute = part.split(":")
+            times.append(clock(int(hour), int(minute)))
+        except ValueError:
+            log.warning(f"Ignoring warm-up time {part!r}; expected HH:MM")
+    return sorted(times)
+
+class CacheWarmer:
+    def __init__(self, history=history, versions=None, top=HISTORY_WARM_TOP, min_count=HISTORY_WARM_MIN_COUNT,
+                 times=HISTORY_WARM_AT, settle=HISTORY_WARM_SETTLE, concurrency=HISTORY_WARM_CONCURRENCY):
+        self.history = history
+        self.versions = versions or result_cache.versions
+        self.top = top
+        self.min_count = min_count
+        self.times = parse_times(times)
+        self.settle = settle
+        self.concurrency = concurrency
+        # Scheduled times that already passed when the worker started do not fire
+        self._last_scheduled = datetime.now()
+        self._seen_write = None
+        self._lock = asyncio.Lock()
+        self._stats = {"runs": 0, "warmed": 0, "failed": 0, "last_run": None, "last_reason": None,
+                       "last_duration_ms": None}
+
+    def due(self, now: datetime = None):
+        """Why a warm-up is due now ("schedule" or "data_reload"), or None."""
+        now = now or datetime.now()
+        for at in self.times:
+            slot = datetime.combine(now.date(), at)
+            if self._last_scheduled < slot <= now:
+                self._last_scheduled = now
+                return "schedule"
+        last_write = self.versions.last_write()
+        if self._seen_write is None:
+            self._seen_write = last_write
+        elif last_write > self._seen_write and time.time() - last_write >= self.settle:
+            self._seen_write = last_write
+            return "data_reload"
+        return None
+
+    async def warm(self, answer, reason: str = "manual"):
+        """
+        Re-run the popular questions through `answer(question, endpoint)`, which returns
+        an error message or None. Returns a summary of the run.
+        """
+        if self._lock.locked():
+            return {"reason": reason, "skipped": "a warm-up is already running"}
+        async with self._lock:
+            started = time.perf_counter()
+            questions = await asyncio.to_thread(self.history.popular, self.top, HISTORY_POPULAR_DAYS, self.min_count)
+            semaphore = asyncio.Semaphore(self.concurrency)
+            failures = []
+
+            async def one(item):
+                async with semaphore:
+                    try:
+                        error = await answer(item["question"], item["endpoint"])
+                    except Exception as e:
+                        error = f"{type(e).__name__}: {e}"
+                    if error:
+                        failures.append({"question": item["question"], "error": error})
+
+            await asyncio.gather(*(one(item) for item in questions))
+            duration_ms = round((time.perf_counter() - started) * 1000, 1)
+            self._stats["runs"] += 1
+            self._stats["warmed"] += len(questions) - len(failures)
+            self._stats["failed"] += len(failures)
+            self._stats.update(last_run=time.time(), last_reason=reason, last_duration_ms=duration_ms)
+            log.info("Cache warm-up complete", extra={"fields": {
+                "reason": reason, "questions": len(questions), "failed": len(failures), "duration_ms": duration_ms,
+            }})
+            return {"reason": reason, "questions": len(questions), "failed": failures, "duration_ms": duration_ms}
+
+    async def run(self, answer, interval: float = HISTORY_WARM_CHECK_INTERVAL, on_start: bool = HISTORY_WARM_ON_START):
+        reason = "startup" if on_start else None
+        while True:
+            try:
+                if reason is not None:
+                    await self.warm(answer, reason)
+                await asyncio.sleep(interval)
+                # The history log is compacted from here, off the request path
+                await asyncio.to_thread(self.history.compact_if_needed)
+                reason = self.due()
+            except Exception as e:
+                log.warning(f"Cache warm-up failed: {type(e).__name__}: {e}")
+                reason = None
+
+    def stats(self):
+        return {
+            **self._stats,
+            "enabled": HISTORY_WARM_ENABLED,
+            "top": self.top,
+            "times": [at.strftime("%H:%M") for at in self.times],
+            "running": self._lock.locked(),
+        }
+
+cache_warmer = CacheWarmer()
@@ -0,0 +1,195 @@
+"""
+Chart helpers shared by the tools.
+
+build_chart() turns a table into a bounded ChartResult payload:
+- column roles are inferred from the types seen across a sample of rows, not
+  just the first row;
+- categorical charts (string labels) sum duplicate labels and keep the top-N
+  categories, with the long tail folded into "Other";
+- series charts (date or numeric x axis) are downsampled to a point budget
+  with Largest-Triangle-Three-Buckets, which keeps the visual shape.
+The heavy lifting runs on NumPy arrays rather than row-by-row Python.
+"""
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from itertools import islice
+from operator import itemgetter
+
+import numpy as np
+
+from observability import span
+
+# Upper bound on points in any chart payload
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "500"))
+# Categories shown before the rest is summed into "Other"
+CHART_TOP_N = int(os.getenv("CHART_TOP_N", "20"))
+# Rows scanned per column to infer its type
+CHART_TYPE_SAMPLE = int(os.getenv("CHART_TYPE_SAMPLE", "1000"))
+# Streamed results keep at most this many (label, value) pairs for the chart
+STREAM_CHART_MAX_POINTS = int(os.getenv("STREAM_CHART_MAX_POINTS", "100000"))
+
+OTHER_LABEL = "Other"
+NUMERIC_TYPES = (int, float, Decimal, np.number)
+
+def _column_kind(values):
+    # One type check per distinct type, not per value
+    types = set(map(type, values))
+    types.discard(type(None))
+    if not types:
+        return None
+    if all(issubclass(t, NUMERIC_TYPES) and not issubclass(t, (bool, np.bool_)) for t in types):
+        return "numeric"
+    if all(issubclass(t, date) for t in types):
+        return "temporal"
+    if all(issubclass(t, str) for t in types):
+        return "text"
+    return None
+
+def infer_chart_columns(columns, rows):
+    """
+    Returns (label_idx, value_idx, kind) or None. kind is "categorical" when the
+    labels are strings and "series" when they are dates or numbers.
+    """
+    sample = list(islice(rows, CHART_TYPE_SAMPLE))
+    if not sample:
+        return None
+    kinds = [_column_kind(map(itemgetter(i), sample)) for i in range(len(columns))]
+    numeric = [i for i, kind in enumerate(kinds) if kind == "numeric"]
+    text = [i for i, kind in enumerate(kinds) if kind == "text"]
+    temporal = [i for i, kind in enumerate(kinds) if kind == "temporal"]
+    if text and numeric:
+        return text[0], numeric[0], "categorical"
+    if temporal and numeric:
+        return temporal[0], numeric[0], "series"
+    if len(numeric) >= 2:
+        return numeric[0], numeric[1], "series"
+    return None
+
+def _as_floats(values):
+    # None becomes NaN; Decimal and int convert through float()
+    return np.array(values, dtype=float)
+
+def categorical_chart(labels, values, top_n=CHART_TOP_N):
+    """Sum duplicate labels, keep the top_n largest, fold the rest into "Other"."""
+    labels = np.asarray(labels, dtype=object).astype(str)
+    values = _as_floats(values)
+    keep = ~np.isnan(values)
+    labels, values = labels[keep], values[keep]
+    if not len(values):
+        return None
+    unique, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    sums = np.bincount(inverse, weights=values, minlength=len(unique))
+    if len(unique) <= top_n:
+        # Few categories: keep the order the query returned them in
+        order = np.argsort(first, kind="stable")
+        return unique[order].tolist(), sums[order].tolist()
+    order = np.argsort(-sums, kind="stable")
+    head, tail = order[:top_n], order[top_n:]
+    return unique[head].tolist() + [OTHER_LABEL], sums[head].tolist() + [float(sums[tail].sum())]
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling. Returns the indices of the
+    points to keep, always including the first and last point.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    keep = np.empty(threshold, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        # The next bucket's average is the third corner of the triangle
+        next_start, next_end = edges[i + 1], (edges[i + 2] if i + 2 < len(edges) else n)
+        next_end = max(next_end, next_start + 1)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        areas = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        keep[i + 1] = a
+    return keep
+
+def series_chart(labels, values, max_points=CHART_MAX_POINTS):
+    values = _as_floats(values)
+    keep = ~np.isnan(values)
+    labels = np.asarray(labels, dtype=object)[keep]
+    values = values[keep]
+    if not len(values):
+        return None
+    if isinstance(labels[0], (date, datetime)):
+        x = np.array([label.timestamp() if isinstance(label, datetime) else label.toordinal() for label in labels], dtype=float)
+    else:
+        x = _as_floats(labels)
+    order = np.argsort(x, kind="stable")
+    x, values, labels = x[order], values[order], labels[order]
+    picked = lttb(x, values, max_points)
+    return [str(label) for label in labels[picked]], values[picked].tolist()
+
+def chart_from_pairs(labels, values, value_name, kind, max_points=CHART_MAX_POINTS, top_n=CHART_TOP_N):
+    if kind == "categorical":
+        points = categorical_chart(labels, values, min(top_n, max_points - 1))
+    else:
+        points = series_chart(labels, values, max_points)
+    if points is None:
+        return None
+    return {"labels": points[0], "data": points[1], "label": value_name}
+
+def build_chart(columns, rows, max_points=CHART_MAX_POINTS, top_n=CHART_TOP_N):
+    """Chart payload for a result table, or None when it has no chartable columns."""
+    with span("chart"):
+        columns = list(columns)
+        roles = infer_chart_columns(columns, rows)
+        if roles is None:
+            return None
+        label_idx, value_idx, kind = roles
+        labels = list(map(itemgetter(label_idx), rows))
+        values = list(map(itemgetter(value_idx), rows))
+        return chart_from_pairs(labels, values, columns[value_idx], kind, max_points, top_n)
+
+class ChartAccumulator:
+    """
+    Builds a chart from streamed row batches. Only the (label, value) pair of
+    each row is kept, up to max_points pairs, and build_chart's aggregation and
+    downsampling run once at the end. Rows past max_points are not charted,
+    which the result marks as truncated.
+    """
+    def __init__(self, columns, max_points=STREAM_CHART_MAX_POINTS):
+        self.columns = list(columns)
+        self.max_points = max_points
+        self.roles = None
+        self.labels = []
+        self.values = []
+        self.truncated = False
+        self._typed = False
+
+    def add(self, rows):
+        if not rows:
+            return
+        if not self._typed:
+            # Column roles come from the first batch, which is a full sample in practice
+            self.roles = infer_chart_columns(self.columns, rows)
+            self._typed = True
+        if self.roles is None:
+            return
+        room = self.max_points - len(self.labels)
+        if room < len(rows):
+            self.truncated = True
+        rows = rows[:max(room, 0)]
+        self.labels.extend(map(itemgetter(self.roles[0]), rows))
+        self.values.extend(map(itemgetter(self.roles[1]), rows))
+
+    def result(self):
+        """The chart, with "truncated" set when rows past max_points were left out of it."""
+        if not self.labels:
+            return None
+        label_idx, value_idx, kind = self.roles
+        with span("chart"):
+            chart = chart_from_pairs(self.labels, self.values, self.columns[value_idx], kind)
+        if chart is not None:
+            chart["truncated"] = self.truncated
+        return chart
@@ -0,0 +1,357 @@
+"""
+Synthetic data generator and bulk loader for both stores.
+
+    python db/generate_data.py --clients 1000000 --portfolios-per-client 3 --workers 8
+
+Clients (Mongo `clients`) and their portfolios (MySQL `portfolios`) are
+generated together, chunk by chunk, so every portfolio's client_name exists
+in Mongo. Distributions are skewed the way real books are: a few relationship
+managers, stocks and cities carry most of the weight (Zipf, --skew), the
+number of portfolios per client is geometric and values are log-normal.
+
+Each chunk is seeded from (--seed, chunk number), so output is reproducible
+for any --workers. Workers generate and load their chunks in parallel and
+only hold one chunk in memory:
+
+- MySQL: LOAD DATA LOCAL INFILE from a temporary CSV per chunk, falling back
+  to multi-row INSERT batches when the server has local_infile disabled.
+- Mongo: unordered insert_many batches.
+
+Secondary indexes are built once after the load. The table and collection are
+replaced unless --append is given.
+"""
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pymysql
+from pymongo import MongoClient, ASCENDING
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Allow running as `python db/generate_data.py` from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cache.results import bump_data_version
+
+MYSQL_HOST = os.getenv("MYSQL_HOST", "localhost")
+MYSQL_PORT = int(os.getenv("MYSQL_PORT", 3306))
+MYSQL_USER = os.getenv("MYSQL_USER", "root")
+MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "")
+MYSQL_DB = os.getenv("MYSQL_DB", "wealth")
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+MONGO_DB = os.getenv("MONGO_DB", "wealth_db")
+
+PORTFOLIOS_DDL = """
+    CREATE TABLE IF NOT EXISTS portfolios (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        client_name VARCHAR(255),
+        portfolio_value DECIMAL(20,2),
+        relationship_manager VARCHAR(255),
+        stock VARCHAR(255)
+    )
+"""
+# Built after the load; one ALTER so InnoDB sorts each index in a single pass
+MYSQL_INDEXES = {
+    "idx_portfolios_client_name": ("client_name",),
+    "idx_portfolios_rm_value": ("relationship_manager", "portfolio_value"),
+    "idx_portfolios_stock_value": ("stock", "portfolio_value"),
+    "idx_portfolios_value": ("portfolio_value",),
+}
+MONGO_INDEXES = {
+    "name_1": [("name", ASCENDING)],
+    "risk_1_city_1": [("risk", ASCENDING), ("city", ASCENDING)],
+    "city_1": [("city", ASCENDING)],
+    "age_1": [("age", ASCENDING)],
+    "preferences_1": [("preferences", ASCENDING)],
+}
+
+# The original sample RMs stay the busiest ones
+MANAGERS = ["Rajiv Mehra", "Priya Shah", "Suresh Iyer"]
+FIRST_NAMES = [
+    "Aarav", "Aditi", "Amitabh", "Ananya", "Arjun", "Deepika", "Divya", "Farhan", "Gaurav", "Ishaan",
+    "Kavya", "Kiran", "Meera", "Neha", "Nikhil", "Pooja", "Rahul", "Riya", "Rohan", "Saanvi",
+    "Sanjay", "Shreya", "Sneha", "Tanvi", "Varun", "Vikram", "Vivek", "Yash", "Zara", "Alice",
+]
+LAST_NAMES = [
+    "Agarwal", "Bansal", "Bhatt", "Chopra", "Desai", "Gupta", "Iyer", "Jain", "Joshi", "Kapoor",
+    "Khan", "Kumar", "Malhotra", "Mehra", "Menon", "Mishra", "Nair", "Patel", "Pillai", "Rao",
+    "Reddy", "Saxena", "Shah", "Sharma", "Singh", "Sinha", "Thakur", "Trivedi", "Verma", "Yadav",
+]
+STOCKS = [
+    "HDFC Bank", "Reliance", "Infosys", "TCS", "ICICI Bank", "Bharti Airtel", "ITC", "Larsen & Toubro",
+    "Kotak Mahindra Bank", "Axis Bank", "State Bank of India", "Hindustan Unilever", "Bajaj Finance",
+    "Asian Paints", "Maruti Suzuki", "Sun Pharma", "Wipro", "HCL Technologies", "Tata Motors", "NTPC",
+]
+CITIES = [
+    "Mumbai", "Delhi", "Bangalore", "Pune", "Chennai", "Hyderabad", "Kolkata", "Ahmedabad",
+    "Jaipur", "Lucknow", "Chandigarh", "Kochi", "Indore", "Surat", "Nagpur",
+]
+PREFERENCES = ["tech", "banking", "energy", "auto", "pharma", "fmcg", "realty", "metals"]
+RISKS = ["Low", "Medium", "High"]
+RISK_WEIGHTS = [0.5, 0.35, 0.15]
+# Higher-risk clients tend to run larger books
+RISK_VALUE_FACTOR = np.array([0.8, 1.0, 1.4])
+MEDIAN_PORTFOLIO_VALUE = 3_000_000
+MAX_PORTFOLIO_VALUE = 10 ** 12
+
+# MySQL error codes for "LOAD DATA LOCAL INFILE is disabled"
+LOCAL_INFILE_DISABLED = {1148, 2068, 3948}
+
+def zipf_weights(n, skew):
+    weights = 1.0 / np.arange(1, n + 1) ** skew
+    return weights / weights.sum()
+
+def manager_names(count, seed):
+    rng = np.random.default_rng([seed, 0xFEED])
+    names = list(MANAGERS)
+    seen = set(names)
+    while len(names) < count:
+        name = f"{FIRST_NAMES[rng.integers(len(FIRST_NAMES))]} {LAST_NAMES[rng.integers(len(LAST_NAMES))]}"
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+        elif len(seen) >= len(FIRST_NAMES) * len(LAST_NAMES):
+            names.append(f"{name} {len(names)}")
+    return names[:count]
+
+def generate_chunk(chunk, start, end, options):
+    """Clients [start, end) as Mongo documents and their portfolios as MySQL rows."""
+    rng = np.random.default_rng([options["seed"], chunk])
+    n = end - start
+    skew = options["skew"]
+    managers = options["managers"]
+
+    first = rng.integers(len(FIRST_NAMES), size=n)
+    last = rng.integers(len(LAST_NAMES), size=n)
+    risk = rng.choice(len(RISKS), size=n, p=RISK_WEIGHTS)
+    age = np.clip(rng.normal(46, 12, size=n).round(), 21, 90).astype(int)
+    city = rng.choice(len(CITIES), size=n, p=zipf_weights(len(CITIES), skew))
+    preference_picks = rng.choice(len(PREFERENCES), size=(n, 3), p=zipf_weights(len(PREFERENCES), skew / 2))
+    preference_counts = rng.integers(1, 4, size=n)
+    manager = rng.choice(len(managers), size=n, p=zipf_weights(len(managers), skew))
+
+    names = [f"{FIRST_NAMES[f]} {LAST_NAMES[l]} {start + i}" for i, (f, l) in enumerate(zip(first, last))]
+    clients = [
+        {
+            "name": names[i],
+            "risk": RISKS[risk[i]],
+            "age": int(age[i]),
+            "city": CITIES[city[i]],
+            "preferences": [PREFERENCES[p] for p in dict.fromkeys(preference_picks[i])][:preference_counts[i]],
+        }
+        for i in range(n)
+    ]
+
+    # Geometric: most clients hold one or two portfolios, a few hold many
+    per_client = rng.geometric(1.0 / max(options["portfolios_per_client"], 1.0), size=n)
+    owner = np.repeat(np.arange(n), per_client)
+    m = len(owner)
+    stock = rng.choice(len(STOCKS), size=m, p=zipf_weights(len(STOCKS), skew))
+    value = rng.lognormal(np.log(MEDIAN_PORTFOLIO_VALUE), 1.0, size=m) * RISK_VALUE_FACTOR[risk[owner]]
+    value = np.minimum(value, MAX_PORTFOLIO_VALUE).round(2)
+    portfolios = [
+        (names[o], f"{v:.2f}", managers[manager[o]], STOCKS[s])
+        for o, v, s in zip(owner.tolist(), value.tolist(), stock.tolist())
+    ]
+    return clients, portfolios
+
+# --- loaders ---------------------------------------------------------------------
+
+def mysql_connect(**kwargs):
+    return pymysql.connect(host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER,
+                           password=MYSQL_PASSWORD, database=MYSQL_DB, **kwargs)
+
+def load_mysql_infile(rows, directory):
+    fd, path = tempfile.mkstemp(suffix=".csv", dir=directory)
+    try:
+        with os.fdopen(fd, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f, lineterminator="\n").writerows(rows)
+        connection = mysql_connect(local_infile=True)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SET unique_checks = 0")
+                cursor.execute(
+                    "LOAD DATA LOCAL INFILE %s INTO TABLE portfolios CHARACTER SET utf8mb4 "
+                    "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '\\n' "
+                    "(client_name, portfolio_value, relationship_manager, stock)",
+                    (path,),
+                )
+            connection.commit()
+        finally:
+            connection.close()
+    finally:
+        os.remove(path)
+
+def load_mysql_insert(rows, batch_size):
+    connection = mysql_connect()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SET unique_checks = 0")
+            for i in range(0, len(rows), batch_size):
+                # pymysql turns this into one multi-row INSERT per batch
+                cursor.executemany(
+                    "INSERT INTO portfolios (client_name, portfolio_value, relationship_manager, stock) VALUES (%s, %s, %s, %s)",
+                    rows[i:i + batch_size],
+                )
+        connection.commit()
+    finally:
+        connection.close()
+
+def load_mysql(rows, options):
+    if options["mysql_load"] != "insert":
+        try:
+            load_mysql_infile(rows, options["tmpdir"])
+            return "infile"
+        except pymysql.err.OperationalError as e:
+            if options["mysql_load"] == "infile" or e.args[0] not in LOCAL_INFILE_DISABLED:
+                raise
+    load_mysql_insert(rows, options["batch_size"])
+    return "insert"
+
+def load_mongo(docs, batch_size):
+    client = MongoClient(MONGO_URI)
+    try:
+        collection = client[MONGO_DB]["clients"]
+        for i in range(0, len(docs), batch_size):
+            collection.insert_many(docs[i:i + batch_size], ordered=False)
+    finally:
+        client.close()
+
+def run_chunk(chunk, start, end, options):
+    clients, portfolios = generate_chunk(chunk, start, end, options)
+    method = None
+    if options["mysql"]:
+        method = load_mysql(portfolios, options)
+    if options["mongo"]:
+        load_mongo(clients, options["batch_size"])
+    return len(clients), len(portfolios), method
+
+# --- setup and indexes ---------------------------------------------------------------
+
+def prepare_mysql(append):
+    connection = mysql_connect()
+    try:
+        with connection.cursor() as cursor:
+            if not append:
+                cursor.execute("DROP TABLE IF EXISTS portfolios")
+            cursor.execute(PORTFOLIOS_DDL)
+        connection.commit()
+    finally:
+        connection.close()
+
+def prepare_mongo(append):
+    client = MongoClient(MONGO_URI)
+    try:
+        if not append:
+            client[MONGO_DB].drop_collection("clients")
+    finally:
+        client.close()
+
+def build_mysql_indexes():
+    connection = mysql_connect()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT DISTINCT index_name FROM information_schema.statistics "
+                "WHERE table_schema = DATABASE() AND table_name = 'portfolios'"
+            )
+            existing = {row[0] for row in cursor.fetchall()}
+            missing = [
+                f"ADD INDEX {name} ({', '.join(columns)})"
+                for name, columns in MYSQL_INDEXES.items() if name not in existing
+            ]
+            if missing:
+                cursor.execute(f"ALTER TABLE portfolios {', '.join(missing)}")
+            cursor.execute("ANALYZE TABLE portfolios")
+            cursor.fetchall()
+        connection.commit()
+    finally:
+        connection.close()
+
+def build_mongo_indexes():
+    client = MongoClient(MONGO_URI)
+    try:
+        collection = client[MONGO_DB]["clients"]
+        for name, keys in MONGO_INDEXES.items():
+            collection.create_index(keys, name=name)
+    finally:
+        client.close()
+
+# --- main --------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--clients", type=int, default=100_000)
+    parser.add_argument("--portfolios-per-client", type=float, default=3.0, help="mean of the geometric distribution")
+    parser.add_argument("--managers", type=int, default=50, help="number of relationship managers")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent for managers, stocks and cities")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="clients per chunk; bounds memory per worker")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="rows per insert_many / INSERT batch")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--target", choices=("both", "mysql", "mongo"), default="both")
+    parser.add_argument("--mysql-load", choices=("auto", "infile", "insert"), default="auto",
+                        help="auto tries LOAD DATA LOCAL INFILE and falls back to batched INSERTs")
+    parser.add_argument("--append", action="store_true", help="keep existing rows instead of replacing them")
+    parser.add_argument("--no-indexes", action="store_true", help="skip building secondary indexes")
+    args = parser.parse_args()
+
+    options = {
+        "seed": args.seed,
+        "skew": args.skew,
+        "managers": manager_names(args.managers, args.seed),
+        "portfolios_per_client": args.portfolios_per_client,
+        "batch_size": args.batch_size,
+        "mysql_load": args.mysql_load,
+        "mysql": args.target in ("both", "mysql"),
+        "mongo": args.target in ("both", "mongo"),
+        "tmpdir": tempfile.gettempdir(),
+    }
+    if options["mysql"]:
+        prepare_mysql(args.append)
+    if options["mongo"]:
+        prepare_mongo(args.append)
+
+    chunks = [
+        (i, start, min(start + args.chunk_size, args.clients))
+        for i, start in enumerate(range(0, args.clients, args.chunk_size))
+    ]
+    started = time.perf_counter()
+    clients = portfolios = 0
+    methods = set()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(run_chunk, chunk, start, end, options) for chunk, start, end in chunks]
+        for done, future in enumerate(as_completed(futures), 1):
+            chunk_clients, chunk_portfolios, method = future.result()
+            clients += chunk_clients
+            portfolios += chunk_portfolios
+            methods.add(method)
+            elapsed = time.perf_counter() - started
+            print(f"chunk {done}/{len(chunks)}: {clients} clients, {portfolios} portfolios "
+                  f"({(clients + portfolios) / elapsed:,.0f} rows/s)")
+    load_seconds = time.perf_counter() - started
+    if "insert" in methods:
+        print("LOAD DATA LOCAL INFILE unavailable; portfolios were loaded with batched INSERTs")
+
+    if not args.no_indexes:
+        started = time.perf_counter()
+        if options["mysql"]:
+            build_mysql_indexes()
+        if options["mongo"]:
+            build_mongo_indexes()
+        print(f"Indexes built in {time.perf_counter() - started:.1f}s")
+
+    if options["mysql"]:
+        bump_data_version("portfolios")
+    if options["mongo"]:
+        bump_data_version("clients")
+    print(f"Loaded {clients} clients and {portfolios} portfolios in {load_seconds:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Query cost guardrails, applied before any generated SQL reaches the database.
+
+1. Static checks on the parsed statement: a single SELECT over allowed
+   tables, with no server-side functions that sleep, read files or take locks.
+2. Admission control from EXPLAIN: queries whose estimated rows, or whose
+   full-scan sort/temporary-table work, exceed the budget are rejected with a
+   structured "too expensive" error instead of being run.
+3. Execution time limits: MySQL's MAX_EXECUTION_TIME optimizer hint and
+   Mongo's maxTimeMS, both capped by the request deadline.
+
+EXPLAIN's row estimate ignores LIMIT, so a LIMITed statement that neither
+sorts nor builds a temporary table skips the row budget: it stops after LIMIT
+rows, and pagination puts a LIMIT on every page. Sorted or grouped statements
+still read everything before the LIMIT applies and stay within both budgets.
+"""
+import threading
+import time
+from os import getenv
+
+import sqlglot
+from sqlglot import exp
+from sqlalchemy import bindparam, text
+
+from langchain_agent.deadline import remaining
+from db.index_advisor import index_advisor
+from db.rollups import ROLLUP_TABLES
+from db.schema_catalog import schema_catalog
+from observability import get_logger
+
+log = get_logger("Guardrails")
+
+FORBIDDEN_FUNCTIONS = {"sleep", "benchmark", "load_file", "get_lock", "release_lock", "sys_exec", "sys_eval"}
+
+# Reject anything estimated to examine more rows than this
+GUARDRAIL_MAX_ROWS = int(getenv("GUARDRAIL_MAX_ROWS", "5000000"))
+# Full scans that also sort or build a temporary table (ORDER BY/GROUP BY) get a tighter budget
+GUARDRAIL_MAX_SORT_ROWS = int(getenv("GUARDRAIL_MAX_SORT_ROWS", "1000000"))
+GUARDRAIL_MAX_EXECUTION_MS = int(getenv("GUARDRAIL_MAX_EXECUTION_MS", "10000"))
+# Admission decisions are reused for identical SQL + params for this long
+GUARDRAIL_CACHE_TTL = float(getenv("GUARDRAIL_CACHE_TTL", "300"))
+
+def allowed_tables():
+    # Whatever the schema catalog exposes to the LLM, plus the rollups queries get rewritten to
+    return {*schema_catalog.sql_tables(), *ROLLUP_TABLES}
+
+class GuardrailRejection(Exception):
+    def __init__(self, code, reason, estimated_rows=None, budget=None):
+        super().__init__(reason)
+        self.code = code
+        self.reason = reason
+        self.estimated_rows = estimated_rows
+        self.budget = budget
+
+    def to_dict(self):
+        return {
+            "code": self.code,
+            "reason": self.reason,
+            "estimated_rows": self.estimated_rows,
+            "budget": self.budget,
+        }
+
+def check_static(sql: str, allowed=None):
+    allowed = allowed if allowed is not None else allowed_tables()
+    try:
+        statements = [s for s in sqlglot.parse(sql, read="mysql") if s is not None]
+    except sqlglot.errors.ParseError as e:
+        raise GuardrailRejection("unparseable", f"Generated SQL could not be parsed: {e}")
+    if len(statements) != 1:
+        raise GuardrailRejection("multiple_statements", "Only a single statement is allowed")
+    tree = statements[0]
+    if not isinstance(tree, exp.Select) or tree.args.get("into") is not None:
+        raise GuardrailRejection("not_select", "Only plain SELECT statements are allowed")
+    ctes = {cte.alias_or_name for cte in tree.find_all(exp.CTE)}
+    aliases = {sub.alias_or_name for sub in tree.find_all(exp.Subquery) if sub.alias_or_name}
+    for table in tree.find_all(exp.Table):
+        name = table.name.lower()
+        if name not in allowed and name not in ctes and name not in aliases:
+            raise GuardrailRejection("table_not_allowed", f"Table '{table.name}' is not allowed")
+    for func in tree.find_all(exp.Func):
+        name = (func.sql_name() if not isinstance(func, exp.Anonymous) else func.name).lower()
+        if name in FORBIDDEN_FUNCTIONS:
+            raise GuardrailRejection("function_not_allowed", f"Function '{name}' is not allowed")
+    return tree
+
+class Estimate:
+    def __init__(self, rows=0, full_scan=False, blocking=False, limited=False):
+        self.rows = rows
+        self.full_scan = full_scan
+        self.blocking = blocking
+        # The outermost SELECT has a LIMIT
+        self.limited = limited
+
+    def __repr__(self):
+        return (f"Estimate(rows={self.rows}, full_scan={self.full_scan}, blocking={self.blocking}, "
+                f"limited={self.limited})")
+
+def _mysql_estimate(plan_rows):
+    estimate = Estimate()
+    for row in plan_rows:
+        estimate.rows += int(row.get("rows") or 0)
+        if (row.get("type") or "").upper() == "ALL":
+            estimate.full_scan = True
+        extra = (row.get("Extra") or "").lower()
+        if "filesort" in extra or "temporary" in extra:
+            estimate.blocking = True
+    return estimate
+
+def _sqlite_estimate(plan_rows, table_sizes):
+    # SQLite's EXPLAIN QUERY PLAN has no row estimates; use table sizes instead
+    estimate = Estimate()
+    for row in plan_rows:
+        detail = (row.get("detail") or "").upper()
+        words = detail.split()
+        table = words[1].lower() if len(words) > 1 else ""
+        size = table_sizes.get(table, 0)
+        if detail.startswith("SCAN") and table in table_sizes:
+            estimate.full_scan = True
+            estimate.rows += size
+        elif detail.startswith("SEARCH") and table in table_sizes:
+            estimate.rows += max(size // 10, 1)
+        if "TEMP B-TREE" in detail:
+            estimate.blocking = True
+    return estimate
+
+def evaluate(estimate: Estimate):
+    # An unsorted LIMITed read stops after LIMIT rows, however many EXPLAIN counts
+    bounded = estimate.limited and not estimate.blocking
+    if estimate.rows > GUARDRAIL_MAX_ROWS and not bounded:
+        raise GuardrailRejection(
+            "too_expensive", "Query would examine too many rows", estimate.rows, GUARDRAIL_MAX_ROWS
+        )
+    if estimate.full_scan and estimate.blocking and estimate.rows > GUARDRAIL_MAX_SORT_ROWS:
+        raise GuardrailRejection(
+            "too_expensive", "Query would sort or group a full table scan",
+            estimate.rows, GUARDRAIL_MAX_SORT_ROWS,
+        )
+    return estimate
+
+class _AdmissionCache:
+    def __init__(self, ttl=GUARDRAIL_CACHE_TTL, size=1024):
+        self.ttl = ttl
+        self.size = size
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] >= self.ttl:
+                return None
+            return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._entries) >= self.size:
+                self._entries.clear()
+            self._entries[key] = (value, time.monotonic())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+_admissions = _AdmissionCache()
+
+def reset_admissions():
+    """Forget cached EXPLAIN estimates, e.g. after indexes change the plans."""
+    _admissions.clear()
+
+def _admission_key(sql, params):
+    return sql, tuple(sorted((k, str(v)) for k, v in (params or {}).items()))
+
+def _dialect(session):
+    return session.bind.dialect.name
+
+def _rows_as_dicts(result):
+    return [dict(row._mapping) for row in result.fetchall()]
+
+def _sqlite_tables(sql):
+    return sorted({t.name.lower() for t in sqlglot.parse_one(sql, read="mysql").find_all(exp.Table)} & allowed_tables())
+
+def _explain_statement(prefix, sql, params):
+    statement = text(prefix + sql)
+    # List parameters, e.g. a pushed-down "client_name IN :names", expand like they do when run
+    expanding = [bindparam(name, expanding=True) for name, value in (params or {}).items() if isinstance(value, (list, tuple))]
+    return statement.bindparams(*expanding) if expanding else statement
+
+async def explain_async(session, sql: str, params=None) -> Estimate:
+    """The EXPLAIN estimate for `sql`, without holding it to the budget."""
+    tree = check_static(sql)
+    key = _admission_key(sql, params)
+    cached = _admissions.get(key)
+    if cached is not None:
+        return cached
+    if _dialect(session) == "sqlite":
+        plan_rows = _rows_as_dicts(await session.execute(_explain_statement("EXPLAIN QUERY PLAN ", sql, params), params or {}))
+        sizes = {}
+        for table in _sqlite_tables(sql):
+            sizes[table] = (await session.execute(text(f"SELECT COUNT(*) FROM {table}"))).scalar() or 0
+        estimate = _sqlite_estimate(plan_rows, sizes)
+    else:
+        plan_rows = _rows_as_dicts(await session.execute(_explain_statement("EXPLAIN ", sql, params), params or {}))
+        estimate = _mysql_estimate(plan_rows)
+    estimate.limited = tree.args.get("limit") is not None
+    _admissions.set(key, estimate)
+    log.debug(f"{estimate} for: {sql}")
+    return estimate
+
+def explain(session, sql: str, params=None) -> Estimate:
+    tree = check_static(sql)
+    key = _admission_key(sql, params)
+    cached = _admissions.get(key)
+    if cached is not None:
+        return cached
+    if _dialect(session) == "sqlite":
+        plan_rows = _rows_as_dicts(session.execute(_explain_statement("EXPLAIN QUERY PLAN ", sql, params), params or {}))
+        sizes = {t: session.execute(text(f"SELECT COUNT(*) FROM {t}")).scalar() or 0 for t in _sqlite_tables(sql)}
+        estimate = _sqlite_estimate(plan_rows, sizes)
+    else:
+        estimate = _mysql_estimate(_rows_as_dicts(session.execute(_explain_statement("EXPLAIN ", sql, params), params or {})))
+    estimate.limited = tree.args.get("limit") is not None
+    _admissions.set(key, estimate)
+    log.debug(f"{estimate} for: {sql}")
+    return estimate
+
+async def admit_async(session, sql: str, params=None) -> Estimate:
+    """Run EXPLAIN and raise GuardrailRejection when the query is over budget."""
+    estimate = await explain_async(session, sql, params)
+    index_advisor.record_sql(sql, params)
+    return evaluate(estimate)
+
+def admit(session, sql: str, params=None) -> Estimate:
+    estimate = explain(session, sql, params)
+    index_advisor.record_sql(sql, params)
+    return evaluate(estimate)
+
+def execution_time_ms(limit_ms: int = GUARDRAIL_MAX_EXECUTION_MS) -> int:
+    """The execution budget in milliseconds, never longer than what is left of the request deadline."""
+    left = remaining()
+    if left is not None:
+        limit_ms = min(limit_ms, max(int(left * 1000), 1))
+    return limit_ms
+
+def with_time_limit(sql: str, session) -> str:
+    """Add MySQL's MAX_EXECUTION_TIME hint to the outermost SELECT."""
+    if _dialect(session) != "mysql":
+        return sql
+    stripped = sql.lstrip()
+    if not stripped[:6].upper() == "SELECT":
+        return sql
+    return f"SELECT /*+ MAX_EXECUTION_TIME({execution_time_ms()}) */" + stripped[6:]
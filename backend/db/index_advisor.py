@@ -0,0 +1,461 @@
+"""
+Workload-driven index advisor for MySQL `portfolios` and Mongo `clients`.
+
+Every SQL statement that passes the guardrails, and every Mongo filter, sort
+or $match that MongoTool and FederatedTool run, is reduced to its shape:
+
+- equality columns (=, IN, array membership),
+- sort columns (GROUP BY, or ORDER BY when there is no GROUP BY),
+- range columns (<, >, BETWEEN, prefix LIKE/regex).
+
+Shapes are counted in memory. advise() turns each shape into a composite
+index in equality-sort-range order. It drops candidates that an existing
+index or a longer candidate already covers, and ranks the rest by how many
+recorded executions they would have served. For one example statement per
+candidate it runs EXPLAIN (MySQL, or EXPLAIN QUERY PLAN on SQLite) or
+explain() (Mongo), comparing rows examined today with the rows the filter
+actually matches. apply() creates the recommendations; the API only exposes
+it when INDEX_ADVISOR_ALLOW_APPLY=1.
+"""
+import json
+import os
+import threading
+
+import sqlglot
+from sqlglot import exp
+from sqlalchemy import bindparam, text
+
+from observability import get_logger
+
+log = get_logger("IndexAdvisor")
+
+INDEX_ADVISOR_ENABLED = os.getenv("INDEX_ADVISOR_ENABLED", "1") == "1"
+INDEX_ADVISOR_ALLOW_APPLY = os.getenv("INDEX_ADVISOR_ALLOW_APPLY", "0") == "1"
+# Distinct shapes kept per store; new shapes beyond this are only counted as dropped
+INDEX_ADVISOR_MAX_SHAPES = int(os.getenv("INDEX_ADVISOR_MAX_SHAPES", "1000"))
+INDEX_ADVISOR_TOP = int(os.getenv("INDEX_ADVISOR_TOP", "10"))
+MAX_INDEX_COLUMNS = 4
+
+SQL_TABLES = {"portfolios"}
+# InnoDB appends the primary key to every secondary index, and Mongo always indexes _id
+IMPLICIT_KEYS = {"mysql": "id", "mongo": "_id"}
+MONGO_RANGE_OPERATORS = {"$gt", "$gte", "$lt", "$lte"}
+MONGO_EQUALITY_OPERATORS = {"$eq", "$in", "$all", "$elemMatch"}
+
+class Shape:
+    def __init__(self, store, table, equality=(), sort=(), ranges=(), columns=(), grouped=False):
+        self.store = store
+        self.table = table
+        self.columns = set(columns)
+        self.grouped = grouped
+        self.equality = tuple(dict.fromkeys(equality))
+        sort = [c for c in dict.fromkeys(sort) if c not in self.equality]
+        # InnoDB secondary indexes end in the primary key, so a trailing ORDER BY id comes for free
+        if store == "mysql" and sort and sort[-1] == IMPLICIT_KEYS[store]:
+            sort.pop()
+        self.sort = tuple(sort)
+        self.ranges = tuple(c for c in dict.fromkeys(ranges) if c not in self.equality and c not in self.sort)
+
+    @property
+    def key(self):
+        return self.store, self.table, tuple(sorted(self.equality)), self.sort, self.ranges
+
+    def candidate(self):
+        """Equality, then sort, then the first range column; None when no index helps."""
+        columns = list(self.equality) + list(self.sort) + list(self.ranges[:1])
+        # _id alone is always indexed already
+        if not columns or columns == [IMPLICIT_KEYS[self.store]]:
+            return None
+        return tuple(columns[:MAX_INDEX_COLUMNS])
+
+    def served_by(self, index) -> int:
+        """How many leading columns of `index` this shape can use (0 = index not usable)."""
+        used = 0
+        columns = list(index)
+        equality = set(self.equality)
+        while columns and columns[0] in equality:
+            equality.discard(columns.pop(0))
+            used += 1
+        for column in self.sort:
+            if not columns or columns[0] != column:
+                break
+            columns.pop(0)
+            used += 1
+        if columns and columns[0] in self.ranges:
+            used += 1
+        return used
+
+# --- shape extraction -----------------------------------------------------------------
+
+def _column(node):
+    return node.name if isinstance(node, exp.Column) else None
+
+def _conjuncts(node):
+    if node is None:
+        return []
+    if isinstance(node, exp.Paren):
+        return _conjuncts(node.this)
+    if isinstance(node, exp.And):
+        return _conjuncts(node.left) + _conjuncts(node.right)
+    return [node]
+
+def _clauses(tree, names):
+    """Equality, range and sort columns of one SELECT; `names` maps output names to table columns."""
+    def column(node):
+        name = _column(node)
+        return names.get(name, name) if name else None
+
+    equality, ranges = [], []
+    where = tree.args.get("where")
+    for predicate in _conjuncts(where.this if where is not None else None):
+        if isinstance(predicate, (exp.EQ, exp.In)):
+            left = column(predicate.this)
+            right = predicate.expression if isinstance(predicate, exp.EQ) else None
+            if left and not isinstance(right, exp.Column) and not predicate.args.get("query"):
+                equality.append(left)
+        elif isinstance(predicate, (exp.GT, exp.GTE, exp.LT, exp.LTE)):
+            left, right = column(predicate.this), column(predicate.expression)
+            if bool(left) != bool(right):
+                ranges.append(left or right)
+        elif isinstance(predicate, exp.Between) and column(predicate.this):
+            ranges.append(column(predicate.this))
+        elif isinstance(predicate, exp.Like) and column(predicate.this):
+            pattern = predicate.expression
+            if isinstance(pattern, exp.Literal) and not pattern.this.startswith(("%", "_")):
+                ranges.append(column(predicate.this))
+    group = tree.args.get("group")
+    order = tree.args.get("order")
+    if group is not None:
+        sort = [column(e) for e in group.expressions]
+    elif order is not None:
+        sort = [column(o.this) for o in order.expressions]
+    else:
+        sort = []
+    # Only plain, leading columns help; an aggregate alias or expression ends the usable prefix
+    usable_sort = []
+    for name in sort:
+        if name is None or name not in names.values():
+            break
+        usable_sort.append(name)
+    return equality, ranges, usable_sort, group is not None
+
+def _output_names(tree, columns):
+    """Output name -> table column for the plain columns a SELECT exposes."""
+    names = {c: c for c in columns}
+    for e in tree.expressions:
+        if isinstance(e, exp.Alias) and isinstance(e.this, exp.Column):
+            names[e.alias] = e.this.name
+        elif isinstance(e, exp.Alias):
+            names.pop(e.alias, None)
+    return names
+
+def sql_shape(tree):
+    """
+    Shape of a SELECT over one of SQL_TABLES, or None. A derived table (how
+    pagination wraps every query) is merged into the outer query, as MySQL does.
+    """
+    from_ = tree.args.get("from") or tree.args.get("from_")
+    source = from_.this if from_ is not None else None
+    if tree.args.get("joins"):
+        return None
+    if isinstance(source, exp.Subquery) and isinstance(source.this, exp.Select):
+        inner = sql_shape(source.this)
+        if inner is None:
+            return None
+        names = _output_names(source.this, inner.columns)
+        equality, ranges, sort, _ = _clauses(tree, names)
+        # A grouped inner query is read in group order whatever the outer ORDER BY says
+        outer_sort = list(inner.sort) if inner.grouped or not sort else sort
+        return Shape("mysql", inner.table, list(inner.equality) + equality, outer_sort,
+                     list(inner.ranges) + ranges, inner.columns, inner.grouped)
+    if not isinstance(source, exp.Table) or source.name.lower() not in SQL_TABLES:
+        return None
+    columns = {c.name for c in tree.find_all(exp.Column)}
+    equality, ranges, sort, grouped = _clauses(tree, _output_names(tree, columns))
+    return Shape("mysql", source.name.lower(), equality, sort, ranges, columns, grouped)
+
+def _mongo_predicates(mongo_filter, equality, ranges):
+    for field, condition in (mongo_filter or {}).items():
+        if field == "$and":
+            for part in condition:
+                _mongo_predicates(part, equality, ranges)
+        elif field.startswith("$"):
+            # $or/$nor/$expr need one index per branch; not recommended from here
+            continue
+        elif isinstance(condition, dict) and any(k.startswith("$") for k in condition):
+            operators = set(condition)
+            if operators & MONGO_EQUALITY_OPERATORS:
+                equality.append(field)
+            elif operators & MONGO_RANGE_OPERATORS:
+                ranges.append(field)
+            elif "$regex" in operators and str(condition["$regex"]).startswith("^"):
+                ranges.append(field)
+        else:
+            equality.append(field)
+
+def mongo_shape(mongo_filter, sort=None, collection="clients"):
+    equality, ranges = [], []
+    _mongo_predicates(mongo_filter, equality, ranges)
+    return Shape("mongo", collection, equality, [field for field, _ in (sort or [])], ranges)
+
+def pipeline_filter(pipeline):
+    """The leading $match and an immediately following $sort, the part an index can serve."""
+    mongo_filter, sort = {}, None
+    if pipeline and "$match" in pipeline[0]:
+        mongo_filter = pipeline[0]["$match"]
+        if len(pipeline) > 1 and "$sort" in pipeline[1]:
+            sort = list(pipeline[1]["$sort"].items())
+    elif pipeline and "$sort" in pipeline[0]:
+        sort = list(pipeline[0]["$sort"].items())
+    return mongo_filter, sort
+
+# --- advisor ------------------------------------------------------------------------
+
+def index_name(table, columns):
+    return f"idx_{table}_{'_'.join(c.lstrip('_') for c in columns)}"[:64]
+
+class IndexAdvisor:
+    def __init__(self, enabled=INDEX_ADVISOR_ENABLED, max_shapes=INDEX_ADVISOR_MAX_SHAPES):
+        self.enabled = enabled
+        self.max_shapes = max_shapes
+        self._shapes = {}
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def _record(self, shape, example):
+        with self._lock:
+            entry = self._shapes.get(shape.key)
+            if entry is None:
+                if len(self._shapes) >= self.max_shapes:
+                    self._dropped += 1
+                    return
+                entry = self._shapes[shape.key] = {"shape": shape, "count": 0, "example": example}
+            entry["count"] += 1
+
+    def record_sql(self, sql: str, params=None, tree=None):
+        if not self.enabled:
+            return
+        try:
+            tree = tree if tree is not None else sqlglot.parse_one(sql, read="mysql")
+            shape = sql_shape(tree)
+        except Exception as e:
+            log.debug(f"Could not extract a shape from SQL ({e}): {sql}")
+            return
+        if shape is not None:
+            self._record(shape, {"sql": sql, "params": dict(params or {})})
+
+    def record_mongo(self, mongo_filter, sort=None, limit=None, collection="clients"):
+        if not self.enabled:
+            return
+        self._record(mongo_shape(mongo_filter, sort, collection),
+                     {"filter": mongo_filter, "sort": sort, "limit": limit})
+
+    def record_pipeline(self, pipeline, collection="clients"):
+        mongo_filter, sort = pipeline_filter(pipeline)
+        self.record_mongo(mongo_filter, sort, collection=collection)
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+            self._dropped = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "shapes": len(self._shapes),
+                "executions": sum(e["count"] for e in self._shapes.values()),
+                "dropped": self._dropped,
+                "enabled": self.enabled,
+            }
+
+    # --- recommendations ---------------------------------------------------------------
+
+    def candidates(self, existing):
+        """Ranked recommendations without explain data. `existing` maps (store, table) to lists of column tuples."""
+        with self._lock:
+            entries = list(self._shapes.values())
+        proposals = {}
+        unindexable = 0
+        for entry in entries:
+            columns = entry["shape"].candidate()
+            if columns is None:
+                unindexable += entry["count"]
+                continue
+            proposals.setdefault((entry["shape"].store, entry["shape"].table, columns), None)
+        # A candidate that is the prefix of a longer one on the same table adds nothing
+        keys = list(proposals)
+        keys = [
+            (store, table, columns) for store, table, columns in keys
+            if not any(s == store and t == table and len(c) > len(columns) and c[:len(columns)] == columns
+                       for s, t, c in keys)
+        ]
+        recommendations = []
+        for store, table, columns in keys:
+            covered = existing.get((store, table), [])
+            if any(index[:len(columns)] == columns for index in covered):
+                continue
+            uses = full = 0
+            best_example, best_count = None, -1
+            for entry in entries:
+                shape = entry["shape"]
+                if shape.store != store or shape.table != table:
+                    continue
+                used = shape.served_by(columns)
+                if not used:
+                    continue
+                # Shapes an existing index already serves at least as well don't count
+                if any(shape.served_by(index) >= used for index in covered):
+                    continue
+                uses += entry["count"]
+                wanted = shape.candidate() or ()
+                if used >= len(wanted):
+                    full += entry["count"]
+                if entry["count"] > best_count:
+                    best_example, best_count = entry["example"], entry["count"]
+            if uses:
+                recommendations.append({
+                    "store": store,
+                    "table": table,
+                    "columns": list(columns),
+                    "name": index_name(table, columns),
+                    "uses": uses,
+                    "fully_served": full,
+                    "example": best_example,
+                })
+        recommendations.sort(key=lambda r: (r["fully_served"], r["uses"]), reverse=True)
+        return recommendations, unindexable
+
+    async def advise(self, session_factory, mongo_db, top: int = INDEX_ADVISOR_TOP):
+        existing = {}
+        async with session_factory() as session:
+            for table in SQL_TABLES:
+                existing[("mysql", table)] = await _sql_indexes(session, table)
+            existing[("mongo", "clients")] = await _mongo_indexes(mongo_db["clients"])
+            recommendations, unindexable = self.candidates(existing)
+            recommendations = recommendations[:top]
+            for rec in recommendations:
+                if rec["store"] == "mysql":
+                    rec["ddl"] = f"CREATE INDEX {rec['name']} ON {rec['table']} ({', '.join(rec['columns'])})"
+                else:
+                    rec["ddl"] = f"db.{rec['table']}.createIndex({json.dumps({c: 1 for c in rec['columns']})})"
+                try:
+                    if rec["store"] == "mysql":
+                        rec["explain"] = await _explain_sql(session, rec["example"])
+                    else:
+                        rec["explain"] = await _explain_mongo(mongo_db[rec["table"]], rec["example"])
+                except Exception as e:
+                    log.warning(f"Explain failed for {rec['name']}: {e}")
+                    rec["explain"] = {"error": str(e)}
+                saved = _rows_saved(rec["explain"])
+                rec["estimated_rows_saved"] = saved * rec["uses"] if saved is not None else None
+        return {
+            "recommendations": recommendations,
+            "existing": {f"{store}.{table}": [list(c) for c in cols] for (store, table), cols in existing.items()},
+            "unindexable_executions": unindexable,
+            "apply_allowed": INDEX_ADVISOR_ALLOW_APPLY,
+            **self.stats(),
+        }
+
+    async def apply(self, session_factory, mongo_db, top: int = INDEX_ADVISOR_TOP):
+        """Create the current top recommendations; returns what was created."""
+        advice = await self.advise(session_factory, mongo_db, top)
+        created = []
+        async with session_factory() as session:
+            for rec in advice["recommendations"]:
+                if rec["store"] == "mysql":
+                    ddl = rec["ddl"]
+                    if session.bind.dialect.name == "mysql":
+                        # Online build: reads and writes continue while the index is created
+                        ddl = (f"ALTER TABLE {rec['table']} ADD INDEX {rec['name']} "
+                               f"({', '.join(rec['columns'])}), ALGORITHM=INPLACE, LOCK=NONE")
+                    await session.execute(text(ddl))
+                    await session.commit()
+                else:
+                    await mongo_db[rec["table"]].create_index([(c, 1) for c in rec["columns"]], name=rec["name"])
+                log.info(f"Created index {rec['name']} on {rec['table']} ({', '.join(rec['columns'])})")
+                created.append({k: rec[k] for k in ("store", "table", "name", "columns", "ddl")})
+        return {"created": created}
+
+# --- database helpers ---------------------------------------------------------------------
+
+async def _sql_indexes(session, table):
+    if session.bind.dialect.name == "sqlite":
+        indexes = []
+        for row in (await session.execute(text(f"PRAGMA index_list({table})"))).mappings().all():
+            info = (await session.execute(text(f"PRAGMA index_info({row['name']})"))).mappings().all()
+            indexes.append(tuple(r["name"] for r in sorted(info, key=lambda r: r["seqno"])))
+        return indexes
+    rows = (await session.execute(text(f"SHOW INDEX FROM {table}"))).mappings().all()
+    indexes = {}
+    for row in rows:
+        indexes.setdefault(row["Key_name"], []).append((row["Seq_in_index"], row["Column_name"]))
+    return [tuple(c for _, c in sorted(cols)) for cols in indexes.values()]
+
+async def _mongo_indexes(collection):
+    info = await collection.index_information()
+    return [tuple(field for field, _ in index["key"]) for index in info.values()]
+
+def _statement(sql, params):
+    # List parameters (the federated IN pushdown) need expanding binds
+    expanding = [bindparam(k, expanding=True) for k, v in params.items() if isinstance(v, (list, tuple))]
+    return text(sql).bindparams(*expanding) if expanding else text(sql)
+
+async def _explain_sql(session, example):
+    sql, params = example["sql"], example["params"]
+    if session.bind.dialect.name == "sqlite":
+        plan = (await session.execute(_statement("EXPLAIN QUERY PLAN " + sql, params), params)).mappings().all()
+        details = [row["detail"] for row in plan]
+        full_scan = any(d.upper().startswith("SCAN") for d in details)
+        table = sql_shape(sqlglot.parse_one(sql, read="mysql")).table
+        size = (await session.execute(text(f"SELECT COUNT(*) FROM {table}"))).scalar() or 0
+        matched = (await session.execute(_statement(f"SELECT COUNT(*) FROM ({sql}) AS matched", params), params)).scalar()
+        return {
+            "access": "scan" if full_scan else "search",
+            "rows_examined": size if full_scan else None,
+            "estimated_matches": matched,
+            "sort": any("TEMP B-TREE" in d.upper() for d in details),
+            "plan": details,
+        }
+    plan = (await session.execute(_statement("EXPLAIN " + sql, params), params)).mappings().all()
+    examined = sum(int(row.get("rows") or 0) for row in plan)
+    # rows * filtered% is the optimizer's own estimate of what the WHERE keeps
+    matched = sum(int((row.get("rows") or 0) * float(row.get("filtered") or 100) / 100) for row in plan)
+    extra = " ".join((row.get("Extra") or "") for row in plan).lower()
+    return {
+        "access": ",".join(str(row.get("type")) for row in plan),
+        "key": ",".join(str(row.get("key")) for row in plan),
+        "rows_examined": examined,
+        "estimated_matches": matched,
+        "sort": "filesort" in extra or "temporary" in extra,
+    }
+
+def _winning_stages(plan):
+    stages = []
+    while plan:
+        stages.append(plan.get("stage"))
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return stages
+
+async def _explain_mongo(collection, example):
+    cursor = collection.find(example["filter"] or {})
+    if example.get("sort"):
+        cursor = cursor.sort(example["sort"])
+    if example.get("limit"):
+        cursor = cursor.limit(example["limit"])
+    explained = await cursor.explain()
+    stats = explained.get("executionStats", {})
+    stages = _winning_stages(explained.get("queryPlanner", {}).get("winningPlan", {}))
+    return {
+        "access": "collscan" if "COLLSCAN" in stages else "ixscan" if "IXSCAN" in stages else ",".join(map(str, stages)),
+        "rows_examined": stats.get("totalDocsExamined"),
+        "estimated_matches": stats.get("nReturned"),
+        "sort": "SORT" in stages,
+    }
+
+def _rows_saved(explain):
+    examined, matched = explain.get("rows_examined"), explain.get("estimated_matches")
+    if examined is None or matched is None:
+        return None
+    return max(examined - matched, 0)
+
+index_advisor = IndexAdvisor()
@@ -1,13 +1,137 @@
-from pymongo import MongoClient
+import threading
+import time
 from os import getenv
 from dotenv import load_dotenv
 
+from db import pool_stats
+
 load_dotenv()
 
 MONGO_URI = getenv('MONGO_URI', 'mongodb://localhost:27017')
 MONGO_DB = getenv('MONGO_DB', 'wealth_db')
 
-client = MongoClient(MONGO_URI)
-db = client[MONGO_DB]
+# Connections per worker and client; the driver opens them on demand up to the max
+MONGO_MAX_POOL_SIZE = int(getenv('MONGO_MAX_POOL_SIZE', '20'))
+MONGO_MIN_POOL_SIZE = int(getenv('MONGO_MIN_POOL_SIZE', '1'))
+MONGO_MAX_IDLE_MS = int(getenv('MONGO_MAX_IDLE_MS', '300000'))
+# Milliseconds to wait for a free connection before failing the query
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000'))
+# Reads go to a secondary when there is one; writes (loaders, index creation) always go to the primary
+MONGO_READ_PREFERENCE = getenv('MONGO_READ_PREFERENCE', 'secondaryPreferred')
+# Secondaries further behind than this are skipped (the server's minimum is 90); -1 means no limit
+MONGO_MAX_STALENESS = int(getenv('MONGO_MAX_STALENESS', '90'))
+# Collections written this recently are read from the primary: a secondary may lag up to
+# maxStalenessSeconds plus a 10 s heartbeat behind it
+MONGO_RECENT_WRITE_WINDOW = float(getenv('MONGO_RECENT_WRITE_WINDOW', '100'))
+# Documents per round-trip for the query tools' cursors
+MONGO_BATCH_SIZE = int(getenv('MONGO_BATCH_SIZE', '500'))
+
+_listener = None
+
+def _pool_listener():
+    # One listener for the sync and async clients, so checkouts are counted once per worker
+    global _listener
+    if _listener is not None:
+        return _listener
+    from pymongo import monitoring
+
+    stats = pool_stats.pool("mongo")
+    checked_out = [0]
+    # Events arrive on pymongo's and Motor's threads at once
+    counter_lock = threading.Lock()
+    stats.gauges = lambda: {"checked_out": checked_out[0], "max_size": MONGO_MAX_POOL_SIZE}
+
+    class PoolListener(monitoring.ConnectionPoolListener):
+        def connection_checked_out(self, event):
+            with counter_lock:
+                checked_out[0] += 1
+            # Time from asking the pool to holding a connection (pymongo 4.7+)
+            stats.checkout(getattr(event, "duration", 0.0))
+
+        def connection_check_out_failed(self, event):
+            stats.failed(timeout=event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT)
+
+        def connection_checked_in(self, event):
+            with counter_lock:
+                checked_out[0] -= 1
+
+        def connection_check_out_started(self, event): pass
+        def pool_created(self, event): pass
+        def pool_ready(self, event): pass
+        def pool_cleared(self, event): pass
+        def pool_closed(self, event): pass
+        def connection_created(self, event): pass
+        def connection_ready(self, event): pass
+        def connection_closed(self, event): pass
+
+    _listener = PoolListener()
+    return _listener
+
+def client_options():
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "readPreference": MONGO_READ_PREFERENCE,
+        "event_listeners": [_pool_listener()],
+    }
+    if MONGO_MAX_STALENESS > 0 and MONGO_READ_PREFERENCE != "primary":
+        options["maxStalenessSeconds"] = MONGO_MAX_STALENESS
+    return options
+
+def read_collection(database, name):
+    """
+    `database[name]` for a read-only query. Right after a write to `name` (see
+    bump_data_version) it reads from the primary, like the SQL replicas' recent-write guard.
+    """
+    collection = database[name]
+    if MONGO_READ_PREFERENCE == "primary":
+        return collection
+    from cache.results import result_cache
+
+    if time.time() - result_cache.versions.last_write((name,)) < MONGO_RECENT_WRITE_WINDOW:
+        from pymongo import ReadPreference
+
+        return collection.with_options(read_preference=ReadPreference.PRIMARY)
+    return collection
+
+def _sync():
+    from pymongo import MongoClient
+
+    client = MongoClient(MONGO_URI, **client_options())
+    return {"client": client, "db": client[MONGO_DB]}
+
+def _async():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    # Non-blocking client used by the API request path (MongoTool._arun)
+    async_client = AsyncIOMotorClient(MONGO_URI, **client_options())
+    return {"async_client": async_client, "async_db": async_client[MONGO_DB]}
+
+_BUILDERS = {"client": _sync, "db": _sync, "async_client": _async, "async_db": _async}
+_lock = threading.Lock()
+
+def __getattr__(name):
+    # Clients (and their monitor threads) are created once per process on first use,
+    # not as a side effect of importing this module
+    if name not in _BUILDERS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _lock:
+        if name not in globals():
+            # Keep anything already assigned from outside (e.g. a mock swapped in by the benchmark)
+            for key, value in _BUILDERS[name]().items():
+                globals().setdefault(key, value)
+    return globals()[name]
+
+async def ping():
+    """Round-trip to the server; also establishes the first pooled connection."""
+    await __getattr__("async_db").command("ping")
+
+def close():
+    for name in ("async_client", "client"):
+        if name in globals():
+            globals()[name].close()
 
 # Example: db['clients'].find_one({})
+# Example: await async_db['clients'].find_one({})
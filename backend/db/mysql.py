@@ -1,8 +1,11 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import os
+import threading
+import time
 from os import getenv
 from dotenv import load_dotenv
 
+from db import pool_stats
+
 load_dotenv()
 
 MYSQL_HOST = getenv('MYSQL_HOST', 'localhost')
@@ -11,14 +14,182 @@ MYSQL_USER = getenv('MYSQL_USER', 'root')
 MYSQL_PASSWORD = getenv('MYSQL_PASSWORD', '')
 MYSQL_DB = getenv('MYSQL_DB', 'wealth')
 
+# Read-only replicas for generated queries: "host", "host:port" or a full async SQLAlchemy URL, comma separated
+MYSQL_REPLICAS = [r.strip() for r in getenv('MYSQL_REPLICAS', '').split(',') if r.strip()]
+
+# Connections this service may hold open on one MySQL server, shared by all workers of a host
+MYSQL_CONNECTION_BUDGET = int(getenv('MYSQL_CONNECTION_BUDGET', '30'))
+WEB_CONCURRENCY = max(int(getenv('WEB_CONCURRENCY', '1')), 1)
+_WORKER_SHARE = max(MYSQL_CONNECTION_BUDGET // WEB_CONCURRENCY, 2)
+# Kept open per worker, plus overflow opened under load and closed when returned
+MYSQL_POOL_SIZE = int(getenv('MYSQL_POOL_SIZE', str(_WORKER_SHARE // 2)))
+MYSQL_MAX_OVERFLOW = int(getenv('MYSQL_MAX_OVERFLOW', str(_WORKER_SHARE - _WORKER_SHARE // 2)))
+# Seconds to wait for a free connection before failing the query
+MYSQL_POOL_TIMEOUT = float(getenv('MYSQL_POOL_TIMEOUT', '5'))
+# Below MySQL's wait_timeout, so the server never closes a connection we still hold
+MYSQL_POOL_RECYCLE = int(getenv('MYSQL_POOL_RECYCLE', '1800'))
+MYSQL_POOL_PRE_PING = getenv('MYSQL_POOL_PRE_PING', '1') == '1'
+
 SQLALCHEMY_DATABASE_URL = (
     f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
 )
+ASYNC_SQLALCHEMY_DATABASE_URL = (
+    f"mysql+aiomysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
+)
+
+# Async driver of a replica URL -> the sync driver for the same database
+SYNC_DRIVERS = {"+aiomysql": "+pymysql", "+aiosqlite": ""}
+
+def replica_urls(replica: str):
+    """(sync URL, async URL) for an entry of MYSQL_REPLICAS."""
+    if "://" in replica:
+        scheme, rest = replica.split("://", 1)
+        for driver, sync_driver in SYNC_DRIVERS.items():
+            scheme = scheme.replace(driver, sync_driver)
+        return f"{scheme}://{rest}", replica
+    host, _, port = replica.partition(":")
+    port = port or MYSQL_PORT
+    return (
+        f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{host}:{port}/{MYSQL_DB}",
+        f"mysql+aiomysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{host}:{port}/{MYSQL_DB}",
+    )
+
+def _timed(name, base):
+    """A pool class that records checkout wait time under `name`."""
+    from sqlalchemy.exc import TimeoutError as PoolTimeout
+
+    stats = pool_stats.pool(name)
+
+    class TimedPool(base):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            # Also runs when the engine is disposed and the pool recreated
+            stats.gauges = lambda: {"size": self.size(), "checked_out": self.checkedout(), "idle": self.checkedin()}
+
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                connection = super()._do_get()
+            except PoolTimeout:
+                stats.failed(timeout=True)
+                raise
+            except Exception:
+                stats.failed()
+                raise
+            stats.checkout(time.perf_counter() - started)
+            return connection
+
+    return TimedPool
+
+def pool_options(name, is_async=False):
+    from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+    return {
+        "poolclass": _timed(name, AsyncAdaptedQueuePool if is_async else QueuePool),
+        "pool_size": MYSQL_POOL_SIZE,
+        "max_overflow": MYSQL_MAX_OVERFLOW,
+        "pool_timeout": MYSQL_POOL_TIMEOUT,
+        "pool_recycle": MYSQL_POOL_RECYCLE,
+        "pool_pre_ping": MYSQL_POOL_PRE_PING,
+    }
+
+def create_pooled_engine(url, name):
+    from sqlalchemy import create_engine
+
+    return create_engine(url, **pool_options(name))
+
+def create_pooled_async_engine(url, name):
+    from sqlalchemy.ext.asyncio import create_async_engine
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    return create_async_engine(url, **pool_options(name, is_async=True))
+
+def _sync():
+    from sqlalchemy.orm import sessionmaker
+
+    # Only the LangChain sync tool interface uses this engine
+    engine = create_pooled_engine(SQLALCHEMY_DATABASE_URL, "primary_sync")
+    return {"engine": engine, "SessionLocal": sessionmaker(autocommit=False, autoflush=False, bind=engine)}
+
+def _async():
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    # Non-blocking engine used by the API request path (SQLTool._arun)
+    async_engine = create_pooled_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, "primary")
+    return {
+        "async_engine": async_engine,
+        "AsyncSessionLocal": async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False),
+    }
+
+def _url_name(url):
+    # host:port, or the file of a SQLite stand-in; never the credentials
+    from sqlalchemy.engine import make_url
+
+    url = make_url(url)
+    return f"{url.host}:{url.port or MYSQL_PORT}" if url.host else os.path.basename(url.database or "")
+
+def _replicas():
+    from db.replicas import Replica, ReplicaSet
+
+    members = []
+    for entry in MYSQL_REPLICAS:
+        sync_url, async_url = replica_urls(entry)
+        name = entry if "://" not in entry else _url_name(entry)
+        members.append(Replica.from_urls(name, sync_url, async_url))
+    # The primary's factories are looked up on every read, so a swapped-in factory is honoured
+    replicas = ReplicaSet(members, lambda: __getattr__("AsyncSessionLocal"), lambda: __getattr__("SessionLocal"))
+    return {
+        "replicas": replicas,
+        "AsyncReadSessionLocal": replicas.session,
+        "ReadSessionLocal": replicas.sync_session,
+    }
+
+_BUILDERS = {
+    "engine": _sync, "SessionLocal": _sync,
+    "async_engine": _async, "AsyncSessionLocal": _async,
+    "replicas": _replicas, "AsyncReadSessionLocal": _replicas, "ReadSessionLocal": _replicas,
+}
+_lock = threading.Lock()
+
+def __getattr__(name):
+    # Engines are created once per process on first use, so importing this module
+    # neither loads the drivers nor touches the database
+    if name not in _BUILDERS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _lock:
+        if name not in globals():
+            # Keep anything already assigned from outside (e.g. a session factory swapped in by the benchmark)
+            for key, value in _BUILDERS[name]().items():
+                globals().setdefault(key, value)
+    return globals()[name]
+
+async def ping():
+    """Round-trip to the database; also opens the first pooled connection."""
+    from sqlalchemy import text
+
+    async with __getattr__("AsyncSessionLocal")() as session:
+        await session.execute(text("SELECT 1"))
+
+def pool_status():
+    """Checkout counters and current size of every connection pool opened so far."""
+    return pool_stats.snapshot()
+
+async def dispose():
+    if "replicas" in globals():
+        await globals()["replicas"].dispose()
+    if "async_engine" in globals():
+        await globals()["async_engine"].dispose()
+    if "engine" in globals():
+        globals()["engine"].dispose()
 
 # Example usage:
 # with SessionLocal() as session:
 #     result = session.execute("SELECT * FROM transactions LIMIT 1")
 #     print(result.fetchall())
+#
+# async with AsyncSessionLocal() as session:
+#     result = await session.execute(text("SELECT * FROM portfolios LIMIT 1"))
+#     print(result.fetchall())
+#
+# Generated read-only queries go to a replica when one is within the lag budget:
+# async with AsyncReadSessionLocal() as session:
+#     result = await session.execute(text("SELECT * FROM portfolios LIMIT 1"))
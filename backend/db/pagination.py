@@ -0,0 +1,256 @@
+"""
+Bounded results and keyset pagination.
+
+plan_sql() analyses a validated SELECT once: it strips ORDER BY/LIMIT into an
+inner query and picks a stable, unique key (the ordering columns plus `id`,
+or plus the GROUP BY columns for aggregates). build_page_sql() then wraps the
+inner query with a keyset predicate so every page is a cheap indexed range
+scan instead of OFFSET. Mongo pages are keyed on `_id`.
+
+The continuation token is the plan plus the last key values, HMAC-signed so
+clients cannot make the server run SQL of their choosing.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+from datetime import date, datetime
+from decimal import Decimal
+from os import getenv
+
+import sqlglot
+from sqlglot import exp
+
+QUERY_PAGE_SIZE = int(getenv("QUERY_PAGE_SIZE", "500"))
+QUERY_MAX_PAGE_SIZE = int(getenv("QUERY_MAX_PAGE_SIZE", "5000"))
+WEB_CONCURRENCY = max(int(getenv("WEB_CONCURRENCY", "1")), 1)
+# Every worker must share the secret, otherwise a token only works on the worker that issued it
+if not getenv("PAGINATION_SECRET") and WEB_CONCURRENCY > 1:
+    raise RuntimeError("Set PAGINATION_SECRET to the same value on every worker when WEB_CONCURRENCY > 1")
+PAGINATION_SECRET = (getenv("PAGINATION_SECRET") or secrets.token_hex(32)).encode("utf-8")
+
+PAGE_ALIAS = "_page"
+HIDDEN_KEY = "_page_key"
+UNIQUE_COLUMN = "id"
+
+class PaginationError(ValueError):
+    pass
+
+def clamp_page_size(page_size=None) -> int:
+    if not page_size or page_size < 1:
+        return QUERY_PAGE_SIZE
+    return min(page_size, QUERY_MAX_PAGE_SIZE)
+
+# --- continuation tokens ---------------------------------------------------
+
+def _encode_value(value):
+    if isinstance(value, Decimal):
+        return {"$dec": str(value)}
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    if isinstance(value, date):
+        return {"$date": value.isoformat()}
+    if type(value).__name__ == "ObjectId":
+        return {"$oid": str(value)}
+    return value
+
+def _decode_value(value):
+    if isinstance(value, dict) and len(value) == 1:
+        (tag, raw), = value.items()
+        if tag == "$dec":
+            return Decimal(raw)
+        if tag == "$dt":
+            return datetime.fromisoformat(raw)
+        if tag == "$date":
+            return date.fromisoformat(raw)
+        if tag == "$oid":
+            from bson import ObjectId
+            return ObjectId(raw)
+    return value
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def encode_cursor(state: dict) -> str:
+    state = dict(state, after=[_encode_value(v) for v in state.get("after") or []])
+    body = json.dumps(state, separators=(",", ":"), sort_keys=True, default=str).encode("utf-8")
+    signature = hmac.new(PAGINATION_SECRET, body, hashlib.sha256).digest()
+    return f"{_b64(body)}.{_b64(signature)}"
+
+def with_cursor(result: dict, question: str) -> dict:
+    """
+    `result` with its next_cursor encoded for `question`. Results keep the cursor
+    state without the question ("cursor_state"), so a result cached for one wording
+    hands every asker a cursor for their own.
+    """
+    state = result.get("cursor_state")
+    if state is None:
+        return result
+    return {**result, "next_cursor": encode_cursor({**state, "question": question})}
+
+def decode_cursor(token: str) -> dict:
+    try:
+        body_part, signature_part = token.split(".", 1)
+        body = _unb64(body_part)
+        signature = _unb64(signature_part)
+    except (ValueError, TypeError):
+        raise PaginationError("Malformed cursor")
+    expected = hmac.new(PAGINATION_SECRET, body, hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        raise PaginationError("Invalid cursor signature")
+    state = json.loads(body)
+    state["after"] = [_decode_value(v) for v in state.get("after") or []]
+    return state
+
+# --- SQL planning ------------------------------------------------------------
+
+def _limit_value(tree, params):
+    limit = tree.args.get("limit")
+    if limit is None:
+        return None
+    value = limit.expression
+    if isinstance(value, exp.Placeholder):
+        return int(params[value.name])
+    if isinstance(value, exp.Literal) and value.is_int:
+        return int(value.this)
+    return None
+
+def _output_name(projections, expr):
+    """Name under which `expr` appears in the SELECT list, or None."""
+    for projection in projections:
+        if projection.unalias() == expr:
+            return projection.alias_or_name
+    if isinstance(expr, exp.Column):
+        names = {p.alias_or_name for p in projections}
+        if expr.name in names:
+            return expr.name
+    return None
+
+def plan_sql(sql: str, params=None) -> dict:
+    """
+    Returns a JSON-serializable plan. With plan["keys"] set the query supports
+    keyset pagination; otherwise it is only bounded by a LIMIT.
+    """
+    params = params or {}
+    sql = sql.strip().rstrip(";")
+    try:
+        tree = sqlglot.parse_one(sql, read="mysql")
+    except sqlglot.errors.ParseError:
+        return {"sql": sql, "keys": None, "limit": None}
+    if not isinstance(tree, exp.Select):
+        return {"sql": sql, "keys": None, "limit": None}
+
+    limit = _limit_value(tree, params)
+    projections = list(tree.expressions)
+    group = tree.args.get("group")
+    is_aggregate = group is not None or any(p.find(exp.AggFunc) for p in projections)
+    if tree.args.get("distinct") or (is_aggregate and group is None) or tree.args.get("offset"):
+        # Single-row aggregates need no paging; DISTINCT/OFFSET are simply bounded
+        return {"sql": sql, "keys": None, "limit": limit}
+
+    inner = tree.copy()
+    inner.set("order", None)
+    inner.set("limit", None)
+    if group is not None:
+        unique = [_output_name(projections, g) for g in group.expressions]
+    else:
+        inner = inner.select(exp.alias_(exp.column(UNIQUE_COLUMN), HIDDEN_KEY), copy=False)
+        unique = [HIDDEN_KEY]
+    if any(name is None for name in unique):
+        return {"sql": sql, "keys": None, "limit": limit}
+
+    keys = []
+    order = tree.args.get("order")
+    for ordered in (order.expressions if order else []):
+        name = _output_name(projections, ordered.this)
+        if name is None:
+            return {"sql": sql, "keys": None, "limit": limit}
+        keys.append([name, bool(ordered.args.get("desc"))])
+    seen = {name for name, _ in keys}
+    keys += [[name, False] for name in unique if name not in seen]
+    return {"sql": inner.sql(dialect="mysql"), "keys": keys, "limit": limit}
+
+def _quote(name: str) -> str:
+    return "`" + name.replace("`", "``") + "`"
+
+def page_window(plan: dict, page_size: int, returned: int = 0):
+    """(take, fetch): rows to return for this page and rows to fetch to detect a next page."""
+    remaining = None if plan.get("limit") is None else max(plan["limit"] - returned, 0)
+    take = page_size if remaining is None else min(page_size, remaining)
+    fetch = take + 1 if remaining is None or remaining > take else take
+    return take, fetch
+
+# NULL sort keys come first ascending and last descending (MySQL and SQLite
+# alike), and never compare equal, so the keyset predicate spells them out.
+
+def _equal(name, i, value):
+    return f"{_quote(name)} IS NULL" if value is None else f"{_quote(name)} = :_k{i}"
+
+def _past(name, desc, i, value):
+    """Predicate for rows sorting after `value` on this key, or None when none can."""
+    if value is None:
+        return None if desc else f"{_quote(name)} IS NOT NULL"
+    if desc:
+        return f"({_quote(name)} < :_k{i} OR {_quote(name)} IS NULL)"
+    return f"{_quote(name)} > :_k{i}"
+
+def build_page_sql(plan: dict, params: dict, page_size: int, after=None, returned: int = 0):
+    """Returns (sql, params, take) for one page."""
+    take, fetch = page_window(plan, page_size, returned)
+    params = dict(params or {})
+    if not plan["keys"]:
+        try:
+            tree = sqlglot.parse_one(plan["sql"], read="mysql")
+        except sqlglot.errors.ParseError:
+            # Callers still only fetch take + 1 rows from the cursor
+            return plan["sql"], params, take
+        return tree.limit(fetch).sql(dialect="mysql"), params, take
+    sql = f"SELECT * FROM ({plan['sql']}) AS {PAGE_ALIAS}"
+    if after:
+        clauses = []
+        for i, (name, desc) in enumerate(plan["keys"]):
+            past = _past(name, desc, i, after[i])
+            if past is None:
+                continue
+            terms = [_equal(plan["keys"][j][0], j, after[j]) for j in range(i)]
+            terms.append(past)
+            clauses.append("(" + " AND ".join(terms) + ")")
+        # Nothing sorts after the last key: an empty page
+        sql += " WHERE " + (" OR ".join(clauses) if clauses else "1 = 0")
+        params.update({f"_k{i}": value for i, value in enumerate(after) if value is not None})
+    order_by = ", ".join(f"{_quote(name)} {'DESC' if desc else 'ASC'}" for name, desc in plan["keys"])
+    sql += f" ORDER BY {order_by} LIMIT :_page_limit"
+    params["_page_limit"] = fetch
+    return sql, params, take
+
+def split_page(plan: dict, columns, rows, take: int):
+    """
+    Trim the look-ahead row and the hidden key column. Returns
+    (columns, rows, after, truncated): `after` is None on the last page and
+    `truncated` marks a result cut off without a way to page further.
+    """
+    columns = list(columns)
+    truncated = len(rows) > take and not plan.get("keys")
+    has_more = len(rows) > take and bool(plan.get("keys"))
+    rows = [list(row) for row in rows[:take]]
+    after = None
+    if has_more and rows:
+        positions = [columns.index(name) for name, _ in plan["keys"]]
+        after = [rows[-1][i] for i in positions]
+    if HIDDEN_KEY in columns:
+        hidden = columns.index(HIDDEN_KEY)
+        columns.pop(hidden)
+        for row in rows:
+            row.pop(hidden)
+    return columns, rows, after, truncated
+
+# --- Mongo -------------------------------------------------------------------
+
+def mongo_page_filter(mongo_filter: dict, after=None) -> dict:
+    if not after:
+        return mongo_filter
+    return {"$and": [mongo_filter, {"_id": {"$gt": after[0]}}]}
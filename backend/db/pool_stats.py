@@ -0,0 +1,61 @@
+"""
+Connection pool checkout statistics, shared by the MySQL engines and the Mongo clients.
+
+Each pool is tracked under a name ("primary", "primary_sync", a replica's
+host:port, "mongo"). Wait time is how long a caller blocked before it was
+handed a connection, including opening a new one when the pool had to grow.
+"""
+import threading
+
+class PoolStats:
+    def __init__(self, name):
+        self.name = name
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+        self.errors = 0
+        # Set by the pool itself: returns current size / checked out / overflow
+        self.gauges = None
+        self._lock = threading.Lock()
+
+    def checkout(self, wait):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def failed(self, timeout=False):
+        with self._lock:
+            if timeout:
+                self.timeouts += 1
+            else:
+                self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            stats = {
+                "checkouts": self.checkouts,
+                "wait_seconds": round(self.wait_seconds, 6),
+                "avg_wait_ms": round(self.wait_seconds / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+            }
+        if self.gauges is not None:
+            stats.update(self.gauges())
+        return stats
+
+_pools = {}
+_lock = threading.Lock()
+
+def pool(name) -> PoolStats:
+    with _lock:
+        if name not in _pools:
+            _pools[name] = PoolStats(name)
+        return _pools[name]
+
+def snapshot():
+    with _lock:
+        pools = list(_pools.values())
+    return {p.name: p.snapshot() for p in pools}
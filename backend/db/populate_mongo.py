@@ -1,19 +1,18 @@
 import os
+import sys
 from pymongo import MongoClient
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Allow running as `python db/populate_*.py` from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cache.results import bump_data_version
+
 MONGO_URI = os.getenv("MONGO_URI")
 MONGO_DB = os.getenv("MONGO_DB")
 
-client = MongoClient(MONGO_URI)
-db = client[MONGO_DB]
-
-clients_collection = db.clients
-
-clients_collection.delete_many({})  # Clean slate
-clients_collection.insert_many([
+CLIENTS = [
     {
         "name": "Alice",
         "risk": "High",
@@ -56,6 +55,19 @@ clients_collection.insert_many([
         "city": "Chennai",
         "preferences": ["banking", "energy"]
     }
-])
+]
+
+def populate():
+    client = MongoClient(MONGO_URI)
+    db = client[MONGO_DB]
+
+    clients_collection = db.clients
+
+    clients_collection.delete_many({})  # Clean slate
+    clients_collection.insert_many([dict(doc) for doc in CLIENTS])
+
+    bump_data_version("clients")
+    print("MongoDB clients collection populated!")
 
-print("MongoDB clients collection populated!")
+if __name__ == "__main__":
+    populate()
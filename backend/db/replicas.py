@@ -0,0 +1,199 @@
+"""
+Read-only routing of generated queries to MySQL replicas.
+
+Generated queries never write, so they can run on a replica and leave the
+primary to the rollup refresh and the loaders. A replica only takes reads
+while it is healthy:
+
+- a background check reads its replication lag (SHOW REPLICA STATUS) every
+  MYSQL_REPLICA_CHECK_INTERVAL seconds; more than MYSQL_REPLICA_MAX_LAG
+  behind, stopped replication or a failed check takes it out of rotation
+- a dropped connection takes it out immediately, until the next good check
+- tables written within the lag budget are read from the primary, so a
+  result cached under the new data version is never a replica's old copy
+
+With no healthy replica, or none configured, reads go to the primary.
+Replicas that are not replicating from anywhere (a plain read-only copy, or a
+SQLite stand-in) count as current.
+"""
+import asyncio
+import itertools
+import threading
+import time
+from os import getenv
+
+from cache.results import result_cache
+from observability import get_logger
+
+log = get_logger("Replicas")
+
+MYSQL_REPLICA_MAX_LAG = float(getenv("MYSQL_REPLICA_MAX_LAG", "5"))
+MYSQL_REPLICA_CHECK_INTERVAL = float(getenv("MYSQL_REPLICA_CHECK_INTERVAL", "5"))
+MYSQL_REPLICA_CHECK_TIMEOUT = float(getenv("MYSQL_REPLICA_CHECK_TIMEOUT", "2"))
+
+# (statement, lag column): MySQL 8.0.22+ first, then the older names
+LAG_QUERIES = (
+    ("SHOW REPLICA STATUS", "Seconds_Behind_Source"),
+    ("SHOW SLAVE STATUS", "Seconds_Behind_Master"),
+)
+
+class Replica:
+    def __init__(self, name, async_engine, sync_engine_factory=None):
+        from sqlalchemy import event
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        self.name = name
+        self.async_engine = async_engine
+        self.async_factory = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+        # The sync engine only exists once the LangChain sync path reads from this replica
+        self._sync_engine_factory = sync_engine_factory
+        self._sync_factory = None
+        self.lag = None
+        self.healthy = False
+        self.checked_at = None
+        self.error = None
+        self.reads = 0
+        event.listen(async_engine.sync_engine, "handle_error", self._on_error)
+
+    @classmethod
+    def from_urls(cls, name, sync_url, async_url):
+        from db.mysql import create_pooled_async_engine, create_pooled_engine
+
+        return cls(name, create_pooled_async_engine(async_url, name),
+                   lambda: create_pooled_engine(sync_url, f"{name}_sync"))
+
+    def sync_factory(self):
+        if self._sync_factory is None:
+            from sqlalchemy import event
+            from sqlalchemy.orm import sessionmaker
+
+            engine = self._sync_engine_factory()
+            event.listen(engine, "handle_error", self._on_error)
+            self._sync_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        return self._sync_factory
+
+    def _on_error(self, context):
+        if context.is_disconnect and self.healthy:
+            self.healthy = False
+            self.error = f"disconnected: {context.original_exception}"
+            log.warning(f"Replica {self.name} lost its connection; reading from the others until it checks out")
+
+    def status(self):
+        return {
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "checked_at": self.checked_at,
+            "error": self.error,
+            "reads": self.reads,
+        }
+
+class ReplicaSet:
+    def __init__(self, replicas, primary_async, primary_sync,
+                 max_lag=MYSQL_REPLICA_MAX_LAG, check_interval=MYSQL_REPLICA_CHECK_INTERVAL,
+                 check_timeout=MYSQL_REPLICA_CHECK_TIMEOUT, versions=None):
+        self.replicas = list(replicas)
+        # Zero-argument callables returning the primary's session factories
+        self._primary_async = primary_async
+        self._primary_sync = primary_sync
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        self.versions = versions or result_cache.versions
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._stats = {"primary_reads": 0, "recent_write_reads": 0, "checks": 0, "failovers": 0}
+
+    def _pick(self, tables=None):
+        if not self.replicas:
+            return None
+        healthy = [r for r in self.replicas if r.healthy]
+        with self._lock:
+            if not healthy:
+                self._stats["primary_reads"] += 1
+                return None
+            # A replica may not have the latest write yet for as long as it may lag, plus until it is next checked
+            if time.time() - self.versions.last_write(tables) < self.max_lag + self.check_interval:
+                self._stats["recent_write_reads"] += 1
+                return None
+            replica = healthy[next(self._next) % len(healthy)]
+            replica.reads += 1
+            return replica
+
+    def session(self, tables=None):
+        """An AsyncSession for a read-only query over `tables` (all tables when None)."""
+        replica = self._pick(tables)
+        return replica.async_factory() if replica is not None else self._primary_async()()
+
+    def sync_session(self, tables=None):
+        replica = self._pick(tables)
+        return replica.sync_factory()() if replica is not None else self._primary_sync()()
+
+    async def _lag(self, replica):
+        from sqlalchemy import text
+        from sqlalchemy.exc import DBAPIError
+
+        async with replica.async_factory() as session:
+            if session.bind.dialect.name != "mysql":
+                await session.execute(text("SELECT 1"))
+                return 0.0
+            for statement, column in LAG_QUERIES:
+                try:
+                    row = (await session.execute(text(statement))).mappings().first()
+                except DBAPIError:
+                    await session.rollback()
+                    continue
+                if row is None:
+                    return 0.0
+                lag = row.get(column)
+                # NULL while the replication threads are stopped
+                return None if lag is None else float(lag)
+            raise RuntimeError("Could not read the replication status")
+
+    async def _check(self, replica):
+        was_healthy = replica.healthy
+        try:
+            replica.lag = await asyncio.wait_for(self._lag(replica), self.check_timeout)
+            if replica.lag is None:
+                replica.healthy, replica.error = False, "replication is not running"
+            elif replica.lag > self.max_lag:
+                replica.healthy, replica.error = False, f"{replica.lag:.0f}s behind"
+            else:
+                replica.healthy, replica.error = True, None
+        except Exception as e:
+            replica.healthy, replica.error = False, f"{type(e).__name__}: {e}"
+        replica.checked_at = time.time()
+        if was_healthy and not replica.healthy:
+            with self._lock:
+                self._stats["failovers"] += 1
+            log.warning(f"Replica {replica.name} out of rotation: {replica.error}")
+        elif replica.healthy and not was_healthy:
+            log.info(f"Replica {replica.name} in rotation", extra={"fields": {"lag_seconds": replica.lag}})
+
+    async def check(self):
+        """Measure every replica's lag once and update which ones take reads."""
+        await asyncio.gather(*(self._check(r) for r in self.replicas))
+        with self._lock:
+            self._stats["checks"] += 1
+
+    async def run(self, interval=None):
+        interval = interval or self.check_interval
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.check()
+            except Exception as e:
+                log.warning(f"Replica check failed: {type(e).__name__}: {e}")
+
+    async def dispose(self):
+        for replica in self.replicas:
+            await replica.async_engine.dispose()
+            if replica._sync_factory is not None:
+                replica._sync_factory.kw["bind"].dispose()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["max_lag"] = self.max_lag
+        stats["replicas"] = {r.name: r.status() for r in self.replicas}
+        stats["healthy"] = sum(1 for r in self.replicas if r.healthy)
+        return stats
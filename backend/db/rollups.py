@@ -0,0 +1,397 @@
+"""
+Materialized rollups of `portfolios` for the hottest aggregate questions.
+
+Three tables hold the aggregates, next to `portfolios` in the same database:
+
+- rollup_rm: SUM(portfolio_value), COUNT(*) and COUNT(portfolio_value) per
+  relationship manager
+- rollup_stock: the same per stock
+- rollup_top: the ROLLUP_TOP_K most valuable portfolios
+
+rollup_state remembers the highest portfolio id folded in and when the
+rollups were last known to match the base table.
+
+Refresh is incremental: rows appended since the last refresh (id above the
+watermark) are aggregated on their own and merged in. A full rebuild happens
+on first use, when rows at or below the watermark were deleted, and every
+ROLLUP_FULL_REFRESH_INTERVAL seconds, which also picks up in-place UPDATEs.
+A background task checks every ROLLUP_REFRESH_INTERVAL seconds, and only
+touches the database when the portfolios data version has moved.
+
+rewrite() turns generated SQL that the rollups can answer into a query over
+them:
+- SUM, COUNT or AVG of portfolio_value and COUNT(*), grouped by
+  relationship_manager or stock (or not grouped), optionally filtered on the
+  group column. The non-NULL count keeps NULL semantics exact: AVG divides by
+  it, and SUM is NULL when it is 0. Counts over no rows are 0, as COUNT is
+- ORDER BY portfolio_value DESC with LIMIT (literal or bound) of at most ROLLUP_TOP_K
+Results read from a rollup carry the time the rollup was last known to be
+current.
+"""
+import asyncio
+import os
+import time
+
+import sqlglot
+from sqlglot import exp
+from sqlalchemy import inspect, text
+
+from cache.results import bump_data_version, result_cache, sql_tables
+from observability import get_logger
+
+log = get_logger("Rollups")
+
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "1") == "1"
+ROLLUP_TOP_K = int(os.getenv("ROLLUP_TOP_K", "100"))
+ROLLUP_REFRESH_INTERVAL = float(os.getenv("ROLLUP_REFRESH_INTERVAL", "60"))
+ROLLUP_FULL_REFRESH_INTERVAL = float(os.getenv("ROLLUP_FULL_REFRESH_INTERVAL", "3600"))
+# Rollups not confirmed current for this long are bypassed and queries go to portfolios
+ROLLUP_MAX_STALENESS = float(os.getenv("ROLLUP_MAX_STALENESS", "600"))
+
+BASE_TABLE = "portfolios"
+GROUPED_ROLLUPS = {"relationship_manager": "rollup_rm", "stock": "rollup_stock"}
+TOP_TABLE = "rollup_top"
+TOP_COLUMNS = ("id", "client_name", "portfolio_value", "relationship_manager", "stock")
+ROLLUP_TABLES = {*GROUPED_ROLLUPS.values(), TOP_TABLE}
+LOCK_NAME = "insightlens_rollups"
+
+DDL = [
+    *(f"""
+    CREATE TABLE IF NOT EXISTS {table} (
+        {key} VARCHAR(255),
+        total_value DECIMAL(24,2) NOT NULL,
+        portfolio_count BIGINT NOT NULL,
+        value_count BIGINT NOT NULL
+    )""" for key, table in GROUPED_ROLLUPS.items()),
+    f"""
+    CREATE TABLE IF NOT EXISTS {TOP_TABLE} (
+        id INT,
+        client_name VARCHAR(255),
+        portfolio_value DECIMAL(20,2),
+        relationship_manager VARCHAR(255),
+        stock VARCHAR(255)
+    )""",
+    """
+    CREATE TABLE IF NOT EXISTS rollup_state (
+        name VARCHAR(64) PRIMARY KEY,
+        watermark BIGINT NOT NULL,
+        row_count BIGINT NOT NULL,
+        refreshed_at DOUBLE PRECISION NOT NULL,
+        rebuilt_at DOUBLE PRECISION NOT NULL
+    )""",
+]
+
+def _column(node):
+    return node.name if isinstance(node, exp.Column) else None
+
+def _set_table(tree, name):
+    key = "from_" if "from_" in tree.arg_types else "from"
+    tree.set(key, exp.From(this=exp.to_table(name)))
+    return tree
+
+def _key_filter(key, value):
+    if value is None:
+        return f"{key} IS NULL", {}
+    return f"{key} = :key", {"key": value}
+
+class Rollups:
+    def __init__(self, enabled=ROLLUPS_ENABLED, top_k=ROLLUP_TOP_K):
+        self.enabled = enabled
+        self.top_k = top_k
+        self.state = None
+        self._seen_version = None
+        self._verified_at = 0.0
+        self._created = False
+        self._stats = {"rewrites": 0, "incremental": 0, "full": 0, "skipped": 0}
+
+    # --- freshness ----------------------------------------------------------------------
+
+    @property
+    def as_of(self):
+        """Epoch seconds at which the rollups were last known to match portfolios, or None."""
+        if self.state is None:
+            return None
+        return max(self.state["refreshed_at"], self._verified_at)
+
+    def freshness(self, sql: str) -> dict:
+        """Where a result of `sql` came from and the time its data is current as of."""
+        if ROLLUP_TABLES.intersection(sql_tables(sql)):
+            return {"source": "rollup", "as_of": self.as_of}
+        return {"source": "live", "as_of": time.time()}
+
+    def fresh(self) -> bool:
+        as_of = self.as_of
+        return self.enabled and as_of is not None and time.time() - as_of <= ROLLUP_MAX_STALENESS
+
+    # --- query rewriting ------------------------------------------------------------------
+
+    def rewrite(self, sql: str, params: dict = None):
+        """SQL over the rollups that returns the same rows as `sql` (with `params` bound), or None."""
+        if not self.fresh():
+            return None
+        try:
+            tree = sqlglot.parse_one(sql, read="mysql")
+        except sqlglot.errors.ParseError:
+            return None
+        if not isinstance(tree, exp.Select) or tree.args.get("joins") or tree.args.get("distinct"):
+            return None
+        from_ = tree.args.get("from") or tree.args.get("from_")
+        table = from_.this if from_ is not None else None
+        if not isinstance(table, exp.Table) or table.name.lower() != BASE_TABLE or table.alias:
+            return None
+        if any(isinstance(node, (exp.Subquery, exp.Window)) for node in tree.walk()):
+            return None
+        if tree.find(exp.AggFunc):
+            rewritten = self._rewrite_aggregate(tree)
+        else:
+            rewritten = self._rewrite_top(tree, params or {})
+        if rewritten is None:
+            return None
+        self._stats["rewrites"] += 1
+        return rewritten.sql(dialect="mysql")
+
+    def _rewrite_aggregate(self, tree):
+        group = tree.args.get("group")
+        keys = [_column(e) for e in group.expressions] if group is not None else []
+        if len(keys) > 1 or (keys and keys[0] not in GROUPED_ROLLUPS):
+            return None
+        key = keys[0] if keys else "relationship_manager"
+        aliases = {e.alias for e in tree.expressions if isinstance(e, exp.Alias)}
+        where = tree.args.get("where")
+        # A filter on the group column keeps whole groups, so it can run on the rollup
+        if where is not None and (not keys or any(c.name != key for c in where.find_all(exp.Column))):
+            return None
+
+        def replacement(agg):
+            argument = agg.this
+            if isinstance(agg, exp.Count):
+                # SUM over no rollup rows is NULL where COUNT gives 0
+                if isinstance(argument, exp.Star) or _column(argument) == "id":
+                    return sqlglot.parse_one("COALESCE(SUM(portfolio_count), 0)", read="mysql")
+                if _column(argument) == "portfolio_value":
+                    return sqlglot.parse_one("COALESCE(SUM(value_count), 0)", read="mysql")
+                return None
+            if _column(argument) != "portfolio_value":
+                return None
+            if isinstance(agg, exp.Sum):
+                # total_value is 0 for a group of NULL values, whose SUM is NULL
+                return sqlglot.parse_one(
+                    "CASE WHEN SUM(value_count) = 0 THEN NULL ELSE SUM(total_value) END", read="mysql"
+                )
+            if isinstance(agg, exp.Avg):
+                return sqlglot.parse_one("1.0 * SUM(total_value) / NULLIF(SUM(value_count), 0)", read="mysql")
+            return None
+
+        # Anything outside an aggregate has to be the group column or an output alias
+        for column in tree.find_all(exp.Column):
+            if column.find_ancestor(exp.AggFunc) is None and column.name != key and column.name not in aliases:
+                return None
+
+        tree = tree.copy()
+        for projection in list(tree.expressions):
+            # Keep the original output name, e.g. "SUM(portfolio_value)", for unaliased aggregates
+            if not isinstance(projection, exp.Alias) and projection.find(exp.AggFunc):
+                projection.replace(exp.alias_(projection.copy(), projection.sql(dialect="mysql"), quoted=True))
+        for agg in list(tree.find_all(exp.AggFunc)):
+            new = replacement(agg)
+            if new is None:
+                return None
+            agg.replace(new)
+        return _set_table(tree, GROUPED_ROLLUPS[key])
+
+    def _rewrite_top(self, tree, params):
+        if tree.args.get("where") is not None or tree.args.get("group") is not None or tree.args.get("having"):
+            return None
+        order = tree.args.get("order")
+        limit = tree.args.get("limit")
+        if order is None or limit is None or tree.args.get("offset"):
+            return None
+        first = order.expressions[0]
+        if _column(first.this) != "portfolio_value" or not first.args.get("desc"):
+            return None
+        count = limit.expression
+        if isinstance(count, exp.Placeholder):
+            # Templates bind the limit, e.g. "LIMIT :limit"
+            try:
+                count = int(params[count.name])
+            except (KeyError, TypeError, ValueError):
+                return None
+        elif isinstance(count, exp.Literal) and count.is_int:
+            count = int(count.this)
+        else:
+            return None
+        if count > self.top_k:
+            return None
+        if any(c.name not in TOP_COLUMNS for c in tree.find_all(exp.Column)):
+            return None
+        return _set_table(tree.copy(), TOP_TABLE)
+
+    # --- refresh --------------------------------------------------------------------------
+
+    async def _ensure_tables(self, session):
+        if not self._created:
+            for ddl in DDL:
+                await session.execute(text(ddl))
+            for table in GROUPED_ROLLUPS.values():
+                columns = await session.run_sync(
+                    lambda sync_session: {c["name"] for c in inspect(sync_session.connection()).get_columns(table)}
+                )
+                if "value_count" not in columns:
+                    # Rollups built before value_count existed are rebuilt on this refresh
+                    await session.execute(text(f"ALTER TABLE {table} ADD COLUMN value_count BIGINT NOT NULL DEFAULT 0"))
+                    await session.execute(text("DELETE FROM rollup_state WHERE name = :name"), {"name": BASE_TABLE})
+            await session.commit()
+            self._created = True
+
+    async def _load_state(self, session):
+        row = (await session.execute(
+            text("SELECT watermark, row_count, refreshed_at, rebuilt_at FROM rollup_state WHERE name = :name"),
+            {"name": BASE_TABLE},
+        )).mappings().first()
+        self.state = dict(row) if row is not None else None
+        return self.state
+
+    async def _lock(self, session) -> bool:
+        if session.bind.dialect.name != "mysql":
+            return True
+        # One worker refreshes; the others pick up its result from rollup_state
+        return bool((await session.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": LOCK_NAME})).scalar())
+
+    async def _unlock(self, session):
+        if session.bind.dialect.name == "mysql":
+            await session.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+
+    async def _rebuild(self, session, high):
+        for key, table in GROUPED_ROLLUPS.items():
+            await session.execute(text(f"DELETE FROM {table}"))
+            await session.execute(text(
+                f"INSERT INTO {table} ({key}, total_value, portfolio_count, value_count) "
+                f"SELECT {key}, COALESCE(SUM(portfolio_value), 0), COUNT(*), COUNT(portfolio_value) FROM {BASE_TABLE} "
+                f"WHERE id <= :high GROUP BY {key}"
+            ), {"high": high})
+        await session.execute(text(f"DELETE FROM {TOP_TABLE}"))
+        await session.execute(text(
+            f"INSERT INTO {TOP_TABLE} ({', '.join(TOP_COLUMNS)}) SELECT {', '.join(TOP_COLUMNS)} FROM {BASE_TABLE} "
+            f"WHERE id <= :high ORDER BY portfolio_value DESC LIMIT {int(self.top_k)}"
+        ), {"high": high})
+
+    async def _merge(self, session, low, high):
+        bounds = {"low": low, "high": high}
+        for key, table in GROUPED_ROLLUPS.items():
+            deltas = (await session.execute(text(
+                f"SELECT {key}, COALESCE(SUM(portfolio_value), 0), COUNT(*), COUNT(portfolio_value) FROM {BASE_TABLE} "
+                f"WHERE id > :low AND id <= :high GROUP BY {key}"
+            ), bounds)).all()
+            for value, total, count, valued in deltas:
+                clause, params = _key_filter(key, value)
+                updated = await session.execute(text(
+                    f"UPDATE {table} SET total_value = total_value + :total, "
+                    f"portfolio_count = portfolio_count + :count, value_count = value_count + :valued WHERE {clause}"
+                ), {**params, "total": total, "count": count, "valued": valued})
+                if updated.rowcount == 0:
+                    await session.execute(text(
+                        f"INSERT INTO {table} ({key}, total_value, portfolio_count, value_count) "
+                        f"VALUES (:value, :total, :count, :valued)"
+                    ), {"value": value, "total": total, "count": count, "valued": valued})
+        columns = ", ".join(TOP_COLUMNS)
+        current = (await session.execute(text(f"SELECT {columns} FROM {TOP_TABLE}"))).all()
+        arrivals = (await session.execute(text(
+            f"SELECT {columns} FROM {BASE_TABLE} WHERE id > :low AND id <= :high "
+            f"ORDER BY portfolio_value DESC LIMIT {int(self.top_k)}"
+        ), bounds)).all()
+        if arrivals:
+            top = sorted([*current, *arrivals], key=lambda r: r[2] if r[2] is not None else float("-inf"), reverse=True)
+            await session.execute(text(f"DELETE FROM {TOP_TABLE}"))
+            await session.execute(
+                text(f"INSERT INTO {TOP_TABLE} ({columns}) VALUES ({', '.join(':' + c for c in TOP_COLUMNS)})"),
+                [dict(zip(TOP_COLUMNS, row)) for row in top[:self.top_k]],
+            )
+
+    async def refresh(self, session_factory, full: bool = False):
+        """Bring the rollups up to date; returns "full", "incremental", "current" or "locked"."""
+        async with session_factory() as session:
+            await self._ensure_tables(session)
+            if not await self._lock(session):
+                await self._load_state(session)
+                return "locked"
+            try:
+                state = await self._load_state(session)
+                high = (await session.execute(text(f"SELECT MAX(id) FROM {BASE_TABLE}"))).scalar() or 0
+                now = time.time()
+                mode = "full"
+                if state is not None and not full and now - state["rebuilt_at"] < ROLLUP_FULL_REFRESH_INTERVAL:
+                    # Rows at or below the watermark must all still be there for a merge to be correct
+                    folded = (await session.execute(
+                        text(f"SELECT COUNT(*) FROM {BASE_TABLE} WHERE id <= :watermark"),
+                        {"watermark": state["watermark"]},
+                    )).scalar()
+                    if folded == state["row_count"] and high >= state["watermark"]:
+                        mode = "incremental" if high > state["watermark"] else "current"
+                if mode == "full":
+                    await self._rebuild(session, high)
+                    row_count = (await session.execute(
+                        text(f"SELECT COUNT(*) FROM {BASE_TABLE} WHERE id <= :high"), {"high": high}
+                    )).scalar()
+                    rebuilt_at = now
+                elif mode == "incremental":
+                    await self._merge(session, state["watermark"], high)
+                    row_count = state["row_count"] + (await session.execute(
+                        text(f"SELECT COUNT(*) FROM {BASE_TABLE} WHERE id > :low AND id <= :high"),
+                        {"low": state["watermark"], "high": high},
+                    )).scalar()
+                    rebuilt_at = state["rebuilt_at"]
+                else:
+                    row_count, rebuilt_at = state["row_count"], state["rebuilt_at"]
+                await session.execute(text("DELETE FROM rollup_state WHERE name = :name"), {"name": BASE_TABLE})
+                await session.execute(text(
+                    "INSERT INTO rollup_state (name, watermark, row_count, refreshed_at, rebuilt_at) "
+                    "VALUES (:name, :watermark, :row_count, :refreshed_at, :rebuilt_at)"
+                ), {"name": BASE_TABLE, "watermark": high, "row_count": row_count,
+                    "refreshed_at": now, "rebuilt_at": rebuilt_at})
+                await session.commit()
+            finally:
+                await self._unlock(session)
+            await self._load_state(session)
+        if mode != "current":
+            self._stats[mode] += 1
+            # Cached answers read from the rollups are stale now
+            for table in ROLLUP_TABLES:
+                bump_data_version(table)
+            log.info(f"Rollups refreshed ({mode}) up to portfolio id {high}")
+        return mode
+
+    async def refresh_if_needed(self, session_factory):
+        """Refresh when portfolios changed (per its data version) or a full rebuild is due."""
+        version = result_cache.versions.get((BASE_TABLE,))
+        due = self.state is None or time.time() - self.state["rebuilt_at"] >= ROLLUP_FULL_REFRESH_INTERVAL
+        if version == self._seen_version and not due:
+            # Writers bump the data version, so an unchanged version means the rollups still match
+            self._verified_at = time.time()
+            self._stats["skipped"] += 1
+            return "current"
+        mode = await self.refresh(session_factory)
+        if mode != "locked":
+            self._seen_version = version
+        return mode
+
+    async def run(self, session_factory, interval: float = ROLLUP_REFRESH_INTERVAL):
+        while True:
+            try:
+                await self.refresh_if_needed(session_factory)
+            except Exception as e:
+                log.warning(f"Rollup refresh failed: {type(e).__name__}: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self):
+        as_of = self.as_of
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "fresh": self.fresh(),
+            "as_of": as_of,
+            "age_seconds": round(time.time() - as_of, 1) if as_of is not None else None,
+            "watermark": self.state["watermark"] if self.state else None,
+            "rows": self.state["row_count"] if self.state else None,
+        }
+
+rollups = Rollups()
@@ -0,0 +1,355 @@
+"""
+Schema catalog shared by the prompts and the validators.
+
+MySQL is introspected with the SQLAlchemy inspector and every Mongo collection
+the tools read is sampled (field types, plus the values of low-cardinality
+string fields). The result is cached in memory and in CACHE_DIR for
+SCHEMA_CATALOG_TTL seconds and carries a version hash, which the translation
+cache keys include. Until the first introspection succeeds (or when the stores
+are unreachable) the built-in description of portfolios/clients is used.
+
+Hand-written notes per column/field are merged in, so prompts keep the hints
+the introspection cannot know.
+
+sql_prompt()/mongo_prompt() render only the tables, collections and columns
+relevant to the question, within SCHEMA_PROMPT_BUDGET tokens; sql_tables(),
+sql_columns() and mongo_fields() are the allowlists the validators check
+against, and mongo_projection() the fields the tools read.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+
+from cache.translation import CACHE_DIR
+from observability import get_logger
+
+log = get_logger("SchemaCatalog")
+
+SCHEMA_CATALOG_TTL = float(os.getenv("SCHEMA_CATALOG_TTL", "3600"))
+SCHEMA_CATALOG_PATH = os.getenv("SCHEMA_CATALOG_PATH", os.path.join(CACHE_DIR, "schema_catalog.json"))
+# Approximate tokens (4 characters each) the schema section of a prompt may use
+SCHEMA_PROMPT_BUDGET = int(os.getenv("SCHEMA_PROMPT_BUDGET", "600"))
+SCHEMA_SAMPLE_SIZE = int(os.getenv("SCHEMA_SAMPLE_SIZE", "200"))
+# String fields with at most this many distinct sampled values list them in the prompt
+SCHEMA_MAX_VALUES = int(os.getenv("SCHEMA_MAX_VALUES", "8"))
+# Comma-separated; empty means every table except the service's own (rollups)
+SCHEMA_SQL_TABLES = [t for t in os.getenv("SCHEMA_SQL_TABLES", "").split(",") if t]
+SCHEMA_MONGO_COLLECTIONS = [c for c in os.getenv("SCHEMA_MONGO_COLLECTIONS", "clients").split(",") if c]
+# Wait this long before retrying a failed introspection
+SCHEMA_RETRY_INTERVAL = float(os.getenv("SCHEMA_RETRY_INTERVAL", "60"))
+
+INTERNAL_TABLE_PREFIXES = ("rollup_",)
+
+SQL_NOTES = {
+    "portfolios": {
+        "client_name": "the name of the client",
+        "portfolio_value": "the total value of the client portfolio",
+        "relationship_manager": "the RM for the client",
+        "stock": "the main stock held in this portfolio",
+    },
+}
+MONGO_NOTES = {
+    "clients": {
+        "name": 'client names like "Alice", "Bob", "Charlie"',
+        "risk": 'risk levels: "High", "Medium", "Low"',
+        "age": "client ages like 45, 52, 38",
+        "city": 'cities like "Mumbai", "Delhi", "Bangalore", "Pune", "Chennai"',
+        "preferences": 'investment preferences like ["tech", "banking"], ["energy", "auto"]',
+    },
+}
+
+DEFAULT_CATALOG = {
+    "database": "portfolios",
+    "sql": {
+        "portfolios": {"columns": {
+            "id": {"type": "integer", "primary_key": True},
+            "client_name": {"type": "string"},
+            "portfolio_value": {"type": "decimal"},
+            "relationship_manager": {"type": "string"},
+            "stock": {"type": "string"},
+        }},
+    },
+    "mongo": {
+        "clients": {"fields": {
+            "name": {"type": "string"},
+            "risk": {"type": "string"},
+            "age": {"type": "integer"},
+            "city": {"type": "string"},
+            "preferences": {"type": "array of strings"},
+        }},
+    },
+}
+
+def _annotated(catalog):
+    """Copy of `catalog` with the hand-written notes filled in."""
+    annotated = json.loads(json.dumps(catalog))
+    for section, members, notes in (("sql", "columns", SQL_NOTES), ("mongo", "fields", MONGO_NOTES)):
+        for name, body in annotated[section].items():
+            for member, entry in body[members].items():
+                if member in notes.get(name, {}):
+                    entry["note"] = notes[name][member]
+    return annotated
+
+def _sql_type(column_type) -> str:
+    name = type(column_type).__name__.lower()
+    for keyword, simple in (("int", "integer"), ("bool", "boolean"), ("dec", "decimal"), ("numeric", "decimal"),
+                            ("float", "float"), ("double", "float"), ("real", "float"), ("datetime", "datetime"),
+                            ("timestamp", "datetime"), ("date", "date"), ("json", "json")):
+        if keyword in name:
+            return simple
+    return "string"
+
+def _mongo_type(value) -> str:
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, float):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, list):
+        inner = {_mongo_type(v) for v in value}
+        return f"array of {inner.pop()}s" if len(inner) == 1 else "array"
+    if isinstance(value, dict):
+        return "object"
+    return type(value).__name__.lower()
+
+def _words(text: str):
+    # "relationship_manager" -> relationship, manager; plurals match their singular
+    return {w[:-1] if len(w) > 3 and w.endswith("s") else w for w in re.findall(r"[a-z0-9]+", text.lower())}
+
+def _tokens(text: str) -> int:
+    return len(text) // 4
+
+def _version(catalog) -> str:
+    body = {k: catalog[k] for k in ("database", "sql", "mongo")}
+    return hashlib.sha1(json.dumps(body, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:12]
+
+class SchemaCatalog:
+    def __init__(self, path=SCHEMA_CATALOG_PATH, ttl=SCHEMA_CATALOG_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._catalog = None
+        self._failed_at = None
+        self._lock = None
+        self._default = {**_annotated(DEFAULT_CATALOG), "source": "default", "introspected_at": None}
+        self._default["version"] = _version(self._default)
+
+    # --- loading ------------------------------------------------------------------------
+
+    @property
+    def catalog(self) -> dict:
+        if self._catalog is None:
+            self._catalog = self._read_disk()
+        return self._catalog or self._default
+
+    @property
+    def version(self) -> str:
+        return self.catalog["version"]
+
+    def _fresh(self, catalog) -> bool:
+        return catalog is not None and time.time() - catalog["introspected_at"] < self.ttl
+
+    def _read_disk(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                catalog = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Another worker (or an earlier run) introspected recently enough
+        return catalog if self._fresh(catalog) else None
+
+    def _write_disk(self, catalog):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(catalog, f, default=str)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning(f"Could not write the schema catalog: {e}")
+
+    async def ensure(self):
+        """Introspect when there is no fresh catalog; the built-in one stays in use if that fails."""
+        if self._fresh(self._catalog) or (self._catalog is None and self._fresh(self._read_disk())):
+            return self.catalog
+        if self._failed_at is not None and time.monotonic() - self._failed_at < SCHEMA_RETRY_INTERVAL:
+            return self.catalog
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._fresh(self._catalog):
+                await self.refresh()
+        return self.catalog
+
+    async def refresh(self):
+        from db import mongo, mysql
+
+        try:
+            sql, database = await self._introspect_sql(mysql.AsyncSessionLocal)
+            collections = await self._introspect_mongo(mongo.async_db)
+        except Exception as e:
+            self._failed_at = time.monotonic()
+            log.warning(f"Schema introspection failed, keeping the {self.catalog['source']} catalog: "
+                        f"{type(e).__name__}: {e}")
+            return self.catalog
+        catalog = {"database": database, "sql": sql, "mongo": collections,
+                   "source": "introspected", "introspected_at": time.time()}
+        catalog["version"] = _version(catalog)
+        if self._catalog is None or self._catalog.get("version") != catalog["version"]:
+            log.info(f"Schema catalog {catalog['version']}: {len(sql)} tables, {len(collections)} collections")
+        self._catalog = catalog
+        self._failed_at = None
+        self._write_disk(catalog)
+        return catalog
+
+    async def _introspect_sql(self, session_factory):
+        from sqlalchemy import inspect
+
+        def read(connection):
+            inspector = inspect(connection)
+            names = SCHEMA_SQL_TABLES or [
+                t for t in inspector.get_table_names() if not t.startswith(INTERNAL_TABLE_PREFIXES)
+            ]
+            tables = {}
+            for table in names:
+                primary = set(inspector.get_pk_constraint(table).get("constrained_columns") or [])
+                notes = SQL_NOTES.get(table, {})
+                columns = {}
+                for column in inspector.get_columns(table):
+                    entry = {"type": _sql_type(column["type"])}
+                    if column["name"] in primary:
+                        entry["primary_key"] = True
+                    note = column.get("comment") or notes.get(column["name"])
+                    if note:
+                        entry["note"] = note
+                    columns[column["name"]] = entry
+                tables[table] = {"columns": columns}
+            return tables
+
+        async with session_factory() as session:
+            connection = await session.connection()
+            tables = await connection.run_sync(read)
+            database = connection.engine.url.database
+        if connection.dialect.name == "sqlite":
+            database = os.path.splitext(os.path.basename(database or "main"))[0]
+        return tables, database
+
+    async def _introspect_mongo(self, database):
+        collections = {}
+        for name in SCHEMA_MONGO_COLLECTIONS:
+            docs = await database[name].aggregate(
+                [{"$sample": {"size": SCHEMA_SAMPLE_SIZE}}, {"$project": {"_id": 0}}]
+            ).to_list(length=SCHEMA_SAMPLE_SIZE)
+            types, values = {}, {}
+            for doc in docs:
+                for field, value in doc.items():
+                    types.setdefault(field, {}).setdefault(_mongo_type(value), 0)
+                    types[field][_mongo_type(value)] += 1
+                    items = value if isinstance(value, list) else [value]
+                    if all(isinstance(v, str) for v in items):
+                        values.setdefault(field, set()).update(items)
+            notes = MONGO_NOTES.get(name, {})
+            fields = {}
+            for field, seen in types.items():
+                entry = {"type": max(seen, key=seen.get)}
+                if field in notes:
+                    entry["note"] = notes[field]
+                sampled = values.get(field, set())
+                if sampled and len(sampled) <= SCHEMA_MAX_VALUES:
+                    entry["values"] = sorted(sampled)
+                fields[field] = entry
+            collections[name] = {"fields": fields}
+        return collections
+
+    # --- allowlists ---------------------------------------------------------------------
+
+    def sql_tables(self) -> set:
+        return set(self.catalog["sql"])
+
+    def sql_columns(self, tables=None) -> set:
+        return {column for table, entry in self.catalog["sql"].items()
+                if tables is None or table in tables for column in entry["columns"]}
+
+    def mongo_fields(self, collection: str) -> set:
+        return set(self.catalog["mongo"].get(collection, {}).get("fields", {}))
+
+    def mongo_projection(self, collection: str, with_id: bool = False) -> dict:
+        """A find() projection of the catalogued fields; _id only when asked for (paging)."""
+        fields = self.catalog["mongo"].get(collection, {}).get("fields", {})
+        return {"_id": 1 if with_id else 0, **{field: 1 for field in fields}}
+
+    # --- prompts ------------------------------------------------------------------------
+
+    @staticmethod
+    def _describe(name, entry):
+        line = f"- {name}: {entry['type']}"
+        if entry.get("primary_key"):
+            line += ", primary key"
+        if entry.get("note"):
+            line += f" ({entry['note']})"
+        elif entry.get("values"):
+            line += " (values: " + ", ".join(f'"{v}"' for v in entry["values"]) + ")"
+        return line
+
+    @staticmethod
+    def _score(terms, name, entry=None):
+        vocabulary = _words(name)
+        if entry is not None:
+            vocabulary |= _words(entry.get("note", "")) | _words(" ".join(entry.get("values", [])))
+        return len(terms & vocabulary)
+
+    def _prune(self, question, items, header, members, budget):
+        """
+        Render the relevant items (tables or collections), most relevant first, each with
+        all of its members when that fits the budget and only the matching ones otherwise.
+        """
+        terms = _words(question or "")
+        scored = []
+        for name, entry in items.items():
+            member_scores = {m: self._score(terms, m, e) for m, e in entry[members].items()}
+            score = 2 * self._score(terms, name) + sum(member_scores.values())
+            scored.append((score, name, member_scores))
+        # Nothing matched: fall back to catalog order, as much as fits
+        relevant = [s for s in scored if s[0] > 0] or scored
+        relevant.sort(key=lambda s: -s[0])
+        sections, used = [], 0
+        for score, name, member_scores in relevant:
+            entry = items[name][members]
+            matching = [m for m in entry if member_scores[m] or entry[m].get("primary_key")]
+            options = [list(entry)] + ([matching] if matching and len(matching) < len(entry) else [])
+            texts = ["\n".join([header(name)] + [self._describe(m, entry[m]) for m in keep]) for keep in options]
+            chosen = next((text for text in texts if used + _tokens(text) <= budget), None)
+            if chosen is None and not sections:
+                # The most relevant item is always included, trimmed as far as it goes
+                chosen = texts[-1]
+            if chosen is not None:
+                sections.append(chosen)
+                used += _tokens(chosen)
+        return sections
+
+    def sql_prompt(self, question: str = None, budget: int = SCHEMA_PROMPT_BUDGET) -> str:
+        catalog = self.catalog
+        sections = self._prune(question, catalog["sql"], lambda t: f"Table: {t}\nColumns:", "columns", budget)
+        return f"\nDatabase: {catalog['database']}\n" + "\n\n".join(sections) + "\n"
+
+    def mongo_prompt(self, collection: str, question: str = None, budget: int = SCHEMA_PROMPT_BUDGET) -> str:
+        collections = {collection: self.catalog["mongo"].get(collection, {"fields": {}})}
+        sections = self._prune(question, collections, lambda c: f"Collection: {c}\nFields:", "fields", budget)
+        return "\n" + "\n\n".join(sections) + "\n"
+
+    def stats(self):
+        catalog = self.catalog
+        return {
+            "version": catalog["version"],
+            "source": catalog["source"],
+            "introspected_at": catalog["introspected_at"],
+            "tables": {t: sorted(e["columns"]) for t, e in catalog["sql"].items()},
+            "collections": {c: sorted(e["fields"]) for c, e in catalog["mongo"].items()},
+        }
+
+schema_catalog = SchemaCatalog()
@@ -0,0 +1,184 @@
+"""
+Opt-in compact encodings for /query responses, negotiated with Accept.
+
+- application/vnd.insightlens.columnar+json: typed, column-oriented JSON
+  written with orjson, bypassing Pydantic response validation.
+- application/vnd.apache.arrow.stream: the table as an Arrow IPC stream, with
+  the rest of the response (every QueryResponse field but the table) in
+  schema metadata.
+
+Both are compressed with zstd or gzip according to Accept-Encoding. Clients
+that ask for neither get the regular QueryResponse JSON.
+"""
+import gzip
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from operator import itemgetter
+
+from fastapi.responses import Response
+
+from schemas import QueryResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COLUMNAR_MEDIA_TYPE = "application/vnd.insightlens.columnar+json"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+ARROW_METADATA_KEY = b"insightlens"
+
+# Bodies smaller than this are sent uncompressed
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "5"))
+ZSTD_LEVEL = int(os.getenv("ZSTD_LEVEL", "3"))
+
+def column_type(values) -> str:
+    """Logical type of a result column: int64, float64, decimal, bool, date, datetime, string or json."""
+    types = set(map(type, values))
+    types.discard(type(None))
+    if not types:
+        return "string"
+    if types == {bool}:
+        return "bool"
+    if types == {int}:
+        return "int64"
+    if types == {Decimal}:
+        return "decimal"
+    if types <= {int, float, Decimal}:
+        return "float64"
+    if types <= {datetime}:
+        return "datetime"
+    if types <= {date}:
+        return "date"
+    if types == {str}:
+        return "string"
+    return "json"
+
+def _convert(values, kind):
+    if kind in ("decimal", "float64"):
+        return [None if v is None else float(v) for v in values]
+    if kind in ("date", "datetime"):
+        return [None if v is None else v.isoformat() for v in values]
+    if kind == "json":
+        return [v if v is None or isinstance(v, (str, int, float, bool, list, dict)) else str(v) for v in values]
+    return values
+
+def columnar_table(columns, rows):
+    """Transpose rows into typed columns; each column is converted in a single pass."""
+    table_columns = []
+    data = []
+    for i, name in enumerate(columns):
+        values = list(map(itemgetter(i), rows))
+        kind = column_type(values)
+        table_columns.append({"name": name, "type": kind})
+        data.append(_convert(values, kind))
+    return {"columns": table_columns, "data": data, "row_count": len(rows)}
+
+# Everything a QueryResponse carries besides the table, so new fields reach every encoding
+ENVELOPE_FIELDS = {
+    name: None if field.is_required() else field.default
+    for name, field in QueryResponse.model_fields.items() if name != "table"
+}
+
+def _envelope(result):
+    envelope = {name: result.get(name, default) for name, default in ENVELOPE_FIELDS.items()}
+    envelope["text"] = envelope["text"] or "No answer available."
+    return envelope
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=_json_default, separators=(",", ":")).encode("utf-8")
+
+def encode_columnar(result) -> bytes:
+    table = result.get("table") or {"columns": [], "rows": []}
+    return dumps({**_envelope(result), "table": columnar_table(table["columns"], table["rows"])})
+
+def _arrow_array(values, kind):
+    if kind == "decimal":
+        # Keep exact values; pyarrow infers precision and scale from the Decimals
+        return pa.array(values)
+    if kind == "float64":
+        # pyarrow cannot infer one type for a mix of ints, floats and Decimals
+        return pa.array(_convert(values, kind), type=pa.float64())
+    if kind == "json":
+        return pa.array(dumps(v).decode("utf-8") if v is not None else None for v in values)
+    return pa.array(values)
+
+def encode_arrow(result) -> bytes:
+    table = result.get("table") or {"columns": [], "rows": []}
+    columns, rows = table["columns"], table["rows"]
+    arrays = []
+    for i in range(len(columns)):
+        values = list(map(itemgetter(i), rows))
+        arrays.append(_arrow_array(values, column_type(values)))
+    batch = pa.RecordBatch.from_arrays(arrays, names=list(columns)) if columns else None
+    schema = (batch.schema if batch is not None else pa.schema([])).with_metadata(
+        {ARROW_METADATA_KEY: dumps(_envelope(result))}
+    )
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        if batch is not None:
+            writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+def _accepts(header: str, media_type: str) -> bool:
+    return any(part.split(";")[0].strip() == media_type for part in header.split(","))
+
+def negotiate_format(accept: str):
+    """'arrow', 'columnar' or None (regular QueryResponse JSON)."""
+    accept = accept or ""
+    if pa is not None and _accepts(accept, ARROW_MEDIA_TYPE):
+        return "arrow"
+    if _accepts(accept, COLUMNAR_MEDIA_TYPE):
+        return "columnar"
+    return None
+
+def compress(body: bytes, accept_encoding: str):
+    """Returns (body, content_encoding or None)."""
+    if len(body) < COMPRESSION_MIN_BYTES:
+        return body, None
+    encodings = {part.split(";")[0].strip() for part in (accept_encoding or "").split(",")}
+    if "zstd" in encodings and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body), "zstd"
+    if "gzip" in encodings:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
+    return body, None
+
+def encode_response(result, accept: str, accept_encoding: str = ""):
+    """
+    A Response in the negotiated compact format, or None when the client wants
+    the regular QueryResponse JSON.
+    """
+    fmt = negotiate_format(accept)
+    if fmt is None:
+        return None
+    if fmt == "arrow":
+        body, media_type = encode_arrow(result), ARROW_MEDIA_TYPE
+    else:
+        body, media_type = encode_columnar(result), COLUMNAR_MEDIA_TYPE
+    body, content_encoding = compress(body, accept_encoding)
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if content_encoding:
+        headers["Content-Encoding"] = content_encoding
+    return Response(content=body, media_type=media_type, headers=headers)
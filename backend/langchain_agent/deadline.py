@@ -0,0 +1,68 @@
+"""
+Per-request deadline shared by every stage of the /query pipeline.
+
+The endpoint opens request_deadline(); the LLM gateway and the tools read
+remaining() to size their own timeouts so the whole request never runs
+past one budget, however many stages or retries it goes through.
+"""
+import asyncio
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+@contextmanager
+def request_deadline(seconds: float = REQUEST_DEADLINE_SECONDS):
+    # A nested deadline can only shorten the budget, never extend it
+    current = _deadline.get()
+    deadline = time.monotonic() + seconds
+    if current is not None:
+        deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+def remaining():
+    """Seconds left before the deadline, or None when no deadline is set."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+def check_deadline(stage: str = "request"):
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Deadline exceeded before {stage}")
+    return left
+
+def cap_timeout(timeout):
+    """The smaller of `timeout` and the time left; raises once the deadline has passed."""
+    left = check_deadline()
+    if left is None:
+        return timeout
+    if timeout is None:
+        return left
+    return min(timeout, left)
+
+async def within_deadline(awaitable, stage: str):
+    """Await `awaitable`, cancelling it if the request deadline passes first."""
+    left = remaining()
+    if left is None:
+        return await awaitable
+    if left <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded(f"Deadline exceeded before {stage}")
+    try:
+        return await asyncio.wait_for(awaitable, timeout=left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"Deadline exceeded during {stage}")
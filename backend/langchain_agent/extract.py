@@ -0,0 +1,153 @@
+"""
+Incremental extraction of a generated query from streamed LLM output.
+
+Reasoning models wrap the query in commentary. The extractors are fed the
+completion as it arrives and return the first complete query the moment it
+closes, so the gateway can stop the stream instead of paying for the rest:
+
+- SQLExtractor: a SELECT statement, complete at a top-level `;` or at the
+  code fence that closes it
+- JSONExtractor: a JSON object or array whose brackets balance and that parses
+
+String literals are tracked, so `;`, brackets and fences inside them do not
+end a query, and <think>...</think> blocks are skipped.
+"""
+import json
+import re
+from abc import ABC, abstractmethod
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+FENCE = "```"
+
+class _Extractor(ABC):
+    # Matches the start of a candidate query, or a reasoning block to skip
+    START = None
+    QUOTES = ""
+
+    def __init__(self):
+        self.text = ""
+        self.result = None
+        self._pos = 0
+        self._start = None
+        self._thinking = False
+        self._quote = None
+        self._depth = 0
+
+    def feed(self, chunk: str):
+        """Add streamed text; returns the complete query once there is one, else None."""
+        if self.result is None and chunk:
+            self.text += chunk
+            self._scan()
+        return self.result
+
+    def _scan(self):
+        while self.result is None:
+            if self._thinking:
+                end = self.text.find(THINK_CLOSE, self._pos)
+                if end < 0:
+                    # Keep enough of the tail to see a closing tag split across chunks
+                    self._pos = max(self._pos, len(self.text) - len(THINK_CLOSE))
+                    return
+                self._thinking = False
+                self._pos = end + len(THINK_CLOSE)
+            elif self._start is None:
+                match = self.START.search(self.text, self._pos)
+                if match is None:
+                    self._pos = max(self._pos, len(self.text) - len(THINK_OPEN))
+                    return
+                if match.group(0).lower() == THINK_OPEN:
+                    self._thinking = True
+                    self._pos = match.end()
+                else:
+                    self._start = self._pos = match.start()
+                    self._quote, self._depth = None, 0
+            elif not self._scan_query():
+                return
+
+    def _scan_query(self) -> bool:
+        """Advance through the candidate; False when more text is needed."""
+        text = self.text
+        i = self._pos
+        while i < len(text):
+            ch = text[i]
+            if self._quote is not None:
+                if ch == "\\":
+                    if i + 1 >= len(text):
+                        break
+                    i += 2
+                    continue
+                if ch == self._quote:
+                    self._quote = None
+            elif ch in self.QUOTES:
+                if ch == "`":
+                    # Possibly a code fence; wait until the next two characters are in
+                    if i + 2 >= len(text):
+                        break
+                    if text.startswith(FENCE, i):
+                        self._pos = i
+                        return self._close(i, fence=True)
+                self._quote = ch
+            else:
+                done = self._structure(ch, i)
+                if done is not None:
+                    return done
+            i += 1
+        self._pos = i
+        return False
+
+    @abstractmethod
+    def _close(self, end, fence=False) -> bool:
+        """Finish the candidate ending at `end`; True when scanning can go on."""
+
+    @abstractmethod
+    def _structure(self, ch, i):
+        """Track a structural character; the _close() outcome when it ends the query, else None."""
+
+class SQLExtractor(_Extractor):
+    START = re.compile(r"<think>|\bselect(?=\W)", re.IGNORECASE)
+    QUOTES = "'\"`"
+
+    def _structure(self, ch, i):
+        if ch == "(":
+            self._depth += 1
+        elif ch == ")":
+            self._depth -= 1
+        elif ch == ";" and self._depth <= 0:
+            return self._close(i + 1)
+        return None
+
+    def _close(self, end, fence=False):
+        if self._depth > 0:
+            # A fence inside an unbalanced statement means the model gave up on it
+            self._start = None
+            self._pos = end + len(FENCE)
+            return True
+        self.result = self.text[self._start:end].strip()
+        return True
+
+class JSONExtractor(_Extractor):
+    START = re.compile(r"<think>|[{\[]", re.IGNORECASE)
+    QUOTES = "\""
+
+    def _structure(self, ch, i):
+        if ch in "{[":
+            self._depth += 1
+        elif ch in "}]":
+            self._depth -= 1
+            if self._depth == 0:
+                return self._close(i + 1)
+        return None
+
+    def _close(self, end, fence=False):
+        candidate = self.text[self._start:end]
+        try:
+            json.loads(candidate)
+            self.result = candidate
+            return True
+        except ValueError:
+            pass
+        # Prose in braces rather than a JSON value; look for the next one
+        self._pos = self._start + 1
+        self._start = None
+        return True
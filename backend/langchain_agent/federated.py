@@ -0,0 +1,409 @@
+"""
+Federated execution for questions that need both stores, e.g. "total
+portfolio value of high-risk clients in Mumbai": risk and city live in Mongo
+`clients`, values in MySQL `portfolios`, joined on name = client_name.
+
+Each side's filter is pushed down to its own store. The side with fewer
+estimated rows becomes the hash-join build side. When it has few enough
+distinct names, they are also pushed into the other store as a semi-join. The
+other side is then streamed through the probe in batches and aggregated on
+the fly, so neither store is read into memory in full.
+
+The build-side choice only uses the EXPLAIN estimate of the portfolios filter;
+the guardrails admit the statement that actually runs, i.e. the SQL build or
+the probe with the pushed-down names.
+"""
+import heapq
+import os
+from decimal import Decimal
+from itertools import count
+
+from langchain.tools import BaseTool
+from sqlalchemy import text, bindparam
+
+from db.mongo import db, async_db, read_collection, MONGO_BATCH_SIZE
+from db.mysql import ReadSessionLocal, AsyncReadSessionLocal
+from db.guardrails import (
+    GuardrailRejection, admit, admit_async, explain, explain_async, execution_time_ms, with_time_limit,
+)
+from db.pagination import clamp_page_size
+from db.index_advisor import index_advisor
+from db.schema_catalog import schema_catalog
+from cache.results import result_cache
+from charts import build_chart
+from langchain_agent.templates import match_federated
+from langchain_agent.deadline import DeadlineExceeded, within_deadline, check_deadline
+from pymongo.errors import ExecutionTimeout
+from observability import get_logger
+
+log = get_logger("FederatedTool")
+
+FEDERATED_BATCH_SIZE = int(os.getenv("FEDERATED_BATCH_SIZE", "1000"))
+# The build side is held in memory; larger joins are rejected as too expensive
+FEDERATED_MAX_BUILD_ROWS = int(os.getenv("FEDERATED_MAX_BUILD_ROWS", "200000"))
+# Up to this many build-side names are pushed into the probe store as an IN filter
+FEDERATED_MAX_PUSHDOWN_KEYS = int(os.getenv("FEDERATED_MAX_PUSHDOWN_KEYS", "1000"))
+
+PORTFOLIO_COLUMNS = ["client_name", "portfolio_value", "stock", "relationship_manager"]
+LISTING_COLUMNS = ["client_name", "risk", "city", "portfolio_value", "stock", "relationship_manager"]
+
+METRIC_NAMES = {
+    ("sum", "portfolio_value"): "total_portfolio_value",
+    ("avg", "portfolio_value"): "average_portfolio_value",
+    ("avg", "age"): "average_age",
+    ("count", "portfolios"): "portfolios",
+    ("count", "clients"): "clients",
+}
+
+def portfolio_sql(sql_filter: dict, names=None):
+    """(sql, params) for the portfolios side with the plan's predicates pushed down."""
+    clauses = []
+    params = {}
+    if "relationship_manager" in sql_filter:
+        clauses.append("relationship_manager = :rm")
+        params["rm"] = sql_filter["relationship_manager"]
+    if "stock" in sql_filter:
+        clauses.append("stock = :stock")
+        params["stock"] = sql_filter["stock"]
+    if "min_value" in sql_filter:
+        clauses.append("portfolio_value > :min_value")
+        params["min_value"] = sql_filter["min_value"]
+    if names is not None:
+        clauses.append("client_name IN :names")
+        params["names"] = sorted(names)
+    sql = f"SELECT {', '.join(PORTFOLIO_COLUMNS)} FROM portfolios"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    return sql, params
+
+def portfolio_statement(sql, params):
+    statement = text(sql)
+    if "names" in params:
+        statement = statement.bindparams(bindparam("names", expanding=True))
+    return statement
+
+def client_filter(mongo_filter: dict, names=None):
+    if names is None:
+        return mongo_filter
+    key_filter = {"name": {"$in": sorted(names)}}
+    return {"$and": [mongo_filter, key_filter]} if mongo_filter else key_filter
+
+def client_projection():
+    # Whatever the schema catalog knows of clients, and always the join key
+    return {**schema_catalog.mongo_projection("clients"), "name": 1}
+
+def client_row(doc):
+    return {**doc, "name": doc.get("name")}
+
+class HashJoin:
+    """
+    Joins client documents and portfolio rows on the client name. build() takes
+    the smaller side; probe() takes the other side one batch at a time and folds
+    each match straight into the aggregate (or the bounded listing).
+    """
+    def __init__(self, plan: dict, build_store: str, limit: int):
+        self.plan = plan
+        self.build_store = build_store
+        self.limit = limit
+        self.table = {}
+        self.build_rows = 0
+        self.matches = 0
+        self.groups = {}
+        self.listing = []
+        self._order = count()
+
+    def _key(self, row, store):
+        return row["name"] if store == "mongo" else row["client_name"]
+
+    def build(self, rows):
+        for row in rows:
+            self.table.setdefault(self._key(row, self.build_store), []).append(row)
+        self.build_rows += len(rows)
+
+    def keys(self):
+        return self.table.keys()
+
+    def probe(self, rows):
+        probe_store = "sql" if self.build_store == "mongo" else "mongo"
+        for row in rows:
+            for match in self.table.get(self._key(row, probe_store), ()):
+                client, portfolio = (match, row) if self.build_store == "mongo" else (row, match)
+                self._add(client, portfolio)
+
+    def _group_values(self, client, portfolio):
+        if not self.plan["group"]:
+            return [None]
+        store, field = self.plan["group"]
+        value = client.get(field) if store == "mongo" else portfolio.get(field)
+        # A client with several preferences counts towards each of them, like $unwind
+        return value if isinstance(value, list) else [value]
+
+    def _add(self, client, portfolio):
+        self.matches += 1
+        metric = self.plan["metric"]
+        if metric is None:
+            row = [client["name"], client.get("risk"), client.get("city"),
+                   portfolio["portfolio_value"], portfolio.get("stock"), portfolio.get("relationship_manager")]
+            # Keep only the `limit` largest portfolios
+            entry = (portfolio["portfolio_value"] or 0, next(self._order), row)
+            if len(self.listing) < self.limit:
+                heapq.heappush(self.listing, entry)
+            elif entry[0] > self.listing[0][0]:
+                heapq.heapreplace(self.listing, entry)
+            return
+        op, field = metric
+        for group in self._group_values(client, portfolio):
+            state = self.groups.setdefault(group, {"total": 0, "n": 0, "names": set()})
+            if op == "count" and field == "clients":
+                state["names"].add(client["name"])
+            elif op == "count":
+                state["n"] += 1
+            else:
+                value = client.get("age") if field == "age" else portfolio.get("portfolio_value")
+                if value is not None:
+                    state["total"] += value
+                    state["n"] += 1
+
+    def _metric_value(self, state):
+        op, field = self.plan["metric"]
+        if op == "count":
+            return len(state["names"]) if field == "clients" else state["n"]
+        if op == "avg":
+            if not state["n"]:
+                return None
+            average = state["total"] / state["n"]
+            return round(average, 2) if isinstance(average, (float, Decimal)) else average
+        return state["total"]
+
+    def result(self, query: str):
+        if self.plan["metric"] is None:
+            rows = [entry[2] for entry in sorted(self.listing, key=lambda e: (-e[0], e[1]))]
+            columns = LISTING_COLUMNS
+            truncated = self.matches > len(rows)
+        else:
+            metric_name = METRIC_NAMES[tuple(self.plan["metric"])]
+            if self.plan["group"]:
+                field = self.plan["group"][1]
+                group_name = "preference" if field == "preferences" else field
+                columns = [group_name, metric_name]
+                rows = [[group, self._metric_value(state)] for group, state in self.groups.items()]
+                rows.sort(key=lambda r: (r[1] is None, -(r[1] or 0)))
+            else:
+                columns = [metric_name]
+                state = self.groups.get(None)
+                rows = [[self._metric_value(state)]] if state else []
+            truncated = False
+        log.debug(f"Joined {self.build_rows} {self.build_store} build rows, {self.matches} matches")
+        if not rows:
+            return {
+                "text": "No matching clients found with portfolios for your query.",
+                "columns": [],
+                "rows": [],
+                "chart": None,
+            }
+        return {
+            "text": f"Results for: {query}",
+            "columns": columns,
+            "rows": rows,
+            "chart": build_chart(columns, rows),
+            "truncated": truncated,
+        }
+
+class FederatedTool(BaseTool):
+    name: str = "FederatedTool"
+    description: str = (
+        "Use this tool for questions that combine client profiles from MongoDB with portfolios from MySQL. "
+        "For example: total portfolio value of high-risk clients in Mumbai, portfolio value per city."
+    )
+
+    def plan(self, query: str):
+        return match_federated(query)
+
+    def _too_expensive(self, reason, estimated_rows=None, budget=None):
+        log.warning(f"Rejected join: {reason}")
+        return {
+            "text": "Sorry, that question would need to combine too many client profiles and portfolios. Please narrow it down, for example by city, risk level or stock.",
+            "columns": [],
+            "rows": [],
+            "chart": None,
+            "error": {"code": "too_expensive", "reason": reason, "estimated_rows": estimated_rows, "budget": budget},
+        }
+
+    def _db_error(self, e):
+        log.warning(f"Error: {e}")
+        return {
+            "text": "Sorry, there was a problem combining client profiles with portfolios. Please try again later.",
+            "columns": [],
+            "rows": [],
+            "chart": None,
+        }
+
+    def _choose_build(self, client_rows, portfolio_rows):
+        build_store = "mongo" if client_rows <= portfolio_rows else "sql"
+        build_rows = min(client_rows, portfolio_rows)
+        log.debug(f"Estimated clients={client_rows}, portfolios={portfolio_rows}; building on {build_store}")
+        if build_rows > FEDERATED_MAX_BUILD_ROWS:
+            return None, self._too_expensive("Join build side is too large", build_rows, FEDERATED_MAX_BUILD_ROWS)
+        return build_store, None
+
+    def _pushdown(self, join):
+        keys = join.keys()
+        return set(keys) if len(keys) <= FEDERATED_MAX_PUSHDOWN_KEYS else None
+
+    def _prepare(self, query, page_size, plan):
+        """(plan, limit, cache_key, answer): the answer is set when there is nothing to execute."""
+        plan = plan or self.plan(query)
+        if plan is None:
+            return None, None, None, self._db_error("Question does not need both stores")
+        limit = clamp_page_size(page_size)
+        cache_key = result_cache.key("federated", plan, {"limit": limit}, ("clients", "portfolios"))
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return plan, limit, cache_key, {**cached, "text": f"Results for: {query}"} if cached["rows"] else cached
+        return plan, limit, cache_key, None
+
+    def _clients(self, database, mongo_filter, batch_size):
+        return read_collection(database, "clients").find(mongo_filter, client_projection()).batch_size(
+            batch_size
+        ).max_time_ms(execution_time_ms())
+
+    def _build_clients(self, plan, database):
+        """Cursor over the clients that build the join."""
+        index_advisor.record_mongo(plan["mongo_filter"])
+        return self._clients(database, plan["mongo_filter"], MONGO_BATCH_SIZE)
+
+    def _probe_clients_cursor(self, plan, join, database):
+        """Cursor over the clients that probe the join, narrowed to the portfolios' keys."""
+        probe_filter = client_filter(plan["mongo_filter"], self._pushdown(join))
+        index_advisor.record_mongo(probe_filter)
+        return self._clients(database, probe_filter, FEDERATED_BATCH_SIZE)
+
+    def _probe_query(self, plan, join):
+        """(sql, params) for the portfolios that probe the join, narrowed to the clients' keys."""
+        return portfolio_sql(plan["sql_filter"], self._pushdown(join))
+
+    def _build_portfolios(self, join, partition):
+        check_deadline("Federated build")
+        join.build([dict(row) for row in partition])
+        if join.build_rows > FEDERATED_MAX_BUILD_ROWS:
+            raise GuardrailRejection(
+                "too_expensive", "Join build side is too large", join.build_rows, FEDERATED_MAX_BUILD_ROWS
+            )
+
+    def _probe_clients(self, join, docs):
+        check_deadline("Federated probe")
+        join.probe([client_row(doc) for doc in docs])
+
+    def _execution_error(self, e):
+        if isinstance(e, GuardrailRejection):
+            return self._too_expensive(e.reason, e.estimated_rows, e.budget)
+        if isinstance(e, ExecutionTimeout):
+            return self._too_expensive(f"Client lookup exceeded its execution time limit: {e}")
+        return self._db_error(e)
+
+    def _store(self, query, join, cache_key):
+        formatted = join.result(query)
+        result_cache.set(cache_key, formatted)
+        return formatted
+
+    def _run(self, query: str, page_size: int = None, plan: dict = None):
+        plan, limit, cache_key, answer = self._prepare(query, page_size, plan)
+        if answer is not None:
+            return answer
+        try:
+            with ReadSessionLocal(("portfolios",)) as session:
+                # Only picks the build side; the statement that actually runs is admitted below
+                sql, params = portfolio_sql(plan["sql_filter"])
+                estimate = explain(session, sql, params)
+                client_rows = read_collection(db, "clients").count_documents(plan["mongo_filter"], maxTimeMS=execution_time_ms())
+                build_store, rejected = self._choose_build(client_rows, estimate.rows)
+                if rejected is not None:
+                    return rejected
+                join = HashJoin(plan, build_store, limit)
+                if build_store == "mongo":
+                    join.build([client_row(doc) for doc in self._build_clients(plan, db)])
+                    sql, params = self._probe_query(plan, join)
+                admit(session, sql, params)
+                statement = portfolio_statement(with_time_limit(sql, session), params)
+                result = session.execute(statement.execution_options(stream_results=True), params)
+                if build_store == "mongo":
+                    for partition in result.mappings().partitions(FEDERATED_BATCH_SIZE):
+                        check_deadline("Federated probe")
+                        join.probe(partition)
+                else:
+                    for partition in result.mappings().partitions(FEDERATED_BATCH_SIZE):
+                        self._build_portfolios(join, partition)
+                    batch = []
+                    for doc in self._probe_clients_cursor(plan, join, db):
+                        batch.append(doc)
+                        if len(batch) >= FEDERATED_BATCH_SIZE:
+                            self._probe_clients(join, batch)
+                            batch = []
+                    self._probe_clients(join, batch)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return self._execution_error(e)
+        return self._store(query, join, cache_key)
+
+    async def _arun(self, query: str, page_size: int = None, plan: dict = None):
+        plan, limit, cache_key, answer = self._prepare(query, page_size, plan)
+        if answer is not None:
+            return answer
+        try:
+            async with AsyncReadSessionLocal(("portfolios",)) as session:
+                sql, params = portfolio_sql(plan["sql_filter"])
+                estimate = await within_deadline(explain_async(session, sql, params), "SQL estimate")
+                client_rows = await within_deadline(
+                    read_collection(async_db, "clients").count_documents(plan["mongo_filter"], maxTimeMS=execution_time_ms()),
+                    "Mongo count",
+                )
+                build_store, rejected = self._choose_build(client_rows, estimate.rows)
+                if rejected is not None:
+                    return rejected
+                join = HashJoin(plan, build_store, limit)
+                if build_store == "mongo":
+                    docs = await within_deadline(self._build_clients(plan, async_db).to_list(length=None), "Mongo build")
+                    join.build([client_row(doc) for doc in docs])
+                    sql, params = self._probe_query(plan, join)
+                await within_deadline(admit_async(session, sql, params), "SQL admission")
+                statement = portfolio_statement(with_time_limit(sql, session), params)
+                result = await within_deadline(session.stream(statement, params), "SQL execution")
+                if build_store == "mongo":
+                    async for partition in result.mappings().partitions(FEDERATED_BATCH_SIZE):
+                        check_deadline("Federated probe")
+                        join.probe(partition)
+                else:
+                    async for partition in result.mappings().partitions(FEDERATED_BATCH_SIZE):
+                        self._build_portfolios(join, partition)
+                    batch = []
+                    async for doc in self._probe_clients_cursor(plan, join, async_db):
+                        batch.append(doc)
+                        if len(batch) >= FEDERATED_BATCH_SIZE:
+                            self._probe_clients(join, batch)
+                            batch = []
+                    self._probe_clients(join, batch)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return self._execution_error(e)
+        return self._store(query, join, cache_key)
+
+    async def astream(self, query: str, plan: dict = None):
+        """
+        Yield (event, data) pairs like the other tools. The joined result is
+        aggregated (or bounded) before it is sent, so it arrives in one batch.
+        """
+        plan = plan or self.plan(query)
+        yield "query", {"query": plan}
+        result = await self._arun(query, plan=plan)
+        if not result["rows"]:
+            if result.get("error"):
+                yield "error", {"text": result["text"], "error": result["error"]}
+            else:
+                yield "done", {"text": result["text"], "row_count": 0}
+            return
+        yield "columns", result["columns"]
+        yield "rows", result["rows"]
+        yield "chart", result["chart"]
+        yield "done", {"text": result["text"], "row_count": len(result["rows"])}
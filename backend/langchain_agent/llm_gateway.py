@@ -0,0 +1,417 @@
+"""
+Shared LLM gateway.
+
+One OpenAI-compatible client per process with a tuned keep-alive connection
+pool, an in-flight concurrency cap, jittered exponential backoff on 429/5xx
+and connection errors, deadline-aware timeouts (see deadline.py; a streamed
+completion is cut off at the deadline, not just each read) and a circuit
+breaker, checked before every attempt, that fast-fails while the provider is
+degraded. Query generation streams the completion and closes it at the first
+complete query (aextract/extract with an extractor from extract.py).
+
+Every module that talks to the LLM goes through `llm_gateway`.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+
+import httpx
+from dotenv import load_dotenv
+
+from langchain_agent.deadline import cap_timeout, check_deadline, remaining, within_deadline, DeadlineExceeded
+from observability import get_logger, span
+
+log = get_logger("LLMGateway")
+
+load_dotenv()
+
+LLM_MODEL = os.getenv("LLM_MODEL", "deepseek/deepseek-r1-0528:free")
+LLM_API_BASE = os.getenv("LLM_API_BASE", "https://openrouter.ai/api/v1")
+LLM_API_KEY = os.getenv("OPENROUTER_API_KEY")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "16"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+# Stream completions for query generation and stop once a complete query has arrived
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") == "1"
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+class LLMUnavailable(Exception):
+    """Raised without calling the provider while the circuit breaker is open."""
+
+class CircuitBreaker:
+    def __init__(self, threshold=LLM_BREAKER_THRESHOLD, cooldown=LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._probe_at = None
+        self._lock = threading.Lock()
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return "closed"
+        if now - self._opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def allow(self):
+        """
+        Closed lets every call through. Half-open lets one probe through, whose result
+        closes or re-opens the breaker; a probe that never reports back (a non-retryable
+        error, the request deadline) is replaced after another cooldown.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._state(now)
+            if state == "closed":
+                return True
+            if state == "open" or (self._probe_at is not None and now - self._probe_at < self.cooldown):
+                return False
+            self._probe_at = now
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_at = None
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+                self._probe_at = None
+
+def _is_retryable(e):
+    import openai
+
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code in RETRYABLE_STATUS
+    return isinstance(e, (openai.APIConnectionError, openai.APITimeoutError))
+
+def is_timeout(e):
+    """Whether `e` is a provider call that timed out (the request deadline passing is DeadlineExceeded)."""
+    import openai
+
+    return isinstance(e, (openai.APITimeoutError, asyncio.TimeoutError)) and not isinstance(e, DeadlineExceeded)
+
+def _backoff(attempt):
+    # Full jitter: uniform in [0, min(max, base * 2^attempt)]
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+class LLMGateway:
+    def __init__(self, model=LLM_MODEL, api_base=LLM_API_BASE, api_key=LLM_API_KEY,
+                 max_concurrency=LLM_MAX_CONCURRENCY, max_retries=LLM_MAX_RETRIES, timeout=LLM_TIMEOUT):
+        self.model = model
+        self.api_base = api_base
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.breaker = CircuitBreaker()
+        self._async_semaphore = asyncio.Semaphore(max_concurrency)
+        self._sync_semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._async_client = None
+        self._sync_client = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0, "retries": 0, "failures": 0, "rejected": 0,
+            "prompt_tokens": 0, "completion_tokens": 0,
+            "streams": 0, "early_stops": 0,
+        }
+
+    def _limits(self):
+        return httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        )
+
+    @property
+    def async_client(self):
+        # Built on first use so importing this module opens no connections (and skips importing openai)
+        if self._async_client is None:
+            import openai
+
+            self._async_client = openai.AsyncOpenAI(
+                api_key=self.api_key or "not-set",
+                base_url=self.api_base,
+                max_retries=0,  # retries are handled here, with the request deadline in mind
+                http_client=httpx.AsyncClient(limits=self._limits(), timeout=self.timeout),
+            )
+        return self._async_client
+
+    @property
+    def sync_client(self):
+        if self._sync_client is None:
+            import openai
+
+            self._sync_client = openai.OpenAI(
+                api_key=self.api_key or "not-set",
+                base_url=self.api_base,
+                max_retries=0,
+                http_client=httpx.Client(limits=self._limits(), timeout=self.timeout),
+            )
+        return self._sync_client
+
+    def warm(self):
+        """Build the async client ahead of the first request; called from the app lifespan."""
+        return self.async_client
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._stats[name] += value
+
+    def _record_usage(self, response):
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self._count("prompt_tokens", usage.prompt_tokens or 0)
+            self._count("completion_tokens", usage.completion_tokens or 0)
+
+    def _record_stream(self, prompt, deltas, stopped, usage_seen):
+        self._count("streams")
+        if stopped:
+            self._count("early_stops")
+        if not usage_seen:
+            # A stream closed early never gets its usage chunk; estimate (~4 chars per prompt
+            # token, about one token per content delta)
+            self._count("prompt_tokens", len(prompt) // 4)
+            self._count("completion_tokens", deltas)
+
+    @staticmethod
+    def _delta(chunk):
+        return chunk.choices[0].delta.content if chunk.choices else None
+
+    def _stream_request(self, prompt, **kwargs):
+        return self._request(prompt, stream=True, stream_options={"include_usage": True}, **kwargs)
+
+    def _request(self, prompt, **kwargs):
+        return dict(model=self.model, messages=[{"role": "user", "content": prompt}], **kwargs)
+
+    def _admit(self):
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise LLMUnavailable("LLM provider circuit breaker is open")
+
+    def _retry_delay(self, e, attempt, capped=False):
+        """
+        Delay before the next attempt, or None when the error should be raised. `capped`
+        says the call's timeout was cut short by the request deadline.
+        """
+        if not _is_retryable(e):
+            self._count("failures")
+            return None
+        # Only provider-side trouble (429/5xx/connection/timeouts) counts towards opening the breaker;
+        # a timeout the request deadline shortened says nothing about the provider
+        if not (capped and is_timeout(e)):
+            self.breaker.failure()
+        if attempt >= self.max_retries:
+            self._count("failures")
+            return None
+        delay = _backoff(attempt)
+        left = remaining()
+        if left is not None and delay >= left:
+            self._count("failures")
+            return None
+        self._count("retries")
+        log.warning(f"{type(e).__name__}, retrying in {delay:.2f}s (attempt {attempt + 1})")
+        return delay
+
+    async def apredict(self, prompt: str, timeout: float = None, **kwargs) -> str:
+        with span("llm"):
+            return await self._apredict(prompt, timeout, **kwargs)
+
+    def predict(self, prompt: str, timeout: float = None, **kwargs) -> str:
+        with span("llm"):
+            return self._predict(prompt, timeout, **kwargs)
+
+    async def _apredict(self, prompt: str, timeout: float = None, **kwargs) -> str:
+        self._admit()
+        self._count("requests")
+        attempt = 0
+        while True:
+            call_timeout = cap_timeout(timeout or self.timeout)
+            try:
+                async with self._async_semaphore:
+                    # Time spent queued on the semaphore counts against the deadline too
+                    call_timeout = cap_timeout(call_timeout)
+                    response = await self.async_client.chat.completions.create(
+                        **self._request(prompt, **kwargs), timeout=call_timeout
+                    )
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, call_timeout < (timeout or self.timeout))
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                # Failures meanwhile (this call's or others') may have opened the breaker
+                self._admit()
+                continue
+            self.breaker.success()
+            self._record_usage(response)
+            return response.choices[0].message.content or ""
+
+    async def aextract(self, prompt: str, extractor, timeout: float = None, **kwargs):
+        """
+        Stream the completion into `extractor` (see extract.py) and close the stream as
+        soon as it holds a complete query. Returns (query or None, text received).
+        """
+        with span("llm"):
+            if not LLM_STREAMING:
+                text = await self._apredict(prompt, timeout, **kwargs)
+                return extractor.feed(text), text
+            return await self._aextract(prompt, extractor, timeout, **kwargs)
+
+    def extract(self, prompt: str, extractor, timeout: float = None, **kwargs):
+        with span("llm"):
+            if not LLM_STREAMING:
+                text = self._predict(prompt, timeout, **kwargs)
+                return extractor.feed(text), text
+            return self._extract(prompt, extractor, timeout, **kwargs)
+
+    async def _aextract(self, prompt: str, extractor, timeout: float = None, **kwargs):
+        self._admit()
+        self._count("requests")
+        attempt = 0
+        while True:
+            call_timeout = cap_timeout(timeout or self.timeout)
+            deltas = 0
+            usage_seen = stopped = False
+            try:
+                async with self._async_semaphore:
+                    call_timeout = cap_timeout(call_timeout)
+                    stream = await self.async_client.chat.completions.create(
+                        **self._stream_request(prompt, **kwargs), timeout=call_timeout
+                    )
+
+                    async def consume():
+                        nonlocal deltas, usage_seen, stopped
+                        async for chunk in stream:
+                            if getattr(chunk, "usage", None) is not None:
+                                usage_seen = True
+                                self._record_usage(chunk)
+                            delta = self._delta(chunk)
+                            if delta:
+                                deltas += 1
+                                if extractor.feed(delta) is not None:
+                                    stopped = True
+                                    return
+
+                    try:
+                        # The client's timeout bounds each read, not the whole stream, so a provider
+                        # trickling tokens would otherwise outlive the request deadline
+                        await within_deadline(consume(), "LLM stream")
+                    finally:
+                        # Closing the connection is what stops generation (and billing) upstream
+                        await stream.close()
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                # Output already received cannot be replayed, so only a stream that never started is retried
+                delay = self._retry_delay(e, attempt, call_timeout < (timeout or self.timeout)) if deltas == 0 else None
+                if delay is None:
+                    if deltas:
+                        self._count("failures")
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                self._admit()
+                continue
+            self.breaker.success()
+            self._record_stream(prompt, deltas, stopped, usage_seen)
+            return extractor.result, extractor.text
+
+    def _extract(self, prompt: str, extractor, timeout: float = None, **kwargs):
+        self._admit()
+        self._count("requests")
+        attempt = 0
+        while True:
+            deltas = 0
+            usage_seen = stopped = False
+            try:
+                with self._sync_semaphore:
+                    call_timeout = cap_timeout(timeout or self.timeout)
+                    stream = self.sync_client.chat.completions.create(
+                        **self._stream_request(prompt, **kwargs), timeout=call_timeout
+                    )
+                    try:
+                        for chunk in stream:
+                            # Reads are bounded by the timeout, the whole stream by the deadline
+                            check_deadline("LLM stream")
+                            if getattr(chunk, "usage", None) is not None:
+                                usage_seen = True
+                                self._record_usage(chunk)
+                            delta = self._delta(chunk)
+                            if delta:
+                                deltas += 1
+                                if extractor.feed(delta) is not None:
+                                    stopped = True
+                                    break
+                    finally:
+                        stream.close()
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, call_timeout < (timeout or self.timeout)) if deltas == 0 else None
+                if delay is None:
+                    if deltas:
+                        self._count("failures")
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                self._admit()
+                continue
+            self.breaker.success()
+            self._record_stream(prompt, deltas, stopped, usage_seen)
+            return extractor.result, extractor.text
+
+    def _predict(self, prompt: str, timeout: float = None, **kwargs) -> str:
+        self._admit()
+        self._count("requests")
+        attempt = 0
+        while True:
+            try:
+                with self._sync_semaphore:
+                    call_timeout = cap_timeout(timeout or self.timeout)
+                    response = self.sync_client.chat.completions.create(
+                        **self._request(prompt, **kwargs), timeout=call_timeout
+                    )
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, call_timeout < (timeout or self.timeout))
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                self._admit()
+                continue
+            self.breaker.success()
+            self._record_usage(response)
+            return response.choices[0].message.content or ""
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["breaker"] = self.breaker.state
+        stats["model"] = self.model
+        return stats
+
+llm_gateway = LLMGateway()
@@ -0,0 +1,171 @@
+"""
+Validation and shaping of MongoDB aggregation pipelines for MongoTool.
+
+Only a small, read-only subset of the aggregation language is accepted:
+$match/$group/$sort/$limit/$project/$count/$unwind stages, comparison and
+logical query operators, a few arithmetic expressions and the numeric
+accumulators. Every field reference is checked against the fields that are
+available at that point in the pipeline, so the aggregation runs inside
+MongoDB and only the small aggregated result is sent back.
+"""
+from os import getenv
+
+ALLOWED_STAGES = {"$match", "$group", "$sort", "$limit", "$project", "$count", "$unwind"}
+QUERY_OPERATORS = {
+    "$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin",
+    "$and", "$or", "$nor", "$not", "$exists", "$all", "$size", "$elemMatch",
+}
+ACCUMULATORS = {"$sum", "$avg", "$min", "$max", "$first", "$last"}
+EXPRESSION_OPERATORS = {"$add", "$subtract", "$multiply", "$divide", "$round", "$size", "$toUpper", "$toLower"}
+
+MAX_STAGES = int(getenv("MONGO_PIPELINE_MAX_STAGES", "8"))
+# Aggregated results are capped; a $limit is appended when the pipeline has none
+MONGO_AGGREGATE_MAX_ROWS = int(getenv("MONGO_AGGREGATE_MAX_ROWS", "1000"))
+
+class PipelineError(ValueError):
+    pass
+
+def _check_reference(value, fields):
+    if isinstance(value, str) and value.startswith("$") and not value.startswith("$$"):
+        root = value[1:].split(".", 1)[0]
+        if root not in fields:
+            raise PipelineError(f"Unknown field reference {value}")
+
+def _check_expression(expr, fields):
+    if isinstance(expr, dict):
+        for key, value in expr.items():
+            if key.startswith("$"):
+                if key not in EXPRESSION_OPERATORS:
+                    raise PipelineError(f"Expression operator {key} is not allowed")
+            _check_expression(value, fields)
+    elif isinstance(expr, list):
+        for item in expr:
+            _check_expression(item, fields)
+    else:
+        _check_reference(expr, fields)
+
+def _check_query(query, fields):
+    if not isinstance(query, dict):
+        raise PipelineError("$match must be an object")
+    for key, value in query.items():
+        if key.startswith("$"):
+            if key not in QUERY_OPERATORS:
+                raise PipelineError(f"Query operator {key} is not allowed")
+            if isinstance(value, list):
+                for clause in value:
+                    if isinstance(clause, dict):
+                        _check_query(clause, fields)
+            elif isinstance(value, dict):
+                _check_query(value, fields)
+        else:
+            if key.split(".", 1)[0] not in fields:
+                raise PipelineError(f"Unknown field {key}")
+            if isinstance(value, dict):
+                _check_operators(value)
+
+def _check_operators(condition):
+    for key, value in condition.items():
+        if key.startswith("$") and key not in QUERY_OPERATORS:
+            raise PipelineError(f"Query operator {key} is not allowed")
+        if isinstance(value, dict):
+            _check_operators(value)
+
+def validate_pipeline(pipeline, fields, max_rows=MONGO_AGGREGATE_MAX_ROWS):
+    """
+    Validate `pipeline` and return a copy that is guaranteed to end with a bounded $limit.
+    Raises PipelineError for anything outside the allowlist.
+    """
+    if not isinstance(pipeline, list) or not pipeline:
+        raise PipelineError("Pipeline must be a non-empty list of stages")
+    if len(pipeline) > MAX_STAGES:
+        raise PipelineError(f"Pipeline has more than {MAX_STAGES} stages")
+    available = set(fields)
+    validated = []
+    has_limit = False
+    for stage in pipeline:
+        if not isinstance(stage, dict) or len(stage) != 1:
+            raise PipelineError("Each stage must be an object with exactly one operator")
+        (name, spec), = stage.items()
+        if name not in ALLOWED_STAGES:
+            raise PipelineError(f"Stage {name} is not allowed")
+        if name == "$match":
+            _check_query(spec, available)
+        elif name == "$group":
+            if not isinstance(spec, dict) or "_id" not in spec:
+                raise PipelineError("$group needs an _id")
+            _check_expression(spec["_id"], available)
+            for out, acc in spec.items():
+                if out == "_id":
+                    continue
+                if not isinstance(acc, dict) or len(acc) != 1 or next(iter(acc)) not in ACCUMULATORS:
+                    raise PipelineError(f"Accumulator for {out} is not allowed")
+                _check_expression(next(iter(acc.values())), available)
+            available = set(spec.keys())
+        elif name == "$sort":
+            if not isinstance(spec, dict) or any(v not in (1, -1) for v in spec.values()):
+                raise PipelineError("$sort directions must be 1 or -1")
+            for key in spec:
+                if key.split(".", 1)[0] not in available:
+                    raise PipelineError(f"Cannot sort on unknown field {key}")
+        elif name == "$limit":
+            if not isinstance(spec, int) or spec < 1:
+                raise PipelineError("$limit must be a positive integer")
+            spec = min(spec, max_rows)
+            has_limit = True
+        elif name == "$project":
+            if not isinstance(spec, dict):
+                raise PipelineError("$project must be an object")
+            projected = set()
+            for out, value in spec.items():
+                if value in (0, 1, True, False):
+                    if out.split(".", 1)[0] not in available:
+                        raise PipelineError(f"Cannot project unknown field {out}")
+                else:
+                    _check_expression(value, available)
+                if value not in (0, False):
+                    projected.add(out)
+            if projected:
+                available = projected | ({"_id"} if "_id" in available and spec.get("_id", 1) else set())
+        elif name == "$count":
+            if not isinstance(spec, str) or spec.startswith("$"):
+                raise PipelineError("$count needs an output field name")
+            available = {spec}
+        elif name == "$unwind":
+            path = spec.get("path") if isinstance(spec, dict) else spec
+            if not isinstance(path, str) or not path.startswith("$"):
+                raise PipelineError("$unwind needs a field path")
+            _check_reference(path, available)
+            spec = path
+        validated.append({name: spec})
+    if not has_limit:
+        validated.append({"$limit": max_rows})
+    return validated
+
+def group_field(pipeline):
+    """Field the (last) $group stage groups by, used to name the _id column."""
+    for stage in reversed(pipeline):
+        spec = stage.get("$group")
+        if spec is not None:
+            key = spec["_id"]
+            if isinstance(key, str) and key.startswith("$"):
+                return key[1:]
+            return None
+    return None
+
+def flatten_results(pipeline, docs):
+    """
+    Turn aggregation output into flat documents: a grouped _id becomes a column
+    named after the grouped field, compound _ids are spread into their parts.
+    """
+    field = group_field(pipeline)
+    flat = []
+    for doc in docs:
+        doc = dict(doc)
+        if "_id" in doc:
+            key = doc.pop("_id")
+            if isinstance(key, dict):
+                doc = {**key, **doc}
+            elif key is not None:
+                doc = {(field or "group"): key, **doc}
+        flat.append(doc)
+    return flat
@@ -1,56 +1,80 @@
 from langchain.tools import BaseTool
-from db.mongo import db
+from db.mongo import db, async_db, read_collection, MONGO_BATCH_SIZE
+from langchain_agent.templates import match_mongo_template, match_mongo_pipeline
+from langchain_agent.mongo_pipeline import (
+    validate_pipeline, flatten_results, PipelineError, MONGO_AGGREGATE_MAX_ROWS
+)
+from cache.translation import translation_cache
+from cache.results import result_cache
 from langchain.prompts import PromptTemplate
-from langchain_community.chat_models import ChatOpenAI
-import os
+from langchain_agent.llm_gateway import llm_gateway
+from langchain_agent.extract import JSONExtractor
+from langchain_agent.deadline import DeadlineExceeded, within_deadline, check_deadline
 import json
-from decimal import Decimal
+import hashlib
+from charts import ChartAccumulator, build_chart
+from db.pagination import with_cursor, clamp_page_size, mongo_page_filter
+from db.guardrails import execution_time_ms
+from db.index_advisor import index_advisor
+from db.schema_catalog import schema_catalog
+from pymongo.errors import ExecutionTimeout
+import os
+from observability import get_logger, span
+
+log = get_logger("MongoTool")
 
-MONGO_SCHEMA = '''
-Collection: clients
-Fields:
-- name: string (client names like "Alice", "Bob", "Charlie")
-- risk: string (risk levels: "High", "Medium", "Low")
-- age: integer (client ages like 45, 52, 38)
-- city: string (cities like "Mumbai", "Delhi", "Bangalore", "Pune", "Chennai")
-- preferences: array of strings (investment preferences like ["tech", "banking"], ["energy", "auto"])
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
 
+MONGO_COLLECTION = "clients"
+
+# Field descriptions come from the schema catalog; the examples stay hand-written
+MONGO_EXAMPLES = '''
 Example queries:
 - High risk clients: {{"risk": "High"}}
 - Clients in Mumbai: {{"city": "Mumbai"}}
 - Clients over 40: {{"age": {{"$gt": 40}}}}
 - Tech preference clients: {{"preferences": "tech"}}
 - High risk tech clients: {{"risk": "High", "preferences": "tech"}}
+- Number of clients per city: [{{"$group": {{"_id": "$city", "clients": {{"$sum": 1}}}}}}, {{"$sort": {{"clients": -1}}}}]
+- Average age of high risk clients: [{{"$match": {{"risk": "High"}}}}, {{"$group": {{"_id": null, "average_age": {{"$avg": "$age"}}}}}}]
 '''
 
 MONGO_PROMPT = PromptTemplate(
-    input_variables=["question", "schema"],
+    input_variables=["question", "schema", "fields", "examples"],
     template="""
 You are a MongoDB expert. Generate a valid MongoDB filter JSON object based on the user's question.
+If the question asks for counts, averages, totals or a breakdown per field, generate an aggregation pipeline (a JSON array of stages) instead.
 
 IMPORTANT RULES:
-- Output ONLY a valid MongoDB filter JSON object, nothing else
+- Output ONLY a valid MongoDB filter JSON object or aggregation pipeline JSON array, nothing else
 - No explanations, no commentary, no markdown formatting
-- Use only the fields: name, risk, age, city, preferences
+- Use only the fields: {fields}
 - For age comparisons, use MongoDB operators like {{"$gt": 40}} for "over 40"
 - For array fields like preferences, use {{"preferences": "tech"}} to find clients with "tech" preference
 - For exact matches, use {{"field": "value"}}
 - For multiple conditions, use {{"field1": "value1", "field2": "value2"}}
+- Pipelines may only use the stages $match, $group, $sort, $limit, $project, $count and $unwind
+- Use $unwind on "$preferences" before grouping by preference
 
 Schema:
 {schema}
-
+{examples}
 Question: {question}
 
-MongoDB Filter:
+MongoDB Filter or Pipeline:
 """
 )
 
-llm = ChatOpenAI(
-    model_name="deepseek/deepseek-r1-0528:free",
-    openai_api_key=os.getenv("OPENROUTER_API_KEY"),
-    openai_api_base="https://openrouter.ai/api/v1",
-)
+TEMPLATE_VERSION = hashlib.sha1((MONGO_EXAMPLES + MONGO_PROMPT.template).encode("utf-8")).hexdigest()[:8]
+
+def schema_version() -> str:
+    return f"{schema_catalog.version}.{TEMPLATE_VERSION}"
+
+def build_mongo_prompt(question: str) -> str:
+    # Only the fields relevant to the question, from the live schema catalog
+    schema = schema_catalog.mongo_prompt(MONGO_COLLECTION, question)
+    fields = ", ".join(schema_catalog.catalog["mongo"].get(MONGO_COLLECTION, {}).get("fields", {}))
+    return MONGO_PROMPT.format(question=question, schema=schema, fields=fields, examples=MONGO_EXAMPLES)
 
 class MongoTool(BaseTool):
     name: str = "MongoTool"
@@ -59,100 +83,80 @@ class MongoTool(BaseTool):
         "For example: risk level, investment preferences, client demographics, etc."
     )
 
-    def _run(self, query: str):
-        prompt = MONGO_PROMPT.format(question=query, schema=MONGO_SCHEMA)
-        print("[MongoTool] Prompt to LLM:\n", prompt)
+    def _message(self, text):
+        return {
+            "text": text,
+            "columns": [],
+            "rows": [],
+            "chart": None
+        }
+
+    def _parse_filter(self, filter_str):
+        """
+        Parse and validate the LLM output. Returns (mongo_filter, None) on success or
+        (None, fallback_result) when the output is unusable.
+        """
+        log.debug("LLM output:\n%s", filter_str)
         try:
-            filter_str = llm.predict(prompt).strip()
-            print("[MongoTool] LLM output:\n", filter_str)
             # Remove code block markers if present
             if filter_str.startswith("```json"):
                 filter_str = filter_str[7:]
             if filter_str.startswith("```"):
                 filter_str = filter_str[3:]
             filter_str = filter_str.strip('`\n ')
-            
-            # Fix common MongoDB operator issues
-            # Replace quoted operators with unquoted ones
-            filter_str = filter_str.replace('"$gt"', '$gt')
-            filter_str = filter_str.replace('"$lt"', '$lt')
-            filter_str = filter_str.replace('"$gte"', '$gte')
-            filter_str = filter_str.replace('"$lte"', '$lte')
-            filter_str = filter_str.replace('"$in"', '$in')
-            filter_str = filter_str.replace('"$nin"', '$nin')
-            
-            print("[MongoTool] Cleaned filter string:\n", filter_str)
+            if filter_str.startswith("["):
+                return self._parse_pipeline(filter_str)
+            # JSONExtractor hands over a value that already parses, quoted operators and all
             mongo_filter = json.loads(filter_str)
         except Exception as e:
-            print(f"[MongoTool] JSON parsing error: {e}")
-            print("[MongoTool] LLM output could not be parsed as JSON, falling back to user-friendly message.")
-            return {
-                "text": "Sorry, I couldn't understand your question or it doesn't match client profile fields. Please ask about client name, risk, age, city, or preferences.",
-                "columns": [],
-                "rows": [],
-                "chart": None
-            }
+            log.warning(f"JSON parsing error: {e}")
+            log.debug("LLM output could not be parsed as JSON, falling back to user-friendly message.")
+            return None, self._message(
+                "Sorry, I couldn't understand your question or it doesn't match client profile fields. Please ask about client name, risk, age, city, or preferences."
+            )
         # Validate filter fields
-        allowed_fields = {"name", "risk", "age", "city", "preferences"}
+        allowed_fields = schema_catalog.mongo_fields(MONGO_COLLECTION)
         if not isinstance(mongo_filter, dict) or any(k not in allowed_fields for k in mongo_filter.keys()):
-            print(f"[MongoTool] Invalid filter fields: {mongo_filter}. Fallback to user-friendly message.")
-            return {
-                "text": "Sorry, your question doesn't match available client profile fields. Please ask about name, risk, age, city, or preferences.",
-                "columns": [],
-                "rows": [],
-                "chart": None
-            }
-        projection = {"_id": 0, "name": 1, "risk": 1, "age": 1, "city": 1, "preferences": 1}
+            log.warning(f"Invalid filter fields: {mongo_filter}. Fallback to user-friendly message.")
+            return None, self._message(
+                "Sorry, your question doesn't match available client profile fields. Please ask about name, risk, age, city, or preferences."
+            )
+        return mongo_filter, None
+
+    def _parse_pipeline(self, pipeline_str):
         try:
-            results = list(db["clients"].find(mongo_filter, projection))
-        except Exception as e:
-            print(f"[MongoTool] MongoDB error: {e}. Fallback to user-friendly message.")
-            return {
-                "text": "Sorry, there was a problem accessing client data. Please try again later.",
-                "columns": [],
-                "rows": [],
-                "chart": None
-            }
+            pipeline = validate_pipeline(json.loads(pipeline_str), schema_catalog.mongo_fields(MONGO_COLLECTION))
+        except ValueError as e:
+            return None, self._invalid_pipeline(e)
+        return pipeline, None
+
+    def _invalid_pipeline(self, e):
+        log.warning(f"Invalid aggregation pipeline: {e}. Fallback to user-friendly message.")
+        return self._message(
+            "Sorry, I couldn't turn your question into a summary of client profiles. Please ask about name, risk, age, city, or preferences."
+        )
+
+    def _too_expensive(self, e):
+        log.warning(f"Query exceeded maxTimeMS: {e}")
+        result = self._message("Sorry, that question would take too long to answer over all client profiles. Please narrow it down, for example by city or risk level.")
+        result["error"] = {"code": "too_expensive", "reason": "Query exceeded its execution time limit", "estimated_rows": None, "budget": None}
+        return result
+
+    def _db_error(self, e):
+        log.warning(f"MongoDB error: {e}. Fallback to user-friendly message.")
+        return self._message("Sorry, there was a problem accessing client data. Please try again later.")
+
+    def _format_result(self, query, results):
         if not results:
-            print("[MongoTool] No results for filter, fallback to user-friendly message.")
-            return {
-                "text": "No matching clients found for your query.",
-                "columns": [],
-                "rows": [],
-                "chart": None
-            }
+            log.info("No results for filter, fallback to user-friendly message.")
+            return self._message("No matching clients found for your query.")
         # Format as table
         columns = list(results[0].keys())
         rows = [list(doc.values()) for doc in results]
-        print(f"[MongoTool] Query columns: {columns}")
-        print(f"[MongoTool] Query rows: {rows}")
-        # Try to extract chart (string + numeric columns)
-        chart = None
-        str_idx = None
-        num_idx = None
-        print(f"[MongoTool] Chart debugging - columns: {columns}")
-        print(f"[MongoTool] Chart debugging - first row: {rows[0]}")
-        print(f"[MongoTool] Chart debugging - column types: {[type(row[i]) for i, row in enumerate([rows[0]])]}")
-        for i, col in enumerate(columns):
-            print(f"[MongoTool] Column {i} ({col}): type={type(rows[0][i])}, value={rows[0][i]}")
-            if isinstance(rows[0][i], str) and str_idx is None:
-                str_idx = i
-                print(f"[MongoTool] Found string column at index {i}: {col}")
-            if isinstance(rows[0][i], (int, float, Decimal)) and num_idx is None:
-                num_idx = i
-                print(f"[MongoTool] Found numeric column at index {i}: {col}")
-        print(f"[MongoTool] Chart indices - str_idx: {str_idx}, num_idx: {num_idx}")
-        if str_idx is not None and num_idx is not None:
-            labels = [str(row[str_idx]) for row in rows]
-            data = [float(row[num_idx]) for row in rows]  # Convert to float for chart
-            chart = {
-                "labels": labels,
-                "data": data,
-                "label": columns[num_idx]
-            }
-            print(f"[MongoTool] Chart created: {chart}")
-        else:
-            print(f"[MongoTool] No chart created - missing string or numeric column")
+        log.debug(f"Query columns: {columns}")
+        log.debug(f"Query returned {len(rows)} rows")
+        chart = build_chart(columns, rows)
+        log.debug(f"Chart points: {len(chart['labels']) if chart else 0}")
         return {
             "columns": columns,
             "rows": rows,
@@ -160,5 +164,318 @@ class MongoTool(BaseTool):
             "text": f"Results for: {query}"
         }
 
-    def _arun(self, query: str):
-        raise NotImplementedError("MongoTool does not support async yet.")
+    def _template(self, query: str):
+        mongo_filter = match_mongo_template(query)
+        if mongo_filter is not None:
+            return mongo_filter
+        return match_mongo_pipeline(query)
+
+    def _lookup(self, query: str):
+        found = self._template(query)
+        if found is not None:
+            return found
+        return translation_cache.get("mongo", query, schema_version())
+
+    async def _alookup(self, query: str):
+        found = self._template(query)
+        if found is not None:
+            return found
+        return await translation_cache.aget("mongo", query, schema_version())
+
+    def _translate(self, query: str):
+        """
+        Returns (mongo_filter, None) or (None, fallback_result). Aggregate questions
+        translate to a pipeline (a list of stages) instead of a filter dict.
+        """
+        mongo_filter = self._lookup(query)
+        if mongo_filter is not None:
+            return mongo_filter, None
+        with span("prompt_build"):
+            prompt = build_mongo_prompt(query)
+        log.debug("Prompt to LLM:\n%s", prompt)
+        try:
+            found, filter_str = llm_gateway.extract(prompt, JSONExtractor())
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return None, self._llm_error(e)
+        return self._accept(query, (found or filter_str).strip())
+
+    async def _atranslate(self, query: str):
+        await schema_catalog.ensure()
+        mongo_filter = await self._alookup(query)
+        if mongo_filter is not None:
+            return mongo_filter, None
+        with span("prompt_build"):
+            prompt = build_mongo_prompt(query)
+        log.debug("Prompt to LLM:\n%s", prompt)
+        try:
+            # Stops generating as soon as a complete filter or pipeline has streamed in
+            found, filter_str = await llm_gateway.aextract(prompt, JSONExtractor())
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return None, self._llm_error(e)
+        return self._accept(query, (found or filter_str).strip())
+
+    def _llm_error(self, e):
+        log.warning(f"LLM error: {e}")
+        return self._message("Sorry, I couldn't understand your question or it doesn't match client profile fields. Please ask about client name, risk, age, city, or preferences.")
+
+    def _accept(self, query, filter_str):
+        with span("parse"):
+            mongo_filter, fallback = self._parse_filter(filter_str)
+        if fallback is None:
+            translation_cache.set("mongo", query, schema_version(), mongo_filter)
+        return mongo_filter, fallback
+
+    def _cached(self, query, cached):
+        if cached["rows"]:
+            return with_cursor({**cached, "text": f"Results for: {query}"}, query)
+        return cached
+
+    def _page_result(self, query, mongo_filter, page_size, returned, docs):
+        # One look-ahead document tells us whether another page exists
+        after = [docs[page_size - 1]["_id"]] if len(docs) > page_size else None
+        results = []
+        for doc in docs[:page_size]:
+            doc = dict(doc)
+            doc.pop("_id", None)
+            results.append(doc)
+        formatted = self._format_result(query, results)
+        formatted["cursor_state"] = {
+            "store": "mongo",
+            "filter": mongo_filter,
+            "page_size": page_size,
+            "after": after,
+            "returned": returned + len(results),
+        } if after is not None else None
+        return formatted
+
+    def _execution_error(self, e):
+        if isinstance(e, ExecutionTimeout):
+            return self._too_expensive(e)
+        return self._db_error(e)
+
+    def _page_lookup(self, query, mongo_filter, page_size, after):
+        """(page_filter, cache_key, cached answer or None) for one page."""
+        page_filter = mongo_page_filter(mongo_filter, after)
+        cache_key = result_cache.key("mongo", page_filter, {"limit": page_size}, ("clients",))
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return page_filter, cache_key, self._cached(query, cached)
+        index_advisor.record_mongo(page_filter, [("_id", 1)], page_size + 1)
+        return page_filter, cache_key, None
+
+    def _page_cursor(self, database, page_filter, page_size):
+        # Pages are keyed on _id, so it is fetched and stripped before formatting
+        projection = schema_catalog.mongo_projection(MONGO_COLLECTION, with_id=True)
+        return (
+            read_collection(database, "clients").find(page_filter, projection)
+            .sort("_id", 1).limit(page_size + 1).batch_size(page_size + 1).max_time_ms(execution_time_ms())
+        )
+
+    def _store_page(self, query, mongo_filter, page_size, returned, docs, cache_key):
+        formatted = self._page_result(query, mongo_filter, page_size, returned, docs)
+        result_cache.set(cache_key, formatted)
+        return with_cursor(formatted, query)
+
+    def _fetch_page(self, query, mongo_filter, page_size, after=None, returned=0):
+        page_filter, cache_key, cached = self._page_lookup(query, mongo_filter, page_size, after)
+        if cached is not None:
+            return cached
+        try:
+            with span("db_execute"):
+                docs = list(self._page_cursor(db, page_filter, page_size))
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return self._execution_error(e)
+        return self._store_page(query, mongo_filter, page_size, returned, docs, cache_key)
+
+    async def _afetch_page(self, query, mongo_filter, page_size, after=None, returned=0):
+        page_filter, cache_key, cached = self._page_lookup(query, mongo_filter, page_size, after)
+        if cached is not None:
+            return cached
+        try:
+            cursor = self._page_cursor(async_db, page_filter, page_size)
+            with span("db_execute"):
+                docs = await within_deadline(cursor.to_list(length=None), "Mongo query")
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return self._execution_error(e)
+        return self._store_page(query, mongo_filter, page_size, returned, docs, cache_key)
+
+    def _aggregate_result(self, query, pipeline, docs):
+        formatted = self._format_result(query, flatten_results(pipeline, docs))
+        # The validator always ends the pipeline with a capped $limit
+        formatted["truncated"] = len(docs) >= MONGO_AGGREGATE_MAX_ROWS
+        return formatted
+
+    def _aggregate_lookup(self, query, pipeline):
+        """(pipeline, cache_key, answer): the answer is set when the pipeline is invalid or cached."""
+        try:
+            pipeline = validate_pipeline(pipeline, schema_catalog.mongo_fields(MONGO_COLLECTION))
+        except PipelineError as e:
+            return None, None, self._invalid_pipeline(e)
+        cache_key = result_cache.key("mongo_pipeline", pipeline, {}, ("clients",))
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return pipeline, cache_key, self._cached(query, cached)
+        index_advisor.record_pipeline(pipeline)
+        return pipeline, cache_key, None
+
+    def _aggregate_cursor(self, database, pipeline):
+        return read_collection(database, "clients").aggregate(
+            pipeline, maxTimeMS=execution_time_ms(), batchSize=MONGO_BATCH_SIZE
+        )
+
+    def _store_aggregate(self, query, pipeline, docs, cache_key):
+        formatted = self._aggregate_result(query, pipeline, docs)
+        result_cache.set(cache_key, formatted)
+        return formatted
+
+    def _aggregate(self, query, pipeline):
+        pipeline, cache_key, answer = self._aggregate_lookup(query, pipeline)
+        if answer is not None:
+            return answer
+        try:
+            with span("db_execute"):
+                docs = list(self._aggregate_cursor(db, pipeline))
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return self._execution_error(e)
+        return self._store_aggregate(query, pipeline, docs, cache_key)
+
+    async def _aaggregate(self, query, pipeline):
+        pipeline, cache_key, answer = self._aggregate_lookup(query, pipeline)
+        if answer is not None:
+            return answer
+        try:
+            cursor = self._aggregate_cursor(async_db, pipeline)
+            with span("db_execute"):
+                docs = await within_deadline(cursor.to_list(length=None), "Mongo aggregation")
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return self._execution_error(e)
+        return self._store_aggregate(query, pipeline, docs, cache_key)
+
+    def _run(self, query: str, page_size: int = None):
+        mongo_filter, fallback = self._translate(query)
+        if fallback is not None:
+            return fallback
+        return self.execute(query, mongo_filter, page_size)
+
+    async def _arun(self, query: str, page_size: int = None):
+        mongo_filter, fallback = await self._atranslate(query)
+        if fallback is not None:
+            return fallback
+        return await self.aexecute(query, mongo_filter, page_size)
+
+    def execute(self, query: str, mongo_filter, page_size: int = None):
+        """Run an already translated filter (dict) or aggregation pipeline (list)."""
+        if isinstance(mongo_filter, list):
+            return self._aggregate(query, mongo_filter)
+        return self._fetch_page(query, mongo_filter, clamp_page_size(page_size))
+
+    async def aexecute(self, query: str, mongo_filter, page_size: int = None):
+        """Run an already translated filter (dict) or aggregation pipeline (list)."""
+        if isinstance(mongo_filter, list):
+            return await self._aaggregate(query, mongo_filter)
+        return await self._afetch_page(query, mongo_filter, clamp_page_size(page_size))
+
+    async def anext_page(self, state: dict):
+        """Serve a follow-up page from a decoded cursor without touching the LLM."""
+        return await self._afetch_page(
+            state["question"], state["filter"], state["page_size"], state["after"], state["returned"]
+        )
+
+    async def astream(self, query: str, batch_size: int = STREAM_BATCH_SIZE):
+        """
+        Yield (event, data) pairs like SQLTool.astream, reading the cursor one batch at a time.
+        """
+        mongo_filter, fallback = await self._atranslate(query)
+        if fallback is not None:
+            yield "error", {"text": fallback["text"]}
+            return
+        yield "query", {"query": mongo_filter}
+        if isinstance(mongo_filter, list):
+            # Aggregated results are small, so they arrive as a single batch
+            result = await self._aaggregate(query, mongo_filter)
+            if not result["rows"]:
+                if result.get("error"):
+                    yield "error", {"text": result["text"], "error": result["error"]}
+                else:
+                    yield "done", {"text": result["text"], "row_count": 0}
+                return
+            yield "columns", result["columns"]
+            yield "rows", result["rows"]
+            yield "chart", result["chart"]
+            yield "done", {"text": result["text"], "row_count": len(result["rows"])}
+            return
+        projection = schema_catalog.mongo_projection(MONGO_COLLECTION)
+        cache_key = result_cache.key("mongo", mongo_filter, projection, ("clients",))
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            yield "columns", cached["columns"]
+            for i in range(0, len(cached["rows"]), batch_size):
+                yield "rows", cached["rows"][i:i + batch_size]
+            yield "chart", cached["chart"]
+            yield "done", {"text": self._cached(query, cached)["text"], "row_count": len(cached["rows"])}
+            return
+        columns = None
+        chart = None
+        batch = []
+        row_count = 0
+        # Results small enough for the result cache are kept, so the next stream of this filter is served from it
+        kept = []
+        index_advisor.record_mongo(mongo_filter)
+        try:
+            cursor = (
+                read_collection(async_db, "clients").find(mongo_filter, projection)
+                .batch_size(batch_size).max_time_ms(execution_time_ms())
+            )
+            async for doc in cursor:
+                if columns is None:
+                    columns = list(doc.keys())
+                    chart = ChartAccumulator(columns)
+                    yield "columns", columns
+                batch.append([doc.get(c) for c in columns])
+                if len(batch) >= batch_size:
+                    check_deadline("Mongo fetch")
+                    chart.add(batch)
+                    row_count += len(batch)
+                    if kept is not None:
+                        kept.extend(batch)
+                        if len(kept) > result_cache.max_rows:
+                            kept = None
+                    yield "rows", batch
+                    batch = []
+        except ExecutionTimeout as e:
+            rejected = self._too_expensive(e)
+            yield "error", {"text": rejected["text"], "error": rejected["error"]}
+            return
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            yield "error", {"text": self._db_error(e)["text"]}
+            return
+        if batch:
+            chart.add(batch)
+            row_count += len(batch)
+            if kept is not None:
+                kept.extend(batch)
+                if len(kept) > result_cache.max_rows:
+                    kept = None
+            yield "rows", batch
+        if not row_count:
+            yield "done", {"text": "No matching clients found for your query.", "row_count": 0}
+            return
+        chart_result = chart.result()
+        yield "chart", chart_result
+        if kept is not None:
+            result_cache.set(cache_key, {"columns": columns, "rows": kept, "chart": chart_result, "text": f"Results for: {query}"})
+        yield "done", {"text": f"Results for: {query}", "row_count": row_count}
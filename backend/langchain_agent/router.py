@@ -0,0 +1,193 @@
+"""
+In-process query router.
+
+Decides between 'mongo' and 'sql' without an LLM round trip by scoring the
+question against both schemas (field/column names and known values) plus a
+small multinomial naive Bayes model over unigrams and bigrams. Callers fall
+back to the LLM classifier only when route() returns None.
+
+The LLM's decisions are proposed to the model and learned only once the
+question was answered under that route, up to ROUTER_MAX_LEARNED questions.
+"""
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+ROUTER_CONFIDENCE_THRESHOLD = float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", "0.8"))
+# Questions learned from LLM decisions at most, so the model stops growing
+ROUTER_MAX_LEARNED = int(os.getenv("ROUTER_MAX_LEARNED", "5000"))
+# Longer questions are never learned
+MAX_LEARN_CHARS = 500
+# LLM decisions waiting for their answer
+MAX_PENDING = 1000
+
+# Schema vocabulary: each hit adds KEYWORD_WEIGHT of log-odds towards its store
+KEYWORD_WEIGHT = 2.0
+
+MONGO_TERMS = {
+    # fields of the clients collection
+    "risk", "age", "city", "preferences", "preference", "profile", "profiles",
+    "demographic", "demographics", "appetite", "old", "older", "younger", "years",
+    "lives", "living", "based", "prefer", "prefers", "interested",
+    # known values
+    "high", "medium", "low", "mumbai", "delhi", "bangalore", "pune", "chennai",
+    "tech", "banking", "energy", "auto", "pharma",
+}
+
+SQL_TERMS = {
+    # columns of the portfolios table
+    "portfolio", "portfolios", "value", "values", "worth", "stock", "stocks",
+    "hold", "holds", "held", "holding", "holdings", "holder", "holders", "manager", "managers", "rm", "rms",
+    "total", "sum", "breakup", "breakdown", "aum", "transactions",
+    # known values
+    "hdfc", "reliance", "infosys", "tcs", "rajiv", "mehra", "shah", "suresh", "iyer",
+}
+
+# Multi-word phrases are matched on the normalized text before tokenizing
+MONGO_PHRASES = {"risk appetite", "client profile", "high risk", "low risk", "medium risk"}
+SQL_PHRASES = {
+    "relationship manager", "portfolio value", "hdfc bank", "rajiv mehra",
+    "priya shah", "suresh iyer", "top five", "greater than",
+}
+
+SEED_EXAMPLES = [
+    ("What are the top five portfolios of our wealth members?", "sql"),
+    ("Give me the breakup of portfolio values per relationship manager.", "sql"),
+    ("Tell me the top relationship managers in my firm", "sql"),
+    ("Which clients are the highest holders of Reliance?", "sql"),
+    ("Show all portfolios with stock = 'Reliance'.", "sql"),
+    ("Show all portfolios managed by Rajiv Mehra.", "sql"),
+    ("What is the total portfolio value?", "sql"),
+    ("Show portfolios with value greater than 7,000,000", "sql"),
+    ("Which stock is held in the most portfolios?", "sql"),
+    ("Average portfolio value per stock", "sql"),
+    ("Show all high risk clients", "mongo"),
+    ("Which clients live in Mumbai?", "mongo"),
+    ("List clients over 40 years old", "mongo"),
+    ("Clients who prefer tech", "mongo"),
+    ("High risk clients interested in tech", "mongo"),
+    ("What is the risk appetite of Bob?", "mongo"),
+    ("How many clients are in Delhi?", "mongo"),
+    ("Show client profiles with low risk", "mongo"),
+    ("Which clients have banking preferences?", "mongo"),
+    ("Show the age and city of every client", "mongo"),
+]
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def _normalize(query: str) -> str:
+    return " ".join(_TOKEN_RE.findall(query.lower()))
+
+def _features(normalized: str):
+    words = normalized.split()
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+class QueryRouter:
+    def __init__(self, threshold: float = ROUTER_CONFIDENCE_THRESHOLD, max_learned: int = ROUTER_MAX_LEARNED):
+        self.threshold = threshold
+        self.max_learned = max_learned
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._learned = 0
+        self._counts = {"mongo": Counter(), "sql": Counter()}
+        self._totals = {"mongo": 0, "sql": 0}
+        self._docs = {"mongo": 0, "sql": 0}
+        self._vocab = set()
+        self._stats = {"router": Counter(), "llm": Counter()}
+        self.train(SEED_EXAMPLES)
+
+    def train(self, examples):
+        """Add (question, label) pairs to the lexical model."""
+        with self._lock:
+            for question, label in examples:
+                feats = _features(_normalize(question))
+                self._counts[label].update(feats)
+                self._totals[label] += len(feats)
+                self._docs[label] += 1
+                self._vocab.update(feats)
+
+    def propose(self, query: str, label: str):
+        """Remember the LLM's decision for `query` until its answer shows whether it was right."""
+        key = _normalize(query)
+        with self._lock:
+            self._pending[key] = label
+            self._pending.move_to_end(key)
+            while len(self._pending) > MAX_PENDING:
+                self._pending.popitem(last=False)
+
+    def confirm(self, query: str, label: str) -> bool:
+        """Learn a proposed decision once `query` was answered under `label`. Returns True when learned."""
+        with self._lock:
+            if self._pending.pop(_normalize(query), None) != label:
+                return False
+            if self._learned >= self.max_learned or len(query) > MAX_LEARN_CHARS:
+                return False
+            self._learned += 1
+        self.train([(query, label)])
+        return True
+
+    def _keyword_score(self, normalized: str) -> float:
+        words = set(normalized.split())
+        score = KEYWORD_WEIGHT * (len(words & SQL_TERMS) - len(words & MONGO_TERMS))
+        padded = f" {normalized} "
+        score += KEYWORD_WEIGHT * sum(1 for p in SQL_PHRASES if f" {p} " in padded)
+        score -= KEYWORD_WEIGHT * sum(1 for p in MONGO_PHRASES if f" {p} " in padded)
+        return score
+
+    def _model_score(self, normalized: str) -> float:
+        vocab = len(self._vocab) or 1
+        score = math.log((self._docs["sql"] + 1) / (self._docs["mongo"] + 1))
+        for feat in _features(normalized):
+            if feat not in self._vocab:
+                continue  # unseen features carry no evidence
+            p_sql = (self._counts["sql"][feat] + 1) / (self._totals["sql"] + vocab)
+            p_mongo = (self._counts["mongo"][feat] + 1) / (self._totals["mongo"] + vocab)
+            score += math.log(p_sql / p_mongo)
+        return score
+
+    def score(self, query: str):
+        """
+        Return (label, confidence) where confidence is the probability of the chosen label.
+        """
+        normalized = _normalize(query)
+        with self._lock:
+            log_odds = self._model_score(normalized) + self._keyword_score(normalized)
+        log_odds = max(min(log_odds, 50.0), -50.0)
+        p_sql = 1.0 / (1.0 + math.exp(-log_odds))
+        if p_sql >= 0.5:
+            return "sql", p_sql
+        return "mongo", 1.0 - p_sql
+
+    def route(self, query: str):
+        """
+        Return 'mongo' or 'sql' when confident enough, otherwise None so the caller asks the LLM.
+        """
+        label, confidence = self.score(query)
+        if confidence < self.threshold:
+            return None
+        self.record("router", label)
+        return label
+
+    def record(self, path: str, label: str):
+        with self._lock:
+            self._stats[path][label] += 1
+
+    def stats(self):
+        with self._lock:
+            router = dict(self._stats["router"])
+            llm = dict(self._stats["llm"])
+            learned = self._learned
+        total = sum(router.values()) + sum(llm.values())
+        return {
+            "threshold": self.threshold,
+            "router": router,
+            "llm": llm,
+            "total": total,
+            "router_ratio": (sum(router.values()) / total) if total else 0.0,
+            "learned": learned,
+            "max_learned": self.max_learned,
+        }
+
+query_router = QueryRouter()
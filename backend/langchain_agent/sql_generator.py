@@ -1,25 +1,12 @@
 from langchain.prompts import PromptTemplate
-from langchain_community.chat_models import ChatOpenAI
-import os
+import hashlib
 from dotenv import load_dotenv
+from observability import get_logger, span
+from db.schema_catalog import schema_catalog
 
-load_dotenv()
-
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-OPENROUTER_API_BASE = "https://openrouter.ai/api/v1"
-
-# Describe your MySQL schema for the LLM
-SCHEMA_DESCRIPTION = '''
-Database: portfolios
-Table: portfolios
-Columns:
-- id: integer, primary key
-- client_name: string (the name of the client)
-- portfolio_value: decimal (the total value of the client portfolio)
-- relationship_manager: string (the RM for the client)
-- stock: string (the main stock held in this portfolio)
-'''
+log = get_logger("SQLTool")
 
+load_dotenv()
 
 STRICT_SQL_INSTRUCTIONS = """
 You are a data assistant helping users query an SQL database.
@@ -54,20 +41,23 @@ SQL Query:
 """
 
 
+TEMPLATE_VERSION = hashlib.sha1(STRICT_SQL_INSTRUCTIONS.encode("utf-8")).hexdigest()[:8]
+
+def schema_version() -> str:
+    # Cached translations are only reused while the schema and prompt are unchanged
+    return f"{schema_catalog.version}.{TEMPLATE_VERSION}"
+
 prompt_template = PromptTemplate(
     input_variables=["question", "schema"],
     template=STRICT_SQL_INSTRUCTIONS
 )
 
-llm = ChatOpenAI(
-    model_name="deepseek/deepseek-r1-0528:free",  # Or your OpenRouter model
-    openai_api_key=OPENROUTER_API_KEY,
-    openai_api_base=OPENROUTER_API_BASE,
-)
-
 import re
 
 import asyncio
+from langchain_agent.llm_gateway import llm_gateway, is_timeout
+from langchain_agent.deadline import DeadlineExceeded
+from langchain_agent.extract import SQLExtractor
 
 def extract_sql_query(llm_output: str) -> str:
     """Extract and clean SQL query from LLM output."""
@@ -77,36 +67,38 @@ def extract_sql_query(llm_output: str) -> str:
     cleaned = re.sub(r"^sql\s*", "", cleaned, flags=re.IGNORECASE)
     return cleaned.strip()
 
-def get_portfolios_schema():
-    return SCHEMA_DESCRIPTION
+def get_portfolios_schema(question: str = None):
+    # Only the tables and columns relevant to the question, from the live schema catalog
+    return schema_catalog.sql_prompt(question)
 
-async def generate_sql_async(question: str, schema: str = None, timeout: int = 60) -> str:
+FALLBACK_SQL = "SELECT relationship_manager, SUM(portfolio_value) AS total_portfolio_value FROM portfolios GROUP BY relationship_manager;"
+
+def build_sql_prompt(question: str, schema: str = None) -> str:
     if schema is None:
-        schema = get_portfolios_schema()
-    prompt = prompt_template.format(question=question, schema=schema)
-    print("[SQLTool] Prompt to LLM:\n", prompt)
-    try:
-        raw_output = await asyncio.wait_for(llm.apredict(prompt), timeout=timeout)
-        print("[SQLTool] LLM output:\n", raw_output)
-        # Clean the output to extract only the SQL
-        sql = extract_sql_query(raw_output)
-        print("[SQLTool] Cleaned SQL:\n", sql)
-    except asyncio.TimeoutError:
-        print("[SQLTool] SQL generation timed out. Using fallback query.")
-        return "SELECT relationship_manager, SUM(portfolio_value) AS total_portfolio_value FROM portfolios GROUP BY relationship_manager;"
-    
+        schema = get_portfolios_schema(question)
+    return prompt_template.format(question=question, schema=schema)
+
+def validate_sql_output(raw_output: str) -> str:
+    """
+    Turn raw LLM output into a single validated SELECT statement, or the fallback query.
+    """
+    log.debug("LLM output:\n%s", raw_output)
+    # Clean the output to extract only the SQL
+    sql = extract_sql_query(raw_output)
+    log.debug("Cleaned SQL:\n%s", sql)
+
     # Always extract the first valid SELECT statement (ignoring explanations)
     match = re.search(r"(SELECT .*?;)", sql, re.IGNORECASE | re.DOTALL)
     if match:
         sql = match.group(1)
     # If the output does not start with SELECT, treat as error
     if not sql.strip().upper().startswith("SELECT"):
-        print("[SQLTool] LLM did not return a SQL query. Using fallback query.")
-        return "SELECT relationship_manager, SUM(portfolio_value) AS total_portfolio_value FROM portfolios GROUP BY relationship_manager;"
+        log.warning("LLM did not return a SQL query. Using fallback query.")
+        return FALLBACK_SQL
     
     # Validate that only allowed columns/tables are used
-    allowed_columns = {"id", "client_name", "portfolio_value", "relationship_manager", "stock"}
-    allowed_table = "portfolios"
+    allowed_columns = schema_catalog.sql_columns()
+    allowed_tables = schema_catalog.sql_tables()
     # Find all column/table names in SELECT, FROM, WHERE, GROUP BY, ORDER BY, but skip aliases after AS
     tokens = re.findall(r"\b([a-zA-Z_][a-zA-Z0-9_]*)\b", sql)
     skip_next = False
@@ -120,15 +112,47 @@ async def generate_sql_async(question: str, schema: str = None, timeout: int = 6
         # Only check tokens that are not SQL keywords or aliases
         if token.lower() in {"select", "from", "where", "and", "or", "as", "group", "by", "order", "desc", "asc", "limit", "on", "sum", "count", "avg", "max", "min", "distinct", "join", "left", "right", "inner", "outer", "having"}:
             continue
-        if token not in allowed_columns and token != allowed_table:
-            print(f"[SQLTool] LLM used invalid column or table: {token}. Using fallback query.")
-            return "SELECT relationship_manager, SUM(portfolio_value) AS total_portfolio_value FROM portfolios GROUP BY relationship_manager;"
+        if token not in allowed_columns and token not in allowed_tables:
+            log.warning(f"LLM used invalid column or table: {token}. Using fallback query.")
+            return FALLBACK_SQL
     return sql
 
+async def generate_sql_async(question: str, schema: str = None, timeout: int = 60) -> str:
+    await schema_catalog.ensure()
+    with span("prompt_build"):
+        prompt = build_sql_prompt(question, schema)
+    log.debug("Prompt to LLM:\n%s", prompt)
+    try:
+        # Stops generating as soon as a complete statement has streamed in
+        sql, raw_output = await llm_gateway.aextract(prompt, SQLExtractor(), timeout=timeout)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        # Only a generation that timed out falls back; an unavailable or rejecting provider is the caller's to report
+        if not is_timeout(e):
+            raise
+        log.warning(f"SQL generation timed out ({type(e).__name__}: {e}). Using fallback query.")
+        return FALLBACK_SQL
+    with span("parse"):
+        return validate_sql_output(sql if sql is not None else raw_output)
+
 def generate_sql(question: str, schema: str = None, timeout: int = 30) -> str:
     """
-    Synchronous wrapper for generate_sql_async for compatibility.
+    Synchronous counterpart of generate_sql_async for LangChain's sync tool interface.
+    Uses the gateway's blocking client instead of spinning up an event loop per call.
     """
-    import asyncio
-    return asyncio.run(generate_sql_async(question, schema, timeout))
-
+    with span("prompt_build"):
+        prompt = build_sql_prompt(question, schema)
+    log.debug("Prompt to LLM:\n%s", prompt)
+    try:
+        sql, raw_output = llm_gateway.extract(prompt, SQLExtractor(), timeout=timeout)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        # Only a generation that timed out falls back; an unavailable or rejecting provider is the caller's to report
+        if not is_timeout(e):
+            raise
+        log.warning(f"SQL generation timed out ({type(e).__name__}: {e}). Using fallback query.")
+        return FALLBACK_SQL
+    with span("parse"):
+        return validate_sql_output(sql if sql is not None else raw_output)
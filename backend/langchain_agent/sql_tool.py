@@ -1,8 +1,28 @@
 from langchain.tools import BaseTool
-from db.mysql import SessionLocal
+from db.mysql import ReadSessionLocal, AsyncReadSessionLocal
 from sqlalchemy import text
-from langchain_agent.sql_generator import generate_sql
-from decimal import Decimal
+from langchain_agent.sql_generator import generate_sql, generate_sql_async, FALLBACK_SQL, schema_version
+from cache.translation import translation_cache
+from cache.results import result_cache, sql_tables
+from langchain_agent.deadline import within_deadline, DeadlineExceeded
+from langchain_agent.templates import match_sql_template
+from charts import ChartAccumulator, build_chart
+from db.pagination import plan_sql, build_page_sql, split_page, with_cursor, clamp_page_size
+from db.guardrails import GuardrailRejection, admit, admit_async, with_time_limit
+from db.rollups import rollups
+from db.schema_catalog import schema_catalog
+import os
+from observability import get_logger, span
+
+log = get_logger("SQLTool")
+
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# Carried by answers to the fallback query, so callers (the history, the cache warmer) see the question failed
+FALLBACK_ERROR = {
+    "code": "fallback_query",
+    "reason": "The question could not be turned into a valid query; the default portfolio breakdown was shown instead.",
+}
 
 class SQLTool(BaseTool):
     name: str = "SQLTool"
@@ -11,70 +31,308 @@ class SQLTool(BaseTool):
         "For example: portfolio value, top portfolios, stock holdings, etc."
     )
 
-    def _run(self, query: str):
-        # Use the LLM to generate SQL from the NL query
-        sql_query = generate_sql(query)
-        print(f"[SQLTool] Generated SQL: {sql_query}")
-        session = SessionLocal()
-        try:
-            result = session.execute(text(sql_query))
-            # Fetch all rows before closing session
-            rows = result.fetchall()
-            columns = result.keys()
-            print(f"[SQLTool] Query columns: {columns}")
-            print(f"[SQLTool] Query rows: {rows}")
-            if not rows:
-                return {
-                    "columns": list(columns),
-                    "rows": [],
-                    "chart": None,
-                    "text": "No results found for your query. Please try a different question about portfolios or transactions."
-                }
-            # Try to extract chart (string + numeric columns)
-            chart = None
-            str_idx = None
-            num_idx = None
-            print(f"[SQLTool] Chart debugging - columns: {columns}")
-            print(f"[SQLTool] Chart debugging - first row: {rows[0]}")
-            print(f"[SQLTool] Chart debugging - column types: {[type(row[i]) for i, row in enumerate([rows[0]])]}")
-            for i, col in enumerate(columns):
-                print(f"[SQLTool] Column {i} ({col}): type={type(rows[0][i])}, value={rows[0][i]}")
-                if isinstance(rows[0][i], str) and str_idx is None:
-                    str_idx = i
-                    print(f"[SQLTool] Found string column at index {i}: {col}")
-                if isinstance(rows[0][i], (int, float, Decimal)) and num_idx is None:
-                    num_idx = i
-                    print(f"[SQLTool] Found numeric column at index {i}: {col}")
-            print(f"[SQLTool] Chart indices - str_idx: {str_idx}, num_idx: {num_idx}")
-            if str_idx is not None and num_idx is not None:
-                labels = [str(row[str_idx]) for row in rows]
-                data = [float(row[num_idx]) for row in rows]  # Convert Decimal to float for chart
-                # Convert RMKeyView to list for proper indexing
-                columns_list = list(columns)
-                chart = {
-                    "labels": labels,
-                    "data": data,
-                    "label": columns_list[num_idx]
-                }
-                print(f"[SQLTool] Chart created: {chart}")
-            else:
-                print(f"[SQLTool] No chart created - missing string or numeric column")
+    def _error_result(self, e):
+        log.warning(f"SQLTool error: {e}")
+        return {
+            "columns": [],
+            "rows": [],
+            "chart": None,
+            "text": "Sorry, I couldn't process your question or it doesn't match available portfolio data. Please ask about portfolio value, top portfolios, stock holdings, etc."
+        }
+
+    def _llm_error(self, e):
+        log.warning(f"LLM error: {type(e).__name__}: {e}")
+        return {
+            "columns": [],
+            "rows": [],
+            "chart": None,
+            "text": "Sorry, I couldn't turn your question into a query right now. Please try again in a moment."
+        }
+
+    def _too_expensive(self, e):
+        log.warning(f"Guardrail rejected query: {e.to_dict()}")
+        return {
+            "columns": [],
+            "rows": [],
+            "chart": None,
+            "text": "Sorry, that question would take too long to answer over the full portfolio data. Please narrow it down, for example to one relationship manager or stock.",
+            "error": e.to_dict()
+        }
+
+    def _format_result(self, query, columns, rows):
+        log.debug(f"Query columns: {columns}")
+        log.debug(f"Query returned {len(rows)} rows")
+        if not rows:
             return {
                 "columns": list(columns),
-                "rows": [list(row) for row in rows],
-                "chart": chart,
-                "text": f"Results for: {query}"
-            }
-        except Exception as e:
-            print(f"[SQLTool] SQLTool error: {e}")
-            return {
-                "columns": [],
                 "rows": [],
                 "chart": None,
-                "text": "Sorry, I couldn't process your question or it doesn't match available portfolio data. Please ask about portfolio value, top portfolios, stock holdings, etc."
+                "text": "No results found for your query. Please try a different question about portfolios or transactions."
             }
-        finally:
-            session.close()
+        chart = build_chart(columns, rows)
+        log.debug(f"Chart points: {len(chart['labels']) if chart else 0}")
+        return {
+            "columns": list(columns),
+            "rows": [list(row) for row in rows],
+            "chart": chart,
+            "text": f"Results for: {query}"
+        }
+
+    def _lookup(self, query: str):
+        # Common question shapes map straight to prepared SQL, then previously validated translations
+        template = match_sql_template(query)
+        if template is not None:
+            return template
+        return self._translation(translation_cache.get("sql", query, schema_version()))
+
+    async def _alookup(self, query: str):
+        template = match_sql_template(query)
+        if template is not None:
+            return template
+        return self._translation(await translation_cache.aget("sql", query, schema_version()))
+
+    def _translation(self, cached):
+        return (cached["query"], cached["params"]) if cached is not None else None
+
+    def _remember(self, query: str, sql_query: str):
+        # Never persist the fallback query; it stands in for a failed generation
+        if sql_query != FALLBACK_SQL:
+            translation_cache.set("sql", query, schema_version(), {"query": sql_query, "params": {}})
+
+    def _translate(self, query: str):
+        """
+        Returns ((sql, params), None) or (None, error_result) when the LLM could not be
+        asked, like MongoTool._translate.
+        """
+        found = self._lookup(query)
+        if found is not None:
+            return found, None
+        try:
+            sql_query = generate_sql(query)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return None, self._llm_error(e)
+        self._remember(query, sql_query)
+        return (sql_query, {}), None
+
+    async def _atranslate(self, query: str):
+        await schema_catalog.ensure()
+        found = await self._alookup(query)
+        if found is not None:
+            return found, None
+        try:
+            sql_query = await generate_sql_async(query)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return None, self._llm_error(e)
+        self._remember(query, sql_query)
+        return (sql_query, {}), None
+
+    def _mark_fallback(self, sql_query, result):
+        # The fallback query runs and is cached like any other; only this answer is marked
+        if sql_query == FALLBACK_SQL and "error" not in result:
+            return {**result, "error": FALLBACK_ERROR}
+        return result
+
+    def _cached(self, query, cached):
+        # Cached payloads are shared between questions that produced the same SQL
+        if cached["rows"]:
+            return with_cursor({**cached, "text": f"Results for: {query}"}, query)
+        return cached
 
-    def _arun(self, query: str):
-        raise NotImplementedError("SQLTool does not support async yet.")
+    def _rollup(self, sql_query: str, params: dict) -> str:
+        # Aggregates the rollups already hold are answered from them instead of scanning portfolios
+        rewritten = rollups.rewrite(sql_query, params)
+        if rewritten is None:
+            return sql_query
+        log.debug(f"Rollup SQL: {rewritten}")
+        return rewritten
+
+    def _page_result(self, query, plan, params, page_size, returned, columns, rows, take):
+        columns, rows, after, truncated = split_page(plan, columns, rows, take)
+        formatted = self._format_result(query, columns, rows)
+        formatted["truncated"] = truncated
+        formatted["freshness"] = rollups.freshness(plan["sql"])
+        formatted["cursor_state"] = {
+            "store": "sql",
+            "plan": plan,
+            "params": params,
+            "page_size": page_size,
+            "after": after,
+            "returned": returned + len(rows),
+        } if after is not None else None
+        return formatted
+
+    def _page_query(self, plan, params, page_size, after, returned):
+        """(page_sql, page_params, take, cache_key) for one page."""
+        page_sql, page_params, take = build_page_sql(plan, params, page_size, after, returned)
+        log.debug(f"Page SQL: {page_sql} params={page_params}")
+        return page_sql, page_params, take, result_cache.key("sql", page_sql, page_params, sql_tables(page_sql))
+
+    def _cached_page(self, query, cache_key):
+        cached = result_cache.get(cache_key)
+        return self._cached(query, cached) if cached is not None else None
+
+    def _store_page(self, query, plan, params, page_size, returned, columns, rows, take, cache_key):
+        formatted = self._page_result(query, plan, params, page_size, returned, columns, rows, take)
+        result_cache.set(cache_key, formatted)
+        return with_cursor(formatted, query)
+
+    def _execution_error(self, e):
+        if isinstance(e, GuardrailRejection):
+            return self._too_expensive(e)
+        return self._error_result(e)
+
+    def _execute_page(self, session, page_sql, page_params, take, after):
+        # Follow-up pages belong to a query that was already admitted
+        if after is None:
+            admit(session, page_sql, page_params)
+        with span("db_execute"):
+            result = session.execute(text(with_time_limit(page_sql, session)), page_params)
+        # Only the page plus one look-ahead row is ever fetched
+        with span("fetch"):
+            return list(result.keys()), result.fetchmany(take + 1)
+
+    async def _aexecute_page(self, session, page_sql, page_params, take, after):
+        if after is None:
+            await within_deadline(admit_async(session, page_sql, page_params), "SQL admission")
+        limited_sql = with_time_limit(page_sql, session)
+        with span("db_execute"):
+            result = await within_deadline(session.execute(text(limited_sql), page_params), "SQL execution")
+        with span("fetch"):
+            return list(result.keys()), result.fetchmany(take + 1)
+
+    def _fetch_page(self, query, plan, params, page_size, after=None, returned=0):
+        page_sql, page_params, take, cache_key = self._page_query(plan, params, page_size, after, returned)
+        cached = self._cached_page(query, cache_key)
+        if cached is not None:
+            return cached
+        try:
+            # Read-only, so a replica within the lag budget serves it when there is one
+            with ReadSessionLocal(sql_tables(page_sql)) as session:
+                columns, rows = self._execute_page(session, page_sql, page_params, take, after)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return self._execution_error(e)
+        return self._store_page(query, plan, params, page_size, returned, columns, rows, take, cache_key)
+
+    async def _afetch_page(self, query, plan, params, page_size, after=None, returned=0, session=None):
+        page_sql, page_params, take, cache_key = self._page_query(plan, params, page_size, after, returned)
+        cached = self._cached_page(query, cache_key)
+        if cached is not None:
+            return cached
+        try:
+            if session is None:
+                async with AsyncReadSessionLocal(sql_tables(page_sql)) as own_session:
+                    columns, rows = await self._aexecute_page(own_session, page_sql, page_params, take, after)
+            else:
+                columns, rows = await self._aexecute_page(session, page_sql, page_params, take, after)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if session is not None:
+                # Leave a shared session usable for the caller's next query
+                await session.rollback()
+            return self._execution_error(e)
+        return self._store_page(query, plan, params, page_size, returned, columns, rows, take, cache_key)
+
+    def _plan(self, sql_query: str, params: dict):
+        log.debug(f"Generated SQL: {sql_query} params={params}")
+        return plan_sql(self._rollup(sql_query, params), params)
+
+    def _run(self, query: str, page_size: int = None):
+        translation, fallback = self._translate(query)
+        if fallback is not None:
+            return fallback
+        sql_query, params = translation
+        return self.execute(query, sql_query, params, page_size)
+
+    async def _arun(self, query: str, page_size: int = None):
+        translation, fallback = await self._atranslate(query)
+        if fallback is not None:
+            return fallback
+        sql_query, params = translation
+        return await self.aexecute(query, sql_query, params, page_size)
+
+    def execute(self, query: str, sql_query: str, params: dict, page_size: int = None):
+        """Run already translated SQL."""
+        result = self._fetch_page(query, self._plan(sql_query, params), params, clamp_page_size(page_size))
+        return self._mark_fallback(sql_query, result)
+
+    async def aexecute(self, query: str, sql_query: str, params: dict, page_size: int = None, session=None):
+        """Run already translated SQL, optionally on a session the caller shares across queries."""
+        result = await self._afetch_page(
+            query, self._plan(sql_query, params), params, clamp_page_size(page_size), session=session
+        )
+        return self._mark_fallback(sql_query, result)
+
+    async def anext_page(self, state: dict):
+        """Serve a follow-up page from a decoded cursor without touching the LLM."""
+        return await self._afetch_page(
+            state["question"], state["plan"], state["params"], state["page_size"], state["after"], state["returned"]
+        )
+
+    async def astream(self, query: str, batch_size: int = STREAM_BATCH_SIZE):
+        """
+        Yield (event, data) pairs: query, columns, one rows event per batch, chart, done.
+        Rows come from a server-side cursor so memory stays flat for large results.
+        """
+        translation, fallback = await self._atranslate(query)
+        if fallback is not None:
+            yield "error", {"text": fallback["text"]}
+            return
+        generated, params = translation
+        sql_query = self._rollup(generated, params)
+        yield "query", {"query": sql_query, "params": params}
+        cache_key = result_cache.key("sql", sql_query, params, sql_tables(sql_query))
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            yield "columns", cached["columns"]
+            for i in range(0, len(cached["rows"]), batch_size):
+                yield "rows", cached["rows"][i:i + batch_size]
+            yield "chart", cached["chart"]
+            yield "done", self._mark_fallback(
+                generated, {"text": self._cached(query, cached)["text"], "row_count": len(cached["rows"])}
+            )
+            return
+        row_count = 0
+        # Results small enough for the result cache are kept, so the next stream of this query is served from it
+        kept = []
+        try:
+            async with AsyncReadSessionLocal(sql_tables(sql_query)) as session:
+                await within_deadline(admit_async(session, sql_query, params), "SQL admission")
+                limited_sql = with_time_limit(sql_query, session)
+                result = await within_deadline(session.stream(text(limited_sql), params), "SQL execution")
+                columns = list(result.keys())
+                yield "columns", columns
+                chart = ChartAccumulator(columns)
+                async for partition in result.partitions(batch_size):
+                    rows = [list(row) for row in partition]
+                    row_count += len(rows)
+                    chart.add(rows)
+                    if kept is not None:
+                        kept.extend(rows)
+                        if len(kept) > result_cache.max_rows:
+                            kept = None
+                    yield "rows", rows
+        except GuardrailRejection as e:
+            rejected = self._too_expensive(e)
+            yield "error", {"text": rejected["text"], "error": rejected["error"]}
+            return
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            yield "error", {"text": self._error_result(e)["text"]}
+            return
+        chart_result = chart.result()
+        yield "chart", chart_result
+        if row_count:
+            text_out = f"Results for: {query}"
+        else:
+            text_out = "No results found for your query. Please try a different question about portfolios or transactions."
+        if kept is not None:
+            result_cache.set(cache_key, {"columns": columns, "rows": kept, "chart": chart_result, "text": text_out})
+        yield "done", self._mark_fallback(generated, {"text": text_out, "row_count": row_count})
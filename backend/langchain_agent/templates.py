@@ -0,0 +1,296 @@
+"""
+Deterministic templates for the common question families (see Question.txt).
+
+match_sql_template returns (sql, params) with bound parameters,
+match_mongo_template returns a validated filter dict and match_mongo_pipeline
+returns an aggregation pipeline for counts/averages over client profiles.
+match_federated returns a join plan for questions that need both stores. All
+return None when no template covers the question, in which case the tools
+fall back to the LLM.
+"""
+import re
+
+KNOWN_STOCKS = ["HDFC Bank", "Reliance", "Infosys", "TCS"]
+KNOWN_RMS = ["Rajiv Mehra", "Priya Shah", "Suresh Iyer"]
+KNOWN_CITIES = ["Mumbai", "Delhi", "Bangalore", "Pune", "Chennai"]
+KNOWN_RISKS = ["High", "Medium", "Low"]
+KNOWN_PREFERENCES = ["tech", "banking", "energy", "auto", "pharma"]
+
+WORD_NUMBERS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+    "twenty": 20, "fifty": 50, "hundred": 100,
+}
+MULTIPLIERS = {
+    "k": 1_000, "thousand": 1_000, "lakh": 100_000, "lakhs": 100_000,
+    "m": 1_000_000, "mn": 1_000_000, "million": 1_000_000,
+    "cr": 10_000_000, "crore": 10_000_000, "crores": 10_000_000,
+}
+
+DEFAULT_TOP_N = 5
+MAX_TOP_N = 100
+# Plain numbers up to this are read as ages ("clients over 40"), larger ones as amounts
+MAX_AGE = 120
+
+SQL_TOP_PORTFOLIOS = (
+    "SELECT client_name, portfolio_value, relationship_manager, stock FROM portfolios "
+    "ORDER BY portfolio_value DESC LIMIT :limit"
+)
+SQL_VALUE_PER_RM = (
+    "SELECT relationship_manager, SUM(portfolio_value) AS total_portfolio_value FROM portfolios "
+    "GROUP BY relationship_manager ORDER BY total_portfolio_value DESC"
+)
+SQL_TOP_RMS = SQL_VALUE_PER_RM + " LIMIT :limit"
+SQL_HOLDERS_OF_STOCK = (
+    "SELECT client_name, portfolio_value, relationship_manager FROM portfolios "
+    "WHERE stock = :stock ORDER BY portfolio_value DESC"
+)
+SQL_PORTFOLIOS_BY_RM = (
+    "SELECT client_name, portfolio_value, stock FROM portfolios "
+    "WHERE relationship_manager = :rm ORDER BY portfolio_value DESC"
+)
+SQL_PORTFOLIOS_OVER_VALUE = (
+    "SELECT client_name, portfolio_value, relationship_manager, stock FROM portfolios "
+    "WHERE portfolio_value > :min_value ORDER BY portfolio_value DESC"
+)
+SQL_TOTAL_VALUE = "SELECT SUM(portfolio_value) AS total_portfolio_value FROM portfolios"
+
+# Words that mean the user wants an aggregate a flat Mongo filter cannot express
+AGGREGATE_WORDS = re.compile(r"\b(average|avg|mean|count|how many|number of|per|by|group|sum|total)\b")
+
+_NUMBER_RE = r"(\d[\d,]*(?:\.\d+)?)\s*(k|thousand|lakhs?|mn|m|million|cr|crores?)?\b"
+COMPARISON_RE = re.compile(
+    r"(?:\b(values?|worth)\s+(?:is\s+|of\s+)?)?"
+    r"(?<!\w)(greater than|more than|older than|younger than|less than|above|over|under|below|exceeding|>|<)\s*" + _NUMBER_RE
+)
+AGE_WORDS = {"older than", "younger than"}
+LESS_WORDS = {"less than", "younger than", "under", "below", "<"}
+
+def _normalize(question: str) -> str:
+    return " ".join(question.lower().replace("’", "'").split())
+
+def _parse_number(number: str, unit: str = None) -> float:
+    value = float(number.replace(",", ""))
+    if unit:
+        value *= MULTIPLIERS[unit]
+    return value
+
+def _parse_count(token: str):
+    if token is None:
+        return None
+    if token.isdigit():
+        return int(token)
+    return WORD_NUMBERS.get(token)
+
+def _find_known(q: str, values):
+    for value in values:
+        if re.search(rf"\b{re.escape(value.lower())}\b", q):
+            return value
+    return None
+
+def _top_n(q: str):
+    match = re.search(r"\btop\s+(\d+|" + "|".join(WORD_NUMBERS) + r")\b", q)
+    n = _parse_count(match.group(1)) if match else None
+    return min(n or DEFAULT_TOP_N, MAX_TOP_N)
+
+def _stock_facet(q: str):
+    stock = _find_known(q, KNOWN_STOCKS)
+    if stock is None:
+        match = re.search(r"\bstock\s*(?:=|is|of)\s*'?\"?([a-z][\w .&-]*?)'?\"?\s*\.?$", q) \
+            or re.search(r"\bholders? of\s+'?\"?([a-z][\w .&-]*?)'?\"?\s*[.?]?$", q)
+        if match:
+            stock = match.group(1).strip().title()
+    return stock
+
+def _comparisons(q: str):
+    """
+    ("age" | "value", "$gt" | "$lt", number) for every comparison in the question.
+    Each is one or the other: a plain number up to MAX_AGE is an age unless it is
+    attached to "value"/"worth"; amounts ("5 lakh", "7,000,000") are values.
+    """
+    comparisons = []
+    for match in COMPARISON_RE.finditer(q):
+        anchor, word, number, unit = match.groups()
+        amount = _parse_number(number, unit)
+        if anchor is None and unit is None and number.isdigit() and amount <= MAX_AGE:
+            kind = "age"
+        elif word in AGE_WORDS:
+            # "older than 500" is no age we can filter on
+            continue
+        else:
+            kind = "value"
+        comparisons.append((kind, "$lt" if word in LESS_WORDS else "$gt", int(amount) if kind == "age" else amount))
+    return comparisons
+
+def _min_value_facet(q: str):
+    if not re.search(r"\b(portfolios?|value|worth)\b", q):
+        return None
+    for kind, op, amount in _comparisons(q):
+        if kind == "value" and op == "$gt":
+            return amount
+    return None
+
+def match_sql_template(question: str):
+    q = _normalize(question)
+    # Client-profile facets (age, risk, city, preferences) and upper value bounds are not in any
+    # template; dropping them would answer a different question, so the federated planner or the LLM takes it
+    if _mongo_facets(q) or any(kind == "value" and op == "$lt" for kind, op, _ in _comparisons(q)):
+        return None
+    rm = _find_known(q, KNOWN_RMS)
+    stock = _stock_facet(q)
+    min_value = _min_value_facet(q)
+    # Each template covers exactly one facet; combinations go to the LLM
+    facets = sum(x is not None for x in (rm, stock, min_value))
+    if facets > 1:
+        return None
+
+    if facets == 0:
+        # "top relationship managers"
+        if re.search(r"\btop\b.*\b(relationship managers?|rms?)\b", q):
+            return SQL_TOP_RMS, {"limit": _top_n(q)}
+
+        # "breakup of portfolio values per relationship manager"
+        if re.search(r"\b(per|by|each|breakup|breakdown|split)\b.*\b(relationship managers?|rms?)\b", q):
+            return SQL_VALUE_PER_RM, {}
+
+        # "top five portfolios"
+        if re.search(r"\b(top|largest|biggest|highest)\b.*\bportfolios?\b", q):
+            return SQL_TOP_PORTFOLIOS, {"limit": _top_n(q)}
+
+        # "what is the total portfolio value"
+        if re.search(r"\btotal\b.*\bportfolio values?\b|\bportfolio values?\b.*\btotal\b", q) \
+                and not re.search(r"\b(per|by|each)\b", q):
+            return SQL_TOTAL_VALUE, {}
+        return None
+
+    # Filtered listings are only templated when nothing else (top-N, totals) is asked for
+    if re.search(r"\b(top|total|sum|average|avg|count|how many|per|each)\b", q):
+        return None
+
+    # "portfolios managed by Rajiv Mehra"
+    if rm and re.search(r"\b(managed|handled|by|under|of)\b", q):
+        return SQL_PORTFOLIOS_BY_RM, {"rm": rm}
+
+    # "holders of HDFC Bank" / "portfolios with stock = 'Reliance'"
+    if stock:
+        return SQL_HOLDERS_OF_STOCK, {"stock": stock}
+
+    # "portfolios with value greater than 7,000,000"
+    if min_value is not None:
+        return SQL_PORTFOLIOS_OVER_VALUE, {"min_value": min_value}
+
+    return None
+
+def _mongo_facets(q: str) -> dict:
+    mongo_filter = {}
+    levels = "|".join(r.lower() for r in KNOWN_RISKS)
+    risk = re.search(rf"\b({levels})[\s-]+risk\b|\brisk\s*(?:=|is|of)?\s*({levels})\b", q)
+    if risk:
+        mongo_filter["risk"] = (risk.group(1) or risk.group(2)).title()
+    city = _find_known(q, KNOWN_CITIES)
+    if city:
+        mongo_filter["city"] = city
+    preference = _find_known(q, KNOWN_PREFERENCES)
+    if preference:
+        mongo_filter["preferences"] = preference
+    # Amounts such as "over 5 lakh" or "above 7,000,000" are portfolio values, not ages
+    for kind, op, years in _comparisons(q):
+        if kind == "age":
+            mongo_filter["age"] = {op: years}
+            break
+    return mongo_filter
+
+def match_mongo_template(question: str):
+    q = _normalize(question)
+    if AGGREGATE_WORDS.search(q):
+        return None
+    return _mongo_facets(q) or None
+
+GROUP_FIELDS = {"city": "city", "cities": "city", "risk": "risk", "preference": "preferences"}
+
+def match_mongo_pipeline(question: str):
+    """
+    "how many high risk clients per city", "average age by risk level",
+    "number of clients in Mumbai". Grouping and counting run inside MongoDB.
+    """
+    q = _normalize(question)
+    average = re.search(r"\b(average|avg|mean)\s+age\b", q)
+    count = re.search(r"\b(count|how many|number of)\b", q)
+    if not average and not count:
+        return None
+    group = re.search(r"\b(?:per|by|in each|each|across)\s+(city|cities|risk|preference)", q)
+    mongo_filter = _mongo_facets(q)
+    if group and GROUP_FIELDS[group.group(1)] in mongo_filter:
+        # "per city" after a specific city was named is ambiguous
+        return None
+
+    pipeline = [{"$match": mongo_filter}] if mongo_filter else []
+    metric = "average_age" if average else "clients"
+    accumulator = {"$avg": "$age"} if average else {"$sum": 1}
+    if group:
+        field = GROUP_FIELDS[group.group(1)]
+        if field == "preferences":
+            pipeline.append({"$unwind": "$preferences"})
+        pipeline += [
+            {"$group": {"_id": f"${field}", metric: accumulator}},
+            {"$sort": {metric: -1}},
+        ]
+    elif average:
+        pipeline.append({"$group": {"_id": None, metric: accumulator}})
+    else:
+        pipeline.append({"$count": metric})
+    return pipeline
+
+# Words that show a question needs the portfolios table
+PORTFOLIO_WORDS = re.compile(
+    r"\b(portfolios?|values?|worth|aum|holdings?|holders?|holds?|stocks?|invested|relationship managers?|rms?)\b"
+)
+FEDERATED_GROUPS = {
+    "city": ("mongo", "city"), "cities": ("mongo", "city"), "risk": ("mongo", "risk"),
+    "preference": ("mongo", "preferences"), "relationship manager": ("sql", "relationship_manager"),
+    "rm": ("sql", "relationship_manager"), "stock": ("sql", "stock"),
+}
+
+def match_federated(question: str):
+    """
+    "total portfolio value of high-risk clients in Mumbai": client facets come
+    from Mongo, values from MySQL. Returns a JSON-serializable plan with the
+    filter for each store, or None when one store can answer alone.
+    """
+    q = _normalize(question)
+    if not PORTFOLIO_WORDS.search(q):
+        return None
+    mongo_filter = _mongo_facets(q)
+    group = re.search(r"\b(?:per|by|in each|each|across)\s+(city|cities|risk|preference|relationship manager|rm|stock)", q)
+    group_store, group_field = FEDERATED_GROUPS[group.group(1)] if group else (None, None)
+    if group_store == "mongo" and group_field in mongo_filter:
+        return None
+    sql_filter = {}
+    rm = _find_known(q, KNOWN_RMS)
+    if rm:
+        sql_filter["relationship_manager"] = rm
+    stock = _find_known(q, KNOWN_STOCKS)
+    if stock:
+        sql_filter["stock"] = stock
+    min_value = _min_value_facet(q)
+    if min_value is not None:
+        sql_filter["min_value"] = min_value
+
+    if re.search(r"\b(average|avg|mean)\s+age\b", q):
+        metric = ["avg", "age"]
+    elif re.search(r"\b(average|avg|mean)\b", q):
+        metric = ["avg", "portfolio_value"]
+    elif re.search(r"\b(how many|count|number of)\b", q):
+        metric = ["count", "clients" if re.search(r"\b(clients?|customers?|investors?)\b", q) else "portfolios"]
+    elif re.search(r"\b(total|sum|aum|breakup|breakdown|split)\b", q) or group:
+        metric = ["sum", "portfolio_value"]
+    else:
+        metric = None
+    if not mongo_filter and group_store != "mongo" and metric != ["avg", "age"]:
+        return None
+    return {
+        "mongo_filter": mongo_filter,
+        "sql_filter": sql_filter,
+        "group": [group_store, group_field] if group else None,
+        "metric": metric,
+    }
@@ -1,15 +1,38 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import Request
-from fastapi.responses import JSONResponse
-from schemas import QueryRequest, QueryResponse, TableResult, ChartResult
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from fastapi.encoders import jsonable_encoder
+from schemas import QueryRequest, QueryResponse, BatchQueryRequest, BatchQueryResponse
 import os
-from langchain_agent.mongo_tool import MongoTool
-from langchain_agent.sql_tool import SQLTool
-from langchain_community.chat_models import ChatOpenAI
+from langchain_agent.router import query_router
+from cache.translation import translation_cache
+from cache.results import result_cache, sql_tables
+from cache.singleflight import single_flight
+from cache.history import history
+from cache.warmer import cache_warmer, HISTORY_WARM_ENABLED
+from langchain_agent.llm_gateway import llm_gateway
+from langchain_agent.deadline import request_deadline, DeadlineExceeded, within_deadline
+from db.pagination import decode_cursor, PaginationError
+from db import mysql, mongo, pool_stats
+from db.index_advisor import index_advisor, INDEX_ADVISOR_ALLOW_APPLY, INDEX_ADVISOR_TOP
+from db.guardrails import reset_admissions
+from db.rollups import rollups, ROLLUPS_ENABLED, ROLLUP_TABLES
+from db.schema_catalog import schema_catalog
+from encoding import encode_response
+from observability import get_logger, span, request_scope, register_collector, render_metrics
 
-from functools import lru_cache
+from contextlib import asynccontextmanager
+from functools import cached_property
+from decimal import Decimal
+from datetime import date, datetime
+import asyncio
+import json
 import re
+import time
+
+log = get_logger("API")
+batch_log = get_logger("Batch")
 
 def clean_llm_output(output):
     if isinstance(output, dict):
@@ -30,31 +53,104 @@ Question: {query}
 Respond with only 'mongo' or 'sql'.
 """
 
-def get_default_llm():
-    # Always use OpenRouter for better SQL generation
-    return ChatOpenAI(
-        model_name="deepseek/deepseek-r1-0528:free",
-        openai_api_key=os.getenv("OPENROUTER_API_KEY"),
-        openai_api_base="https://openrouter.ai/api/v1",
-    )
+async def classify_query_async(query: str) -> str:
+    with span("classify"):
+        # Local router first; only ask the LLM when it is not confident enough
+        routed = query_router.route(query)
+        if routed is not None:
+            return routed
+        prompt = CLASSIFIER_PROMPT.format(query=query)
+        result = (await llm_gateway.apredict(prompt)).strip().lower()
+        db_type = 'mongo' if 'mongo' in result else 'sql'
+        query_router.record("llm", db_type)
+        # Learned once the question is answered this way, so similar questions stay local next time
+        query_router.propose(query, db_type)
+        return db_type
+
+class Tools:
+    """
+    The query tools, built on first use so importing this module does not pull in
+    LangChain. The lifespan builds them before the first request.
+    """
+    @cached_property
+    def sql(self):
+        from langchain_agent.sql_tool import SQLTool
+        return SQLTool()
+
+    @cached_property
+    def mongo(self):
+        from langchain_agent.mongo_tool import MongoTool
+        return MongoTool()
+
+    @cached_property
+    def federated(self):
+        from langchain_agent.federated import FederatedTool
+        return FederatedTool()
+
+    def load(self):
+        return self.sql, self.mongo, self.federated
+
+    @property
+    def loaded(self):
+        return all(name in self.__dict__ for name in ("sql", "mongo", "federated"))
+
+tools = Tools()
+
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "10"))
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "2"))
+
+# Outcome of each warm-up step, reported by /ready
+warmup = {}
 
-def classify_query(query: str) -> str:
-    llm = get_default_llm()
-    prompt = CLASSIFIER_PROMPT.format(query=query)
-    result = llm.predict(prompt).strip().lower()
-    if 'mongo' in result:
-        return 'mongo'
-    return 'sql'
+async def warm(name, start):
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(start(), WARMUP_TIMEOUT)
+        warmup[name] = {"ready": True}
+    except Exception as e:
+        # A dependency that is down must not stop the worker from starting; /ready reports it
+        log.warning(f"Warm-up of {name} failed: {type(e).__name__}: {e}")
+        warmup[name] = {"ready": False, "error": f"{type(e).__name__}: {e}"}
+    warmup[name]["warmup_ms"] = round((time.perf_counter() - started) * 1000, 1)
 
-mongo_tool = MongoTool()
-sql_tool = SQLTool()
+@asynccontextmanager
+async def lifespan(app):
+    # Heavy imports and the first connection to every store, once per worker and concurrently
+    started = time.perf_counter()
+    await asyncio.gather(
+        warm("tools", lambda: asyncio.to_thread(tools.load)),
+        warm("llm", lambda: asyncio.to_thread(llm_gateway.warm)),
+        warm("mysql", mysql.ping),
+        warm("mongo", mongo.ping),
+        warm("schema", schema_catalog.ensure),
+        # The first read of the data versions is the only one that waits for SQLite
+        asyncio.to_thread(result_cache.versions.snapshot),
+        # Replicas take reads only after their lag has been measured
+        *([warm("replicas", mysql.replicas.check)] if mysql.MYSQL_REPLICAS else []),
+    )
+    log.info("Startup complete", extra={"fields": {
+        "startup_ms": round((time.perf_counter() - started) * 1000, 1),
+        **{f"{name}_ms": step["warmup_ms"] for name, step in warmup.items()},
+    }})
+    tasks = []
+    if ROLLUPS_ENABLED:
+        tasks.append(asyncio.create_task(rollups.run(mysql.AsyncSessionLocal)))
+    if mysql.MYSQL_REPLICAS:
+        tasks.append(asyncio.create_task(mysql.replicas.run()))
+    if HISTORY_WARM_ENABLED:
+        tasks.append(asyncio.create_task(cache_warmer.run(warm_question)))
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await mysql.dispose()
+    mongo.close()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Allow frontend dev
-from pydantic_settings import BaseSettings
-import os
-from dotenv import load_dotenv
+# from pydantic_settings import BaseSettings
+# from dotenv import load_dotenv
 # load_dotenv()
 # class Settings(BaseSettings):
 #     FRONTEND_URL: str = os.getenv("FRONTEND_URL")
@@ -73,43 +169,545 @@ app.add_middleware(
 def health():
     return {"status": "ok"}
 
-@app.post("/query", response_model=QueryResponse)
-def query_endpoint(req: QueryRequest):
+async def check(ping):
     try:
-        # Classify the query
-        db_type = classify_query(req.query)
-        print(f"[API] Query classified as: {db_type}")
-        if db_type == 'mongo':
-            print(f"[API] Calling MongoDB tool with query: {req.query}")
-            tool_result = mongo_tool._run(req.query)
-        else:
-            print(f"[API] Calling SQL tool with query: {req.query}")
-            tool_result = sql_tool._run(req.query)
-        cleaned_result = clean_llm_output(tool_result)
-        if isinstance(cleaned_result, dict):
-            text = cleaned_result.get("text", "No answer available.")
-            table = {
-                "columns": cleaned_result.get("columns", []),
-                "rows": cleaned_result.get("rows", [])
-            } if ("columns" in cleaned_result and "rows" in cleaned_result) else {"columns": [], "rows": []}
-            chart = cleaned_result.get("chart", None)
-        else:
-            text = str(cleaned_result)
-            table = {"columns": [], "rows": []}
-            chart = None
+        await asyncio.wait_for(ping(), READY_TIMEOUT)
+        return {"ready": True}
+    except Exception as e:
+        return {"ready": False, "error": f"{type(e).__name__}: {e}"}
+
+@app.get("/ready")
+async def ready():
+    # /health says the process is up; /ready says whether it can answer questions right now
+    mysql_check, mongo_check = await asyncio.gather(check(mysql.ping), check(mongo.ping))
+    dependencies = {
+        "tools": {"ready": tools.loaded},
+        "llm": {"ready": llm_gateway.breaker.state != "open", "breaker": llm_gateway.breaker.state},
+        # The built-in schema still answers questions, so the catalog never blocks readiness
+        "schema": {"ready": True, "source": schema_catalog.catalog["source"], "version": schema_catalog.version},
+        "mysql": mysql_check,
+        "mongo": mongo_check,
+    }
+    if mysql.MYSQL_REPLICAS:
+        # Reads fail over to the primary, so lagging or missing replicas never block readiness
+        replicas = mysql.replicas.stats()
+        dependencies["replicas"] = {"ready": True, "healthy": replicas["healthy"], "configured": len(replicas["replicas"])}
+    for name, step in warmup.items():
+        dependencies[name]["warmup_ms"] = step["warmup_ms"]
+    status = "ready" if all(d["ready"] for d in dependencies.values()) else "not_ready"
+    return JSONResponse(status_code=200 if status == "ready" else 503,
+                        content={"status": status, "dependencies": dependencies})
+
+@app.get("/router/stats")
+def router_stats():
+    return query_router.stats()
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {
+        "translation": translation_cache.stats(),
+        "results": result_cache.stats(),
+        "singleflight": single_flight.stats(),
+    }
+
+@app.get("/llm/stats")
+def llm_stats():
+    return llm_gateway.stats()
+
+@app.get("/indexes/advice")
+async def index_advice(top: int = INDEX_ADVISOR_TOP):
+    return await index_advisor.advise(mysql.AsyncSessionLocal, mongo.async_db, top)
+
+@app.post("/indexes/apply")
+async def apply_indexes(top: int = INDEX_ADVISOR_TOP):
+    # Building indexes on a large table is an operational decision, so it is opt-in
+    if not INDEX_ADVISOR_ALLOW_APPLY:
+        return JSONResponse(status_code=403, content={"error": "Set INDEX_ADVISOR_ALLOW_APPLY=1 to let the API create indexes"})
+    created = await index_advisor.apply(mysql.AsyncSessionLocal, mongo.async_db, top)
+    reset_admissions()
+    return created
+
+@app.get("/schema")
+def schema():
+    return schema_catalog.stats()
+
+@app.post("/schema/refresh")
+async def refresh_schema():
+    await schema_catalog.refresh()
+    # Admission decisions depend on which tables are allowed
+    reset_admissions()
+    return schema_catalog.stats()
+
+@app.get("/db/stats")
+def db_stats():
+    return {"pools": pool_stats.snapshot(), "replicas": mysql.replicas.stats()}
+
+@app.get("/history")
+def search_history(q: str = "", limit: int = 20):
+    # Prefix then fuzzy matches on past questions, or the most recent ones without `q`
+    return history.search(q, limit)
+
+@app.get("/history/popular")
+def popular_history(n: int = 20):
+    return history.popular(n)
+
+@app.get("/history/stats")
+def history_stats():
+    return {"history": history.stats(), "warmer": cache_warmer.stats()}
+
+@app.post("/history/warm")
+async def warm_history():
+    return await cache_warmer.warm(warm_question)
+
+@app.get("/rollups/stats")
+def rollup_stats():
+    return rollups.stats()
+
+@app.post("/rollups/refresh")
+async def refresh_rollups(full: bool = False):
+    mode = await rollups.refresh(mysql.AsyncSessionLocal, full=full)
+    return {"mode": mode, **rollups.stats()}
+
+@register_collector
+def service_metrics():
+    llm = llm_gateway.stats()
+    translation = translation_cache.stats()
+    results = result_cache.stats()
+    coalescing = single_flight.stats()
+    router = query_router.stats()
+    rollup = rollups.stats()
+    pools = pool_stats.snapshot()
+    replica_set = mysql.replicas.stats()
+    warmer = cache_warmer.stats()
+    return [
+        ("insightlens_llm_tokens_total", "LLM tokens used", "counter",
+         [({"kind": "prompt"}, llm["prompt_tokens"]), ({"kind": "completion"}, llm["completion_tokens"])]),
+        ("insightlens_llm_calls_total", "LLM gateway calls by outcome", "counter",
+         [({"outcome": name}, llm[name]) for name in ("requests", "retries", "failures", "rejected")]),
+        ("insightlens_cache_hit_ratio", "Cache hit rate since start", "gauge",
+         [({"cache": "translation"}, translation["hit_rate"]), ({"cache": "results"}, results["hit_rate"])]),
+        ("insightlens_cache_lookups_total", "Cache lookups by outcome", "counter",
+         [({"cache": "translation", "outcome": name}, translation[name]) for name in ("memory_hits", "disk_hits", "misses")]
+         + [({"cache": "results", "outcome": name}, results[name]) for name in ("hits", "misses", "stale")]),
+        ("insightlens_singleflight_total", "Query executions and coalesced duplicates", "counter",
+         [({"outcome": name}, coalescing[name]) for name in ("executions", "coalesced", "shared_hits")]),
+        ("insightlens_route_decisions_total", "Routing decisions by path and store", "counter",
+         [({"path": path, "store": store}, count) for path in ("router", "llm") for store, count in router[path].items()]),
+        ("insightlens_rollup_refreshes_total", "Rollup refreshes by kind", "counter",
+         [({"kind": name}, rollup[name]) for name in ("incremental", "full", "skipped")]),
+        ("insightlens_rollup_rewrites_total", "Queries answered from rollups", "counter",
+         [({}, rollup["rewrites"])]),
+        ("insightlens_rollup_age_seconds", "Seconds since the rollups were last known current", "gauge",
+         [({}, rollup["age_seconds"])] if rollup["age_seconds"] is not None else []),
+        ("insightlens_db_pool_checkouts_total", "Connections handed out by each pool", "counter",
+         [({"pool": name}, p["checkouts"]) for name, p in pools.items()]),
+        ("insightlens_db_pool_wait_seconds_total", "Time spent waiting for a pooled connection", "counter",
+         [({"pool": name}, p["wait_seconds"]) for name, p in pools.items()]),
+        ("insightlens_db_pool_checkout_failures_total", "Checkouts that timed out or failed", "counter",
+         [({"pool": name, "reason": reason}, p[reason]) for name, p in pools.items() for reason in ("timeouts", "errors")]),
+        ("insightlens_db_pool_checked_out", "Connections currently in use", "gauge",
+         [({"pool": name}, p["checked_out"]) for name, p in pools.items() if "checked_out" in p]),
+        ("insightlens_db_replica_lag_seconds", "Replication lag at the last check", "gauge",
+         [({"replica": name}, r["lag_seconds"]) for name, r in replica_set["replicas"].items() if r["lag_seconds"] is not None]),
+        ("insightlens_db_replica_healthy", "Whether a replica takes reads", "gauge",
+         [({"replica": name}, int(r["healthy"])) for name, r in replica_set["replicas"].items()]),
+        ("insightlens_db_reads_total", "Generated queries by where they ran", "counter",
+         [({"target": name}, r["reads"]) for name, r in replica_set["replicas"].items()]
+         + [({"target": "primary", "reason": reason}, replica_set[key])
+            for reason, key in (("no_healthy_replica", "primary_reads"), ("recent_write", "recent_write_reads"))]),
+        ("insightlens_cache_warmups_total", "Cache warm-up runs", "counter", [({}, warmer["runs"])]),
+        ("insightlens_cache_warmed_questions_total", "Questions re-run by the cache warmer by outcome", "counter",
+         [({"outcome": "warmed"}, warmer["warmed"]), ({"outcome": "failed"}, warmer["failed"])]),
+    ]
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+def build_response(tool_result):
+    cleaned_result = clean_llm_output(tool_result)
+    if isinstance(cleaned_result, dict):
+        text = cleaned_result.get("text", "No answer available.")
+        table = {
+            "columns": cleaned_result.get("columns", []),
+            "rows": cleaned_result.get("rows", [])
+        } if ("columns" in cleaned_result and "rows" in cleaned_result) else {"columns": [], "rows": []}
+        chart = cleaned_result.get("chart", None)
+        next_cursor = cleaned_result.get("next_cursor")
+        truncated = cleaned_result.get("truncated", False)
+        error = cleaned_result.get("error")
+        freshness = cleaned_result.get("freshness")
+        if freshness is not None and freshness.get("as_of") is not None:
+            freshness = {**freshness, "age_seconds": round(max(time.time() - freshness["as_of"], 0.0), 1)}
+    else:
+        text = str(cleaned_result)
+        table = {"columns": [], "rows": []}
+        chart = None
+        next_cursor = None
+        truncated = False
+        error = None
+        freshness = None
+    return {
+        "text": text or "No answer available.",
+        "table": table if table else {"columns": [], "rows": []},
+        "chart": chart if chart else None,
+        "next_cursor": next_cursor,
+        "truncated": truncated,
+        "error": error,
+        "freshness": freshness
+    }
+
+def error_response(e):
+    log.exception(f"Error: {e}", extra={"fields": {"error_type": type(e).__name__}})
+    return {
+        "text": f"Sorry, I couldn't process your question. Please try rephrasing or ask about client profiles or portfolios. (Error: {e})",
+        "table": {"columns": [], "rows": []},
+        "chart": None
+    }
+
+async def run_next_page(cursor: str):
+    # Follow-up pages re-run only the cheap paginated query: no routing, no LLM
+    state = decode_cursor(cursor)
+    tool = tools.mongo if state["store"] == 'mongo' else tools.sql
+    return build_response(await tool.anext_page(state))
+
+async def run_query(query: str, page_size: int = None):
+    # Questions that need client profiles and portfolios together are joined across both stores
+    plan = tools.federated.plan(query)
+    if plan is not None:
+        log.debug(f"Calling federated tool with plan: {plan}")
+        response = build_response(await tools.federated._arun(query, page_size=page_size, plan=plan))
+        return {**response, "route": "federated", "generated_query": {"query": plan}}
+    # Classify the query
+    db_type = await classify_query_async(query)
+    log.debug(f"Query classified as: {db_type}")
+    # Translate first, then run, so the response can say which query answered it
+    if db_type == 'mongo':
+        log.debug(f"Calling MongoDB tool with query: {query}")
+        mongo_filter, fallback = await tools.mongo._atranslate(query)
+        if fallback is not None:
+            return {**build_response(fallback), "route": db_type}
+        tool_result = await tools.mongo.aexecute(query, mongo_filter, page_size)
+        generated = {"query": mongo_filter}
+    else:
+        log.debug(f"Calling SQL tool with query: {query}")
+        translation, fallback = await tools.sql._atranslate(query)
+        if fallback is not None:
+            return {**build_response(fallback), "route": db_type}
+        sql_query, params = translation
+        tool_result = await tools.sql.aexecute(query, sql_query, params, page_size)
+        generated = {"query": sql_query, "params": params}
+    return {**build_response(tool_result), "route": db_type, "generated_query": generated}
+
+def response_error(response):
+    """Why a response is a failure, for the history; None when it answered the question."""
+    error = response.get("error")
+    if error:
+        return error.get("code") if isinstance(error, dict) else str(error)
+    # Every failure message without a structured error starts with "Sorry"
+    return "failed" if response.get("text", "").startswith("Sorry") else None
+
+def learn_route(question, route, rows, error):
+    # An LLM routing decision is only worth learning when it led to an answer
+    if route in ("sql", "mongo") and rows and error is None:
+        query_router.confirm(question, route)
+
+def record_history(question, endpoint, started, response):
+    rows = len((response.get("table") or {}).get("rows") or [])
+    error = response_error(response)
+    history.record(
+        question, endpoint, (time.perf_counter() - started) * 1000,
+        route=response.get("route"), query=response.get("generated_query"), rows=rows, error=error,
+    )
+    learn_route(question, response.get("route"), rows, error)
+
+async def answer_query(req: QueryRequest):
+    try:
+        # One budget for routing, generation and execution together
+        with request_deadline():
+            if req.cursor:
+                return await run_next_page(req.cursor)
+            if not req.query.strip():
+                return {
+                    "text": "Please ask a question about client profiles or portfolios.",
+                    "table": {"columns": [], "rows": []},
+                    "chart": None
+                }
+            # Identical questions already in flight share that execution
+            key = single_flight.key(req.query, req.page_size)
+            return await within_deadline(
+                single_flight.do(key, lambda: run_query(req.query, page_size=req.page_size)), "Query"
+            )
+    except PaginationError as e:
+        log.warning(f"Rejected cursor: {e}")
         return {
-            "text": text or "No answer available.",
-            "table": table if table else {"columns": [], "rows": []},
-            "chart": chart if chart else None
+            "text": "Sorry, that page link is invalid. Please ask your question again.",
+            "table": {"columns": [], "rows": []},
+            "chart": None
         }
-    except Exception as e:
-        import traceback
-        print(f"[API] Error: {e}")
-        print(f"[API] Error type: {type(e)}")
-        print(f"[API] Full traceback:")
-        traceback.print_exc()
+    except DeadlineExceeded as e:
+        log.warning(f"{e}")
         return {
-            "text": f"Sorry, I couldn't process your question. Please try rephrasing or ask about client profiles or portfolios. (Error: {e})",
+            "text": "Sorry, your question took too long to answer. Please try again or ask a narrower question.",
             "table": {"columns": [], "rows": []},
             "chart": None
         }
+    except Exception as e:
+        return error_response(e)
+
+@app.post("/query", response_model=QueryResponse)
+async def query_endpoint(req: QueryRequest, request: Request):
+    with request_scope("query"):
+        started = time.perf_counter()
+        result = await answer_query(req)
+        # Follow-up pages are not new questions
+        if not req.cursor:
+            record_history(req.query, "query", started, result)
+        with span("serialize"):
+            # Columnar JSON / Arrow skip response_model validation entirely
+            encoded = encode_response(result, request.headers.get("accept", ""), request.headers.get("accept-encoding", ""))
+            if encoded is not None:
+                return encoded
+            # Same validation and encoding FastAPI would do for response_model, but timed
+            return JSONResponse(jsonable_encoder(QueryResponse.model_validate(result)))
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value)
+
+def encode_event(event, data, sse=False):
+    payload = json.dumps(data, default=_json_default)
+    if sse:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return json.dumps({"event": event, "data": data}, default=_json_default) + "\n"
+
+async def stream_events(query: str):
+    """(event, data) pairs for one question: route, query, columns, rows (batched), chart, done."""
+    plan = tools.federated.plan(query)
+    if plan is not None:
+        yield "route", {"db": "federated"}
+        async for event, data in tools.federated.astream(query, plan=plan):
+            yield event, data
+        return
+    db_type = await classify_query_async(query)
+    yield "route", {"db": db_type}
+    tool = tools.mongo if db_type == 'mongo' else tools.sql
+    async for event, data in tool.astream(query):
+        yield event, data
+
+async def stream_query(query: str, sse: bool = False):
+    """
+    Emit pipeline stages as they happen: route, query, columns, rows (batched), chart, done.
+    """
+    with request_scope("stream"), request_deadline():
+        started = time.perf_counter()
+        trace = {"route": None, "generated_query": None, "rows": 0, "error": None}
+        try:
+            async for event, data in stream_events(query):
+                if event == "route":
+                    trace["route"] = data["db"]
+                elif event == "query":
+                    trace["generated_query"] = data
+                elif event == "rows":
+                    trace["rows"] += len(data)
+                elif event == "error":
+                    trace["error"] = (data.get("error") or {}).get("code") or "failed"
+                elif event == "done" and data.get("error"):
+                    # Answered, but not the question asked (e.g. the fallback query)
+                    trace["error"] = data["error"]["code"]
+                yield encode_event(event, data, sse)
+        except DeadlineExceeded as e:
+            log.warning(f"{e}")
+            trace["error"] = "deadline"
+            yield encode_event("error", {"text": "Sorry, your question took too long to answer. Please try again or ask a narrower question."}, sse)
+        except Exception as e:
+            trace["error"] = "failed"
+            yield encode_event("error", {"text": error_response(e)["text"]}, sse)
+        history.record(query, "stream", (time.perf_counter() - started) * 1000, route=trace["route"],
+                       query=trace["generated_query"], rows=trace["rows"], error=trace["error"])
+        learn_route(query, trace["route"], trace["rows"], trace["error"])
+
+async def warm_question(question: str, endpoint: str):
+    """
+    Answer a question the way its askers did, so that path's translation and result
+    caches are filled. Returns an error message, or None when it was answered.
+    """
+    with request_deadline():
+        if endpoint == "stream":
+            async for event, data in stream_events(question):
+                if event == "error":
+                    return data["text"]
+                if event == "done" and data.get("error"):
+                    return data["error"]["code"]
+            return None
+        # A user asking the same question meanwhile shares this run
+        key = single_flight.key(question, None)
+        return response_error(await single_flight.do(key, lambda: run_query(question)))
+
+@app.post("/query/stream")
+async def query_stream_endpoint(req: QueryRequest, request: Request):
+    # NDJSON by default; Server-Sent Events when the client asks for them
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(stream_query(req.query, sse), media_type=media_type)
+
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "100"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+BATCH_DEADLINE_SECONDS = float(os.getenv("BATCH_DEADLINE_SECONDS", "300"))
+
+def deadline_response():
+    return {
+        "text": "Sorry, your question took too long to answer. Please try again or ask a narrower question.",
+        "table": {"columns": [], "rows": []},
+        "chart": None
+    }
+
+async def translate_batch_item(query: str, semaphore):
+    """Route and translate one question. Returns (store, translation) or ("done", response)."""
+    async with semaphore:
+        plan = tools.federated.plan(query)
+        if plan is not None:
+            return "federated", plan
+        db_type = await classify_query_async(query)
+        if db_type == 'mongo':
+            mongo_filter, fallback = await tools.mongo._atranslate(query)
+            if fallback is not None:
+                return "done", build_response(fallback)
+            return "mongo", mongo_filter
+        translation, fallback = await tools.sql._atranslate(query)
+        if fallback is not None:
+            return "done", build_response(fallback)
+        return "sql", translation
+
+async def run_batch(queries, page_size, on_result):
+    """
+    Classify and translate every question in parallel (at most BATCH_MAX_CONCURRENCY
+    at a time), then execute grouped per store: all SQL on one session, Mongo and
+    federated work in their own lanes. on_result(query, response) is awaited as each
+    question finishes; a failing question only fails itself.
+    """
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+    lanes = {"sql": [], "mongo": [], "federated": []}
+    started = time.perf_counter()
+
+    async def finish(query, response):
+        record_history(query, "batch", started, response)
+        await on_result(query, response)
+
+    async def translate(query):
+        if not query.strip():
+            return await finish(query, {
+                "text": "Please ask a question about client profiles or portfolios.",
+                "table": {"columns": [], "rows": []},
+                "chart": None
+            })
+        try:
+            store, translation = await translate_batch_item(query, semaphore)
+        except DeadlineExceeded as e:
+            batch_log.warning(f"{e}")
+            return await finish(query, deadline_response())
+        except Exception as e:
+            return await finish(query, error_response(e))
+        if store == "done":
+            return await finish(query, translation)
+        lanes[store].append((query, translation))
+
+    await asyncio.gather(*(translate(query) for query in queries))
+
+    async def execute(query, run, route, generated):
+        try:
+            response = {**build_response(await run()), "route": route, "generated_query": generated}
+        except DeadlineExceeded as e:
+            batch_log.warning(f"{e}")
+            response = deadline_response()
+        except Exception as e:
+            response = error_response(e)
+        await finish(query, response)
+
+    async def sql_lane():
+        if not lanes["sql"]:
+            return
+        # One connection for the whole SQL group instead of one per question
+        # Any of these may be rewritten onto the rollups, so their tables count as read too
+        tables = sorted({t for _, (sql_query, _) in lanes["sql"] for t in sql_tables(sql_query)} | ROLLUP_TABLES)
+        async with mysql.AsyncReadSessionLocal(tables) as session:
+            for query, (sql_query, params) in lanes["sql"]:
+                await execute(query, lambda: tools.sql.aexecute(query, sql_query, params, page_size, session=session),
+                              "sql", {"query": sql_query, "params": params})
+
+    async def mongo_lane():
+        for query, mongo_filter in lanes["mongo"]:
+            await execute(query, lambda: tools.mongo.aexecute(query, mongo_filter, page_size), "mongo", {"query": mongo_filter})
+
+    async def federated_lane():
+        for query, plan in lanes["federated"]:
+            await execute(query, lambda: tools.federated._arun(query, page_size=page_size, plan=plan),
+                          "federated", {"query": plan})
+
+    batch_log.info(f"{len(queries)} questions: " + ", ".join(f"{store}={len(items)}" for store, items in lanes.items()))
+    await asyncio.gather(sql_lane(), mongo_lane(), federated_lane())
+
+def dedupe_batch(queries, page_size):
+    """Unique questions (by normalized text) and, for each, the request positions asking it."""
+    positions = {}
+    unique = []
+    for index, query in enumerate(queries):
+        key = single_flight.key(query, page_size)
+        if key not in positions:
+            positions[key] = []
+            unique.append((key, query))
+        positions[key].append(index)
+    return unique, positions
+
+async def stream_batch(req: BatchQueryRequest, unique, positions):
+    queue = asyncio.Queue()
+    keys = {query: key for key, query in unique}
+
+    async def on_result(query, response):
+        await queue.put((query, response))
+
+    async def produce():
+        with request_scope("batch"), request_deadline(BATCH_DEADLINE_SECONDS):
+            await run_batch([query for _, query in unique], req.page_size, on_result)
+        await queue.put(None)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            query, response = item
+            for index in positions[keys[query]]:
+                yield json.dumps({"index": index, "query": req.queries[index], "result": response}, default=_json_default) + "\n"
+    finally:
+        producer.cancel()
+
+@app.post("/query/batch", response_model=BatchQueryResponse)
+async def query_batch_endpoint(req: BatchQueryRequest):
+    if len(req.queries) > BATCH_MAX_QUERIES:
+        # Rejected whole rather than answering only the first BATCH_MAX_QUERIES
+        return JSONResponse(status_code=413, content={
+            "error": f"A batch holds at most {BATCH_MAX_QUERIES} questions; this one has {len(req.queries)}. Split it into smaller batches."
+        })
+    queries = req.queries
+    unique, positions = dedupe_batch(queries, req.page_size)
+    batch_log.info(f"{len(queries)} questions, {len(unique)} unique")
+    if req.stream:
+        return StreamingResponse(stream_batch(req, unique, positions), media_type="application/x-ndjson")
+    responses = {}
+
+    async def on_result(query, response):
+        responses[query] = response
+
+    with request_scope("batch"), request_deadline(BATCH_DEADLINE_SECONDS):
+        await run_batch([query for _, query in unique], req.page_size, on_result)
+    results = []
+    for key, query in unique:
+        for index in positions[key]:
+            results.append({"index": index, "query": queries[index], "result": responses[query]})
+    results.sort(key=lambda r: r["index"])
+    return {"results": results, "unique": len(unique)}
@@ -0,0 +1,187 @@
+"""
+Structured logging, per-request stage timings and Prometheus metrics.
+
+- get_logger(name) returns a level-gated logger (LOG_LEVEL, default INFO).
+  Lines are JSON by default (LOG_FORMAT=text for plain lines) and carry the
+  current request id. Prompts, raw LLM output and result rows are DEBUG only.
+- span(stage) times one pipeline stage (classify, prompt_build, llm, parse,
+  db_execute, fetch, chart, serialize) into insightlens_stage_seconds and
+  into the current request's timing summary.
+- request_scope(endpoint) wraps one request and logs a single summary line.
+- render_metrics() produces the Prometheus text format for /metrics. Gauges
+  from the caches, router and LLM gateway are read at scrape time.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_request_id = contextvars.ContextVar("insightlens_request_id", default=None)
+_timings = contextvars.ContextVar("insightlens_timings", default=None)
+
+# --- logging -------------------------------------------------------------------
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        request_id = _request_id.get()
+        if request_id:
+            entry["request_id"] = request_id
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"[{record.name.rsplit('.', 1)[-1]}] {record.getMessage()}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+_root = logging.getLogger("insightlens")
+if not _root.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+    _root.addHandler(_handler)
+    _root.setLevel(LOG_LEVEL)
+    _root.propagate = False
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"insightlens.{name}")
+
+# --- metrics ---------------------------------------------------------------------
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in labels) + "}"
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, n) in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_label_text(key + (('le', bound),))} {count}")
+                lines.append(f"{self.name}_bucket{_label_text(key + (('le', '+Inf'),))} {n}")
+                lines.append(f"{self.name}_sum{_label_text(key)} {total}")
+                lines.append(f"{self.name}_count{_label_text(key)} {n}")
+        return lines
+
+STAGE_SECONDS = Histogram("insightlens_stage_seconds", "Time spent per pipeline stage")
+REQUEST_SECONDS = Histogram("insightlens_request_seconds", "End-to-end request latency")
+REQUESTS_TOTAL = Counter("insightlens_requests_total", "Requests served")
+
+_collectors = []
+
+def register_collector(fn):
+    """fn() returns [(name, help, type, [(labels_dict, value), ...]), ...], read at scrape time."""
+    _collectors.append(fn)
+    return fn
+
+def render_metrics() -> str:
+    lines = []
+    for metric in (STAGE_SECONDS, REQUEST_SECONDS, REQUESTS_TOTAL):
+        lines += metric.render()
+    for collector in _collectors:
+        for name, help_text, kind, samples in collector():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for labels, value in samples:
+                lines.append(f"{name}{_label_text(tuple(sorted(labels.items())))} {value}")
+    return "\n".join(lines) + "\n"
+
+# --- spans -----------------------------------------------------------------------
+
+@contextmanager
+def span(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+@contextmanager
+def request_scope(endpoint: str):
+    """Request id and stage timings for one request, logged as one line at the end."""
+    request_token = _request_id.set(uuid.uuid4().hex[:12])
+    timings = {}
+    timings_token = _timings.set(timings)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield timings
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+        REQUESTS_TOTAL.inc(endpoint=endpoint, status=status)
+        get_logger("API").info("request finished", extra={"fields": {
+            "endpoint": endpoint,
+            "status": status,
+            "duration_ms": round(elapsed * 1000, 1),
+            "stages_ms": {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()},
+        }})
+        _timings.reset(timings_token)
+        _request_id.reset(request_token)
@@ -2,7 +2,10 @@ from pydantic import BaseModel
 from typing import Optional, Any, List
 
 class QueryRequest(BaseModel):
-    query: str
+    query: str = ""
+    # Opaque continuation token from a previous QueryResponse.next_cursor
+    cursor: Optional[str] = None
+    page_size: Optional[int] = None
 
 class TableResult(BaseModel):
     columns: list[str]
@@ -11,8 +14,44 @@ class TableResult(BaseModel):
 class ChartResult(BaseModel):
     labels: list[str]
     data: list[Any]
+    # Set when the chart only covers the first rows of a streamed result
+    truncated: bool = False
+
+class QueryError(BaseModel):
+    code: str
+    reason: str
+    estimated_rows: Optional[int] = None
+    budget: Optional[int] = None
+
+class Freshness(BaseModel):
+    # "rollup" when answered from a materialized rollup, "live" when read from the base tables
+    source: str
+    as_of: Optional[float] = None
+    age_seconds: Optional[float] = None
 
 class QueryResponse(BaseModel):
     text: str
     table: Optional[TableResult] = None
     chart: Optional[ChartResult] = None
+    next_cursor: Optional[str] = None
+    truncated: bool = False
+    error: Optional[QueryError] = None
+    freshness: Optional[Freshness] = None
+    # "sql", "mongo" or "federated", and the query that answered the question
+    route: Optional[str] = None
+    generated_query: Optional[dict] = None
+
+class BatchQueryRequest(BaseModel):
+    queries: list[str]
+    page_size: Optional[int] = None
+    # Stream one NDJSON line per question as soon as it finishes
+    stream: bool = False
+
+class BatchQueryResult(BaseModel):
+    index: int
+    query: str
+    result: QueryResponse
+
+class BatchQueryResponse(BaseModel):
+    results: list[BatchQueryResult]
+    unique: int
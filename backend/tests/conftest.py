@@ -0,0 +1,87 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Caches, history and rollup state go to a scratch directory, never the developer's
+os.environ.setdefault("CACHE_DIR", tempfile.mkdtemp(prefix="insightlens-tests-"))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "bench"))
+
+CLIENT_DOCS = [
+    {"name": "Alice", "risk": "High", "age": 45, "city": "Mumbai", "preferences": ["tech"]},
+    {"name": "Bob", "risk": "Low", "age": 52, "city": "Delhi", "preferences": ["energy"]},
+    {"name": "Charlie", "risk": "High", "age": 38, "city": "Pune", "preferences": []},
+]
+PORTFOLIO_ROWS = [
+    ("Alice", 10_000_000, "Rajiv Mehra", "HDFC Bank"),
+    ("Bob", 8_500_000, "Priya Shah", "Reliance"),
+    ("Charlie", 7_000_000, "Rajiv Mehra", "Infosys"),
+    ("Diana", 6_000_000, "Priya Shah", "Reliance"),
+]
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """
+    A TestClient for main.app over SQLite and mongomock, with the benchmark's canned
+    LLM and no local shortcuts (router, templates, federated plans), like bench_e2e.py.
+    The lifespan does not run.
+    """
+    pytest.importorskip("aiosqlite")
+    mongomock = pytest.importorskip("mongomock")
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import sqlite3
+
+    from fastapi.testclient import TestClient
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from sqlalchemy.pool import NullPool
+
+    import db.mongo
+    import db.mysql
+    import main
+    from bench_e2e import CANNED, FakeLLM, FakeSyncLLM
+    from cache.results import result_cache
+    from cache.translation import translation_cache
+    from db.guardrails import reset_admissions
+    from langchain_agent import federated, mongo_tool, sql_tool
+    from langchain_agent.llm_gateway import llm_gateway
+    from langchain_agent.router import query_router
+
+    path = str(tmp_path / "portfolios.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE portfolios (id INTEGER PRIMARY KEY, client_name TEXT, "
+                     "portfolio_value NUMERIC, relationship_manager TEXT, stock TEXT)")
+        conn.executemany("INSERT INTO portfolios (client_name, portfolio_value, relationship_manager, stock) "
+                         "VALUES (?, ?, ?, ?)", PORTFOLIO_ROWS)
+    clients = mongomock.MongoClient()
+    clients["wealth"].clients.insert_many([dict(doc) for doc in CLIENT_DOCS])
+    # Every TestClient request runs on a fresh event loop, so connections are not pooled
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+    monkeypatch.setattr(db.mysql, "AsyncSessionLocal", async_sessionmaker(engine, expire_on_commit=False),
+                        raising=False)
+    sync_db = clients["wealth"]
+    async_db = mongomock_motor.AsyncMongoMockClient(mock_mongo_client=clients)["wealth"]
+    for module in (db.mongo, mongo_tool, federated):
+        monkeypatch.setattr(module, "db", sync_db, raising=False)
+        monkeypatch.setattr(module, "async_db", async_db, raising=False)
+
+    monkeypatch.setattr(llm_gateway, "_async_client", FakeLLM(CANNED, 0, 0, 42))
+    monkeypatch.setattr(llm_gateway, "_sync_client", FakeSyncLLM(CANNED, 0, 0, 42))
+    nothing = lambda *args, **kwargs: None
+    monkeypatch.setattr(query_router, "route", nothing)
+    monkeypatch.setattr(sql_tool, "match_sql_template", nothing)
+    monkeypatch.setattr(mongo_tool, "match_mongo_template", nothing)
+    monkeypatch.setattr(mongo_tool, "match_mongo_pipeline", nothing)
+    monkeypatch.setattr(federated, "match_federated", nothing)
+
+    for cache in (result_cache, translation_cache):
+        cache.clear()
+    reset_admissions()
+    yield TestClient(main.app)
+    for cache in (result_cache, translation_cache):
+        cache.clear()
+    reset_admissions()
@@ -0,0 +1,64 @@
+import json
+
+import main
+
+TOP_FIVE = "What are the top five portfolios of our wealth members?"
+TOTAL = "What is the total portfolio value?"
+
+def test_duplicates_are_answered_once(api, monkeypatch):
+    executed = []
+    tool = type(main.tools.sql)
+    aexecute = tool.aexecute
+
+    async def counting(self, query, sql_query, params, page_size=None, session=None):
+        executed.append(query)
+        return await aexecute(self, query, sql_query, params, page_size, session=session)
+
+    # SQLTool is a pydantic model: patch the class, not the instance
+    monkeypatch.setattr(tool, "aexecute", counting)
+    queries = [TOP_FIVE, TOTAL, "  what are the top five portfolios of our wealth members", TOTAL]
+    response = api.post("/query/batch", json={"queries": queries})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["unique"] == 2
+    assert sorted(executed) == sorted([TOP_FIVE, TOTAL])
+    results = body["results"]
+    # One result per question asked, in request order, each with the question as asked
+    assert [r["index"] for r in results] == [0, 1, 2, 3]
+    assert [r["query"] for r in results] == queries
+    assert results[0]["result"] == results[2]["result"]
+    assert results[1]["result"]["table"]["rows"] == [[31_500_000]]
+    assert results[0]["result"]["route"] == "sql"
+
+def test_streamed_batches_emit_a_line_per_question(api):
+    queries = [TOP_FIVE, TOTAL, TOTAL]
+    with api.stream("POST", "/query/batch", json={"queries": queries, "stream": True}) as response:
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.iter_lines() if line]
+    assert sorted(line["index"] for line in lines) == [0, 1, 2]
+    by_index = {line["index"]: line for line in lines}
+    assert by_index[1]["result"] == by_index[2]["result"]
+    assert by_index[0]["query"] == TOP_FIVE
+
+def test_one_failing_question_fails_alone(api, monkeypatch):
+    tool = type(main.tools.sql)
+    translate = tool._atranslate
+
+    async def flaky(self, query):
+        if query == TOTAL:
+            raise RuntimeError("translation failed")
+        return await translate(self, query)
+
+    monkeypatch.setattr(tool, "_atranslate", flaky)
+    results = api.post("/query/batch", json={"queries": [TOP_FIVE, TOTAL, ""]}).json()["results"]
+    assert results[0]["result"]["table"]["rows"]
+    assert results[1]["result"]["table"]["rows"] == []
+    assert "Please ask a question" in results[2]["result"]["text"]
+
+def test_oversized_batches_are_rejected_whole(api, monkeypatch):
+    monkeypatch.setattr(main, "BATCH_MAX_QUERIES", 3)
+    response = api.post("/query/batch", json={"queries": [TOTAL] * 4})
+    assert response.status_code == 413
+    assert "at most 3" in response.json()["error"]
+    # Duplicates count too: the cap is on what was sent
+    assert api.post("/query/batch", json={"queries": [TOTAL] * 3}).status_code == 200
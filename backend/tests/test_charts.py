@@ -0,0 +1,68 @@
+from datetime import date, timedelta
+from decimal import Decimal
+
+import numpy as np
+
+from charts import OTHER_LABEL, ChartAccumulator, build_chart, categorical_chart, lttb
+
+def test_lttb_keeps_the_endpoints_and_the_threshold():
+    x = np.arange(1000, dtype=float)
+    y = np.sin(x / 50)
+    keep = lttb(x, y, 100)
+    assert len(keep) == 100
+    assert keep[0] == 0 and keep[-1] == 999
+    assert np.all(np.diff(keep) > 0)
+
+def test_lttb_keeps_a_spike():
+    x = np.arange(500, dtype=float)
+    y = np.zeros(500)
+    y[321] = 100.0
+    assert 321 in lttb(x, y, 20)
+
+def test_lttb_returns_short_series_whole():
+    x = np.arange(10, dtype=float)
+    assert lttb(x, x, 50).tolist() == list(range(10))
+    assert lttb(x, x, 2).tolist() == list(range(10))
+
+def test_categorical_folds_the_tail_into_other():
+    labels = [f"stock {i}" for i in range(10)]
+    values = list(range(10))
+    chart_labels, data = categorical_chart(labels, values, top_n=3)
+    assert chart_labels == ["stock 9", "stock 8", "stock 7", OTHER_LABEL]
+    assert data == [9.0, 8.0, 7.0, float(sum(range(7)))]
+
+def test_categorical_sums_duplicates_in_query_order():
+    chart_labels, data = categorical_chart(["TCS", "Reliance", "TCS", "Infosys"], [1, Decimal("2.5"), 3, None])
+    # NULL values are dropped, not charted as zero
+    assert chart_labels == ["TCS", "Reliance"]
+    assert data == [4.0, 2.5]
+
+def test_build_chart_downsamples_a_series():
+    start = date(2024, 1, 1)
+    rows = [(start + timedelta(days=i), float(i % 37)) for i in range(2000)]
+    chart = build_chart(["day", "value"], rows[::-1], max_points=50)
+    assert len(chart["labels"]) == len(chart["data"]) == 50
+    # Points come back in date order, from the first day to the last
+    assert chart["labels"][0] == str(start) and chart["labels"][-1] == str(start + timedelta(days=1999))
+    assert chart["label"] == "value"
+
+def test_build_chart_top_n():
+    rows = [(f"RM {i}", i) for i in range(30)]
+    chart = build_chart(["relationship_manager", "total"], rows, top_n=5)
+    assert len(chart["labels"]) == 6 and chart["labels"][-1] == OTHER_LABEL
+    assert sum(chart["data"]) == sum(range(30))
+
+def test_accumulator_marks_truncated_charts():
+    accumulator = ChartAccumulator(["stock", "value"], max_points=5)
+    accumulator.add([("TCS", 1), ("Reliance", 2), ("Infosys", 3)])
+    accumulator.add([("TCS", 4), ("HDFC Bank", 5), ("Wipro", 6)])
+    chart = accumulator.result()
+    assert chart["truncated"] is True
+    # Only the first five rows are charted
+    assert dict(zip(chart["labels"], chart["data"])) == {"TCS": 5.0, "Reliance": 2.0, "Infosys": 3.0, "HDFC Bank": 5.0}
+
+def test_accumulator_within_budget():
+    accumulator = ChartAccumulator(["stock", "value"], max_points=5)
+    accumulator.add([("TCS", 1), ("Reliance", 2)])
+    assert accumulator.result()["truncated"] is False
+    assert ChartAccumulator(["stock", "value"]).result() is None
@@ -0,0 +1,94 @@
+import gzip
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+import encoding
+from encoding import (
+    ARROW_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE, column_type, compress, encode_columnar, encode_response,
+    negotiate_format,
+)
+
+ROWS = [
+    (1, "Alice", Decimal("100.25"), 2.5, date(2024, 1, 31), datetime(2024, 1, 31, 9, 30), True, ["tech"]),
+    (2, "Bob", None, Decimal("3.75"), None, None, False, {"a": 1}),
+    (3, None, Decimal("0.10"), 4, date(2024, 2, 1), datetime(2024, 2, 1, 18, 0), None, None),
+]
+COLUMNS = ["id", "name", "value", "mixed", "since", "updated", "active", "extra"]
+
+def _result(rows=ROWS):
+    return {"text": "Found 3 rows", "table": {"columns": COLUMNS, "rows": rows}, "chart": None,
+            "generated_query": "SELECT ...", "route": "sql"}
+
+def test_column_types():
+    assert [column_type([row[i] for row in ROWS]) for i in range(len(COLUMNS))] == [
+        "int64", "string", "decimal", "float64", "date", "datetime", "bool", "json",
+    ]
+    assert column_type([None, None]) == "string"
+    assert column_type([1, "a"]) == "json"
+
+def test_columnar_round_trip():
+    payload = json.loads(encode_columnar(_result()))
+    assert payload["text"] == "Found 3 rows" and payload["route"] == "sql"
+    table = payload["table"]
+    assert table["row_count"] == 3
+    assert [c["name"] for c in table["columns"]] == COLUMNS
+    data = dict(zip(COLUMNS, table["data"]))
+    assert data["id"] == [1, 2, 3]
+    assert data["value"] == [100.25, None, 0.1]
+    assert data["mixed"] == [2.5, 3.75, 4.0]
+    assert data["since"] == ["2024-01-31", None, "2024-02-01"]
+    assert data["updated"] == ["2024-01-31T09:30:00", None, "2024-02-01T18:00:00"]
+    assert data["active"] == [True, False, None]
+    assert data["extra"] == [["tech"], {"a": 1}, None]
+
+def test_empty_table_encodes():
+    payload = json.loads(encode_columnar({"text": "", "table": None}))
+    assert payload["text"] == "No answer available."
+    assert payload["table"] == {"columns": [], "data": [], "row_count": 0}
+
+def test_arrow_round_trip():
+    pa = pytest.importorskip("pyarrow")
+    body = encoding.encode_arrow(_result())
+    table = pa.ipc.open_stream(body).read_all()
+    assert table.column_names == COLUMNS
+    assert table.column("id").to_pylist() == [1, 2, 3]
+    # Decimals stay exact; the int/float/Decimal mix becomes float64
+    assert table.column("value").to_pylist() == [Decimal("100.25"), None, Decimal("0.10")]
+    assert table.schema.field("mixed").type == pa.float64()
+    assert table.column("mixed").to_pylist() == [2.5, 3.75, 4.0]
+    assert table.column("since").to_pylist() == [date(2024, 1, 31), None, date(2024, 2, 1)]
+    assert [json.loads(v) if v else v for v in table.column("extra").to_pylist()] == [["tech"], {"a": 1}, None]
+    envelope = json.loads(table.schema.metadata[encoding.ARROW_METADATA_KEY])
+    assert envelope["generated_query"] == "SELECT ..." and "table" not in envelope
+
+def test_negotiation(monkeypatch):
+    assert negotiate_format("application/json") is None
+    assert negotiate_format(f"{COLUMNAR_MEDIA_TYPE};q=0.9, application/json") == "columnar"
+    monkeypatch.setattr(encoding, "pa", None)
+    # Without pyarrow Arrow is never chosen
+    assert negotiate_format(f"{ARROW_MEDIA_TYPE}, {COLUMNAR_MEDIA_TYPE}") == "columnar"
+    assert encode_response(_result(), "application/json") is None
+
+@pytest.mark.parametrize("accept_encoding", ["gzip", "zstd", "br, gzip;q=0.5"])
+def test_compression_round_trip(accept_encoding, monkeypatch):
+    if accept_encoding == "zstd":
+        pytest.importorskip("zstandard")
+    monkeypatch.setattr(encoding, "COMPRESSION_MIN_BYTES", 64)
+    rows = [(i, f"client {i}", Decimal(i), 1.5, None, None, True, None) for i in range(200)]
+    response = encode_response(_result(rows), COLUMNAR_MEDIA_TYPE, accept_encoding)
+    content_encoding = response.headers["content-encoding"]
+    if content_encoding == "zstd":
+        body = encoding.zstandard.ZstdDecompressor().decompressobj().decompress(response.body)
+    else:
+        assert content_encoding == "gzip"
+        body = gzip.decompress(response.body)
+    assert body == encode_columnar(_result(rows))
+    assert len(response.body) < len(body)
+    assert response.headers["vary"] == "Accept, Accept-Encoding"
+
+def test_small_bodies_are_not_compressed():
+    assert compress(b"{}", "gzip, zstd") == (b"{}", None)
+    assert compress(b"x" * 4096, "identity") == (b"x" * 4096, None)
@@ -0,0 +1,61 @@
+import pytest
+
+from langchain_agent.extract import JSONExtractor, SQLExtractor, _Extractor
+
+def stream(extractor, text, size=1):
+    """Feed `text` in chunks of `size` characters; returns (result, characters fed until it was found)."""
+    for i in range(0, len(text), size):
+        if extractor.feed(text[i:i + size]) is not None:
+            return extractor.result, i + size
+    return extractor.result, len(text)
+
+@pytest.mark.parametrize("size", [1, 3, 64])
+def test_sql_stops_at_the_first_complete_statement(size):
+    answer = "Sure! SELECT stock, COUNT(*) FROM portfolios GROUP BY stock; Explanation: this counts holders."
+    result, fed = stream(SQLExtractor(), answer, size)
+    assert result == "SELECT stock, COUNT(*) FROM portfolios GROUP BY stock;"
+    # Stopped in the chunk that completed the statement
+    assert fed - size < answer.index(result) + len(result)
+
+def test_sql_skips_reasoning_and_quoted_semicolons():
+    answer = "<think>maybe select a; no</think>SELECT * FROM portfolios WHERE stock = 'a;b' AND x = (1);"
+    result, _ = stream(SQLExtractor(), answer)
+    assert result == "SELECT * FROM portfolios WHERE stock = 'a;b' AND x = (1);"
+
+def test_sql_ends_at_a_closing_fence():
+    result, _ = stream(SQLExtractor(), "```sql\nSELECT relationship_manager FROM portfolios\n``` and more")
+    assert result == "SELECT relationship_manager FROM portfolios"
+
+def test_sql_without_a_statement_yields_nothing():
+    extractor = SQLExtractor()
+    assert stream(extractor, "I cannot answer that.")[0] is None
+    assert extractor.text == "I cannot answer that."
+
+@pytest.mark.parametrize("size", [1, 5])
+def test_json_stops_once_the_value_parses(size):
+    answer = 'Here you go: {"risk": "High", "city": {"$in": ["Mumbai", "Pune"]}} hope that helps {"x": 1}'
+    result, fed = stream(JSONExtractor(), answer, size)
+    assert result == '{"risk": "High", "city": {"$in": ["Mumbai", "Pune"]}}'
+    assert fed - size < answer.index(result) + len(result)
+
+def test_json_skips_prose_in_braces_and_brackets_in_strings():
+    answer = 'The filter {roughly} is: [{"$match": {"name": "a]}"}}]'
+    assert stream(JSONExtractor(), answer)[0] == '[{"$match": {"name": "a]}"}}]'
+
+def test_feed_after_a_result_is_ignored():
+    extractor = JSONExtractor()
+    assert extractor.feed('{"a": 1}') == '{"a": 1}'
+    assert extractor.feed(' {"b": 2}') == '{"a": 1}'
+    assert extractor.text == '{"a": 1}'
+
+def test_the_base_extractor_is_abstract():
+    with pytest.raises(TypeError):
+        _Extractor()
+
+def test_extracted_comparison_filters_parse():
+    from langchain_agent.mongo_tool import MongoTool
+
+    result, _ = stream(JSONExtractor(), 'Filter: {"age": {"$gt": 40}, "city": {"$in": ["Pune"]}}')
+    mongo_filter, fallback = MongoTool()._parse_filter(result)
+    assert fallback is None
+    assert mongo_filter == {"age": {"$gt": 40}, "city": {"$in": ["Pune"]}}
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+import db.guardrails as guardrails
+import langchain_agent.federated as federated
+from cache.results import result_cache
+from db.guardrails import reset_admissions
+from langchain_agent.federated import FederatedTool
+
+CLIENTS = [
+    {"name": "Alice", "risk": "High", "age": 45, "city": "Mumbai", "preferences": ["tech", "banking"]},
+    {"name": "Amitabh", "risk": "High", "age": 60, "city": "Mumbai", "preferences": ["tech", "auto"]},
+    {"name": "Bob", "risk": "Low", "age": 52, "city": "Delhi", "preferences": ["energy"]},
+] + [{"name": f"D{i}", "risk": "Low", "age": 30, "city": "Delhi", "preferences": []} for i in range(100)]
+PORTFOLIOS = [
+    ("Alice", 100, "Rajiv Mehra", "HDFC Bank"),
+    ("Alice", 50, "Priya Shah", "Reliance"),
+    ("Amitabh", 70, "Rajiv Mehra", "Infosys"),
+    ("Bob", 85, "Priya Shah", "Reliance"),
+] + [(f"Z{i}", 1, "Suresh Iyer", "TCS") for i in range(56)]
+
+def _seed(conn, index=True):
+    conn.execute(text(
+        "CREATE TABLE portfolios (id INTEGER PRIMARY KEY, client_name TEXT, portfolio_value NUMERIC, "
+        "relationship_manager TEXT, stock TEXT)"
+    ))
+    if index:
+        conn.execute(text("CREATE INDEX ix_portfolios_client_name ON portfolios (client_name)"))
+    conn.execute(text(
+        "INSERT INTO portfolios (client_name, portfolio_value, relationship_manager, stock) VALUES (:a, :b, :c, :d)"
+    ), [dict(a=a, b=b, c=c, d=d) for a, b, c, d in PORTFOLIOS])
+
+@pytest.fixture
+def clients():
+    database = mongomock.MongoClient()["wealth"]
+    database.clients.insert_many([dict(doc) for doc in CLIENTS])
+    return database
+
+@pytest.fixture
+def stores(tmp_path, clients, monkeypatch):
+    """Point FederatedTool at SQLite and mongomock; returns the SQL statements it admitted."""
+    def make(index=True):
+        engine = create_engine(f"sqlite:///{tmp_path / 'portfolios.db'}")
+        with engine.begin() as conn:
+            _seed(conn, index)
+        sessions = sessionmaker(engine)
+        monkeypatch.setattr(federated, "ReadSessionLocal", lambda tables=None: sessions())
+        monkeypatch.setattr(federated, "db", clients)
+        admitted = []
+
+        def admit(session, sql, params=None):
+            admitted.append((sql, params))
+            return guardrails.admit(session, sql, params)
+
+        monkeypatch.setattr(federated, "admit", admit)
+        return admitted
+
+    result_cache.clear()
+    reset_admissions()
+    yield make
+    result_cache.clear()
+    reset_admissions()
+
+def test_small_client_side_builds_and_pushes_names_into_sql(stores, monkeypatch):
+    admitted = stores()
+    # portfolios alone is over the row budget; the pushed-down probe is not
+    monkeypatch.setattr(guardrails, "GUARDRAIL_MAX_ROWS", 20)
+    result = FederatedTool()._run("total portfolio value of high-risk clients in Mumbai")
+    assert result["columns"] == ["total_portfolio_value"]
+    assert [float(v) for v in result["rows"][0]] == [220.0]
+    [(sql, params)] = admitted
+    assert "client_name IN :names" in sql
+    assert params["names"] == ["Alice", "Amitabh"]
+
+def test_small_portfolio_side_builds_on_sql(stores, monkeypatch):
+    admitted = stores()
+    found = []
+    find = mongomock.collection.Collection.find
+
+    def spy(collection, mongo_filter=None, *args, **kwargs):
+        found.append(mongo_filter)
+        return find(collection, mongo_filter, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, "find", spy)
+    # 103 clients in Delhi against 60 portfolios
+    result = FederatedTool()._run("total portfolio value of clients in Delhi")
+    assert [float(v) for v in result["rows"][0]] == [85.0]
+    [(sql, params)] = admitted
+    assert "IN" not in sql and params == {}
+    # The portfolios' names narrow the Mongo probe
+    assert found[-1]["$and"][0] == {"city": "Delhi"}
+    assert "Bob" in found[-1]["$and"][1]["name"]["$in"]
+
+def test_probe_over_budget_is_too_expensive(stores, monkeypatch):
+    stores(index=False)
+    # Without an index on client_name the pushed-down probe still scans every portfolio
+    monkeypatch.setattr(guardrails, "GUARDRAIL_MAX_ROWS", 20)
+    result = FederatedTool()._run("total portfolio value of high-risk clients in Mumbai")
+    assert result["rows"] == []
+    assert result["error"]["code"] == "too_expensive"
+    assert result["error"]["budget"] == 20
+
+def test_build_side_over_budget_is_too_expensive(stores, monkeypatch):
+    stores()
+    monkeypatch.setattr(federated, "FEDERATED_MAX_BUILD_ROWS", 1)
+    result = FederatedTool()._run("total portfolio value of high-risk clients in Mumbai")
+    assert result["error"] == {
+        "code": "too_expensive", "reason": "Join build side is too large", "estimated_rows": 2, "budget": 1,
+    }
+
+def test_async_join_streams_the_probe(tmp_path, clients, monkeypatch):
+    pytest.importorskip("aiosqlite")
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'portfolios.db'}")
+    with engine.begin() as conn:
+        _seed(conn)
+    sessions = async_sessionmaker(create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'portfolios.db'}"))
+    monkeypatch.setattr(federated, "AsyncReadSessionLocal", lambda tables=None: sessions())
+    monkeypatch.setattr(
+        federated, "async_db", mongomock_motor.AsyncMongoMockClient(mock_mongo_client=clients.client)["wealth"]
+    )
+    monkeypatch.setattr(guardrails, "GUARDRAIL_MAX_ROWS", 20)
+    result_cache.clear()
+    reset_admissions()
+    result = asyncio.run(FederatedTool()._arun("total portfolio value per city for high risk clients"))
+    assert [(city, float(total)) for city, total in result["rows"]] == [("Mumbai", 220.0)]
+    result_cache.clear()
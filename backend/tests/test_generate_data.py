@@ -0,0 +1,96 @@
+from collections import Counter
+from decimal import Decimal
+
+import pymysql
+import pytest
+
+from db import generate_data
+from db.generate_data import MANAGERS, MAX_PORTFOLIO_VALUE, generate_chunk, load_mysql, manager_names
+
+def _options(seed=42, **overrides):
+    return {"seed": seed, "skew": 1.1, "managers": manager_names(50, seed), "portfolios_per_client": 3.0, **overrides}
+
+def test_chunks_are_reproducible_from_the_seed():
+    options = _options()
+    assert generate_chunk(3, 300, 400, options) == generate_chunk(3, 300, 400, options)
+    assert generate_chunk(3, 300, 400, options) != generate_chunk(4, 300, 400, options)
+    assert generate_chunk(3, 300, 400, options) != generate_chunk(3, 300, 400, _options(seed=7))
+
+def test_managers_keep_the_sample_ones_first():
+    names = manager_names(50, 42)
+    assert names[:len(MANAGERS)] == MANAGERS
+    assert len(names) == len(set(names)) == 50
+    assert manager_names(50, 42) == names
+    # More managers than first x last name pairs still come out unique
+    assert len(set(manager_names(1000, 42))) == 1000
+
+def test_every_portfolio_belongs_to_a_client():
+    options = _options()
+    clients, portfolios = [], []
+    for chunk, start in enumerate(range(0, 2000, 500)):
+        chunk_clients, chunk_portfolios = generate_chunk(chunk, start, start + 500, options)
+        clients += chunk_clients
+        portfolios += chunk_portfolios
+    names = {client["name"] for client in clients}
+    assert len(names) == len(clients) == 2000
+    assert {row[0] for row in portfolios} <= names
+    for client in clients:
+        assert client["risk"] in generate_data.RISKS
+        assert 21 <= client["age"] <= 90
+        assert 1 <= len(client["preferences"]) <= 3
+        assert len(set(client["preferences"])) == len(client["preferences"])
+    for _, value, manager, stock in portfolios:
+        assert 0 < Decimal(value) <= MAX_PORTFOLIO_VALUE and Decimal(value).as_tuple().exponent == -2
+        assert manager in options["managers"] and stock in generate_data.STOCKS
+
+def test_distributions_are_skewed():
+    clients, portfolios = generate_chunk(0, 0, 5000, _options())
+    # Geometric with mean 3 per client
+    assert 2.5 < len(portfolios) / len(clients) < 3.5
+    managers = Counter(row[2] for row in portfolios).most_common()
+    assert managers[0][0] == MANAGERS[0]
+    assert managers[0][1] > 5 * managers[-1][1]
+    cities = Counter(client["city"] for client in clients).most_common()
+    assert cities[0][0] == generate_data.CITIES[0]
+    stocks = Counter(row[3] for row in portfolios).most_common()
+    assert stocks[0][0] == generate_data.STOCKS[0]
+
+def test_mysql_falls_back_to_inserts_when_local_infile_is_off(monkeypatch):
+    loaded = []
+
+    def disabled(rows, directory):
+        raise pymysql.err.OperationalError(3948, "Loading local data is disabled")
+
+    def lost(rows, directory):
+        raise pymysql.err.OperationalError(2013, "Lost connection")
+
+    monkeypatch.setattr(generate_data, "load_mysql_infile", disabled)
+    monkeypatch.setattr(generate_data, "load_mysql_insert", lambda rows, batch_size: loaded.append(len(rows)))
+    rows = [("Alice 0", "100.00", "Rajiv Mehra", "TCS")]
+    options = {"mysql_load": "auto", "tmpdir": None, "batch_size": 10}
+    assert load_mysql(rows, options) == "insert"
+    assert loaded == [1]
+    # Asked for infile explicitly: the error is the answer
+    with pytest.raises(pymysql.err.OperationalError):
+        load_mysql(rows, {**options, "mysql_load": "infile"})
+    # Any other server error is not a reason to fall back
+    monkeypatch.setattr(generate_data, "load_mysql_infile", lost)
+    with pytest.raises(pymysql.err.OperationalError):
+        load_mysql(rows, options)
+
+def test_mongo_loads_in_batches(monkeypatch):
+    mongomock = pytest.importorskip("mongomock")
+    client = mongomock.MongoClient()
+    batches = []
+    insert_many = mongomock.collection.Collection.insert_many
+
+    def counting(self, documents, *args, **kwargs):
+        batches.append(len(documents))
+        return insert_many(self, documents, *args, **kwargs)
+
+    monkeypatch.setattr(mongomock.collection.Collection, "insert_many", counting)
+    monkeypatch.setattr(generate_data, "MongoClient", lambda uri: client)
+    clients, _ = generate_chunk(0, 0, 250, _options())
+    generate_data.load_mongo(clients, batch_size=100)
+    assert batches == [100, 100, 50]
+    assert client[generate_data.MONGO_DB]["clients"].count_documents({}) == 250
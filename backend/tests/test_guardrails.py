@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+import db.guardrails as guardrails
+from db.guardrails import Estimate, GuardrailRejection, admit, check_static, evaluate, reset_admissions
+
+ALLOWED = {"portfolios"}
+
+def test_plain_select_is_admitted_statically():
+    tree = check_static("SELECT stock, SUM(portfolio_value) FROM portfolios GROUP BY stock", ALLOWED)
+    assert tree.key == "select"
+
+@pytest.mark.parametrize("sql, code", [
+    ("DELETE FROM portfolios", "not_select"),
+    ("SELECT 1; SELECT 2", "multiple_statements"),
+    ("SELECT * FROM clients_secret", "table_not_allowed"),
+    ("SELECT SLEEP(10) FROM portfolios", "function_not_allowed"),
+    ("SELECT * INTO copied FROM portfolios", "not_select"),
+])
+def test_static_rejections(sql, code):
+    with pytest.raises(GuardrailRejection) as rejected:
+        check_static(sql, ALLOWED)
+    assert rejected.value.code == code
+
+def test_ctes_and_subquery_aliases_are_not_tables():
+    check_static("WITH t AS (SELECT * FROM portfolios) SELECT * FROM t", ALLOWED)
+
+def test_evaluate_budgets(monkeypatch):
+    monkeypatch.setattr(guardrails, "GUARDRAIL_MAX_ROWS", 100)
+    monkeypatch.setattr(guardrails, "GUARDRAIL_MAX_SORT_ROWS", 10)
+    assert evaluate(Estimate(rows=50, full_scan=True)).rows == 50
+    # A large plain scan is fine (pagination bounds it), a large sorted scan is not
+    with pytest.raises(GuardrailRejection) as rejected:
+        evaluate(Estimate(rows=50, full_scan=True, blocking=True))
+    assert (rejected.value.code, rejected.value.budget) == ("too_expensive", 10)
+    with pytest.raises(GuardrailRejection):
+        evaluate(Estimate(rows=101))
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE portfolios (id INTEGER PRIMARY KEY, stock TEXT, portfolio_value NUMERIC)"))
+        conn.execute(text("INSERT INTO portfolios (stock, portfolio_value) VALUES (:s, :v)"),
+                     [{"s": f"S{i % 5}", "v": i} for i in range(50)])
+    reset_admissions()
+    with sessionmaker(engine)() as session:
+        yield session
+    reset_admissions()
+
+def test_admit_explains_and_rejects_over_budget(session, monkeypatch):
+    estimate = admit(session, "SELECT stock, SUM(portfolio_value) FROM portfolios GROUP BY stock")
+    assert estimate.full_scan and estimate.blocking and estimate.rows == 50
+    monkeypatch.setattr(guardrails, "GUARDRAIL_MAX_SORT_ROWS", 10)
+    # The cached estimate is re-evaluated against the current budget
+    with pytest.raises(GuardrailRejection):
+        admit(session, "SELECT stock, SUM(portfolio_value) FROM portfolios GROUP BY stock")
+    assert not admit(session, "SELECT * FROM portfolios").blocking
+
+def test_unsorted_limited_scans_skip_the_row_budget(session, monkeypatch):
+    monkeypatch.setattr(guardrails, "GUARDRAIL_MAX_ROWS", 10)
+    monkeypatch.setattr(guardrails, "GUARDRAIL_MAX_SORT_ROWS", 10)
+    # EXPLAIN counts the whole table either way; only the LIMIT bounds the read
+    estimate = admit(session, "SELECT * FROM portfolios LIMIT 5")
+    assert (estimate.rows, estimate.limited) == (50, True)
+    with pytest.raises(GuardrailRejection):
+        admit(session, "SELECT * FROM portfolios")
+    # A sort reads every row before the LIMIT applies
+    with pytest.raises(GuardrailRejection):
+        admit(session, "SELECT * FROM portfolios ORDER BY portfolio_value DESC LIMIT 5")
+
+def test_keyset_pages_are_admitted_over_large_tables(session, monkeypatch):
+    from db.pagination import build_page_sql, plan_sql
+
+    monkeypatch.setattr(guardrails, "GUARDRAIL_MAX_ROWS", 10)
+    page_sql, params, _ = build_page_sql(plan_sql("SELECT stock, portfolio_value FROM portfolios"), {}, 5)
+    assert admit(session, page_sql, params).limited
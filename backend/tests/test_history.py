@@ -0,0 +1,83 @@
+import json
+import time
+
+import pytest
+
+from cache.history import QueryHistory
+
+@pytest.fixture
+def history(tmp_path):
+    return QueryHistory(path=str(tmp_path / "history.jsonl"), enabled=True)
+
+def _ask(history, question, times=1, error=None, endpoint="query"):
+    for _ in range(times):
+        history.record(question, endpoint, 12.0, route="sql", query="SELECT 1", rows=3, error=error)
+        # Records are stamped to the millisecond; keep "most recent" unambiguous
+        time.sleep(0.002)
+    history.flush()
+
+def test_prefix_matches_come_first_by_count(history):
+    _ask(history, "Show all portfolios managed by Rajiv Mehra", times=3)
+    _ask(history, "Show all high risk clients", times=1)
+    _ask(history, "What is the total portfolio value?", times=2)
+    results = history.search("show all")
+    assert [r["question"] for r in results] == [
+        "Show all portfolios managed by Rajiv Mehra", "Show all high risk clients",
+    ]
+    assert results[0]["match"] == "prefix" and results[0]["count"] == 3
+
+def test_fuzzy_search_tolerates_typos(history):
+    _ask(history, "Which clients are the highest holders of Reliance?")
+    results = history.search("holdrs of relaince")
+    assert results and results[0]["match"] == "fuzzy"
+    assert results[0]["question"] == "Which clients are the highest holders of Reliance?"
+    assert history.search("quarterly tax summary") == []
+
+def test_empty_search_lists_the_most_recent(history):
+    _ask(history, "first question")
+    _ask(history, "second question")
+    assert [r["question"] for r in history.search("")] == ["second question", "first question"]
+
+def test_other_writers_are_picked_up(history):
+    other = QueryHistory(path=history.path, enabled=True)
+    _ask(other, "Asked on another worker")
+    assert history.search("asked on")[0]["question"] == "Asked on another worker"
+
+def test_popular_skips_questions_whose_latest_run_failed(history):
+    _ask(history, "Top five portfolios", times=3)
+    _ask(history, "Clients in Pune", times=2)
+    _ask(history, "Broken question", times=5, error="boom")
+    popular = history.popular(n=5)
+    assert [p["question"] for p in popular] == ["Top five portfolios", "Clients in Pune"]
+    assert popular[0]["endpoint"] == "query"
+
+def test_compaction_keeps_counts_and_shrinks_the_log(tmp_path):
+    history = QueryHistory(path=str(tmp_path / "history.jsonl"), enabled=True, max_bytes=1024)
+    _ask(history, "Top five portfolios", times=20)
+    _ask(history, "Clients in Pune", times=5, endpoint="stream")
+    assert history.compact_if_needed()
+    with open(history.path, encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    assert sorted(line["question"] for line in lines) == ["Clients in Pune", "Top five portfolios"]
+    counts = {r["question"]: r["count"] for r in history.search("")}
+    assert counts == {"Top five portfolios": 20, "Clients in Pune": 5}
+    assert history.popular(n=1)[0]["recent_count"] == 20
+    assert {p["question"]: p["endpoint"] for p in history.popular()}["Clients in Pune"] == "stream"
+    # Appends after the compaction are counted on top of the summary
+    _ask(history, "Clients in Pune")
+    assert history.search("clients in")[0]["count"] == 6
+    assert not history.compact_if_needed()
+    assert history.stats()["compactions"] == 1
+
+def test_compaction_drops_the_least_recent_questions(tmp_path):
+    history = QueryHistory(path=str(tmp_path / "history.jsonl"), enabled=True, max_bytes=0, max_questions=2)
+    for question in ("one", "two", "three"):
+        _ask(history, f"question {question}")
+    assert history.compact_if_needed()
+    assert {r["question"] for r in history.search("")} == {"question two", "question three"}
+
+def test_disabled_history_records_nothing(tmp_path):
+    history = QueryHistory(path=str(tmp_path / "history.jsonl"), enabled=False)
+    _ask(history, "Top five portfolios")
+    assert history.search("") == []
+    assert history.stats()["log_bytes"] == 0
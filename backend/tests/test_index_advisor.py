@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+import sqlglot
+
+import main
+from db.index_advisor import IndexAdvisor, index_advisor, mongo_shape, pipeline_filter, sql_shape
+
+def _candidate(sql):
+    return sql_shape(sqlglot.parse_one(sql, read="mysql")).candidate()
+
+def test_sql_columns_go_equality_then_sort_then_range():
+    assert _candidate("SELECT * FROM portfolios WHERE portfolio_value > 5 AND stock = 'TCS' "
+                      "ORDER BY relationship_manager") == ("stock", "relationship_manager", "portfolio_value")
+    # GROUP BY sorts; the ORDER BY on the aggregate can't use an index
+    assert _candidate("SELECT stock, SUM(portfolio_value) AS total FROM portfolios "
+                      "WHERE relationship_manager IN ('a', 'b') GROUP BY stock ORDER BY total DESC") == (
+        "relationship_manager", "stock")
+    assert _candidate("SELECT * FROM portfolios WHERE client_name LIKE 'Ali%'") == ("client_name",)
+    assert _candidate("SELECT * FROM portfolios WHERE client_name LIKE '%ice'") is None
+    # InnoDB gives ORDER BY id for free after the equality columns
+    assert _candidate("SELECT * FROM portfolios WHERE stock = 'TCS' ORDER BY id") == ("stock",)
+    assert sql_shape(sqlglot.parse_one("SELECT * FROM clients WHERE x = 1", read="mysql")) is None
+
+def test_paginated_queries_are_merged_into_their_inner_query():
+    sql = ("SELECT * FROM (SELECT client_name AS name, portfolio_value FROM portfolios WHERE stock = :stock) AS page "
+           "WHERE name > :after ORDER BY name LIMIT 21")
+    assert _candidate(sql) == ("stock", "client_name")
+
+def test_mongo_filters_and_pipelines():
+    shape = mongo_shape({"risk": {"$in": ["High", "Medium"]}, "age": {"$gte": 40}, "name": {"$regex": "^A"}},
+                        [("city", 1)])
+    assert shape.candidate() == ("risk", "city", "age")
+    assert mongo_shape({"$or": [{"city": "Pune"}, {"age": 3}]}).candidate() is None
+    assert mongo_shape({"name": {"$regex": "ice"}}).candidate() is None
+    assert pipeline_filter([{"$match": {"risk": "High"}}, {"$sort": {"age": -1}}, {"$limit": 5}]) == (
+        {"risk": "High"}, [("age", -1)])
+    assert pipeline_filter([{"$group": {"_id": "$city"}}]) == ({}, None)
+
+def test_candidates_are_ranked_and_deduplicated():
+    advisor = IndexAdvisor(enabled=True)
+    for _ in range(3):
+        advisor.record_sql("SELECT * FROM portfolios WHERE stock = 'TCS'")
+    advisor.record_sql("SELECT * FROM portfolios WHERE stock = 'TCS' ORDER BY portfolio_value")
+    advisor.record_sql("SELECT * FROM portfolios WHERE client_name = 'Alice'")
+    advisor.record_mongo({})
+    recommendations, unindexable = advisor.candidates({})
+    # (stock) is a prefix of (stock, portfolio_value) and folds into it
+    assert [(r["columns"], r["uses"], r["fully_served"]) for r in recommendations] == [
+        (["stock", "portfolio_value"], 4, 4),
+        (["client_name"], 1, 1),
+    ]
+    assert unindexable == 1
+    # An existing index that already starts with the candidate removes it
+    existing = {("mysql", "portfolios"): [("client_name", "stock")]}
+    assert [r["columns"] for r in advisor.candidates(existing)[0]] == [["stock", "portfolio_value"]]
+
+def test_recording_is_bounded_and_can_be_off():
+    advisor = IndexAdvisor(enabled=True, max_shapes=1)
+    advisor.record_sql("SELECT * FROM portfolios WHERE stock = 'TCS'")
+    advisor.record_sql("SELECT * FROM portfolios WHERE stock = 'Infosys'")
+    advisor.record_sql("SELECT * FROM portfolios WHERE client_name = 'Alice'")
+    advisor.record_sql("not sql at all (")
+    assert advisor.stats() == {"shapes": 1, "executions": 2, "dropped": 1, "enabled": True}
+    off = IndexAdvisor(enabled=False)
+    off.record_sql("SELECT * FROM portfolios WHERE stock = 'TCS'")
+    off.record_pipeline([{"$match": {"risk": "High"}}])
+    assert off.stats()["shapes"] == 0
+
+@pytest.fixture
+def advisor():
+    index_advisor.reset()
+    yield index_advisor
+    index_advisor.reset()
+
+def test_advice_is_explained_and_applied_only_when_allowed(api, advisor, monkeypatch):
+    import db.mongo
+    import db.mysql
+
+    assert api.post("/query", json={"query": "What are the top five portfolios of our wealth members?"}).status_code == 200
+    advisor.record_mongo({"risk": "High", "age": {"$gte": 40}})
+    advice = api.get("/indexes/advice").json()
+    assert advice["apply_allowed"] is False
+    by_store = {rec["store"]: rec for rec in advice["recommendations"]}
+    assert by_store["mysql"]["columns"] == ["portfolio_value"]
+    assert by_store["mysql"]["explain"]["access"] == "scan"
+    assert by_store["mysql"]["ddl"] == "CREATE INDEX idx_portfolios_portfolio_value ON portfolios (portfolio_value)"
+    assert by_store["mongo"]["ddl"] == 'db.clients.createIndex({"risk": 1, "age": 1})'
+
+    assert api.post("/indexes/apply").status_code == 403
+    assert asyncio.run(db.mongo.async_db["clients"].index_information()).keys() == {"_id_"}
+
+    monkeypatch.setattr(main, "INDEX_ADVISOR_ALLOW_APPLY", True)
+    created = api.post("/indexes/apply").json()["created"]
+    assert {rec["name"] for rec in created} == {"idx_portfolios_portfolio_value", "idx_clients_risk_age"}
+    # Once built, the same workload asks for nothing more and reads through the index
+    advice = api.get("/indexes/advice").json()
+    assert advice["recommendations"] == []
+    assert ["portfolio_value"] in advice["existing"]["mysql.portfolios"]
+    explained = asyncio.run(_explain_top_five(db.mysql.AsyncSessionLocal, advisor))
+    assert any("idx_portfolios_portfolio_value" in step for step in explained["plan"])
+
+async def _explain_top_five(session_factory, advisor):
+    from db.index_advisor import _explain_sql
+
+    entry = next(iter(advisor._shapes.values()))
+    async with session_factory() as session:
+        return await _explain_sql(session, entry["example"])
@@ -0,0 +1,190 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("openai")
+uvicorn = pytest.importorskip("uvicorn")
+from starlette.responses import JSONResponse
+
+import langchain_agent.llm_gateway as gateway_module
+from bench_e2e import FakeLLM
+from fake_llm_server import create_app
+from langchain_agent.deadline import DeadlineExceeded, request_deadline
+from langchain_agent.llm_gateway import CircuitBreaker, LLMGateway, LLMUnavailable
+
+SQL_PROMPT = "SQL Query:\nQuestion: unknown"
+
+class Provider:
+    """fake_llm_server.py behind a switch that answers scripted error statuses first."""
+    def __init__(self, llm):
+        self.app = create_app(llm)
+        self.errors = []
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].endswith("/chat/completions"):
+            return await self.app(scope, receive, send)
+        self.calls += 1
+        if self.errors:
+            status = self.errors.pop(0)
+            return await JSONResponse({"error": {"message": "scripted"}}, status_code=status)(scope, receive, send)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+@pytest.fixture
+def provider():
+    """Start a Provider over HTTP; returns it with a factory for gateways pointed at it."""
+    servers = []
+
+    def start(latency_ms=10, token_ms=0, tail=0, canned=None):
+        served = Provider(FakeLLM(canned or {}, latency_ms, 0, 42, token_ms, tail))
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        server = uvicorn.Server(uvicorn.Config(served, log_level="warning", lifespan="off"))
+        thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+        thread.start()
+        while not server.started:
+            time.sleep(0.01)
+        servers.append((server, thread))
+        port = sock.getsockname()[1]
+        return served, lambda **kwargs: LLMGateway(
+            api_base=f"http://127.0.0.1:{port}/v1", api_key="fake", **{"max_retries": 3, **kwargs}
+        )
+
+    yield start
+    for server, thread in servers:
+        server.should_exit = True
+        thread.join(timeout=5)
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(gateway_module, "LLM_BACKOFF_BASE", 0.01)
+
+class Unfinished:
+    """An extractor that never finds its query, so the whole completion is read."""
+    result = None
+    text = ""
+
+    def feed(self, delta):
+        self.text += delta
+        return None
+
+def test_concurrency_is_capped(provider):
+    served, make = provider(latency_ms=50)
+    gateway = make(max_concurrency=2)
+
+    async def burst():
+        return await asyncio.gather(*(gateway.apredict(SQL_PROMPT) for _ in range(6)))
+
+    assert asyncio.run(burst()) == [""] * 6
+    assert served.max_in_flight == 2
+    assert gateway.stats()["requests"] == 6
+
+def test_retryable_errors_back_off_and_retry(provider):
+    served, make = provider()
+    served.errors = [503, 429]
+    gateway = make()
+    assert gateway.predict(SQL_PROMPT) == ""
+    stats = gateway.stats()
+    assert served.calls == 3
+    assert (stats["requests"], stats["retries"], stats["failures"]) == (1, 2, 0)
+    assert stats["breaker"] == "closed"
+
+def test_client_errors_are_not_retried(provider):
+    import openai
+
+    served, make = provider()
+    served.errors = [400]
+    gateway = make()
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(gateway.apredict(SQL_PROMPT))
+    assert served.calls == 1
+    assert gateway.stats()["failures"] == 1
+
+def test_breaker_opens_between_retries(provider):
+    served, make = provider()
+    served.errors = [503] * 10
+    gateway = make()
+    gateway.breaker = CircuitBreaker(threshold=2, cooldown=60)
+    # The second failure opens the breaker, so the remaining retries never reach the provider
+    with pytest.raises(LLMUnavailable):
+        gateway.predict(SQL_PROMPT)
+    assert served.calls == 2
+    with pytest.raises(LLMUnavailable):
+        asyncio.run(gateway.apredict(SQL_PROMPT))
+    assert served.calls == 2
+    assert gateway.stats()["breaker"] == "open"
+    assert gateway.stats()["rejected"] == 2
+
+def test_half_open_breaker_lets_one_probe_through(provider):
+    served, make = provider(latency_ms=100)
+    served.errors = [503, 503]
+    gateway = make(max_retries=0)
+    gateway.breaker = CircuitBreaker(threshold=2, cooldown=0.2)
+    for _ in range(2):
+        with pytest.raises(Exception):
+            gateway.predict(SQL_PROMPT)
+    assert gateway.breaker.state == "open"
+    time.sleep(0.25)
+    assert gateway.breaker.state == "half-open"
+
+    async def probe_and_racer():
+        probe = asyncio.ensure_future(gateway.apredict(SQL_PROMPT))
+        await asyncio.sleep(0.02)
+        # While the probe is out, other calls still fail fast
+        with pytest.raises(LLMUnavailable):
+            await gateway.apredict(SQL_PROMPT)
+        return await probe
+
+    assert asyncio.run(probe_and_racer()) == ""
+    assert gateway.breaker.state == "closed"
+    assert served.calls == 3
+
+def test_failed_probe_reopens_the_breaker(provider):
+    served, make = provider()
+    served.errors = [503, 503, 503]
+    gateway = make(max_retries=0)
+    gateway.breaker = CircuitBreaker(threshold=2, cooldown=0.2)
+    for _ in range(2):
+        with pytest.raises(Exception):
+            gateway.predict(SQL_PROMPT)
+    time.sleep(0.25)
+    with pytest.raises(Exception):
+        gateway.predict(SQL_PROMPT)
+    assert gateway.breaker.state == "open"
+
+def test_stream_is_cut_off_at_the_request_deadline(provider):
+    # 200 tokens at 20ms each: every read is quick, the whole stream takes 4s
+    served, make = provider(token_ms=20, tail=200)
+    gateway = make()
+
+    async def ask():
+        with request_deadline(0.5):
+            return await gateway.aextract(SQL_PROMPT, Unfinished())
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(ask())
+    assert time.monotonic() - started < 1.5
+    assert served.calls == 1
+
+def test_stream_closes_at_the_first_complete_query(provider):
+    from langchain_agent.extract import SQLExtractor
+
+    served, make = provider(token_ms=20, tail=200, canned={"top": {"sql": "SELECT 1;"}})
+    gateway = make()
+    started = time.monotonic()
+    result, _ = asyncio.run(gateway.aextract("SQL Query:\nQuestion: top", SQLExtractor()))
+    assert result == "SELECT 1;"
+    assert gateway.stats()["early_stops"] == 1
+    # Closed well before the 200 tokens of commentary were generated
+    assert time.monotonic() - started < 2
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from cache.results import result_cache
+from langchain_agent.mongo_pipeline import PipelineError, flatten_results, validate_pipeline
+
+FIELDS = {"name", "risk", "age", "city", "preferences"}
+CLIENTS = [
+    {"name": "Alice", "risk": "High", "age": 45, "city": "Mumbai", "preferences": ["tech", "banking"]},
+    {"name": "Amitabh", "risk": "High", "age": 61, "city": "Mumbai", "preferences": ["tech"]},
+    {"name": "Bob", "risk": "Low", "age": 52, "city": "Delhi", "preferences": ["energy"]},
+    {"name": "Charlie", "risk": "High", "age": 38, "city": "Pune", "preferences": []},
+]
+
+def test_a_limit_is_always_there_and_capped():
+    pipeline = [{"$match": {"risk": "High"}}, {"$group": {"_id": "$city", "clients": {"$sum": 1}}}]
+    assert validate_pipeline(pipeline, FIELDS, max_rows=50)[-1] == {"$limit": 50}
+    capped = validate_pipeline([*pipeline, {"$limit": 10_000}], FIELDS, max_rows=50)
+    assert capped[-1] == {"$limit": 50} and len(capped) == 3
+
+def test_fields_follow_the_stages():
+    grouped = [{"$group": {"_id": "$city", "clients": {"$sum": 1}}}]
+    # After $group only its outputs exist
+    validate_pipeline([*grouped, {"$sort": {"clients": -1}}], FIELDS)
+    with pytest.raises(PipelineError):
+        validate_pipeline([*grouped, {"$sort": {"age": -1}}], FIELDS)
+    projected = [{"$project": {"name": 1, "decade": {"$divide": ["$age", 10]}}}]
+    validate_pipeline([*projected, {"$match": {"decade": {"$gte": 4}}}], FIELDS)
+    with pytest.raises(PipelineError):
+        validate_pipeline([*projected, {"$match": {"city": "Pune"}}], FIELDS)
+    assert validate_pipeline([{"$count": "clients"}], FIELDS)[0] == {"$count": "clients"}
+
+@pytest.mark.parametrize("pipeline", [
+    [],
+    {"$match": {}},
+    [{"$out": "stolen"}],
+    [{"$lookup": {"from": "users", "as": "u"}}],
+    [{"$match": {"$where": "sleep(1000)"}}],
+    [{"$match": {"age": {"$function": {}}}}],
+    [{"$match": {"income": {"$gt": 1}}}],
+    [{"$group": {"_id": "$city", "names": {"$push": "$name"}}}],
+    [{"$group": {"clients": {"$sum": 1}}}],
+    [{"$sort": {"age": 2}}],
+    [{"$limit": 0}],
+    [{"$unwind": "preferences"}],
+    [{"$match": {}, "$limit": 1}],
+    [{"$match": {}}] * 9,
+])
+def test_outside_the_allowlist_is_rejected(pipeline):
+    with pytest.raises(PipelineError):
+        validate_pipeline(pipeline, FIELDS)
+
+def test_results_are_flattened_into_columns():
+    pipeline = [{"$group": {"_id": "$city", "clients": {"$sum": 1}}}]
+    assert flatten_results(pipeline, [{"_id": "Mumbai", "clients": 2}]) == [{"city": "Mumbai", "clients": 2}]
+    compound = [{"$group": {"_id": {"city": "$city", "risk": "$risk"}, "n": {"$sum": 1}}}]
+    assert flatten_results(compound, [{"_id": {"city": "Pune", "risk": "High"}, "n": 1}]) == [
+        {"city": "Pune", "risk": "High", "n": 1}
+    ]
+    ungrouped = [{"$group": {"_id": None, "average_age": {"$avg": "$age"}}}]
+    assert flatten_results(ungrouped, [{"_id": None, "average_age": 49}]) == [{"average_age": 49}]
+
+@pytest.fixture
+def tool(monkeypatch):
+    mongomock = pytest.importorskip("mongomock")
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from langchain_agent import mongo_tool
+
+    client = mongomock.MongoClient()
+    client["wealth"].clients.insert_many([dict(doc) for doc in CLIENTS])
+    monkeypatch.setattr(mongo_tool, "db", client["wealth"])
+    monkeypatch.setattr(mongo_tool, "async_db", mongomock_motor.AsyncMongoMockClient(mock_mongo_client=client)["wealth"])
+    result_cache.clear()
+    yield mongo_tool.MongoTool()
+    result_cache.clear()
+
+def test_aggregation_runs_inside_mongo(tool):
+    pipeline = [
+        {"$match": {"risk": "High"}},
+        {"$group": {"_id": "$city", "clients": {"$sum": 1}, "average_age": {"$avg": "$age"}}},
+        {"$sort": {"clients": -1}},
+    ]
+    result = asyncio.run(tool.aexecute("high risk clients per city", pipeline))
+    rows = [dict(zip(result["columns"], row)) for row in result["rows"]]
+    assert rows[0] == {"city": "Mumbai", "clients": 2, "average_age": 53}
+    assert sorted(row["city"] for row in rows) == ["Mumbai", "Pune"]
+    assert result["truncated"] is False
+    # Served from the result cache the second time, and the sync path agrees
+    hits = result_cache.stats()["hits"]
+    assert asyncio.run(tool.aexecute("high risk clients per city", pipeline))["rows"] == result["rows"]
+    assert result_cache.stats()["hits"] == hits + 1
+    result_cache.clear()
+    assert tool.execute("high risk clients per city", pipeline)["rows"] == result["rows"]
+
+def test_unwound_preferences_are_counted(tool):
+    pipeline = [{"$unwind": "$preferences"}, {"$group": {"_id": "$preferences", "clients": {"$sum": 1}}},
+                {"$sort": {"clients": -1}}]
+    result = asyncio.run(tool.aexecute("clients per preference", pipeline))
+    assert result["rows"][0] == ["tech", 2]
+
+def test_an_invalid_pipeline_never_reaches_mongo(tool, monkeypatch):
+    from langchain_agent import mongo_tool
+
+    monkeypatch.setattr(mongo_tool.MongoTool, "_aggregate_cursor", lambda *args: pytest.fail("queried Mongo"))
+    result = asyncio.run(tool.aexecute("everything", [{"$out": "copy"}]))
+    assert result["rows"] == []
+    assert "summary of client profiles" in result["text"]
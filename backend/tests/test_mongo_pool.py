@@ -0,0 +1,87 @@
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+pymongo = pytest.importorskip("pymongo")
+from pymongo import ReadPreference, monitoring
+
+import db.mongo as mongo
+from cache.results import bump_data_version, result_cache
+from db import pool_stats
+
+@pytest.fixture
+def listener(monkeypatch):
+    monkeypatch.setattr(mongo, "_listener", None)
+    monkeypatch.setattr(pool_stats, "_pools", {})
+    return mongo._pool_listener()
+
+def test_listener_is_shared_by_both_clients(listener):
+    assert mongo.client_options()["event_listeners"] == [listener]
+    assert mongo._pool_listener() is listener
+
+def test_checkouts_from_many_threads_are_counted_exactly(listener):
+    # Switch threads as often as possible so unlocked read-modify-writes interleave
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    threads, rounds = 8, 5000
+    event = SimpleNamespace(duration=0.002)
+    peak = []
+    # Every thread holds its connections at once before returning them
+    held = threading.Barrier(threads, action=lambda: peak.append(pool_stats.snapshot()["mongo"]["checked_out"]))
+
+    def work():
+        for _ in range(rounds):
+            listener.connection_checked_out(event)
+        held.wait()
+        for _ in range(rounds):
+            listener.connection_checked_in(event)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        sys.setswitchinterval(interval)
+    stats = pool_stats.snapshot()["mongo"]
+    assert peak == [threads * rounds]
+    assert stats["checkouts"] == threads * rounds
+    assert stats["checked_out"] == 0
+    assert stats["max_size"] == mongo.MONGO_MAX_POOL_SIZE
+    assert stats["max_wait_ms"] == 2.0
+
+def test_failed_checkouts_are_split_by_reason(listener):
+    listener.connection_check_out_failed(SimpleNamespace(reason=monitoring.ConnectionCheckOutFailedReason.TIMEOUT))
+    listener.connection_check_out_failed(SimpleNamespace(reason=monitoring.ConnectionCheckOutFailedReason.CONN_ERROR))
+    stats = pool_stats.snapshot()["mongo"]
+    assert (stats["timeouts"], stats["errors"]) == (1, 1)
+
+@pytest.fixture
+def database():
+    # Never connects: read_collection only chooses the read preference
+    client = pymongo.MongoClient("mongodb://127.0.0.1:1", connect=False, readPreference="secondaryPreferred")
+    yield client["wealth_db"]
+    client.close()
+
+def test_reads_go_to_the_primary_right_after_a_write(database, monkeypatch):
+    monkeypatch.setattr(mongo, "MONGO_READ_PREFERENCE", "secondaryPreferred")
+    assert mongo.read_collection(database, "routing_clients").read_preference == ReadPreference.SECONDARY_PREFERRED
+    bump_data_version("routing_clients")
+    result_cache.versions.refresh()
+    assert mongo.read_collection(database, "routing_clients").read_preference == ReadPreference.PRIMARY
+    # Other collections still read from secondaries
+    assert mongo.read_collection(database, "routing_other").read_preference == ReadPreference.SECONDARY_PREFERRED
+    # Once the write is older than the window a secondary has caught up
+    monkeypatch.setattr(mongo, "MONGO_RECENT_WRITE_WINDOW", 0)
+    assert mongo.read_collection(database, "routing_clients").read_preference == ReadPreference.SECONDARY_PREFERRED
+
+def test_primary_preference_needs_no_write_check(database, monkeypatch):
+    monkeypatch.setattr(mongo, "MONGO_READ_PREFERENCE", "primary")
+    bump_data_version("routing_primary")
+    result_cache.versions.refresh()
+    # The client's own preference already is the primary
+    assert mongo.read_collection(database, "routing_primary") is not None
+    assert mongo.read_collection(database, "routing_primary").read_preference == database.read_preference
@@ -0,0 +1,98 @@
+import io
+import json
+import logging
+import re
+
+import pytest
+
+import observability
+from observability import Counter, Histogram, JsonFormatter, TextFormatter, get_logger, request_scope, span
+
+@pytest.fixture
+def lines():
+    """Log lines written by the insightlens loggers at INFO, formatted as JSON."""
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    root = logging.getLogger("insightlens")
+    level = root.level
+    root.setLevel(logging.INFO)
+    root.addHandler(handler)
+    yield lambda: [json.loads(line) for line in stream.getvalue().splitlines()]
+    root.removeHandler(handler)
+    root.setLevel(level)
+
+def test_a_request_logs_one_summary_line_with_its_id(lines):
+    with request_scope("query"):
+        get_logger("SQLTool").info("executing", extra={"fields": {"rows": 3}})
+        with span("llm"):
+            pass
+        with span("db_execute"):
+            pass
+    executing, summary = lines()
+    assert executing["logger"] == "insightlens.SQLTool"
+    assert executing["rows"] == 3
+    assert executing["request_id"] == summary["request_id"]
+    assert summary["msg"] == "request finished"
+    assert summary["endpoint"] == "query" and summary["status"] == "ok"
+    assert set(summary["stages_ms"]) == {"llm", "db_execute"}
+    # Outside a request there is no id
+    get_logger("API").info("idle")
+    assert "request_id" not in lines()[-1]
+
+def test_a_failing_request_is_logged_as_an_error(lines):
+    with pytest.raises(RuntimeError):
+        with request_scope("stream"):
+            raise RuntimeError("boom")
+    assert lines()[-1]["status"] == "error"
+
+def test_debug_lines_are_gated_by_level(lines):
+    get_logger("LLMGateway").debug("prompt: secret")
+    assert lines() == []
+
+def test_text_format():
+    record = logging.LogRecord("insightlens.Rollups", logging.INFO, __file__, 1, "refreshed", None, None)
+    record.fields = {"mode": "full"}
+    assert TextFormatter().format(record) == "[Rollups] refreshed mode=full"
+
+def test_counters_and_histograms_render_as_prometheus_text():
+    counter = Counter("test_requests_total", "Requests")
+    counter.inc(endpoint="query")
+    counter.inc(2, endpoint="query")
+    assert counter.render()[-1] == 'test_requests_total{endpoint="query"} 3'
+    histogram = Histogram("test_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, stage="llm")
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{stage="llm",le="0.1"} 1',
+        'test_seconds_bucket{stage="llm",le="1.0"} 2',
+        'test_seconds_bucket{stage="llm",le="+Inf"} 3',
+        'test_seconds_sum{stage="llm"} 5.55',
+        'test_seconds_count{stage="llm"} 3',
+    ]
+
+def _samples(text):
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+def test_metrics_endpoint_reports_requests_stages_and_service_gauges(api):
+    before = _samples(api.get("/metrics").text)
+    assert api.post("/query", json={"query": "What is the total portfolio value?"}).status_code == 200
+    response = api.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    after = _samples(response.text)
+    ok = 'insightlens_requests_total{endpoint="query",status="ok"}'
+    assert after[ok] == before.get(ok, 0) + 1
+    for stage in ("classify", "llm", "db_execute", "serialize"):
+        key = f'insightlens_stage_seconds_count{{stage="{stage}"}}'
+        assert after[key] > before.get(key, 0), stage
+    assert after['insightlens_llm_calls_total{outcome="requests"}'] >= 2
+    assert 'insightlens_cache_hit_ratio{cache="results"}' in after
+    # Every sample line is well formed
+    assert all(re.fullmatch(r"[a-z_]+(\{.*\})? -?[0-9.e+-]+|#.*", line)
+               for line in response.text.splitlines() if line)
+    assert observability.render_metrics().count("# TYPE insightlens_requests_total counter") == 1
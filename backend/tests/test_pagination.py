@@ -0,0 +1,60 @@
+import sqlite3
+
+import pytest
+
+from db.pagination import (
+    PaginationError, build_page_sql, decode_cursor, encode_cursor, plan_sql, split_page,
+)
+
+def _tamper(token):
+    body, signature = token.split(".", 1)
+    return f"{body[:-2]}{'A' if body[-2] != 'A' else 'B'}{body[-1]}.{signature}"
+
+def test_cursor_round_trip():
+    state = {"store": "sql", "plan": {"sql": "SELECT 1", "keys": [["id", False]], "limit": None},
+             "params": {}, "page_size": 2, "after": [3], "returned": 2, "question": "q"}
+    assert decode_cursor(encode_cursor(state)) == state
+
+def test_tampered_cursor_is_rejected():
+    token = encode_cursor({"store": "sql", "plan": {"sql": "SELECT 1"}, "after": [1]})
+    with pytest.raises(PaginationError):
+        decode_cursor(_tamper(token))
+
+@pytest.mark.parametrize("token", ["abc", "abc.def", "", "!!.??"])
+def test_malformed_cursor_is_rejected(token):
+    with pytest.raises(PaginationError):
+        decode_cursor(token)
+
+@pytest.fixture
+def portfolios():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE portfolios (id INTEGER PRIMARY KEY, relationship_manager TEXT, portfolio_value NUMERIC)")
+    managers = [None, "Priya Shah", "Rajiv Mehra"]
+    values = [None, 100, 200, 300]
+    conn.executemany(
+        "INSERT INTO portfolios (relationship_manager, portfolio_value) VALUES (?, ?)",
+        [(managers[i % 3], values[i % 4]) for i in range(40)],
+    )
+    yield conn
+    conn.close()
+
+def _all_pages(conn, sql, page_size=7):
+    plan = plan_sql(sql)
+    rows, after, returned = [], None, 0
+    while True:
+        page_sql, params, take = build_page_sql(plan, {}, page_size, after, returned)
+        cursor = conn.execute(page_sql, params)
+        _, page, after, _ = split_page(plan, [d[0] for d in cursor.description], cursor.fetchall(), take)
+        rows += page
+        returned += len(page)
+        if after is None:
+            return rows
+
+@pytest.mark.parametrize("sql", [
+    "SELECT relationship_manager, portfolio_value FROM portfolios ORDER BY portfolio_value DESC",
+    "SELECT relationship_manager, portfolio_value FROM portfolios ORDER BY relationship_manager, portfolio_value",
+    "SELECT relationship_manager, SUM(portfolio_value) AS total FROM portfolios GROUP BY relationship_manager ORDER BY total DESC",
+])
+def test_keyset_pages_cover_rows_with_null_keys(portfolios, sql):
+    expected = portfolios.execute(sql).fetchall()
+    assert sorted(map(tuple, _all_pages(portfolios, sql)), key=repr) == sorted(expected, key=repr)
@@ -0,0 +1,71 @@
+import time
+
+from cache.results import DataVersions, ResultCache, bump_data_version, sql_tables
+
+SQL = "SELECT stock, SUM(portfolio_value) FROM portfolios GROUP BY stock"
+RESULT = {"columns": ["stock", "total"], "rows": [["TCS", 10]]}
+
+def _cache(tmp_path, **kwargs):
+    path = str(tmp_path / "versions.sqlite3")
+    # check_interval=0: every lookup re-reads the version table, as if the interval had passed
+    return ResultCache(versions=DataVersions(path=path, check_interval=0), **kwargs), path
+
+def _refreshed(cache):
+    # The background re-read the next lookup would trigger, done now
+    cache.versions.refresh()
+    return cache
+
+def test_a_write_to_a_read_table_invalidates(tmp_path):
+    cache, path = _cache(tmp_path)
+    key = cache.key("sql", SQL, {}, sql_tables(SQL))
+    cache.set(key, RESULT)
+    assert cache.get(cache.key("sql", SQL, {}, ["portfolios"])) == RESULT
+    # A write to another table leaves the entry alone
+    bump_data_version("clients", path=path)
+    _refreshed(cache)
+    assert cache.get(cache.key("sql", SQL, {}, ["portfolios"])) == RESULT
+    bump_data_version("portfolios", path=path)
+    _refreshed(cache)
+    assert cache.get(cache.key("sql", SQL, {}, ["portfolios"])) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["stale"], stats["entries"]) == (2, 1, 0)
+
+def test_workers_see_each_others_writes(tmp_path):
+    first, path = _cache(tmp_path)
+    second = ResultCache(versions=DataVersions(path=path, check_interval=0))
+    key = first.key("mongo", {"risk": "High"}, None, ["clients"])
+    first.set(key, RESULT)
+    version = bump_data_version("clients", path=path)
+    assert _refreshed(second).versions.get(["clients"]) == (("clients", version),)
+    assert first.get(_refreshed(first).key("mongo", {"risk": "High"}, None, ["clients"])) is None
+
+def test_params_are_part_of_the_key(tmp_path):
+    cache, _ = _cache(tmp_path)
+    sql = "SELECT * FROM portfolios WHERE stock = :stock"
+    cache.set(cache.key("sql", sql, {"stock": "TCS"}, ["portfolios"]), RESULT)
+    assert cache.get(cache.key("sql", sql, {"stock": "Infosys"}, ["portfolios"])) is None
+    assert cache.get(cache.key("sql", sql, {"stock": "TCS"}, ["portfolios"])) == RESULT
+
+def test_ttl_size_and_row_limits(tmp_path):
+    cache, _ = _cache(tmp_path, size=2, max_rows=3)
+    keys = [cache.key("sql", f"SELECT {i} FROM portfolios", {}, ["portfolios"]) for i in range(3)]
+    for key in keys:
+        cache.set(key, RESULT)
+    # Least recently used first out
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) == RESULT
+    big = cache.key("sql", "SELECT * FROM portfolios", {}, ["portfolios"])
+    cache.set(big, {"columns": ["id"], "rows": [[i] for i in range(4)]})
+    assert cache.get(big) is None
+    cache.ttl = 0.01
+    time.sleep(0.02)
+    assert cache.get(keys[2]) is None
+
+def test_cursors_are_not_cached(tmp_path):
+    cache, _ = _cache(tmp_path)
+    key = cache.key("sql", SQL, {}, ["portfolios"])
+    cache.set(key, {**RESULT, "next_cursor": "abc.def"})
+    assert "next_cursor" not in cache.get(key)
+
+def test_tables_are_read_from_the_sql():
+    assert sql_tables("SELECT * FROM `Portfolios` p JOIN rollup_rm r ON 1=1") == ["portfolios", "rollup_rm"]
@@ -0,0 +1,154 @@
+import asyncio
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from db.rollups import Rollups
+
+ROWS = [
+    (1, "Alice", 10_000_000, "Rajiv Mehra", "HDFC Bank"),
+    (2, "Bob", 8_500_000, "Priya Shah", "Reliance"),
+    (3, "Charlie", 7_000_000, "Rajiv Mehra", "Infosys"),
+    (4, "Diana", None, "Priya Shah", "TCS"),
+    (5, "Esha", 6_500_000, None, "Reliance"),
+    (6, "Farhan", None, "Rajiv Mehra", None),
+]
+QUERIES = [
+    "SELECT relationship_manager, SUM(portfolio_value) AS total FROM portfolios "
+    "GROUP BY relationship_manager ORDER BY relationship_manager",
+    "SELECT stock, COUNT(*) AS n, AVG(portfolio_value) AS average FROM portfolios GROUP BY stock ORDER BY stock",
+    "SELECT SUM(portfolio_value), COUNT(*), AVG(portfolio_value) FROM portfolios",
+    # The NULL stock's only portfolio has no value: its SUM is NULL, not 0
+    "SELECT stock, SUM(portfolio_value) AS total, COUNT(portfolio_value) AS valued FROM portfolios "
+    "GROUP BY stock ORDER BY stock",
+    "SELECT stock, SUM(portfolio_value) AS total FROM portfolios WHERE stock = 'Reliance' GROUP BY stock",
+    "SELECT id, client_name, portfolio_value FROM portfolios ORDER BY portfolio_value DESC, id LIMIT 3",
+]
+
+def _insert(rows):
+    return text(
+        "INSERT INTO portfolios (id, client_name, portfolio_value, relationship_manager, stock) "
+        "VALUES (:id, :client_name, :portfolio_value, :relationship_manager, :stock)"
+    ), [dict(zip(("id", "client_name", "portfolio_value", "relationship_manager", "stock"), row)) for row in rows]
+
+@pytest.fixture
+def sessions(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'portfolios.db'}")
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def seed():
+        async with engine.begin() as conn:
+            await conn.execute(text(
+                "CREATE TABLE portfolios (id INTEGER PRIMARY KEY, client_name TEXT, "
+                "portfolio_value NUMERIC, relationship_manager TEXT, stock TEXT)"
+            ))
+            await conn.execute(*_insert(ROWS))
+
+    asyncio.run(seed())
+    yield sessions
+    asyncio.run(engine.dispose())
+
+def _normalize(rows):
+    return [tuple(round(float(v), 2) if isinstance(v, (float, Decimal)) else v for v in row) for row in rows]
+
+async def _rows(sessions, sql, params=None):
+    async with sessions() as session:
+        return _normalize((await session.execute(text(sql), params or {})).all())
+
+async def _assert_rewrites_match(rollups, sessions):
+    for sql in QUERIES:
+        rewritten = rollups.rewrite(sql)
+        assert rewritten is not None and " portfolios" not in rewritten, sql
+        assert await _rows(sessions, rewritten) == await _rows(sessions, sql), sql
+
+def test_rewrites_match_the_base_table_through_refreshes(sessions):
+    rollups = Rollups(enabled=True, top_k=3)
+
+    async def run():
+        assert await rollups.refresh(sessions) == "full"
+        await _assert_rewrites_match(rollups, sessions)
+        assert await rollups.refresh(sessions) == "current"
+
+        # Appended rows are merged in, including new and NULL groups
+        async with sessions() as session:
+            await session.execute(*_insert([
+                (7, "Zed", 99_999_999, "New RM", "NEWCO"),
+                (8, "Yan", 5, None, "Reliance"),
+                (9, "Xi", None, None, None),
+            ]))
+            await session.commit()
+        assert await rollups.refresh(sessions) == "incremental"
+        await _assert_rewrites_match(rollups, sessions)
+
+        # Deleting folded rows forces a rebuild
+        async with sessions() as session:
+            await session.execute(text("DELETE FROM portfolios WHERE id IN (1, 7)"))
+            await session.commit()
+        assert await rollups.refresh(sessions) == "full"
+        await _assert_rewrites_match(rollups, sessions)
+
+    asyncio.run(run())
+
+def test_avg_skips_null_values(sessions):
+    rollups = Rollups(enabled=True)
+
+    async def run():
+        await rollups.refresh(sessions)
+        sql = "SELECT relationship_manager, AVG(portfolio_value) AS average FROM portfolios " \
+              "GROUP BY relationship_manager ORDER BY relationship_manager"
+        rows = dict(await _rows(sessions, rollups.rewrite(sql)))
+        # Rajiv Mehra has one NULL value out of three portfolios
+        assert rows["Rajiv Mehra"] == 8_500_000
+        assert rows == dict(await _rows(sessions, sql))
+
+    asyncio.run(run())
+
+def test_empty_table_matches_the_base_aggregates(sessions):
+    rollups = Rollups(enabled=True, top_k=3)
+
+    async def run():
+        async with sessions() as session:
+            await session.execute(text("DELETE FROM portfolios"))
+            await session.commit()
+        await rollups.refresh(sessions)
+        sql = "SELECT COUNT(*) AS n, SUM(portfolio_value) AS total, COUNT(portfolio_value) AS valued, " \
+              "AVG(portfolio_value) AS average FROM portfolios"
+        assert await _rows(sessions, rollups.rewrite(sql)) == [(0, None, 0, None)]
+        assert await _rows(sessions, sql) == [(0, None, 0, None)]
+        await _assert_rewrites_match(rollups, sessions)
+
+    asyncio.run(run())
+
+def test_bound_limit_reads_the_top_table(sessions):
+    rollups = Rollups(enabled=True, top_k=3)
+    sql = "SELECT client_name, portfolio_value FROM portfolios ORDER BY portfolio_value DESC LIMIT :limit"
+
+    async def run():
+        await rollups.refresh(sessions)
+        rewritten = rollups.rewrite(sql, {"limit": 2})
+        assert "rollup_top" in rewritten
+        assert await _rows(sessions, rewritten, {"limit": 2}) == await _rows(sessions, sql, {"limit": 2})
+        # More rows than the rollup keeps, or an unbound limit, go to portfolios
+        assert rollups.rewrite(sql, {"limit": 4}) is None
+        assert rollups.rewrite(sql) is None
+
+    asyncio.run(run())
+
+@pytest.mark.parametrize("sql", [
+    "SELECT stock, SUM(portfolio_value) FROM portfolios WHERE relationship_manager = 'Priya Shah' GROUP BY stock",
+    "SELECT relationship_manager, stock, COUNT(*) FROM portfolios GROUP BY relationship_manager, stock",
+    "SELECT client_name, MAX(portfolio_value) FROM portfolios GROUP BY client_name",
+    "SELECT COUNT(DISTINCT stock) FROM portfolios WHERE portfolio_value > 100",
+    "SELECT client_name FROM portfolios WHERE stock = 'TCS' ORDER BY portfolio_value DESC LIMIT 2",
+])
+def test_unsupported_queries_are_not_rewritten(sessions, sql):
+    rollups = Rollups(enabled=True)
+    asyncio.run(rollups.refresh(sessions))
+    assert rollups.rewrite(sql) is None
+
+def test_nothing_is_rewritten_before_the_first_refresh():
+    assert Rollups(enabled=True).rewrite(QUERIES[0]) is None
@@ -0,0 +1,59 @@
+import pytest
+
+from langchain_agent.router import MAX_LEARN_CHARS, QueryRouter
+
+@pytest.mark.parametrize("question, label", [
+    ("Show all high risk clients", "mongo"),
+    ("Which clients live in Pune?", "mongo"),
+    ("What is the total portfolio value?", "sql"),
+    ("Show all portfolios managed by Priya Shah.", "sql"),
+])
+def test_schema_questions_route_without_the_llm(question, label):
+    assert QueryRouter().route(question) == label
+
+def test_no_evidence_falls_back_to_the_llm():
+    router = QueryRouter()
+    assert router.score("quarterly summary please") == ("sql", 0.5)
+    assert router.route("quarterly summary please") is None
+
+def test_threshold_decides_between_router_and_llm():
+    question = "Which clients are the holders of Reliance?"
+    _, confidence = QueryRouter().score(question)
+    assert QueryRouter(threshold=confidence).route(question) is not None
+    assert QueryRouter(threshold=confidence + 1e-9).route(question) is None
+
+def test_route_counts_only_confident_decisions():
+    router = QueryRouter()
+    router.route("Show all high risk clients")
+    router.route("quarterly summary please")
+    stats = router.stats()
+    assert stats["router"] == {"mongo": 1}
+    assert stats["total"] == 1
+
+def test_proposals_are_learned_only_once_confirmed():
+    router = QueryRouter()
+    question = "quarterly summary please"
+    router.propose(question, "sql")
+    # A different label, or an unproposed question, teaches nothing
+    assert not router.confirm(question, "mongo")
+    assert not router.confirm(question, "sql")
+    router.propose(question, "sql")
+    assert router.confirm(question, "sql")
+    label, confidence = router.score(question)
+    assert label == "sql" and confidence > 0.5
+    assert router.stats()["learned"] == 1
+
+def test_learning_stops_at_the_cap():
+    router = QueryRouter(max_learned=1)
+    for question in ("quarterly summary please", "yearly summary please"):
+        router.propose(question, "sql")
+    assert router.confirm("quarterly summary please", "sql")
+    assert not router.confirm("yearly summary please", "sql")
+    assert router.stats()["learned"] == 1
+
+def test_long_questions_are_never_learned():
+    router = QueryRouter()
+    question = "summary " * (MAX_LEARN_CHARS // 8 + 1)
+    router.propose(question, "sql")
+    assert not router.confirm(question, "sql")
+    assert router.stats()["learned"] == 0
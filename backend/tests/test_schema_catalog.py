@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+import pytest
+
+import db.schema_catalog as catalog_module
+from db.schema_catalog import DEFAULT_CATALOG, SchemaCatalog, _version, schema_catalog
+from langchain_agent.mongo_pipeline import PipelineError, validate_pipeline
+
+def _catalog(sql=None, mongo=None):
+    catalog = {
+        "database": "wealth",
+        "sql": sql if sql is not None else DEFAULT_CATALOG["sql"],
+        "mongo": mongo if mongo is not None else DEFAULT_CATALOG["mongo"],
+        "source": "introspected",
+        "introspected_at": time.time(),
+    }
+    catalog["version"] = _version(catalog)
+    return catalog
+
+def _with_segment():
+    fields = {**DEFAULT_CATALOG["mongo"]["clients"]["fields"], "segment": {"type": "string"}}
+    return _catalog(mongo={"clients": {"fields": fields}})
+
+def test_failed_introspection_keeps_the_default_and_backs_off(tmp_path, monkeypatch):
+    catalog = SchemaCatalog(path=str(tmp_path / "schema.json"))
+    calls = []
+
+    async def unreachable(session_factory):
+        calls.append(session_factory)
+        raise ConnectionError("MySQL is down")
+
+    monkeypatch.setattr(catalog, "_introspect_sql", unreachable)
+    asyncio.run(catalog.ensure())
+    assert catalog.catalog["source"] == "default"
+    assert catalog.mongo_fields("clients") == {"name", "risk", "age", "city", "preferences"}
+    # No second attempt within SCHEMA_RETRY_INTERVAL
+    asyncio.run(catalog.ensure())
+    assert len(calls) == 1
+    monkeypatch.setattr(catalog_module, "SCHEMA_RETRY_INTERVAL", 0)
+    asyncio.run(catalog.ensure())
+    assert len(calls) == 2
+
+def test_introspection_reads_both_stores(tmp_path, monkeypatch):
+    pytest.importorskip("aiosqlite")
+    mongomock = pytest.importorskip("mongomock")
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import db.mongo
+    import db.mysql
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'wealth.db'}")
+
+    async def seed():
+        async with engine.begin() as conn:
+            await conn.execute(text("CREATE TABLE portfolios (id INTEGER PRIMARY KEY, client_name TEXT, portfolio_value NUMERIC)"))
+            await conn.execute(text("CREATE TABLE rollup_rm (relationship_manager TEXT)"))
+
+    asyncio.run(seed())
+    clients = mongomock.MongoClient()
+    clients["wealth"].clients.insert_many(
+        [{"name": f"C{i}", "risk": ["High", "Low"][i % 2], "age": 30 + i, "segment": "retail"} for i in range(10)]
+    )
+    monkeypatch.setattr(db.mysql, "AsyncSessionLocal", async_sessionmaker(engine))
+    monkeypatch.setattr(db.mongo, "async_db", mongomock_motor.AsyncMongoMockClient(mock_mongo_client=clients)["wealth"],
+                        raising=False)
+
+    catalog = SchemaCatalog(path=str(tmp_path / "schema.json"))
+    default_version = catalog.version
+    asyncio.run(catalog.ensure())
+    assert catalog.catalog["source"] == "introspected"
+    # The service's own rollup tables are not part of the schema
+    assert catalog.sql_tables() == {"portfolios"}
+    assert catalog.mongo_fields("clients") == {"name", "risk", "age", "segment"}
+    assert catalog.catalog["mongo"]["clients"]["fields"]["risk"]["values"] == ["High", "Low"]
+    assert catalog.version != default_version
+    # Other workers pick the catalog up from disk
+    assert SchemaCatalog(path=catalog.path).version == catalog.version
+
+def test_version_hash_follows_the_schema():
+    assert _catalog()["version"] == _catalog()["version"]
+    assert _with_segment()["version"] != _catalog()["version"]
+    # When it was introspected does not change the version
+    later = _catalog()
+    later["introspected_at"] += 60
+    assert _version(later) == _catalog()["version"]
+
+def test_prompt_keeps_relevant_tables_within_budget(monkeypatch):
+    unrelated = {f"audit_log_{i}": {"columns": {f"event_{j}": {"type": "string"} for j in range(20)}} for i in range(10)}
+    monkeypatch.setattr(schema_catalog, "_catalog", _catalog(sql={**DEFAULT_CATALOG["sql"], **unrelated}))
+    prompt = schema_catalog.sql_prompt("total portfolio value per relationship manager", budget=100)
+    assert "Table: portfolios" in prompt
+    assert "audit_log" not in prompt
+    assert len(prompt) // 4 <= 100
+
+def test_prompt_trims_the_most_relevant_table_to_matching_columns(monkeypatch):
+    columns = {**DEFAULT_CATALOG["sql"]["portfolios"]["columns"],
+               **{f"extra_{j}": {"type": "string"} for j in range(40)}}
+    monkeypatch.setattr(schema_catalog, "_catalog", _catalog(sql={"portfolios": {"columns": columns}}))
+    prompt = schema_catalog.sql_prompt("total portfolio value per stock", budget=20)
+    assert "- portfolio_value" in prompt and "- stock" in prompt
+    # The primary key always stays; unrelated columns go
+    assert "- id: integer, primary key" in prompt
+    assert "extra_" not in prompt
+    full = schema_catalog.sql_prompt("total portfolio value per stock", budget=10_000)
+    assert "extra_39" in full
+
+def test_introspected_fields_reach_the_validators(monkeypatch):
+    monkeypatch.setattr(schema_catalog, "_catalog", _with_segment())
+    from langchain_agent.federated import client_projection
+    from langchain_agent.mongo_tool import MONGO_COLLECTION, MongoTool
+
+    pipeline = [{"$group": {"_id": "$segment", "clients": {"$sum": 1}}}]
+    validated, _, answer = MongoTool()._aggregate_lookup("clients per segment", pipeline)
+    assert answer is None and validated[0] == pipeline[0]
+    assert schema_catalog.mongo_projection(MONGO_COLLECTION)["segment"] == 1
+    assert client_projection()["segment"] == 1
+    with pytest.raises(PipelineError):
+        validate_pipeline([{"$group": {"_id": "$income", "n": {"$sum": 1}}}], schema_catalog.mongo_fields("clients"))
@@ -0,0 +1,116 @@
+import asyncio
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+import cache.singleflight as singleflight_module
+from cache.singleflight import SingleFlight
+
+RESULT = {
+    "text": "Found 1 row",
+    "table": {"columns": ["client_name", "total", "since", "updated"],
+              "rows": [("Alice", Decimal("150.25"), date(2024, 1, 31), datetime(2024, 1, 31, 9, 30))]},
+}
+
+def _open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+@pytest.fixture
+def workers(tmp_path, monkeypatch):
+    """Two SingleFlights sharing a lock directory, standing in for two workers on one host."""
+    if singleflight_module.fcntl is None:
+        pytest.skip("cross-worker mode needs fcntl")
+    monkeypatch.setattr(singleflight_module, "SINGLEFLIGHT_POLL_INTERVAL", 0.01)
+    return [SingleFlight(enabled=True, shared=True, directory=str(tmp_path)) for _ in range(2)]
+
+def _slow(calls, result=RESULT, delay=0.1, error=None):
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return result
+    return fn
+
+def test_concurrent_duplicates_share_one_execution():
+    flight = SingleFlight(enabled=True, shared=False)
+    calls = []
+    key = flight.key("Top five portfolios?", None)
+    # The same question, normalized
+    assert flight.key("  top five portfolios ", None) == key
+
+    async def ask():
+        return await asyncio.gather(*(flight.do(key, _slow(calls)) for _ in range(5)))
+
+    results = asyncio.run(ask())
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.stats()["coalesced"] == 4
+    assert flight.stats()["inflight"] == 0
+
+def test_leader_failure_reaches_every_waiter_and_is_not_cached():
+    flight = SingleFlight(enabled=True, shared=False)
+    calls = []
+
+    async def ask():
+        return await asyncio.gather(
+            *(flight.do("k", _slow(calls, error=RuntimeError("boom"))) for _ in range(3)), return_exceptions=True
+        )
+
+    assert [str(e) for e in asyncio.run(ask())] == ["boom"] * 3
+    assert len(calls) == 1
+    # The next request runs again instead of replaying the failure
+    assert asyncio.run(flight.do("k", _slow(calls))) == RESULT
+    assert len(calls) == 2
+
+def test_workers_share_identical_results(workers):
+    leader, follower = workers
+    calls = []
+
+    async def ask():
+        first = asyncio.ensure_future(leader.do("k", _slow(calls)))
+        await asyncio.sleep(0.02)
+        return await asyncio.gather(first, follower.do("k", _slow(calls)))
+
+    led, followed = asyncio.run(ask())
+    assert len(calls) == 1
+    assert follower.stats()["shared_hits"] == 1
+    assert led == followed
+    row = followed["table"]["rows"][0]
+    assert row == ["Alice", Decimal("150.25"), date(2024, 1, 31), datetime(2024, 1, 31, 9, 30)]
+    assert [type(v) for v in row] == [type(v) for v in led["table"]["rows"][0]]
+
+def test_follower_runs_the_question_after_a_leader_failure(workers):
+    leader, follower = workers
+    calls = []
+
+    async def ask():
+        first = asyncio.ensure_future(leader.do("k", _slow(calls, error=RuntimeError("boom"))))
+        await asyncio.sleep(0.02)
+        return await asyncio.gather(first, follower.do("k", _slow(calls)), return_exceptions=True)
+
+    failed, followed = asyncio.run(ask())
+    assert isinstance(failed, RuntimeError)
+    assert len(calls) == 2
+    assert followed["table"]["rows"][0][1] == Decimal("150.25")
+    assert follower.stats()["shared_hits"] == 0
+
+def test_follower_timeout_releases_its_lock_descriptor(workers):
+    leader, follower = workers
+    calls = []
+
+    async def ask():
+        first = asyncio.ensure_future(leader.do("k", _slow(calls, delay=0.3)))
+        await asyncio.sleep(0.02)
+        before = _open_fds()
+        waiting = asyncio.ensure_future(follower._shared_do("k", _slow(calls)))
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(waiting, 0.1)
+        # Cancelled while polling for the lock: nothing left open
+        assert _open_fds() == before
+        return await first
+
+    assert asyncio.run(ask())["text"] == "Found 1 row"
+    assert len(calls) == 1
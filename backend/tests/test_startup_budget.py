@@ -0,0 +1,22 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import BACKEND_DIR
+
+# The stand-in stores the budget check runs against
+pytest.importorskip("aiosqlite")
+pytest.importorskip("mongomock")
+pytest.importorskip("mongomock_motor")
+
+def test_startup_within_budget():
+    # One fresh interpreter; budgets come from IMPORT_BUDGET_MS, STARTUP_BUDGET_MS and FIRST_REQUEST_BUDGET_MS
+    result = subprocess.run(
+        [sys.executable, os.path.join(BACKEND_DIR, "bench", "startup_budget.py"), "--runs", "1"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, timeout=300,
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+    lines = [line for line in result.stdout.splitlines() if "budget" in line]
+    assert len(lines) == 3 and all(line.endswith("ok") for line in lines), result.stdout
@@ -0,0 +1,69 @@
+import functools
+import json
+import time
+
+import main
+from bench_e2e import FakeLLM
+from langchain_agent.deadline import request_deadline
+from langchain_agent.llm_gateway import llm_gateway
+
+TOP_FIVE = "What are the top five portfolios of our wealth members?"
+
+def _events(response):
+    return [(line["event"], line["data"]) for line in map(json.loads, response.iter_lines()) if line]
+
+def test_stages_arrive_in_order(api):
+    with api.stream("POST", "/query/stream", json={"query": TOP_FIVE}) as response:
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        events = _events(response)
+    names = [name for name, _ in events]
+    assert names[:3] == ["route", "query", "columns"]
+    assert names[-1] == "done"
+    data = dict(events)
+    assert data["route"] == {"db": "sql"}
+    assert data["columns"] == ["client_name", "portfolio_value"]
+    rows = [row for name, batch in events if name == "rows" for row in batch]
+    assert [row[0] for row in rows] == ["Alice", "Bob", "Charlie", "Diana"]
+    assert "error" not in data["done"] or data["done"]["error"] is None
+
+def test_server_sent_events_on_request(api):
+    with api.stream("POST", "/query/stream", json={"query": TOP_FIVE},
+                    headers={"Accept": "text/event-stream"}) as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        body = response.read().decode()
+    frames = [frame for frame in body.split("\n\n") if frame]
+    assert frames[0].startswith("event: route\ndata: ")
+    assert json.loads(frames[0].split("data: ", 1)[1]) == {"db": "sql"}
+    assert frames[-1].startswith("event: done\n")
+
+def test_mongo_questions_stream_documents(api):
+    llm_gateway._async_client.canned = {"Which clients are high risk?": {"store": "mongo", "mongo": '{"risk": "High"}'}}
+    with api.stream("POST", "/query/stream", json={"query": "Which clients are high risk?"}) as response:
+        events = _events(response)
+    data = dict(events)
+    assert data["route"] == {"db": "mongo"}
+    names = data["columns"].index("name")
+    rows = [row for name, batch in events if name == "rows" for row in batch]
+    assert sorted(row[names] for row in rows) == ["Alice", "Charlie"]
+
+def test_a_failure_ends_the_stream_with_an_error(api, monkeypatch):
+    async def broken(query):
+        raise RuntimeError("classifier down")
+        yield
+
+    monkeypatch.setattr(main, "stream_events", broken)
+    with api.stream("POST", "/query/stream", json={"query": TOP_FIVE}) as response:
+        events = _events(response)
+    assert [name for name, _ in events] == ["error"]
+    assert events[0][1]["text"]
+
+def test_the_request_deadline_ends_a_slow_generation(api, monkeypatch):
+    # No query in 500 tokens at 20ms each: 10s of generation against a 0.5s deadline
+    monkeypatch.setattr(llm_gateway, "_async_client", FakeLLM({}, 0, 0, 42, token_ms=20, tail_tokens=500))
+    monkeypatch.setattr(main, "request_deadline", functools.partial(request_deadline, 0.5))
+    started = time.monotonic()
+    with api.stream("POST", "/query/stream", json={"query": "Show portfolio values by stock"}) as response:
+        events = _events(response)
+    assert time.monotonic() - started < 3
+    assert events[-1][0] == "error"
+    assert "took too long" in events[-1][1]["text"]
@@ -0,0 +1,68 @@
+import pytest
+
+from langchain_agent.templates import (
+    SQL_HOLDERS_OF_STOCK, SQL_PORTFOLIOS_BY_RM, SQL_PORTFOLIOS_OVER_VALUE, SQL_TOP_PORTFOLIOS,
+    SQL_TOP_RMS, SQL_TOTAL_VALUE, SQL_VALUE_PER_RM,
+    match_mongo_pipeline, match_mongo_template, match_sql_template,
+)
+
+@pytest.mark.parametrize("question, sql, params", [
+    ("What are the top five portfolios of our wealth members?", SQL_TOP_PORTFOLIOS, {"limit": 5}),
+    ("Tell me the top 3 relationship managers", SQL_TOP_RMS, {"limit": 3}),
+    ("Give me the breakup of portfolio values per relationship manager.", SQL_VALUE_PER_RM, {}),
+    ("Which clients are the highest holders of Reliance?", SQL_HOLDERS_OF_STOCK, {"stock": "Reliance"}),
+    ("Show all portfolios with stock = 'Reliance'.", SQL_HOLDERS_OF_STOCK, {"stock": "Reliance"}),
+    ("Show all portfolios managed by Rajiv Mehra.", SQL_PORTFOLIOS_BY_RM, {"rm": "Rajiv Mehra"}),
+    ("Show portfolios with value greater than 7,000,000", SQL_PORTFOLIOS_OVER_VALUE, {"min_value": 7_000_000}),
+    ("Portfolios over 5 lakh", SQL_PORTFOLIOS_OVER_VALUE, {"min_value": 500_000}),
+    ("What is the total portfolio value?", SQL_TOTAL_VALUE, {}),
+])
+def test_sql_templates(question, sql, params):
+    assert match_sql_template(question) == (sql, params)
+
+@pytest.mark.parametrize("question", [
+    # Client-profile facets live in Mongo; dropping them would answer a different question
+    "Top five portfolios of clients over 40",
+    "Top five portfolios of high risk clients",
+    "Portfolios of clients in Mumbai",
+    "Holders of Reliance who prefer tech",
+    # No template has an upper value bound
+    "Portfolios with value under 5 lakh",
+    # Nor more than one facet
+    "Reliance holders managed by Priya Shah",
+])
+def test_sql_templates_decline(question):
+    assert match_sql_template(question) is None
+
+@pytest.mark.parametrize("question, sql, mongo", [
+    # A bare small number is an age ...
+    ("Show portfolios over 40", None, {"age": {"$gt": 40}}),
+    # ... unless it is attached to a value, or carries a unit
+    ("Show portfolios with value over 40", (SQL_PORTFOLIOS_OVER_VALUE, {"min_value": 40}), None),
+    ("Show portfolios over 40 lakh", (SQL_PORTFOLIOS_OVER_VALUE, {"min_value": 4_000_000}), None),
+])
+def test_a_number_is_a_value_or_an_age_never_both(question, sql, mongo):
+    assert match_sql_template(question) == sql
+    assert match_mongo_template(question) == mongo
+
+@pytest.mark.parametrize("question, mongo", [
+    ("Show all high risk clients", {"risk": "High"}),
+    ("Clients in Pune who prefer banking", {"city": "Pune", "preferences": "banking"}),
+    ("List clients younger than 30", {"age": {"$lt": 30}}),
+    ("List clients older than 500", None),
+    ("How many clients are in Delhi?", None),
+])
+def test_mongo_templates(question, mongo):
+    assert match_mongo_template(question) == mongo
+
+def test_mongo_pipelines():
+    assert match_mongo_pipeline("How many high risk clients per city?") == [
+        {"$match": {"risk": "High"}},
+        {"$group": {"_id": "$city", "clients": {"$sum": 1}}},
+        {"$sort": {"clients": -1}},
+    ]
+    assert match_mongo_pipeline("How many clients are in Delhi?") == [
+        {"$match": {"city": "Delhi"}}, {"$count": "clients"},
+    ]
+    # Grouping by a field the question already fixed is ambiguous
+    assert match_mongo_pipeline("Number of clients in Mumbai per city") is None
@@ -0,0 +1,76 @@
+import asyncio
+import sqlite3
+import time
+
+import cache.translation as translation_module
+from cache.translation import TranslationCache
+
+SQL = {"query": "SELECT stock, COUNT(*) FROM portfolios GROUP BY stock;", "params": {}}
+
+def _cache(tmp_path, **kwargs):
+    return TranslationCache(path=str(tmp_path / "translations.sqlite3"), **kwargs)
+
+def test_hits_match_normalized_questions(tmp_path):
+    cache = _cache(tmp_path)
+    assert cache.get("sql", "How many holders per stock?", "v1") is None
+    cache.set("sql", "How many holders per stock?", "v1", SQL)
+    assert cache.get("sql", "  how many holders per stock ", "v1") == SQL
+    # The store and the schema version are part of the key
+    assert cache.get("mongo", "How many holders per stock?", "v1") is None
+    assert cache.get("sql", "How many holders per stock?", "v2") is None
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["misses"]) == (1, 3)
+
+def test_memory_tier_is_lru_bounded(tmp_path):
+    cache = _cache(tmp_path, memory_size=2)
+    for question in ("a", "b"):
+        cache.set("sql", question, "v1", {"query": question})
+    # Reading "a" makes "b" the least recently used
+    assert cache.get("sql", "a", "v1") == {"query": "a"}
+    cache.set("sql", "c", "v1", {"query": "c"})
+    cache.flush()
+    assert cache.stats()["memory_entries"] == 2
+    hits = cache.stats()["memory_hits"]
+    assert cache.get("sql", "a", "v1") == {"query": "a"}
+    assert cache.get("sql", "c", "v1") == {"query": "c"}
+    assert cache.stats()["memory_hits"] == hits + 2
+    # "b" was evicted from memory but is still on disk
+    assert cache.get("sql", "b", "v1") == {"query": "b"}
+    assert cache.stats()["disk_hits"] == 1
+
+def test_workers_share_the_file_in_wal_mode(tmp_path):
+    writer = _cache(tmp_path)
+    writer.set("sql", "top five portfolios", "v1", SQL)
+    writer.flush()
+    with sqlite3.connect(writer.path) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    # Another worker (or a restart) reads what this one wrote, off the event loop
+    reader = _cache(tmp_path)
+    assert asyncio.run(reader.aget("sql", "Top five portfolios?", "v1")) == SQL
+    assert reader.stats()["disk_hits"] == 1
+    # ... and then serves it from memory
+    assert asyncio.run(reader.aget("sql", "Top five portfolios?", "v1")) == SQL
+    assert reader.stats()["memory_hits"] == 1
+
+def test_expired_entries_miss_and_are_evicted(tmp_path):
+    cache = _cache(tmp_path, ttl=60)
+    cache.set("sql", "old question", "v1", SQL)
+    cache.flush()
+    with sqlite3.connect(cache.path) as conn:
+        conn.execute("UPDATE translations SET created_at = ?", (time.time() - 120,))
+    fresh = _cache(tmp_path, ttl=60)
+    assert fresh.get("sql", "old question", "v1") is None
+    fresh.evict()
+    assert fresh.stats()["evictions"] == 1
+
+def test_disk_keeps_the_most_recently_used_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(translation_module, "EVICTION_INTERVAL", 5)
+    cache = _cache(tmp_path, max_entries=3)
+    for i in range(5):
+        cache.set("sql", f"question {i}", "v1", {"query": str(i)})
+        cache.flush()
+        time.sleep(0.002)
+    with sqlite3.connect(cache.path) as conn:
+        kept = sorted(row[0] for row in conn.execute("SELECT question FROM translations"))
+    assert kept == ["question 2", "question 3", "question 4"]
+    assert cache.stats()["evictions"] == 2
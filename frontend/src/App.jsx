@@ -25,6 +25,42 @@ function App() {
   const [loading, setLoading] = useState(false);
   const [longLoading, setLongLoading] = useState(false);
   const [error, setError] = useState(null);
+  const [suggestions, setSuggestions] = useState([]);
+
+  // History is kept server-side, so it survives reloads and covers every session
+  const loadHistory = async () => {
+    try {
+      const res = await fetch(`${import.meta.env.VITE_BACKEND_URL}/history?limit=20`);
+      if (res.ok) setHistory(await res.json());
+    } catch (err) {
+      // History is a convenience; the page works without it
+    }
+  };
+
+  useEffect(() => {
+    loadHistory();
+  }, []);
+
+  // Suggest past questions as the user types, debounced to one request per pause
+  useEffect(() => {
+    if (!query.trim()) {
+      setSuggestions([]);
+      return;
+    }
+    const controller = new AbortController();
+    const timer = setTimeout(async () => {
+      try {
+        const res = await fetch(`${import.meta.env.VITE_BACKEND_URL}/history?q=${encodeURIComponent(query)}&limit=8`, { signal: controller.signal });
+        if (res.ok) setSuggestions(await res.json());
+      } catch (err) {
+        // Aborted by the next keystroke, or the backend is unreachable
+      }
+    }, 200);
+    return () => {
+      clearTimeout(timer);
+      controller.abort();
+    };
+  }, [query]);
 
   // Show extended loading message if loading > 10s
   useEffect(() => {
@@ -43,15 +79,42 @@ function App() {
     setError(null);
     try {
       // Use backend URL from environment variable for easy deployment
-      const res = await fetch(`${import.meta.env.VITE_BACKEND_URL}/query`, {
+      // Stream NDJSON events so the first rows render while the rest are still being fetched
+      const res = await fetch(`${import.meta.env.VITE_BACKEND_URL}/query/stream`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', Accept: 'application/x-ndjson' },
         body: JSON.stringify({ query }),
       });
-      if (!res.ok) throw new Error('Server error');
-      const data = await res.json();
-      setResults(data);
-      setHistory([{ query, timestamp: new Date().toLocaleString() }, ...history]);
+      if (!res.ok || !res.body) throw new Error('Server error');
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let current = { text: '', table: { columns: [], rows: [] }, chart: null };
+      const applyEvent = ({ event, data }) => {
+        if (event === 'columns') {
+          current = { ...current, table: { columns: data, rows: [] } };
+        } else if (event === 'rows') {
+          current = { ...current, table: { ...current.table, rows: current.table.rows.concat(data) } };
+          setLoading(false);
+        } else if (event === 'chart') {
+          current = { ...current, chart: data };
+        } else if (event === 'done' || event === 'error') {
+          current = { ...current, text: data.text };
+        } else {
+          return;
+        }
+        setResults(current);
+      };
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        lines.filter(line => line.trim()).forEach(line => applyEvent(JSON.parse(line)));
+      }
+      if (buffer.trim()) applyEvent(JSON.parse(buffer));
+      loadHistory();
     } catch (err) {
       setError('Failed to get response from backend.');
       setResults(null);
@@ -99,12 +162,16 @@ function App() {
                     </Box>
                   )}
                   <input
+                    list="history-suggestions"
                     placeholder="e.g., What were the total sales last quarter?"
                     value={query}
                     onChange={e => setQuery(e.target.value)}
                     style={{ border: 'none', outline: 'none', background: 'transparent', color: '#121615', flex: 1, fontSize: 16, padding: '0 12px', width: '100%' }}
                     onKeyDown={e => { if (e.key === 'Enter') handleSubmit(e); }}
                   />
+                  <datalist id="history-suggestions">
+                    {suggestions.map(item => <option key={item.question} value={item.question} />)}
+                  </datalist>
                   <Button
                     type="submit"
                     variant="contained"
@@ -222,11 +289,13 @@ function App() {
             <Typography sx={{ fontWeight: 700, fontSize: { xs: 15, sm: 18 }, px: { xs: 1, sm: 4 }, pt: 2, color: '#121615' }}>Query History</Typography>
             <Box sx={{ px: { xs: 1, sm: 4 }, pb: 4 }}>
               {history.length === 0 && <Typography>No previous queries yet.</Typography>}
-              {history.map((item, i) => (
-                <Box key={i} sx={{ display: 'flex', flexDirection: { xs: 'column', sm: 'row' }, justifyContent: 'space-between', bgcolor: '#f9f9f9', borderRadius: 2, px: 2, py: 1, mb: 1 }}>
-                  <Typography sx={{ color: '#121615' }}>{item.query}</Typography>
+              {history.map(item => (
+                <Box key={item.question} sx={{ display: 'flex', flexDirection: { xs: 'column', sm: 'row' }, justifyContent: 'space-between', bgcolor: '#f9f9f9', borderRadius: 2, px: 2, py: 1, mb: 1 }}>
+                  <Typography sx={{ color: '#121615', cursor: 'pointer' }} onClick={() => setQuery(item.question)}>{item.question}</Typography>
 
-                  <Typography sx={{ color: '#666', fontSize: 12 }}>{item.timestamp}</Typography>
+                  <Typography sx={{ color: '#666', fontSize: 12 }}>
+                    {new Date(item.last_asked * 1000).toLocaleString()}{item.count > 1 ? ` · asked ${item.count} times` : ''}
+                  </Typography>
 
                 </Box>
               ))}